@@ -0,0 +1,113 @@
+"""
+ASGI (async views) vs WSGI (sync views) under N simultaneous clients.
+
+Requests are driven in-process, straight into the ASGI / WSGI handlers, so the numbers
+compare request handling and not a particular server:
+
+    python benchmarks/bench_asgi.py [clients]
+"""
+import asyncio
+import io
+import logging
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from common import report, setup_django, setup_test_database
+
+setup_django()
+
+from django.core.asgi import get_asgi_application
+from django.core.wsgi import get_wsgi_application
+
+
+def seed():
+    from catalog.models import Author, Book, BookCopy, Genre
+    author = Author.objects.create(name='Benchmark Author')
+    genre = Genre.objects.create(name='Benchmark Genre')
+    for i in range(200):
+        book = Book.objects.create(title=f'Book {i}', author=author, isbn=f'{9780000000000 + i}')
+        book.genre.add(genre)
+        BookCopy.objects.create(book=book, status='a', publisher='Benchmark')
+    return Book.objects.first().pk
+
+
+async def asgi_get(app, path):
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+        'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': b'',
+        'headers': [(b'host', b'testserver')], 'server': ('testserver', 80), 'client': ('127.0.0.1', 0),
+    }
+    received = False
+    status = None
+
+    async def receive():
+        nonlocal received
+        if not received:
+            received = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        await asyncio.sleep(3600)
+
+    async def send(message):
+        nonlocal status
+        if message['type'] == 'http.response.start':
+            status = message['status']
+
+    await app(scope, receive, send)
+    return status
+
+def run_asgi(path, clients):
+    app = get_asgi_application()
+
+    async def main():
+        return await asyncio.gather(*(asgi_get(app, path) for _ in range(clients)))
+
+    start = time.perf_counter()
+    statuses = asyncio.run(main())
+    return time.perf_counter() - start, statuses
+
+
+def wsgi_get(app, path):
+    environ = {
+        'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': '', 'SERVER_NAME': 'testserver',
+        'SERVER_PORT': '80', 'HTTP_HOST': 'testserver', 'REMOTE_ADDR': '127.0.0.1',
+        'wsgi.input': io.BytesIO(), 'wsgi.errors': sys.stderr, 'wsgi.url_scheme': 'http',
+        'wsgi.version': (1, 0), 'wsgi.multithread': True, 'wsgi.multiprocess': False, 'wsgi.run_once': False,
+    }
+    status = []
+    body = app(environ, lambda s, headers, exc_info=None: status.append(int(s.split()[0])))
+    b''.join(body)
+    return status[0]
+
+def run_wsgi(path, clients, threads):
+    app = get_wsgi_application()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        statuses = list(pool.map(lambda _: wsgi_get(app, path), range(clients)))
+    return time.perf_counter() - start, statuses
+
+
+def main():
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    logging.getLogger('django.request').setLevel(logging.CRITICAL)
+    teardown = setup_test_database()
+    try:
+        book_id = seed()
+        cases = (
+            ('index', '/catalog/', '/catalog/async/'),
+            ('book detail', f'/catalog/book/{book_id}', f'/catalog/async/book/{book_id}'),
+        )
+        for name, sync_path, async_path in cases:
+            for label, (elapsed, statuses) in (
+                (f'WSGI {name} (32 threads)', run_wsgi(sync_path, clients, 32)),
+                (f'WSGI {name} ({clients} threads)', run_wsgi(sync_path, clients, clients)),
+                (f'ASGI {name} (async view)', run_asgi(async_path, clients)),
+            ):
+                ok = sum(1 for status in statuses if status == 200)
+                report(label, elapsed, f'{clients / elapsed:8.0f} req/s  {ok}/{clients} ok')
+    finally:
+        teardown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""
+Faceted book search, SQL (search_books + facets.get_facets) against the bitmap index.
+
+    python benchmarks/bench_bitmaps.py [books]
+
+Runs on a throwaway test database. The bitmaps are pyroaring ones when it is
+installed, Python ints otherwise.
+"""
+import random
+import sys
+
+from common import measure, report, setup_django, setup_test_database
+
+setup_django()
+
+from catalog import bitmaps, facets
+from catalog.models import Author, Book, BookCopy, Genre, Language
+from catalog.views import search_books
+
+
+def populate(books):
+    random.seed(0)
+    authors = Author.objects.bulk_create([Author(name=f'Author {i}') for i in range(max(books // 20, 10))])
+    genres = Genre.objects.bulk_create([Genre(name=f'Genre {i}') for i in range(40)])
+    languages = Language.objects.bulk_create([Language(name=f'Language {i}') for i in range(15)])
+    Book.objects.bulk_create([
+        Book(title=f'Book {i}', summary='', isbn=f'{i:013d}', author=random.choice(authors),
+             language=random.choice(languages))
+        for i in range(books)], batch_size=2000)
+    book_ids = list(Book.objects.values_list('id', flat=True))
+    Book.genre.through.objects.bulk_create([
+        Book.genre.through(book_id=book_id, genre_id=genre.id)
+        for book_id in book_ids for genre in random.sample(genres, random.randint(1, 3))], batch_size=2000)
+    BookCopy.objects.bulk_create([
+        BookCopy(book_id=book_id, status=random.choice('aaabm'), publisher='Publisher')
+        for book_id in book_ids], batch_size=2000)
+    return genres, languages
+
+
+def main():
+    books = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    teardown = setup_test_database()
+    try:
+        genres, languages = populate(books)
+        queries = {
+            'all books': {},
+            '2 genres': {'genre': genres[:2]},
+            '2 genres + language + available': {'genre': genres[:2], 'language': languages[0], 'available': True},
+        }
+        print(f'{books} books, bitmaps: {"pyroaring" if bitmaps.BitMap is not None else "python int"}')
+        report('bitmap index load', measure(bitmaps.BookBitmapIndex.load, repeat=3))
+        bitmaps.get_index()
+        for label, query in queries.items():
+            cleaned_data = {'title': '', 'author': None, 'genre': None, 'language': None, 'available': False}
+            cleaned_data.update(query)
+            expression = bitmaps.search_expression(
+                genre_ids=[genre.pk for genre in cleaned_data['genre'] or ()],
+                language_id=cleaned_data['language'].pk if cleaned_data['language'] else None,
+                available=cleaned_data['available'])
+
+            def sql():
+                result = search_books(cleaned_data).select_related('author').order_by('pk')
+                return result.count(), list(result[:10]), facets.get_facets(result)
+
+            def bitmap():
+                result = bitmaps.search(expression)
+                return len(result), result[:10], bitmaps.get_facets(result)
+
+            report(f'{label}: sql', measure(sql, number=5))
+            report(f'{label}: bitmaps', measure(bitmap, number=5), f'{bitmap()[0]} hits')
+    finally:
+        bitmaps.reset_index()
+        teardown()
+
+
+if __name__ == '__main__':
+    main()
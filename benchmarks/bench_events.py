@@ -0,0 +1,50 @@
+"""
+Delivery latency of a borrowing event to N waiting clients.
+
+    python benchmarks/bench_events.py [clients]
+
+The event is published from another thread, as the views committing a
+borrowing do, and the time until every waiting coroutine has it is measured
+for the in-process broker and for the cache broker (polling).
+"""
+import asyncio
+import sys
+import threading
+import time
+
+from common import report, setup_django
+
+setup_django()
+
+from catalog.events import CacheBroker, LocalBroker
+
+
+async def deliver(broker, clients):
+    last_id = broker.head()
+    delivered = []
+
+    async def client():
+        await broker.wait(last_id, 10)
+        delivered.append(time.perf_counter())
+
+    tasks = [asyncio.create_task(client()) for _ in range(clients)]
+    # let every client register before publishing
+    await asyncio.sleep(0.1)
+    published = []
+    publisher = threading.Thread(target=lambda: (published.append(time.perf_counter()),
+                                                 broker.publish('borrowing.created', {})))
+    publisher.start()
+    await asyncio.gather(*tasks)
+    publisher.join()
+    return max(delivered) - published[0]
+
+
+def main():
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    for name, broker in (('local', LocalBroker()), ('cache', CacheBroker())):
+        latency = min(asyncio.run(deliver(broker, clients)) for _ in range(3))
+        report(f'{name} broker: event to {clients} clients', latency)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""
+Startup cost: a new process starting Django and loading the URLconf (what a
+worker and most management commands pay), the API views imported by the first
+API request, and the OpenAPI schema generated against read from its cache.
+
+    python benchmarks/bench_imports.py [runs]
+
+Process times are the best of `runs` new interpreters, the module counts come
+from python -X importtime (see the profile_imports management command).
+"""
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from common import BASE_DIR, measure, report, setup_django
+
+setup_django()
+
+from django.conf import settings
+from django.test.utils import override_settings
+
+from catalog import api_schema, importprofile
+
+
+def process_time(code, runs):
+    """Best wall time of `runs` interpreters running `code`."""
+    best = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', code], cwd=BASE_DIR, env=dict(os.environ), check=True)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    for name, modules in (('startup: setup + URLconf', [settings.ROOT_URLCONF]),
+                          ('startup + API views', [settings.ROOT_URLCONF, 'catalog.api_views']),
+                          ('startup + schema views', [settings.ROOT_URLCONF, 'catalog.api_schema'])):
+        code = importprofile.startup_code(modules)
+        summary = importprofile.summarize(importprofile.run(code))
+        report(name, process_time(code, runs), f"{summary['modules']} modules, {summary['total'] * 1e3:.1f} ms imports")
+
+    # drf_yasg warns about the views it cannot introspect
+    logging.getLogger('drf_yasg').setLevel(logging.ERROR)
+    with tempfile.TemporaryDirectory() as directory, \
+            override_settings(CATALOG_API_SCHEMA_CACHE=os.path.join(directory, 'openapi.json')):
+        report('OpenAPI schema: generated', measure(api_schema.generate, repeat=3))
+        api_schema.get_schema(refresh=True)
+
+        def read_cached():
+            api_schema._schemas.clear()
+            api_schema.get_schema()
+        report('OpenAPI schema: read from the cache file', measure(read_cached))
+
+
+if __name__ == '__main__':
+    main()
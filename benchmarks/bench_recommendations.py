@@ -0,0 +1,45 @@
+"""
+Co-borrowing recommendations batch on a synthetic loan history.
+
+    python benchmarks/bench_recommendations.py [loans]
+
+Book popularity follows a Zipf law. The NumPy/SciPy path is used when both are
+installed, the plain Python one otherwise (timed on a smaller history).
+"""
+import random
+import sys
+import time
+
+from common import report, setup_django
+
+setup_django()
+
+from catalog import recommendations
+
+
+def loan_history(loans, users, books):
+    random.seed(0)
+    weights = [1 / (rank + 1) for rank in range(books)]
+    book_ids = random.choices(range(books), weights=weights, k=loans)
+    return {(random.randrange(users), book_id) for book_id in book_ids}
+
+
+def run(name, compute, pairs):
+    start = time.perf_counter()
+    result = compute(pairs, 10)
+    report(name, time.perf_counter() - start, f'{len(pairs)} pairs, {len(result)} books')
+
+
+def main():
+    loans = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    pairs = loan_history(loans, users=loans // 10, books=max(loans // 50, 100))
+    if recommendations.np is not None:
+        run(f'numpy/scipy, {loans} loans', recommendations.compute_numpy, pairs)
+    else:
+        print('numpy/scipy not installed, skipping the vectorized path')
+    small = loan_history(loans // 10, users=loans // 100, books=max(loans // 500, 100))
+    run(f'python, {loans // 10} loans', recommendations.compute_python, small)
+
+
+if __name__ == '__main__':
+    main()
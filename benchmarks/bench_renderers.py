@@ -0,0 +1,56 @@
+"""
+Encode time and bytes on the wire of a 10k book search response.
+
+    python benchmarks/bench_renderers.py [books]
+
+The payload is the SearchBookAPI output built in memory. Renderers and
+encodings whose library is not installed are skipped.
+"""
+import gzip
+import random
+import sys
+
+from common import measure, report, setup_django
+
+setup_django()
+
+from rest_framework.renderers import JSONRenderer
+
+from catalog import middleware, renderers
+from catalog.renderers import MessagePackRenderer, ORJSONRenderer
+
+
+def payload(books):
+    random.seed(0)
+    return [{
+        'title': f'Book {i}',
+        'summary': 'A summary of the book ' * random.randint(1, 10),
+        'author': random.randrange(500),
+        'genre': random.sample(range(40), random.randint(1, 3)),
+        'language': random.randrange(15),
+    } for i in range(books)]
+
+
+def main():
+    books = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    data = payload(books)
+    candidates = [('json (stdlib)', JSONRenderer())]
+    if renderers.orjson is not None:
+        candidates.append(('orjson', ORJSONRenderer()))
+    if renderers.msgpack is not None:
+        candidates.append(('msgpack', MessagePackRenderer()))
+
+    for name, renderer in candidates:
+        body = renderer.render(data)
+        report(f'{name}: encode {books} books', measure(lambda: renderer.render(data)), f'{len(body)} bytes')
+        level = middleware.GZIP_LEVEL
+        report(f'{name}: + gzip', measure(lambda: gzip.compress(body, level, mtime=0)),
+               f'{len(gzip.compress(body, level, mtime=0))} bytes')
+        if middleware.brotli is not None:
+            quality = middleware.BROTLI_QUALITY
+            report(f'{name}: + brotli', measure(lambda: middleware.brotli.compress(body, quality=quality)),
+                   f'{len(middleware.brotli.compress(body, quality=quality))} bytes')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+"""
+Reservation calendar range queries on a book with thousands of loans.
+
+    python benchmarks/bench_reservations.py
+"""
+import datetime
+import random
+
+from common import measure, report, setup_django
+
+setup_django()
+
+from catalog.reservations import BookCalendar, IntervalIndex
+
+
+def build_calendar(copies, loans_per_copy):
+    random.seed(0)
+    origin = datetime.date(2020, 1, 1)
+    calendar = {}
+    for copy_id in range(copies):
+        intervals = []
+        day = 0
+        for _ in range(loans_per_copy):
+            day += random.randint(0, 5)
+            length = random.randint(1, 21)
+            intervals.append((origin + datetime.timedelta(days=day),
+                              origin + datetime.timedelta(days=day + length)))
+            day += length + 1
+        calendar[copy_id] = IntervalIndex(intervals)
+    return calendar, origin
+
+
+def main():
+    for copies, loans in ((1, 1000), (5, 2000), (20, 1000)):
+        copy_indexes, origin = build_calendar(copies, loans)
+        calendar = BookCalendar(copy_indexes)
+        start = origin + datetime.timedelta(days=loans * 8)
+        end = start + datetime.timedelta(days=30)
+        label = f'{copies} copies x {loans} loans'
+        report(f'{label}: is_copy_free', measure(lambda: calendar.is_copy_free(0, start, end), number=1000))
+        report(f'{label}: available_copies', measure(lambda: calendar.available_copies(start, end), number=1000))
+        report(f'{label}: free_ranges (book)', measure(lambda: calendar.free_ranges(start, end), number=1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""
+Book list serialization: DRF ModelSerializer against the .values() fast path,
+and the NDJSON stream (time to first chunk, peak memory) against the full list.
+
+    python benchmarks/bench_serialization.py [books]
+
+Runs on a throwaway test database, times include the queries.
+"""
+import random
+import sys
+import time
+import tracemalloc
+
+from common import measure, report, setup_django, setup_test_database
+
+setup_django()
+
+from catalog.models import Author, Book, Genre, Language
+from catalog.renderers import json_line
+from catalog.serializers import BookSerializer, BookValuesSerializer
+
+
+def populate(books):
+    random.seed(0)
+    authors = Author.objects.bulk_create([Author(name=f'Author {i}') for i in range(max(books // 20, 10))])
+    genres = Genre.objects.bulk_create([Genre(name=f'Genre {i}') for i in range(40)])
+    languages = Language.objects.bulk_create([Language(name=f'Language {i}') for i in range(15)])
+    Book.objects.bulk_create([
+        Book(title=f'Book {i}', summary='A summary of the book ' * 5, isbn=f'{i:013d}',
+             author=random.choice(authors), language=random.choice(languages))
+        for i in range(books)], batch_size=2000)
+    Book.genre.through.objects.bulk_create([
+        Book.genre.through(book_id=book_id, genre_id=genre.id)
+        for book_id in Book.objects.values_list('id', flat=True)
+        for genre in random.sample(genres, random.randint(1, 3))], batch_size=2000)
+
+
+def peak_memory(func):
+    tracemalloc.start()
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak
+
+def stream(queryset):
+    def full():
+        json_line(BookValuesSerializer(queryset).data)
+
+    def chunked():
+        for rows in BookValuesSerializer(queryset).iter_chunks(500):
+            b''.join(json_line(row) for row in rows)
+
+    start = time.perf_counter()
+    next(BookValuesSerializer(queryset).iter_chunks(500))
+    report('NDJSON stream: first chunk', time.perf_counter() - start)
+    for name, func in (('full list + encode', full), ('NDJSON stream, 500 rows/chunk', chunked)):
+        elapsed, peak = peak_memory(func)
+        report(name, elapsed, f'peak {peak / 2 ** 20:.1f} MiB')
+
+
+def main():
+    books = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    teardown = setup_test_database()
+    try:
+        populate(books)
+        queryset = Book.objects.all()
+        report(f'ModelSerializer + prefetch, {books} books',
+               measure(lambda: BookSerializer(queryset.prefetch_related('genre'), many=True).data, repeat=3))
+        report(f'ValuesSerializer, {books} books', measure(lambda: BookValuesSerializer(queryset).data, repeat=3))
+        fields = ['title', 'author']
+        report('ModelSerializer ?fields=title,author',
+               measure(lambda: BookSerializer(queryset.only('pk', *fields), many=True,
+                                              context={'fields': fields}).data, repeat=3))
+        report('ValuesSerializer ?fields=title,author',
+               measure(lambda: BookValuesSerializer(queryset, fields).data, repeat=3))
+        stream(queryset)
+    finally:
+        teardown()
+
+
+if __name__ == '__main__':
+    main()
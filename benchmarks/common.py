@@ -0,0 +1,40 @@
+import os
+import sys
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def setup_django():
+    sys.path.insert(0, BASE_DIR)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'locallibrary.settings')
+    os.environ.setdefault('SECRET_KEY', 'benchmark')
+    import django
+    django.setup()
+
+def setup_test_database():
+    """Create a throwaway test database, returns a callable that drops it."""
+    from django.db import connection
+    from django.test.utils import setup_test_environment
+    setup_test_environment()
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0)
+    return lambda: connection.creation.destroy_test_db(old_name, verbosity=0)
+
+def measure(func, repeat=5, number=1):
+    """Best wall time of `repeat` runs of `number` calls, in seconds per call."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = (time.perf_counter() - start) / number
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def report(name, seconds, extra=''):
+    if seconds < 1e-3:
+        value = f'{seconds * 1e6:10.1f} us'
+    else:
+        value = f'{seconds * 1e3:10.2f} ms'
+    print(f'{name:<50}{value}  {extra}')
@@ -1,5 +1,9 @@
-from django.contrib import admin
-from .models import Author, Genre, Language, Book, Review, Borrowing, BookCopy
+from django.contrib import admin, messages
+from django.utils import timezone
+from . import copies
+from . import lifecycle
+from .models import Author, Genre, Language, Book, Review, Borrowing, BookCopy, BorrowingTransition, Hold, ScheduledJob, Task
+from .scheduler import parse_schedule
 
 admin.site.register(Genre)
 admin.site.register(Language)
@@ -30,6 +34,7 @@ class BookAdmin(admin.ModelAdmin):
 class BookCopyAdmin(admin.ModelAdmin):
     list_display = ('book', 'status', 'published_date', 'id')
     list_filter = ('book', 'status')
+    actions = ['mark_available', 'mark_maintenance']
     fieldsets = (
         (None, {
             'fields': ('book', 'publisher', 'published_date', 'id')
@@ -39,7 +44,112 @@ class BookCopyAdmin(admin.ModelAdmin):
         }),
     )
 
+    def set_status(self, request, queryset, status):
+        copy_ids = list(queryset.values_list('id', flat=True))
+        updated = copies.set_copies_status(copy_ids, status)
+        self.message_user(request, f'{len(updated)} copies updated.')
+        skipped = queryset.exclude(status=status).count()
+        if skipped:
+            self.message_user(request, f'{skipped} borrowed or reserved copies skipped.', messages.WARNING)
+
+    @admin.action(description='Mark selected copies available')
+    def mark_available(self, request, queryset):
+        self.set_status(request, queryset, 'a')
+
+    @admin.action(description='Send selected copies to maintenance')
+    def mark_maintenance(self, request, queryset):
+        self.set_status(request, queryset, 'm')
+
+class BorrowingTransitionInline(admin.TabularInline):
+    """Timeline of the borrowing, the log is append-only."""
+    model = BorrowingTransition
+    fields = ('created_at', 'from_status', 'to_status', 'actor')
+    readonly_fields = fields
+    ordering = ('created_at', 'id')
+    extra = 0
+    can_delete = False
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
 @admin.register(Borrowing)
 class BorrowingAdmin(admin.ModelAdmin):
     list_display = ('book_copy', 'borrower', 'start_date', 'due_date', 'status')
     fields = ['book_copy', 'borrower', ('start_date', 'due_date'), 'status', 'decline_reason']
+    # status changes go through the state machine (actions), with the book copy
+    readonly_fields = ('status',)
+    inlines = [BorrowingTransitionInline]
+    actions = ['approve', 'mark_borrowing', 'mark_returned', 'cancel']
+
+    def set_status(self, request, queryset, status):
+        updated, rejected = lifecycle.transition_many(list(queryset.values_list('id', flat=True)), status)
+        self.message_user(request, f'{len(updated)} borrowings updated.')
+        if rejected:
+            self.message_user(request, f'{len(rejected)} borrowings skipped: {rejected[0][1]}', messages.WARNING)
+
+    @admin.action(description='Approve selected borrowing requests')
+    def approve(self, request, queryset):
+        self.set_status(request, queryset, 'a')
+
+    @admin.action(description='Mark selected borrowings as borrowing')
+    def mark_borrowing(self, request, queryset):
+        self.set_status(request, queryset, 'b')
+
+    @admin.action(description='Mark selected borrowings as returned')
+    def mark_returned(self, request, queryset):
+        self.set_status(request, queryset, 'r')
+
+    @admin.action(description='Cancel selected borrowing requests')
+    def cancel(self, request, queryset):
+        self.set_status(request, queryset, 'c')
+
+@admin.register(Hold)
+class HoldAdmin(admin.ModelAdmin):
+    list_display = ('book', 'user', 'created_at', 'status')
+    list_filter = ('status',)
+
+@admin.register(ScheduledJob)
+class ScheduledJobAdmin(admin.ModelAdmin):
+    list_display = ('name', 'schedule', 'enabled', 'next_run_at', 'last_status', 'last_duration',
+                    'last_processed', 'runs', 'failures')
+    list_filter = ('enabled', 'last_status')
+    fields = ['name', 'schedule', 'enabled', 'next_run_at', ('locked_by', 'locked_until'),
+              ('last_started_at', 'last_finished_at'), ('last_status', 'last_duration'),
+              ('last_processed', 'last_chunks'), 'last_error',
+              ('runs', 'failures'), ('total_duration', 'total_processed')]
+    # jobs are created by the scheduler, the rest is written by the runs
+    readonly_fields = (
+        'name', 'locked_by', 'locked_until', 'last_started_at', 'last_finished_at', 'last_status',
+        'last_duration', 'last_processed', 'last_chunks', 'last_error', 'runs', 'failures',
+        'total_duration', 'total_processed')
+    actions = ['run_now']
+
+    def has_add_permission(self, request):
+        return False
+
+    def save_model(self, request, obj, form, change):
+        if 'schedule' in form.changed_data:
+            obj.next_run_at = parse_schedule(obj.schedule).next_after(timezone.now())
+        super().save_model(request, obj, form, change)
+
+    @admin.action(description='Run selected jobs at the next look of the scheduler')
+    def run_now(self, request, queryset):
+        updated = queryset.update(next_run_at=timezone.now())
+        self.message_user(request, f'{updated} jobs due.')
+
+@admin.register(Task)
+class TaskAdmin(admin.ModelAdmin):
+    list_display = ('id', 'name', 'status', 'attempts', 'run_at', 'finished_at')
+    list_filter = ('status', 'name')
+    search_fields = ('key',)
+    readonly_fields = ('name', 'kwargs', 'key', 'status', 'attempts', 'max_attempts', 'run_at', 'locked_by',
+                       'locked_until', 'result', 'last_error', 'created_at', 'started_at', 'finished_at')
+    actions = ['retry']
+
+    def has_add_permission(self, request):
+        return False
+
+    @admin.action(description='Retry selected failed tasks')
+    def retry(self, request, queryset):
+        updated = queryset.filter(status='f').update(status='q', attempts=0, run_at=timezone.now())
+        self.message_user(request, f'{updated} tasks queued.')
@@ -0,0 +1,139 @@
+"""
+OpenAPI schema of the REST API, generated once and cached on disk.
+
+Generating the schema introspects every API view and serializer, which took
+longer than the requests themselves. The schema served by /swagger and /redoc
+(public, every endpoint) is generated the first time and written to
+CATALOG_API_SCHEMA_CACHE with a fingerprint of the catalog sources and of the
+DRF and drf_yasg versions: workers, and later deployments of the same code,
+read it back instead, and a code change regenerates it. The
+generate_api_schema management command writes it ahead, at deployment.
+"""
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+from urllib.parse import urlparse
+
+import rest_framework
+import drf_yasg
+from django.conf import settings
+from drf_yasg import openapi
+from drf_yasg.codecs import OpenAPICodecJson
+from drf_yasg.generators import OpenAPISchemaGenerator
+from drf_yasg.views import get_schema_view
+from rest_framework import permissions
+
+logger = logging.getLogger(__name__)
+
+INFO = openapi.Info(
+    title="Simple API",
+    default_version='v1',
+    description="An simple API for CRUD with Article",
+    contact=openapi.Contact(email="contact@education.sun.local"),
+    license=openapi.License(name="Sun Education License"),
+)
+
+CATALOG_DIR = Path(__file__).resolve().parent
+SKIPPED_DIRS = {'tests', 'migrations', '__pycache__'}
+
+# fingerprint: schema of this process
+_schemas = {}
+
+
+def cache_path():
+    return getattr(settings, 'CATALOG_API_SCHEMA_CACHE', None)
+
+def fingerprint():
+    """Changes with the catalog sources (views, serializers, filters...) and the DRF and drf_yasg versions."""
+    digest = hashlib.sha1(f'{rest_framework.VERSION} {drf_yasg.__version__}'.encode())
+    for path in sorted(CATALOG_DIR.rglob('*.py')):
+        relative = path.relative_to(CATALOG_DIR)
+        if SKIPPED_DIRS.intersection(relative.parts[:-1]):
+            continue
+        stat = path.stat()
+        digest.update(f'{relative} {stat.st_size} {stat.st_mtime_ns}\n'.encode())
+    return digest.hexdigest()
+
+def generate():
+    """The public schema, encoded as JSON."""
+    schema = OpenAPISchemaGenerator(INFO).get_schema(request=None, public=True)
+    return OpenAPICodecJson(validators=[]).encode(schema).decode()
+
+def decode(text):
+    """openapi.Swagger of an encoded schema, as the renderers expect."""
+    data = json.loads(text)
+    schema = openapi.Swagger.__new__(openapi.Swagger)
+    openapi.SwaggerDict.__init__(schema)
+    schema.update(data)
+    # the UI renderers read info.title and info.version
+    info = openapi.SwaggerDict()
+    info.update(data['info'])
+    schema['info'] = info
+    return schema
+
+def read_cache(path, key):
+    try:
+        with open(path, encoding='utf-8') as file:
+            cached = json.load(file)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(cached, dict) or cached.get('fingerprint') != key:
+        return None
+    return cached.get('schema')
+
+def write_cache(path, key, text):
+    """Write the schema atomically, readers never see a partial file."""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    temporary = f'{path}.{os.getpid()}.tmp'
+    with open(temporary, 'w', encoding='utf-8') as file:
+        json.dump({'fingerprint': key, 'schema': text}, file)
+    os.replace(temporary, path)
+
+def get_schema(refresh=False):
+    """Cached public schema, generated (and written to the cache file) when missing or stale."""
+    key = fingerprint()
+    if not refresh and key in _schemas:
+        return _schemas[key]
+
+    path = cache_path()
+    text = None if refresh or not path else read_cache(path, key)
+    if text is None:
+        text = generate()
+        if path:
+            try:
+                write_cache(path, key, text)
+            except OSError:
+                logger.warning('Cannot write the API schema cache %s', path, exc_info=True)
+    _schemas.clear()
+    _schemas[key] = text
+    return text
+
+
+class CachedSchemaGenerator(OpenAPISchemaGenerator):
+    """Serves the public schema from the cache, with the host and scheme of the request."""
+
+    def get_schema(self, request=None, public=False):
+        # the UI pages (no patterns) and the per-user or versioned schemas are generated
+        if not public or self._gen.patterns is not None or self._gen.urlconf is not None or self.version:
+            return super().get_schema(request, public)
+        schema = decode(get_schema())
+        url = self.url or (request.build_absolute_uri() if request is not None else None)
+        if url:
+            # as openapi.Swagger does for a generated schema
+            parsed = urlparse(url)
+            schema['host'] = parsed.netloc
+            schema['schemes'] = [parsed.scheme]
+        return schema
+
+
+schema_view = get_schema_view(
+    INFO,
+    public=True,
+    permission_classes=(permissions.AllowAny,),
+    generator_class=CachedSchemaGenerator,
+)
+
+swagger_ui = schema_view.with_ui('swagger', cache_timeout=0)
+redoc_ui = schema_view.with_ui('redoc', cache_timeout=0)
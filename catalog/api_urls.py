@@ -0,0 +1,81 @@
+"""
+URLs of the REST API and of its documentation, routed to views loaded lazily.
+
+The API views import DRF, knox, django_filters and the serializers, and the
+documentation drf_yasg; LazyAPIView only imports them with the first request
+to one of them, so loading the URLconf (worker start, management commands
+running the system checks) and serving the HTML pages do not pay for them.
+"""
+from django.urls import path
+from django.utils.module_loading import import_string
+
+
+class LazyAPIView:
+    """
+    DRF view imported by its first call: `path` is the dotted path of a view function,
+    or of a view class whose as_view(**initkwargs) is used.
+
+    Django's URL resolver probes view_class, which is answered without importing the
+    view. Other attributes are read on the view, so the schema generator sees the
+    view class (cls) and its initkwargs.
+    """
+    # DRF views enforce CSRF themselves, for session authentication only
+    csrf_exempt = True
+
+    def __init__(self, path, **initkwargs):
+        self._path = path
+        self._initkwargs = initkwargs
+        self._view = None
+        self.__module__, self.__name__ = path.rsplit('.', 1)
+        self.__qualname__ = self.__name__
+
+    def load(self):
+        if self._view is None:
+            view = import_string(self._path)
+            self._view = view.as_view(**self._initkwargs) if hasattr(view, 'as_view') else view
+        return self._view
+
+    def __call__(self, request, *args, **kwargs):
+        return self.load()(request, *args, **kwargs)
+
+    def __getattr__(self, name):
+        if name.startswith('_') or name == 'view_class':
+            raise AttributeError(name)
+        return getattr(self.load(), name)
+
+
+def api(name):
+    return LazyAPIView(f'catalog.api_views.{name}')
+
+
+urlpatterns = [
+    path('api/v1/register/', api('RegisterAPI'), name='api-register'),
+    path('api/v1/login/', api('LoginAPI'), name='api-login'),
+    path('api/v1/logout/', LazyAPIView('knox.views.LogoutView'), name='api-logout'),
+    path('api/v1/logoutall/', LazyAPIView('knox.views.LogoutAllView'), name='api-logoutall'),
+    path('api/v1/search-book/', api('SearchBookAPI'), name='search-book'),
+    path('api/v1/create-borrow-book/', api('BorrowBookAPI'), name='borrow-book'),
+    path('api/v1/create-borrow-book/batch/', api('BatchBorrowBookAPI'), name='batch-borrow-book'),
+    path('api/v1/books/isbn-lookup/', api('IsbnLookupAPI'), name='isbn-lookup'),
+    path('api/v1/book/<int:pk>/availability/', api('BookAvailabilityAPI'), name='book-availability'),
+    path('api/v1/book/<int:pk>/hold/', api('HoldAPI'), name='book-hold'),
+    path('api/v1/pending-borrowing/', api('PendingBorrowingAPI'), name='pending-borrowing'),
+    path('api/v1/pending-borrowing/update-status/<int:id>', api('ProcessBorrowBookAPI'), name='update-status'),
+    path('api/v1/reports/circulation/', api('CirculationReportAPI'), name='circulation-report-api'),
+    path('api/v1/reports/borrowing-latency/', api('BorrowingLatencyReportAPI'), name='borrowing-latency-report'),
+    path('api/v1/book/<int:pk>/recommendations/', api('BookRecommendationAPI'), name='book-recommendations'),
+    path('api/v1/borrowing-stats/', api('BorrowingStatsAPI'), name='borrowing-stats'),
+    path('api/v1/rankings/', api('RankingAPI'), name='rankings-api'),
+    path('api/v1/book/<int:pk>/copies/', api('BookCopiesAPI'), name='book-copies-api'),
+    path('api/v1/copies/status/', api('BookCopyStatusAPI'), name='book-copy-status-api'),
+    path('api/v1/borrowings/status/', api('BorrowingStatusAPI'), name='borrowing-status-api'),
+    path('api/v1/changes/', api('ChangeFeedAPI'), name='change-feed'),
+    path('api/v1/tasks/', api('TaskQueueAPI'), name='task-queue'),
+    path('api/v1/tasks/<int:pk>/', api('TaskStatusAPI'), name='task-status'),
+    path('api/v1/throttle-metrics/', api('ThrottleMetricsAPI'), name='throttle-metrics'),
+]
+
+urlpatterns += [
+    path('swagger', LazyAPIView('catalog.api_schema.swagger_ui'), name='schema-swagger-ui'),
+    path('redoc', LazyAPIView('catalog.api_schema.redoc_ui'), name='schema-redoc'),
+]
@@ -0,0 +1,506 @@
+"""
+REST API views (DRF, knox, django_filters), kept apart from the HTML views so that
+loading the URLconf or the HTML views does not import them: catalog.api_urls routes
+to these classes lazily and this module is imported by the first API request.
+"""
+from django.conf import settings
+from django.contrib.auth import login
+from django.db import transaction
+from django.http import StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+
+from django_filters.rest_framework import DjangoFilterBackend
+from knox.models import AuthToken
+from knox.views import LoginView as KnoxLoginView
+from rest_framework import generics, permissions
+from rest_framework.authtoken.serializers import AuthTokenSerializer
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+
+from .models import Book, Borrowing, BookCopy, Task, UserBorrowingStats
+from .serializers import *
+from .authentication import get_request_token
+from .throttling import bucket_throttles, get_rejection_metrics
+from .borrowing import (ACTIVE_BORROWING_STATUSES, check_borrowing_limit, check_borrowing_requests,
+                        get_borrowing_limits, get_borrowing_stats, remaining_borrowing_slots)
+from .reservations import get_book_calendar, has_conflict, invalidate_copy_calendars
+from .facets import get_facets
+from .renderers import NDJSONRenderer, json_line
+from . import changes
+from . import copies
+from . import events
+from . import holds
+from . import isbn
+from . import lifecycle
+from . import ranking
+from . import recommendations
+from . import rollups
+from . import taskqueue
+from . import transitions
+
+class SparseFieldsAPIMixin:
+    """
+    ?fields=a,b sparse fieldsets on GET: the serializer only outputs the requested
+    fields and loads their columns only. list() serializes .values() rows with
+    `values_serializer_class` instead of model instances.
+
+    ?stream=1 or Accept: application/x-ndjson streams the list as NDJSON, read in
+    chunks of CATALOG_STREAM_CHUNK_SIZE rows, one JSON object per line.
+    """
+    values_serializer_class = None
+    renderer_classes = [*api_settings.DEFAULT_RENDERER_CLASSES, NDJSONRenderer]
+
+    def get_requested_fields(self):
+        if self.request.method != 'GET':
+            return None
+        return parse_fields(self.request.query_params.get('fields'), self.get_serializer_class().Meta.fields)
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if self.request is not None:
+            context['fields'] = self.get_requested_fields()
+        return context
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        fields = self.get_requested_fields()
+        if fields is not None:
+            queryset = queryset.only(*model_columns(queryset.model, fields))
+        return queryset
+
+    def serialize_list(self, queryset):
+        return self.values_serializer_class(queryset, self.get_requested_fields()).data
+
+    def is_streamed(self):
+        return (self.request.accepted_renderer.format == 'ndjson'
+                or self.request.query_params.get('stream') in ('1', 'true'))
+
+    def stream_list(self, queryset):
+        serializer = self.values_serializer_class(queryset, self.get_requested_fields())
+        chunk_size = getattr(settings, 'CATALOG_STREAM_CHUNK_SIZE', 500)
+        lines = (b''.join(json_line(row) for row in rows) for rows in serializer.iter_chunks(chunk_size))
+        return StreamingHttpResponse(lines, content_type=NDJSONRenderer.media_type)
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        if self.is_streamed():
+            return self.stream_list(queryset)
+        return Response(self.serialize_list(queryset))
+
+# Register API
+class RegisterAPI(generics.GenericAPIView):
+    serializer_class = RegisterSerializer
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        user = serializer.save()
+        return Response({
+            "user": UserSerializer(user, context=self.get_serializer_context()).data,
+            "token": AuthToken.objects.create(user)[1]
+            })
+
+class LoginAPI(KnoxLoginView):
+    permission_classes = (permissions.AllowAny,)
+
+    def post(self, request, format=None):
+        serializer = AuthTokenSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        user = serializer.validated_data['user']
+        login(request, user)
+        return super(LoginAPI, self).post(request, format=None)
+
+class SearchBookAPI(SparseFieldsAPIMixin, generics.ListAPIView):
+    """
+    GET: ?fields=title,author,... returns only these fields
+    """
+    queryset = Book.objects.all()
+    serializer_class = BookSerializer
+    values_serializer_class = BookValuesSerializer
+    filter_backends = [DjangoFilterBackend, ]
+    filterset_fields  = ('title', 'author', 'language', 'genre')
+    throttle_classes = bucket_throttles('search-book')
+
+    def list(self, request, *args, **kwargs):
+        # ?facets=1 wraps the books as {"results": [...], "facets": {...}}
+        if request.query_params.get('facets') not in ('1', 'true') or self.is_streamed():
+            return super().list(request, *args, **kwargs)
+        queryset = self.filter_queryset(self.get_queryset())
+        return Response({
+            "results": self.serialize_list(queryset),
+            "facets": get_facets(queryset),
+            })
+
+class BorrowBookAPI(generics.CreateAPIView):
+    """
+    POST: signed in callers only; `token` is the caller's knox token,
+    null when the call is authenticated otherwise (e.g. a session)
+    """
+    serializer_class = ProcessBorrowBookSerializer
+    permission_classes = [permissions.IsAuthenticated, ]
+    throttle_classes = bucket_throttles('borrow-book')
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        with transaction.atomic():
+            stats = get_borrowing_stats(serializer.validated_data['borrower'], lock=True)
+            error = check_borrowing_limit(stats)
+            # checked again under the copy lock, another request may have been saved since validate()
+            data = serializer.validated_data
+            if not error and has_conflict(data['book_copy'].id, data['start_date'], data['due_date'], lock=True):
+                error = 'This book copy is already requested for these dates'
+            if error:
+                raise ValidationError({'non_field_errors': [error]})
+            borrow = serializer.save()
+        # reuse the caller's token, minting one per borrow made the token table grow without bound
+        token = get_request_token(request)
+        return Response({
+            "borrow": ProcessBorrowBookSerializer(borrow, context=self.get_serializer_context()).data,
+            "token": token
+            })
+
+class BatchBorrowBookAPI(generics.GenericAPIView):
+    """
+    POST: create several borrowing requests at once,
+    unavailable or conflicting requests are returned in `rejected`
+    """
+    serializer_class = BatchBorrowBookSerializer
+    permission_classes = [permissions.AllowAny, ]
+    throttle_classes = bucket_throttles('batch-borrow-book')
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        borrower = serializer.validated_data['borrower']
+        items = serializer.validated_data['borrowings']
+
+        with transaction.atomic():
+            stats = get_borrowing_stats(borrower, lock=True)
+            accepted, rejected = check_borrowing_requests(items, lock=True)
+            slots = remaining_borrowing_slots(stats)
+            if len(accepted) > slots:
+                indexes = {id(item): index for index, item in enumerate(items)}
+                rejected = sorted(rejected + [(indexes[id(item)], 'Borrowing limit reached')
+                                              for item in accepted[slots:]])
+                accepted = accepted[:slots]
+            # bulk_create skips Borrowing.save(), update the counters here
+            borrowings = Borrowing.objects.bulk_create([
+                Borrowing(borrower=borrower, book_copy_id=item['book_copy'],
+                          start_date=item['start_date'], due_date=item['due_date'])
+                for item in accepted
+            ])
+            UserBorrowingStats.apply_change(borrower.pk, None, ('p', None), count=len(borrowings))
+            changes.record(Borrowing, [borrowing.pk for borrowing in borrowings])
+            for borrowing in borrowings:
+                events.publish_borrowing('created', borrowing)
+            transitions.record(borrowings)
+        invalidate_copy_calendars({item['book_copy'] for item in accepted})
+        return Response({
+            "accepted": ProcessBorrowBookSerializer(borrowings, many=True).data,
+            "rejected": [{"index": index, "book_copy": items[index]['book_copy'], "reason": reason}
+                         for index, reason in rejected],
+            })
+
+def date_ranges_data(ranges):
+    return [{"start": start, "end": end} for start, end in ranges]
+
+class IsbnLookupAPI(generics.GenericAPIView):
+    """
+    POST: books of a list of ISBN-10/ISBN-13 numbers (hyphens allowed), resolved in one query;
+    unknown and invalid numbers and inputs of the same book are listed separately
+    """
+    serializer_class = IsbnLookupSerializer
+    permission_classes = [permissions.AllowAny, ]
+    throttle_classes = bucket_throttles('isbn-lookup')
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        isbns = serializer.validated_data['isbns']
+        found, missing, invalid = isbn.lookup_books(isbns, Book.objects.select_related('author'))
+        return Response({
+            "found": {value: IsbnBookSerializer(book).data for value, book in found.items()},
+            "missing": missing,
+            "invalid": invalid,
+            "duplicates": isbn.find_duplicates(isbns),
+            })
+
+class BookAvailabilityAPI(generics.GenericAPIView):
+    """
+    GET: free and booked date ranges of a book and each of its copies,
+    ?start=YYYY-MM-DD&end=YYYY-MM-DD (default: the next 30 days)
+    """
+    serializer_class = AvailabilityQuerySerializer
+    permission_classes = [permissions.AllowAny, ]
+
+    def get(self, request, pk, *args, **kwargs):
+        get_object_or_404(Book, pk=pk)
+        serializer = self.get_serializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        start = serializer.validated_data['start']
+        end = serializer.validated_data['end']
+
+        calendar = get_book_calendar(pk)
+        return Response({
+            "book": pk,
+            "start": start,
+            "end": end,
+            "free": date_ranges_data(calendar.free_ranges(start, end)),
+            "copies": [{
+                "book_copy": copy_id,
+                "booked": date_ranges_data(calendar.booked(copy_id, start, end)),
+                "free": date_ranges_data(calendar.copy_free_ranges(copy_id, start, end)),
+            } for copy_id in calendar.copies],
+            })
+
+class HoldAPI(generics.GenericAPIView):
+    """
+    GET: hold queue length and the caller's position
+    POST: join the hold queue of the book
+    DELETE: leave the hold queue
+    """
+    permission_classes = [permissions.IsAuthenticated, ]
+
+    def get_response(self, book_id):
+        hold = holds.get_user_hold(book_id, self.request.user)
+        return Response({
+            "book": book_id,
+            "queue_length": holds.queue_length(book_id),
+            "position": holds.queue_position(hold) if hold else None,
+            })
+
+    def get(self, request, pk, *args, **kwargs):
+        get_object_or_404(Book, pk=pk)
+        return self.get_response(pk)
+
+    def post(self, request, pk, *args, **kwargs):
+        book = get_object_or_404(Book, pk=pk)
+        holds.join_queue(book, request.user)
+        return self.get_response(pk)
+
+    def delete(self, request, pk, *args, **kwargs):
+        book = get_object_or_404(Book, pk=pk)
+        holds.leave_queue(book, request.user)
+        return self.get_response(pk)
+
+class CirculationReportAPI(generics.GenericAPIView):
+    """
+    GET: circulation statistics of a month per book, genre or language,
+    ?dimension=book|genre|language&month=YYYY-MM (read from the rollups only)
+    """
+    serializer_class = CirculationReportQuerySerializer
+    permission_classes = [permissions.IsAdminUser, ]
+
+    def get(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        dimension = serializer.validated_data['dimension']
+        report = list(rollups.get_report(dimension, serializer.validated_data['month']))
+        context = {'names': rollups.get_names(dimension, report)}
+        return Response(CirculationRollupSerializer(report, many=True, context=context).data)
+
+class BorrowingLatencyReportAPI(generics.GenericAPIView):
+    """
+    GET: time spent by borrowings in a status, count, mean and percentiles in seconds,
+    ?status=p&to_status=a&since=<datetime>&until=<datetime> (pending to approved)
+    """
+    serializer_class = BorrowingLatencyQuerySerializer
+    permission_classes = [permissions.IsAdminUser, ]
+
+    def get(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        return Response(transitions.latency_report(**serializer.validated_data))
+
+class BookRecommendationAPI(generics.GenericAPIView):
+    """
+    GET: books borrowed by the readers of a book, most similar first
+    """
+    permission_classes = [permissions.AllowAny, ]
+
+    def get(self, request, pk, *args, **kwargs):
+        books = recommendations.get_recommendations(get_object_or_404(Book, pk=pk).pk)
+        return Response(RecommendedBookSerializer(books, many=True).data)
+
+class RankingAPI(generics.GenericAPIView):
+    """
+    GET: top rated or most borrowed books,
+    ?kind=rated|borrowed&genre=<id>&language=<id>&limit=<n>
+    """
+    serializer_class = RankingQuerySerializer
+    permission_classes = [permissions.AllowAny, ]
+
+    def get(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        query = serializer.validated_data
+        if query['kind'] == 'borrowed':
+            books = ranking.most_borrowed(query['limit'], query.get('genre'), query.get('language'))
+        else:
+            books = ranking.top_rated(query['limit'], query.get('genre'), query.get('language'))
+        return Response(RankedBookSerializer(books, many=True).data)
+
+class PendingBorrowingAPI(SparseFieldsAPIMixin, generics.ListAPIView):
+    """
+    GET: ?fields=borrower,book_copy,... returns only these fields
+    """
+    queryset = Borrowing.objects.filter(status='p')
+    serializer_class = BorrowBookSerializer
+    values_serializer_class = BorrowingValuesSerializer
+    permission_classes = [permissions.AllowAny, ]
+    throttle_classes = bucket_throttles('pending-borrowing')
+
+class ProcessBorrowBookAPI(SparseFieldsAPIMixin, generics.RetrieveUpdateAPIView):
+    """
+    GET: ?fields=... returns only these fields
+    PUT
+    PATCH
+    """
+    queryset = Borrowing.objects.all()
+    serializer_class = BorrowBookSerializer
+    lookup_url_kwarg = 'id'
+
+    def get_permissions(self):
+        # changes (status transitions included) are for the librarians
+        if self.request.method in permissions.SAFE_METHODS:
+            return [permissions.AllowAny()]
+        return [permissions.IsAdminUser()]
+
+    def perform_update(self, serializer):
+        # the status goes through the state machine, with the book copy
+        status = serializer.validated_data.pop('status', None)
+        instance, data = serializer.instance, serializer.validated_data
+        with transaction.atomic():
+            # validate() checked the new copy/period, again under the copy lock before saving
+            if ({'book_copy', 'start_date', 'due_date'} & set(data)
+                    and (status or instance.status) in ACTIVE_BORROWING_STATUSES
+                    and has_conflict(data.get('book_copy', instance.book_copy).id,
+                                     data.get('start_date', instance.start_date),
+                                     data.get('due_date', instance.due_date), exclude=instance.pk, lock=True)):
+                raise ValidationError({'non_field_errors': ['This book copy is already requested for these dates']})
+            if data:
+                serializer.save()
+            if status is not None and status != serializer.instance.status:
+                try:
+                    lifecycle.transition(serializer.instance, status)
+                except lifecycle.TransitionError as error:
+                    raise ValidationError({'status': [str(error)]})
+
+class BorrowingStatsAPI(generics.GenericAPIView):
+    """
+    GET: borrowing counters and limits of the current user
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        stats = get_borrowing_stats(request.user)
+        data = BorrowingStatsSerializer(stats).data
+        data.update(get_borrowing_limits())
+        data['remaining'] = remaining_borrowing_slots(stats)
+        return Response(data)
+
+class BookCopiesAPI(generics.GenericAPIView):
+    """
+    POST: add `count` copies of a book with the same publisher and published date
+    """
+    serializer_class = AddBookCopiesSerializer
+    permission_classes = [permissions.IsAdminUser]
+
+    def post(self, request, pk, *args, **kwargs):
+        book = get_object_or_404(Book, pk=pk)
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        new_copies = copies.add_copies(book, **serializer.validated_data)
+        return Response(BookCopySerializer(new_copies, many=True).data, status=201)
+
+class BookCopyStatusAPI(generics.GenericAPIView):
+    """
+    POST: set copies available or in maintenance,
+    borrowed and reserved copies are returned in `skipped`
+    """
+    serializer_class = BookCopyStatusSerializer
+    permission_classes = [permissions.IsAdminUser]
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        copy_ids = serializer.validated_data['copies']
+        status = serializer.validated_data['status']
+        updated = copies.set_copies_status(copy_ids, status)
+        skipped = (BookCopy.objects
+            .filter(id__in=copy_ids)
+            .exclude(status=status)
+            .exclude(id__in=updated)
+            .values_list('id', flat=True))
+        return Response({
+            "updated": updated,
+            "skipped": list(skipped),
+            })
+
+class BorrowingStatusAPI(generics.GenericAPIView):
+    """
+    POST: move borrowings to a status, following the borrowing state machine;
+    borrowings that cannot make the transition are returned in `rejected`
+    """
+    serializer_class = BorrowingStatusSerializer
+    permission_classes = [permissions.IsAdminUser]
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        updated, rejected = lifecycle.transition_many(serializer.validated_data['borrowings'],
+                                                      serializer.validated_data['status'])
+        return Response({
+            "updated": updated,
+            "rejected": [{"id": pk, "reason": reason} for pk, reason in rejected],
+            })
+
+class ChangeFeedAPI(generics.GenericAPIView):
+    """
+    GET: changes of books, authors, copies, reviews (and borrowings for staff) after a cursor,
+    ?since=<seq>&limit=<n>&models=book,bookcopy; start with since=0, then send back `cursor`
+    """
+    serializer_class = ChangeFeedQuerySerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        query = serializer.validated_data
+        models = query.get('models') or list(changes.FEED_MODELS)
+        if not request.user.is_staff:
+            models = [name for name in models if name in changes.PUBLIC_MODELS]
+        entries, cursor, has_more = changes.get_changes(query['since'], query['limit'], models)
+        return Response({
+            "changes": entries,
+            "cursor": cursor,
+            "has_more": has_more,
+            })
+
+class TaskQueueAPI(generics.GenericAPIView):
+    """
+    GET: number of background tasks per status, and the seconds the oldest due task has waited
+    """
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return Response(taskqueue.queue_stats())
+
+class TaskStatusAPI(generics.RetrieveAPIView):
+    """
+    GET: status, attempts and result of a background task
+    """
+    queryset = Task.objects.all()
+    serializer_class = TaskSerializer
+    permission_classes = [permissions.IsAdminUser]
+
+class ThrottleMetricsAPI(generics.GenericAPIView):
+    """
+    GET: rejected calls per throttled endpoint
+    """
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return Response(get_rejection_metrics())
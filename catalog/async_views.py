@@ -0,0 +1,249 @@
+"""
+Async (ASGI) variants of the catalogue read views.
+
+They use the async ORM (aget, acount, async for). Templates are rendered through
+sync_to_async since forms and model methods used by the templates may still
+query the database. asyncio.gather groups the independent lookups but does not
+run them in parallel: Django 4.2 runs the async ORM, like sync_to_async, on a
+single thread (thread_sensitive), whatever the database backend. What the async
+views save is a thread per waiting request, not query time.
+
+The REST API has no async variant: a copy of its views would have to repeat
+their authentication, throttling, sparse fieldsets and streaming.
+
+The borrowing events of catalog.events are pushed to the librarians as
+server-sent events, or returned by a long-poll endpoint for clients that
+cannot keep a stream open. Both hold a connection per client and only make
+sense on ASGI.
+"""
+import asyncio
+import datetime
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user
+from django.contrib.auth.views import redirect_to_login
+from django.core.exceptions import PermissionDenied
+from django.core.paginator import Paginator
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from django.shortcuts import render
+from django.views import View
+
+from .borrowing import get_borrowing_limits, get_borrowing_stats
+from .forms import SearchBookForm
+from .models import Author, Book, BookCopy, Borrowing, Genre
+from .reservations import get_book_calendar
+from . import events
+from . import holds
+from . import ranking
+from . import recommendations
+from .jsonlines import json_line
+from .views import search_books
+
+PAGINATE_BY = 10
+# seconds between two keepalive comments of an idle event stream
+EVENTS_KEEPALIVE = 15
+# the stream is closed after this many seconds, the browser reconnects with Last-Event-ID
+EVENTS_STREAM_SECONDS = 300
+# reconnection delay sent to the browsers (milliseconds)
+EVENTS_RETRY = 3000
+# longest wait of the long-poll endpoint (seconds)
+LONG_POLL_SECONDS = 25
+
+arender = sync_to_async(render)
+
+
+async def aget_user(request):
+    return await sync_to_async(get_user)(request)
+
+async def acheck_perm(user, perm):
+    if not await sync_to_async(user.has_perm)(perm):
+        raise PermissionDenied
+
+async def apaginate(request, queryset, paginate_by=PAGINATE_BY):
+    """
+    Paginate with one acount() and one async page query.
+    Returns the ListView pagination context (paginator, page_obj, is_paginated, object list).
+    """
+    count = await queryset.acount()
+    paginator = Paginator(range(count), paginate_by)
+    page_obj = paginator.get_page(request.GET.get('page'))
+    objects = []
+    if count:
+        objects = [obj async for obj in queryset[page_obj.start_index() - 1:page_obj.end_index()]]
+    page_obj.object_list = objects
+    return {
+        'paginator': paginator,
+        'page_obj': page_obj,
+        'is_paginated': page_obj.has_other_pages(),
+    }, page_obj.object_list
+
+
+async def index(request):
+    """View function for home page of site."""
+    num_books, num_copies, num_genres, num_copies_available, num_authors = await asyncio.gather(
+        Book.objects.acount(),
+        BookCopy.objects.acount(),
+        Genre.objects.acount(),
+        BookCopy.objects.filter(status__exact='a').acount(),
+        Author.objects.acount(),
+    )
+    top_rated_books, most_borrowed_books = await asyncio.gather(
+        sync_to_async(ranking.top_rated)(10),
+        sync_to_async(ranking.most_borrowed)(10),
+    )
+
+    context = {
+        'num_books': num_books,
+        'num_copies': num_copies,
+        'num_copies_available': num_copies_available,
+        'num_authors': num_authors,
+        'num_genres': num_genres,
+        'top_rated_books': top_rated_books,
+        'most_borrowed_books': most_borrowed_books,
+    }
+    return await arender(request, 'index.html', context=context)
+
+
+async def book_list(request):
+    form = SearchBookForm(request.GET)
+    if await sync_to_async(form.is_valid)():
+        queryset = search_books(form.cleaned_data)
+    else:
+        queryset = Book.objects.all()
+
+    context, books = await apaginate(request, queryset.order_by('pk'))
+    context.update({'form': form, 'book_list': books, 'object_list': books})
+    return await arender(request, 'catalog/book_list.html', context)
+
+
+class BookDetailView(View):
+    """Async detail view of a book, its copies, reviews, availability and hold queue."""
+
+    async def get(self, request, pk):
+        try:
+            book = await (Book.objects
+                .select_related('author', 'language')
+                .prefetch_related('genre', 'bookcopy_set', 'review_set__user')
+                .aget(pk=pk))
+        except Book.DoesNotExist:
+            raise Http404('No book found matching the query')
+
+        start = datetime.date.today()
+        end = start + datetime.timedelta(days=30)
+        user = await aget_user(request)
+        calendar, hold, hold_queue_length, recommended_books = await asyncio.gather(
+            sync_to_async(get_book_calendar)(pk),
+            sync_to_async(holds.get_user_hold)(pk, user),
+            sync_to_async(holds.queue_length)(pk),
+            sync_to_async(recommendations.get_recommendations)(pk),
+        )
+        hold_position = await sync_to_async(holds.queue_position)(hold) if hold else None
+
+        context = {
+            'book': book,
+            'object': book,
+            'availability_end': end,
+            'free_ranges': calendar.free_ranges(start, end),
+            'copy_bookings': [(copy, calendar.booked(copy.id, start, end)) for copy in book.bookcopy_set.all()],
+            'hold_queue_length': hold_queue_length,
+            'hold_position': hold_position,
+            'recommended_books': recommended_books,
+        }
+        return await arender(request, 'catalog/book_detail.html', context)
+
+
+async def borrowing_list_user(request):
+    user = await aget_user(request)
+    if not user.is_authenticated:
+        return redirect_to_login(request.get_full_path())
+
+    queryset = (Borrowing.objects
+        .filter(borrower=user)
+        .select_related('book_copy__book')
+        .order_by('-updated_at'))
+    context, borrowings = await apaginate(request, queryset)
+    context.update({'borrowing_list': borrowings, 'object_list': borrowings,
+                    'stats': await sync_to_async(get_borrowing_stats)(user)})
+    context.update(get_borrowing_limits())
+    return await arender(request, 'catalog/borrowing_list_user.html', context)
+
+
+async def borrowing_list_staff(request):
+    user = await aget_user(request)
+    if not user.is_authenticated:
+        return redirect_to_login(request.get_full_path())
+    await acheck_perm(user, 'catalog.can_view_all_borrowing')
+
+    queryset = Borrowing.objects.select_related('book_copy__book', 'borrower')
+    context, borrowings = await apaginate(request, queryset)
+    # served over ASGI, the page can keep an event stream open
+    context.update({'borrowing_list': borrowings, 'object_list': borrowings, 'borrowing_events': True})
+    return await arender(request, 'catalog/borrowing_list_staff.html', context)
+
+
+def parse_cursor(value):
+    """Event id sent by the client, None when absent."""
+    if value in (None, ''):
+        return None
+    return max(int(value), 0)
+
+def sse_message(event):
+    return b'id: %d\nevent: %s\ndata: %s\n' % (event['id'], event['type'].encode(), json_line(event))
+
+async def borrowing_events(request):
+    """
+    Server-sent events stream of the borrowing events after the Last-Event-ID
+    header (or ?since=), from now on when neither is given.
+    """
+    await acheck_perm(await aget_user(request), 'catalog.can_view_all_borrowing')
+    try:
+        last_id = parse_cursor(request.headers.get('Last-Event-ID') or request.GET.get('since'))
+    except ValueError:
+        return JsonResponse({'detail': 'Invalid event id'}, status=400)
+    broker = events.get_broker()
+    if last_id is None:
+        last_id = await sync_to_async(broker.head)()
+
+    async def stream(last_id):
+        yield b'retry: %d\n\n' % EVENTS_RETRY
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + EVENTS_STREAM_SECONDS
+        while (remaining := deadline - loop.time()) > 0:
+            new_events = await broker.wait(last_id, min(EVENTS_KEEPALIVE, remaining))
+            if new_events is None:
+                # too far behind, the page reloads the list
+                last_id = await sync_to_async(broker.head)()
+                yield sse_message({'id': last_id, 'type': 'reset'})
+            elif new_events:
+                last_id = new_events[-1]['id']
+                yield b''.join(sse_message(event) for event in new_events)
+            else:
+                yield b': keepalive\n\n'
+
+    response = StreamingHttpResponse(stream(last_id), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # no buffering by nginx
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+async def borrowing_events_poll(request):
+    """
+    Long poll: the borrowing events after ?since=, waiting up to ?timeout= seconds
+    (at most LONG_POLL_SECONDS) for one. Without `since` only the cursor is returned.
+    `reset` is true when the events are no longer kept, the list has to be reloaded.
+    """
+    await acheck_perm(await aget_user(request), 'catalog.can_view_all_borrowing')
+    try:
+        since = parse_cursor(request.GET.get('since'))
+        timeout = min(max(float(request.GET.get('timeout', LONG_POLL_SECONDS)), 0), LONG_POLL_SECONDS)
+    except ValueError:
+        return JsonResponse({'detail': 'since and timeout must be numbers'}, status=400)
+    broker = events.get_broker()
+    new_events = [] if since is None else await broker.wait(since, timeout)
+    if not new_events:
+        return JsonResponse({
+            'events': [],
+            'cursor': await sync_to_async(broker.head)() if since is None or new_events is None else since,
+            'reset': new_events is None,
+        })
+    return JsonResponse({'events': new_events, 'cursor': new_events[-1]['id'], 'reset': False})
@@ -0,0 +1,86 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+
+from knox.auth import TokenAuthentication
+from knox.crypto import hash_token
+from knox.models import AuthToken
+from knox.settings import knox_settings
+from rest_framework import exceptions
+from rest_framework.authentication import get_authorization_header
+
+TOKEN_CACHE_PREFIX = 'knox-auth:'
+
+
+def token_cache_key(digest):
+    return TOKEN_CACHE_PREFIX + digest
+
+def get_request_token(request):
+    """Return the raw knox token the request was authenticated with (or None)."""
+    if not isinstance(request.auth, AuthToken):
+        return None
+    auth = get_authorization_header(request).split()
+    if len(auth) != 2:
+        return None
+    return auth[1].decode('utf-8')
+
+def invalidate_token(digest):
+    cache.delete(token_cache_key(digest))
+
+def invalidate_user_tokens(user):
+    digests = AuthToken.objects.filter(user=user).values_list('digest', flat=True)
+    cache.delete_many([token_cache_key(digest) for digest in digests])
+
+def purge_expired_tokens():
+    """Delete every expired knox token, returns the number of deleted tokens."""
+    deleted, _rows = AuthToken.objects.filter(expiry__lt=timezone.now()).delete()
+    return deleted
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Knox token authentication that memoizes validated token digests.
+
+    A successful lookup stores the (user, auth_token) pair in the cache under the
+    token digest for CATALOG_TOKEN_CACHE_TTL seconds (never past the token expiry),
+    so repeated calls with the same token skip the AuthToken query. With knox
+    AUTO_REFRESH, cache hits renew the token expiry as the knox lookup does.
+
+    Cache entries are dropped when a token is deleted (logout, purge) or its user changes,
+    in the cache of the process doing it: with a per-process cache (LocMemCache) the
+    other worker processes keep accepting a revoked token for up to the TTL. Use a
+    shared cache backend with several processes (see catalog.checks), or set the TTL to 0.
+    """
+
+    def authenticate_credentials(self, token):
+        try:
+            digest = hash_token(token.decode('utf-8'))
+        except (TypeError, UnicodeDecodeError, ValueError):
+            raise exceptions.AuthenticationFailed(_('Invalid token.'))
+
+        key = token_cache_key(digest)
+        cached = cache.get(key)
+        if cached is not None:
+            user, auth_token = cached
+            if auth_token.expiry is None or auth_token.expiry > timezone.now():
+                if knox_settings.AUTO_REFRESH and auth_token.expiry:
+                    expiry = auth_token.expiry
+                    self.renew_token(auth_token)
+                    # saved (and cached again) once per MIN_REFRESH_INTERVAL, as in knox
+                    if (auth_token.expiry - expiry).total_seconds() > knox_settings.MIN_REFRESH_INTERVAL:
+                        self.cache_token(key, user, auth_token)
+                return self.validate_user(auth_token)
+            cache.delete(key)
+
+        user, auth_token = super().authenticate_credentials(token)
+        self.cache_token(key, user, auth_token)
+        return (user, auth_token)
+
+    def cache_token(self, key, user, auth_token):
+        timeout = getattr(settings, 'CATALOG_TOKEN_CACHE_TTL', 60)
+        if auth_token.expiry is not None:
+            remaining = (auth_token.expiry - timezone.now()).total_seconds()
+            timeout = min(timeout, int(remaining))
+        if timeout > 0:
+            cache.set(key, (user, auth_token), timeout)
@@ -0,0 +1,300 @@
+"""
+In-process bitmap index for facet filtering of books.
+
+One bitmap of book ids per genre, language, author and availability (a copy with
+status 'a'), so any AND/OR/NOT combination of facet values is a handful of
+bitmap operations and the facet counts of a result are intersection counts.
+Pages of ids are hydrated with in_bulk().
+
+pyroaring compressed bitmaps are used when installed, Python ints otherwise.
+The index is enabled with CATALOG_BITMAP_INDEX, loaded on first use and kept up
+to date by the model signals of this process; a version number in the cache
+makes other processes reload it after a change.
+"""
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Author, Book, BookCopy, Genre, Language
+
+try:
+    from pyroaring import BitMap
+except ImportError: # pragma: no cover
+    BitMap = None
+
+VERSION_CACHE_KEY = 'bitmaps:version'
+FACETS = ('genre', 'language', 'author', 'available')
+FACET_MODELS = {'genre': Genre, 'language': Language, 'author': Author}
+
+
+class IntBitmap:
+    """Bitmap on a Python int, the subset of the pyroaring BitMap API used here."""
+
+    __slots__ = ('bits',)
+
+    def __init__(self, values=(), bits=0):
+        for value in values:
+            bits |= 1 << value
+        self.bits = bits
+
+    def add(self, value):
+        self.bits |= 1 << value
+
+    def discard(self, value):
+        self.bits &= ~(1 << value)
+
+    def copy(self):
+        return IntBitmap(bits=self.bits)
+
+    def __and__(self, other):
+        return IntBitmap(bits=self.bits & other.bits)
+
+    def __or__(self, other):
+        return IntBitmap(bits=self.bits | other.bits)
+
+    def __sub__(self, other):
+        return IntBitmap(bits=self.bits & ~other.bits)
+
+    def __contains__(self, value):
+        return bool(self.bits >> value & 1)
+
+    def __len__(self):
+        return self.bits.bit_count()
+
+    def __eq__(self, other):
+        return isinstance(other, IntBitmap) and self.bits == other.bits
+
+    def __iter__(self):
+        bits = bin(self.bits)[:1:-1]
+        position = bits.find('1')
+        while position != -1:
+            yield position
+            position = bits.find('1', position + 1)
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice) or index.step not in (None, 1):
+            raise TypeError('IntBitmap only supports [start:stop] slices')
+        start, stop, _step = index.indices(len(self))
+        values = []
+        for position, value in enumerate(self):
+            if position >= stop:
+                break
+            if position >= start:
+                values.append(value)
+        return IntBitmap(values)
+
+    def intersection_cardinality(self, other):
+        return (self.bits & other.bits).bit_count()
+
+def new_bitmap(values=()):
+    return BitMap(values) if BitMap is not None else IntBitmap(values)
+
+
+class BookBitmapIndex:
+    """Bitmaps of book ids per (facet, key), key is True/False for 'available'."""
+
+    def __init__(self):
+        self.books = new_bitmap()
+        self.bitmaps = defaultdict(new_bitmap)
+        self.book_facets = {}
+        self.version = None
+        self.lock = threading.RLock()
+
+    @classmethod
+    def load(cls):
+        index = cls()
+        index.version = cache.get(VERSION_CACHE_KEY, 0)
+        genres = defaultdict(list)
+        for book_id, genre_id in Book.genre.through.objects.values_list('book_id', 'genre_id'):
+            genres[book_id].append(genre_id)
+        available = set(BookCopy.objects.filter(status='a').values_list('book_id', flat=True).distinct())
+        for book_id, author_id, language_id in Book.objects.values_list('id', 'author_id', 'language_id'):
+            index.set_book(book_id, author_id, language_id, genres[book_id], book_id in available)
+        return index
+
+    def set_book(self, book_id, author_id, language_id, genre_ids, available):
+        facets = {('available', bool(available))}
+        facets.update(('genre', genre_id) for genre_id in genre_ids)
+        if author_id is not None:
+            facets.add(('author', author_id))
+        if language_id is not None:
+            facets.add(('language', language_id))
+        with self.lock:
+            old = self.book_facets.get(book_id, set())
+            for key in old - facets:
+                self.bitmaps[key].discard(book_id)
+            for key in facets - old:
+                self.bitmaps[key].add(book_id)
+            self.book_facets[book_id] = facets
+            self.books.add(book_id)
+
+    def remove_book(self, book_id):
+        with self.lock:
+            for key in self.book_facets.pop(book_id, ()):
+                self.bitmaps[key].discard(book_id)
+            self.books.discard(book_id)
+
+    def bitmap(self, facet, key):
+        return self.bitmaps.get((facet, key)) or new_bitmap()
+
+    def evaluate(self, node):
+        """
+        Book ids matching a filter expression:
+        (facet, key), ('and', [nodes]), ('or', [nodes]), ('not', node) or None for all books.
+        """
+        if node is None:
+            return self.books.copy()
+        operator, operand = node
+        if operator == 'and':
+            result = self.books.copy()
+            for child in operand:
+                result = result & self.evaluate(child)
+            return result
+        if operator == 'or':
+            result = new_bitmap()
+            for child in operand:
+                result = result | self.evaluate(child)
+            return result
+        if operator == 'not':
+            return self.books - self.evaluate(operand)
+        return self.bitmap(operator, operand).copy()
+
+    def facet_counts(self, result):
+        """{facet: {key: count}} of the books in result, zero counts left out."""
+        counts = {facet: {} for facet in FACETS}
+        with self.lock:
+            items = list(self.bitmaps.items())
+        for (facet, key), bitmap in items:
+            count = result.intersection_cardinality(bitmap)
+            if count:
+                counts[facet][key] = count
+        return counts
+
+
+_index = None
+_index_lock = threading.Lock()
+
+def is_enabled():
+    return getattr(settings, 'CATALOG_BITMAP_INDEX', False)
+
+def get_index():
+    """The index of this process, (re)loaded when missing or changed by another process."""
+    global _index
+    version = cache.get(VERSION_CACHE_KEY, 0)
+    if _index is None or _index.version != version:
+        with _index_lock:
+            if _index is None or _index.version != version:
+                _index = BookBitmapIndex.load()
+    return _index
+
+def reset_index():
+    global _index
+    _index = None
+
+def bump_version(index):
+    """Record a change of this process, other processes reload on their next query."""
+    try:
+        version = cache.incr(VERSION_CACHE_KEY)
+    except ValueError:
+        cache.add(VERSION_CACHE_KEY, 0, None)
+        version = cache.incr(VERSION_CACHE_KEY)
+    # an unseen change of another process in between: reload on next use
+    index.version = version if index.version is not None and version == index.version + 1 else None
+
+def update_books(book_ids):
+    """Reload some books into the loaded index (signals), a no-op when it is not loaded."""
+    index = _index
+    if index is None or not book_ids:
+        return
+    book_ids = set(book_ids)
+    genres = defaultdict(list)
+    for book_id, genre_id in (Book.genre.through.objects
+            .filter(book_id__in=book_ids)
+            .values_list('book_id', 'genre_id')):
+        genres[book_id].append(genre_id)
+    available = set(BookCopy.objects
+        .filter(book_id__in=book_ids, status='a')
+        .values_list('book_id', flat=True))
+    found = set()
+    for book_id, author_id, language_id in (Book.objects
+            .filter(id__in=book_ids)
+            .values_list('id', 'author_id', 'language_id')):
+        index.set_book(book_id, author_id, language_id, genres[book_id], book_id in available)
+        found.add(book_id)
+    for book_id in book_ids - found:
+        index.remove_book(book_id)
+    bump_version(index)
+
+def invalidate_index():
+    """Make every process reload the index (bulk changes the signals cannot follow)."""
+    reset_index()
+    try:
+        cache.incr(VERSION_CACHE_KEY)
+    except ValueError:
+        pass
+
+def remove_book(book_id):
+    index = _index
+    if index is not None:
+        index.remove_book(book_id)
+        bump_version(index)
+
+
+class BitmapResult:
+    """
+    Book ids of a bitmap query as a sequence for Paginator/ListView:
+    len() is the bitmap cardinality and slices are hydrated with in_bulk().
+    """
+
+    model = Book
+
+    def __init__(self, ids, queryset=None):
+        self.ids = ids
+        self.queryset = queryset if queryset is not None else Book.objects.select_related('author')
+
+    def __len__(self):
+        return len(self.ids)
+
+    def count(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        return iter(self[:len(self)])
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        ids = list(self.ids[index])
+        books = self.queryset.in_bulk(ids)
+        return [books[book_id] for book_id in ids if book_id in books]
+
+
+def search_expression(genre_ids=(), language_id=None, author_id=None, available=False):
+    """Filter expression of the book search form: genres OR'ed, facets AND'ed."""
+    terms = []
+    if genre_ids:
+        terms.append(('or', [('genre', genre_id) for genre_id in genre_ids]))
+    if language_id is not None:
+        terms.append(('language', language_id))
+    if author_id is not None:
+        terms.append(('author', author_id))
+    if available:
+        terms.append(('available', True))
+    return ('and', terms)
+
+def search(expression):
+    return BitmapResult(get_index().evaluate(expression))
+
+def get_facets(result):
+    """Same output as catalog.facets.get_facets() for a BitmapResult, from the bitmaps."""
+    counts = get_index().facet_counts(result.ids)
+    facets = {}
+    for facet, model in FACET_MODELS.items():
+        names = dict(model.objects.filter(id__in=counts[facet]).values_list('id', 'name'))
+        facets[facet] = sorted(
+            ({'key': key, 'name': names[key], 'count': count}
+             for key, count in counts[facet].items() if key in names),
+            key=lambda value: (-value['count'], value['name']))
+    return facets
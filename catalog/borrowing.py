@@ -0,0 +1,97 @@
+import datetime
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import BookCopy, Borrowing, UserBorrowingStats
+
+# borrowings that hold a book copy for their date range
+ACTIVE_BORROWING_STATUSES = ('p', 'a', 'b')
+
+
+def dates_overlap(start_a, end_a, start_b, end_b):
+    """Closed date ranges [start_a, end_a] and [start_b, end_b] share at least one day."""
+    return start_a <= end_b and start_b <= end_a
+
+def check_borrowing_requests(items, lock=False):
+    """
+    Split borrowing requests into accepted and rejected ones.
+
+    `items` are dicts with book_copy (id), start_date and due_date. A request is
+    rejected when its copy does not exist, is not available, or overlaps an active
+    borrowing of the copy or an earlier accepted request of the same batch.
+    Copies and their active borrowings are loaded with one IN query each.
+    lock=True locks the copies (in id order) until the end of the caller's transaction,
+    so concurrent requests for the same copies are checked one after the other.
+    Returns (accepted, rejected) where rejected is a list of (index, reason).
+    """
+    copy_ids = {item['book_copy'] for item in items}
+    copies = BookCopy.objects.filter(id__in=copy_ids)
+    if lock:
+        copies = copies.select_for_update().order_by('id')
+    copy_status = dict(copies.values_list('id', 'status'))
+
+    taken = {}
+    active = (Borrowing.objects
+        .filter(book_copy_id__in=copy_ids, status__in=ACTIVE_BORROWING_STATUSES)
+        .values_list('book_copy_id', 'start_date', 'due_date'))
+    for copy_id, start_date, due_date in active:
+        taken.setdefault(copy_id, []).append((start_date, due_date))
+
+    accepted, rejected = [], []
+    for index, item in enumerate(items):
+        copy_id = item['book_copy']
+        if copy_id not in copy_status:
+            rejected.append((index, 'Book copy does not exist'))
+        elif copy_status[copy_id] != 'a':
+            rejected.append((index, 'Book copy is not available'))
+        elif any(dates_overlap(item['start_date'], item['due_date'], start, end)
+                 for start, end in taken.get(copy_id, ())):
+            rejected.append((index, 'Book copy is already requested for these dates'))
+        else:
+            taken.setdefault(copy_id, []).append((item['start_date'], item['due_date']))
+            accepted.append(item)
+    return accepted, rejected
+
+def get_borrowing_stats(user, lock=False):
+    """
+    Counters of a user, created from the history on first use.
+    The overdue counter is recounted on the user's active loans once a day.
+    lock=True locks the row until the end of the caller's transaction (limit checks).
+    """
+    today = datetime.date.today()
+    queryset = UserBorrowingStats.objects.filter(pk=user.pk)
+    stats = (queryset.select_for_update() if lock else queryset).first()
+    if stats is None:
+        return UserBorrowingStats.recount(user.pk)
+    if stats.overdue_checked_on < today:
+        with transaction.atomic():
+            stats = queryset.select_for_update().get()
+            stats.overdue = Borrowing.objects.filter(borrower=user, status='b', due_date__lt=today).count()
+            stats.overdue_checked_on = today
+            stats.save(update_fields=['overdue', 'overdue_checked_on'])
+    return stats
+
+def get_borrowing_limits():
+    return {
+        'max_active_loans': getattr(settings, 'CATALOG_MAX_ACTIVE_LOANS', 5),
+        'max_pending_requests': getattr(settings, 'CATALOG_MAX_PENDING_REQUESTS', 3),
+    }
+
+def check_borrowing_limit(stats, count=1, pending=True):
+    """
+    Error message when `count` new requests would exceed the user's limits, else None.
+    pending=False for borrowings created approved (hold assignments), only the active limit applies.
+    """
+    limits = get_borrowing_limits()
+    if pending and stats.pending + count > limits['max_pending_requests']:
+        return f'You cannot have more than {limits["max_pending_requests"]} pending borrowing requests'
+    if stats.active + stats.pending + count > limits['max_active_loans']:
+        return f'You cannot have more than {limits["max_active_loans"]} active loans and requests'
+    return None
+
+def remaining_borrowing_slots(stats):
+    """Number of new requests the user can still open."""
+    limits = get_borrowing_limits()
+    return max(min(limits['max_pending_requests'] - stats.pending,
+                   limits['max_active_loans'] - stats.active - stats.pending), 0)
@@ -0,0 +1,104 @@
+"""
+Change feed for incremental sync of books, authors, copies, reviews and borrowings.
+
+Every write of one of these objects appends a Change row whose id is the change
+sequence number; deletes append a tombstone. Older entries of the object are
+dropped at the same time, so the feed holds the last change of each object and
+a client syncing from a cursor downloads each changed object once, whatever
+the number of writes in between.
+
+Writes are recorded by the model signals (catalog.signals) and explicitly by
+the code writing with bulk_create()/update(). The entries get their sequence
+number once committed, not when they are written: each read of the feed first
+numbers the committed entries that have none yet (number_changes()), after the
+highest number given so far and under a lock on the ChangeSequence row. So a
+transaction committing late, however long it ran, gets numbers above every
+cursor already handed out: a client syncing from its cursor receives every
+committed change, none is skipped.
+"""
+from django.db import transaction
+from django.db.models import F, Max, Min
+
+from .models import Author, Book, BookCopy, Borrowing, Change, ChangeSequence, Review
+
+FEED_MODELS = {model._meta.model_name: model for model in (Author, Book, BookCopy, Review, Borrowing)}
+# models any signed in user can sync, the others are for staff
+PUBLIC_MODELS = ('author', 'book', 'bookcopy', 'review')
+
+
+def record(model, object_ids, deleted=False):
+    """Append a change of each object, replacing the previous change of the same object."""
+    name = model._meta.model_name
+    object_ids = list(dict.fromkeys(str(pk) for pk in object_ids))
+    if not object_ids:
+        return
+    with transaction.atomic(savepoint=False):
+        Change.objects.filter(model=name, object_id__in=object_ids).delete()
+        Change.objects.bulk_create([Change(model=name, object_id=pk, deleted=deleted) for pk in object_ids])
+
+def number_changes():
+    """Give the committed entries with no sequence number the next ones, in the order they were written."""
+    pending = Change.objects.filter(seq__isnull=True)
+    if not pending.exists():
+        return
+    with transaction.atomic():
+        sequence = ChangeSequence.objects.select_for_update().first()
+        if sequence is None:
+            sequence = ChangeSequence.objects.create(value=Change.objects.aggregate(value=Max('seq'))['value'] or 0)
+        bounds = pending.aggregate(first=Min('id'), last=Max('id'))
+        if bounds['first'] is None:
+            return
+        # seq = id + offset keeps the write order and starts after every number given
+        offset = max(sequence.value - bounds['first'] + 1, 0)
+        pending.filter(id__lte=bounds['last']).update(seq=F('id') + offset)
+        sequence.value = max(sequence.value, bounds['last'] + offset)
+        sequence.save(update_fields=['value'])
+
+def get_changes(since=0, limit=500, models=None):
+    """
+    Changes after the `since` cursor, oldest first, with the current data of the
+    changed objects. Returns (changes, cursor, has_more), cursor is the sequence
+    number to send back as `since` for the next page.
+    """
+    number_changes()
+    queryset = Change.objects.filter(seq__gt=since).order_by('seq')
+    if models is not None:
+        queryset = queryset.filter(model__in=models)
+    entries = list(queryset[:limit + 1])
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+
+    data = load_objects(entries)
+    changes = []
+    for entry in entries:
+        model = FEED_MODELS[entry.model]
+        object_data = data[entry.model].get(entry.object_id)
+        changes.append({
+            'seq': entry.seq,
+            'model': entry.model,
+            'id': model._meta.pk.to_python(entry.object_id),
+            'deleted': entry.deleted or object_data is None,
+            'data': object_data,
+        })
+    cursor = entries[-1].seq if entries else since
+    return changes, cursor, has_more
+
+def load_objects(entries):
+    """{model: {object_id: data}} of the objects still existing, one query per model (and per many-to-many field)."""
+    # the serializers import DRF, the signal handlers recording changes do not need them
+    from .serializers import CHANGE_FEED_SERIALIZERS
+    ids = {name: [] for name in FEED_MODELS}
+    for entry in entries:
+        if not entry.deleted:
+            ids[entry.model].append(entry.object_id)
+    data = {}
+    for name, object_ids in ids.items():
+        data[name] = {}
+        if not object_ids:
+            continue
+        serializer = CHANGE_FEED_SERIALIZERS[name](FEED_MODELS[name].objects.filter(pk__in=object_ids))
+        rows = list(serializer.values(serializer.queryset))
+        pks = [row['pk'] for row in rows]
+        for pk, row in zip(pks, serializer.serialize(rows, pks)):
+            data[name][str(pk)] = row
+    return data
@@ -0,0 +1,33 @@
+"""
+System checks of the catalog settings, run at startup by runserver, migrate and the
+other management commands; the deploy ones by `manage.py check --deploy` only.
+"""
+from numbers import Real
+
+from django.conf import settings
+from django.core.checks import Error, Tags, Warning, register
+
+
+@register()
+def check_ranking_settings(app_configs, **kwargs):
+    errors = []
+    half_life = getattr(settings, 'CATALOG_BORROW_HALF_LIFE_DAYS', 30)
+    if isinstance(half_life, bool) or not isinstance(half_life, Real) or not half_life >= 1:
+        errors.append(Error(
+            'CATALOG_BORROW_HALF_LIFE_DAYS must be a number of days, at least 1.',
+            hint='Run `manage.py rank_books` after changing it, the stored borrow scores depend on it.',
+            id='catalog.E001',
+        ))
+    return errors
+
+@register(Tags.caches, deploy=True)
+def check_token_cache(app_configs, **kwargs):
+    backend = settings.CACHES.get('default', {}).get('BACKEND', '')
+    if getattr(settings, 'CATALOG_TOKEN_CACHE_TTL', 60) > 0 and backend.endswith('.LocMemCache'):
+        return [Warning(
+            'The knox tokens are cached in a per-process cache (LocMemCache).',
+            hint='A revoked token is accepted by the other worker processes for up to '
+                 'CATALOG_TOKEN_CACHE_TTL seconds: use a shared cache backend, or set it to 0.',
+            id='catalog.W001',
+        )]
+    return []
@@ -0,0 +1,74 @@
+"""
+Bulk management of book copies: add N copies of a book, send copies to
+maintenance or put them back on the shelf.
+
+bulk_create() and update() send no model signals, so the caches the BookCopy
+signals keep up to date (calendars, bitmap index) and the change feed are
+refreshed here, and copies that become available are handed to the hold queues.
+"""
+from django.db import transaction
+
+from . import bitmaps
+from . import changes
+from . import holds
+from .models import BookCopy
+from .reservations import invalidate_book_calendars
+
+# copies on loan ('b') or reserved for a borrower ('r') keep their status
+SHELF_STATUSES = ('m', 'a')
+
+
+def add_copies(book, count, publisher, published_date=None, status='a'):
+    """Create `count` copies of a book in one INSERT, returns the new copies."""
+    if status not in SHELF_STATUSES:
+        raise ValueError(f'New copies must be available or in maintenance, not {status!r}')
+    with transaction.atomic():
+        copies = BookCopy.objects.bulk_create([
+            BookCopy(book=book, publisher=publisher, published_date=published_date, status=status)
+            for _ in range(count)
+        ])
+        changes.record(BookCopy, [copy.pk for copy in copies])
+    copies_changed([book.pk])
+    if status == 'a':
+        serve_holds(copies)
+    return copies
+
+def set_copies_status(copy_ids, status):
+    """
+    Move copies between maintenance and available with a single UPDATE.
+
+    Copies that are borrowed or reserved are left untouched, returns the ids of the
+    copies whose status changed.
+    """
+    if status not in SHELF_STATUSES:
+        raise ValueError(f'Copies can only be set available or in maintenance, not {status!r}')
+    with transaction.atomic():
+        copies = list(BookCopy.objects
+            .select_for_update()
+            .filter(id__in=copy_ids, status__in=SHELF_STATUSES)
+            .exclude(status=status)
+            .only('id', 'book_id'))
+        # the status guard is repeated in the UPDATE itself
+        BookCopy.objects.filter(id__in=[copy.id for copy in copies], status__in=SHELF_STATUSES).update(status=status)
+        changes.record(BookCopy, [copy.id for copy in copies])
+    copies_changed({copy.book_id for copy in copies})
+    if status == 'a':
+        for copy in copies:
+            copy.status = status
+        serve_holds(copies)
+    return [copy.id for copy in copies]
+
+def copies_changed(book_ids):
+    book_ids = set(book_ids)
+    invalidate_book_calendars(book_ids)
+    bitmaps.update_books(book_ids)
+
+def serve_holds(copies):
+    """Reserve available copies for the users waiting for their books, stops per book once its queue is empty."""
+    served = set()
+    for copy in copies:
+        if copy.book_id in served or holds.assign_returned_copy(copy) is not None:
+            continue
+        # not assigned: nobody is waiting, or this copy is booked by other requests
+        if not holds.queue_length(copy.book_id):
+            served.add(copy.book_id)
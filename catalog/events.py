@@ -0,0 +1,178 @@
+"""
+Borrowing events pushed to the librarian screens.
+
+Borrowings created, deleted or changing status publish an event once their
+transaction commits. Events are numbered and a broker keeps the recent ones,
+so a client reconnecting with the id of the last event it got (server-sent
+events Last-Event-ID, `since` of the long-poll endpoint) receives what it
+missed. A client too far behind gets None instead of events and reloads the
+list.
+
+CATALOG_EVENT_BROKER selects the broker: 'local' fans out in process, waiters
+are woken as soon as an event is published, but each worker process only sees
+its own events. 'cache' keeps the events in the cache and waiters poll it,
+every worker sees every event when the cache backend is shared.
+"""
+import asyncio
+import threading
+from collections import deque
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+# events kept for clients catching up
+HISTORY = 1000
+# poll interval of the cache broker (seconds)
+CACHE_POLL_INTERVAL = 0.5
+CACHE_KEY_PREFIX = 'events'
+CACHE_TIMEOUT = 3600
+
+
+class LocalBroker:
+    """Events of this process, in memory."""
+
+    def __init__(self, history=HISTORY):
+        self.lock = threading.Lock()
+        self.events = deque(maxlen=history)
+        self.last_id = 0
+        # (loop, asyncio.Event) of the coroutines waiting for an event
+        self.waiters = set()
+
+    def publish(self, event_type, data):
+        """Append an event, wake up the waiters. Safe to call from any thread."""
+        with self.lock:
+            self.last_id += 1
+            event = {'id': self.last_id, 'type': event_type, **data}
+            self.events.append(event)
+            waiters = list(self.waiters)
+        for loop, waiter in waiters:
+            try:
+                loop.call_soon_threadsafe(waiter.set)
+            except RuntimeError:
+                # the loop is closed
+                with self.lock:
+                    self.waiters.discard((loop, waiter))
+        return event
+
+    def head(self):
+        """Id of the last event."""
+        return self.last_id
+
+    def events_since(self, last_id):
+        """Events after `last_id`, None when some of them are no longer kept."""
+        with self.lock:
+            if last_id > self.last_id:
+                # ids of a previous process
+                return None
+            if last_id == self.last_id:
+                return []
+            first_id = self.events[0]['id'] if self.events else self.last_id + 1
+            if last_id < first_id - 1:
+                return None
+            return list(self.events)[last_id - first_id + 1:]
+
+    async def wait(self, last_id, timeout):
+        """Events after `last_id`, waiting up to `timeout` seconds for one; [] on timeout."""
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        # registered before the check, an event published in between sets it
+        with self.lock:
+            self.waiters.add(waiter)
+        try:
+            events = self.events_since(last_id)
+            if events == []:
+                try:
+                    await asyncio.wait_for(waiter[1].wait(), timeout)
+                except asyncio.TimeoutError:
+                    return []
+                events = self.events_since(last_id)
+            return events
+        finally:
+            with self.lock:
+                self.waiters.discard(waiter)
+
+
+class CacheBroker:
+    """Events shared by the worker processes through the cache."""
+
+    def __init__(self, history=HISTORY, poll_interval=CACHE_POLL_INTERVAL):
+        self.history = history
+        self.poll_interval = poll_interval
+        self.head_key = f'{CACHE_KEY_PREFIX}:head'
+
+    def event_key(self, event_id):
+        return f'{CACHE_KEY_PREFIX}:{event_id}'
+
+    def publish(self, event_type, data):
+        cache.add(self.head_key, 0, None)
+        event_id = cache.incr(self.head_key)
+        event = {'id': event_id, 'type': event_type, **data}
+        cache.set(self.event_key(event_id), event, CACHE_TIMEOUT)
+        return event
+
+    def head(self):
+        return cache.get(self.head_key, 0)
+
+    def events_since(self, last_id):
+        head = self.head()
+        if last_id > head or head - last_id > self.history:
+            return None
+        ids = range(last_id + 1, head + 1)
+        found = cache.get_many([self.event_key(event_id) for event_id in ids])
+        events = []
+        for event_id in ids:
+            event = found.get(self.event_key(event_id))
+            if event is None:
+                if any(event['id'] > event_id for event in found.values()):
+                    # expired or evicted
+                    return None
+                # numbered but not stored yet, it is sent with the next poll
+                break
+            events.append(event)
+        return events
+
+    async def wait(self, last_id, timeout):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            events = await sync_to_async(self.events_since)(last_id)
+            remaining = deadline - loop.time()
+            if events != [] or remaining <= 0:
+                return events
+            await asyncio.sleep(min(self.poll_interval, remaining))
+
+
+BROKERS = {'local': LocalBroker, 'cache': CacheBroker}
+_brokers = {}
+_brokers_lock = threading.Lock()
+
+
+def get_broker():
+    name = getattr(settings, 'CATALOG_EVENT_BROKER', 'local')
+    with _brokers_lock:
+        if name not in _brokers:
+            _brokers[name] = BROKERS[name]()
+        return _brokers[name]
+
+
+def borrowing_data(borrowing):
+    return {
+        'id': borrowing.pk,
+        'status': borrowing.status,
+        'status_display': borrowing.get_status_display(),
+        'book_copy': borrowing.book_copy_id,
+        'borrower': borrowing.borrower_id,
+        'start_date': borrowing.start_date,
+        'due_date': borrowing.due_date,
+    }
+
+def publish_borrowing(event_type, borrowing, previous_status=None):
+    """
+    Publish a 'created', 'status_changed' or 'deleted' event of a borrowing when the
+    current transaction commits, nothing is sent if it rolls back.
+    """
+    data = {'borrowing': borrowing_data(borrowing)}
+    if previous_status is not None:
+        data['previous_status'] = previous_status
+    transaction.on_commit(lambda: get_broker().publish(f'borrowing.{event_type}', data))
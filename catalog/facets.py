@@ -0,0 +1,64 @@
+"""
+Facet counts (genre, language, author) of a book search.
+
+The three counts come from one UNION of grouped queries over the ids of the
+filtered books, each row is (facet, key, name, count).
+"""
+from django.db.models import CharField, Count, F, Value
+
+from .models import Book
+
+FACETS = ('genre', 'language', 'author')
+
+
+def facet_rows(book_ids):
+    """Grouped (facet, key, name, count) querysets over a subquery of book ids."""
+    genres = (Book.genre.through.objects
+        .filter(book_id__in=book_ids)
+        .values(facet=Value('genre', output_field=CharField()), key=F('genre_id'), name=F('genre__name'))
+        .annotate(count=Count('book_id'))
+        .order_by())
+    languages = (Book.objects
+        .filter(id__in=book_ids, language__isnull=False)
+        .values(facet=Value('language', output_field=CharField()), key=F('language_id'), name=F('language__name'))
+        .annotate(count=Count('id'))
+        .order_by())
+    authors = (Book.objects
+        .filter(id__in=book_ids, author__isnull=False)
+        .values(facet=Value('author', output_field=CharField()), key=F('author_id'), name=F('author__name'))
+        .annotate(count=Count('id'))
+        .order_by())
+    return genres.union(languages, authors, all=True)
+
+def get_facets(books):
+    """
+    {facet: [{'key', 'name', 'count'}]} for a Book queryset, most frequent first.
+    Ordering, slicing and distinct of the queryset are dropped, only its filters count.
+    """
+    book_ids = books.order_by().values('id')
+    facets = {facet: [] for facet in FACETS}
+    for row in facet_rows(book_ids):
+        facets[row['facet']].append({'key': row['key'], 'name': row['name'], 'count': row['count']})
+    for values in facets.values():
+        values.sort(key=lambda value: (-value['count'], value['name']))
+    return facets
+
+def add_facet_links(facets, params):
+    """
+    Set `query` (the search query string with the facet value selected) and
+    `selected` on every facet value. Genres add up, language and author replace.
+    """
+    for facet, values in facets.items():
+        current = params.getlist(facet)
+        for value in values:
+            key = str(value['key'])
+            query = params.copy()
+            query.pop('page', None)
+            query.pop('csrfmiddlewaretoken', None)
+            if facet == 'genre':
+                query.setlist(facet, current if key in current else current + [key])
+            else:
+                query[facet] = key
+            value['query'] = query.urlencode()
+            value['selected'] = key in current
+    return facets
@@ -7,6 +7,7 @@ from django.utils.translation import gettext_lazy as _
 from django.forms import ModelForm
 from django.contrib.auth.forms import UserCreationForm
 from .models import Book, Author, Review, Borrowing
+from .reservations import has_conflict
 from django.contrib.auth.models import User
 
 class UserRegisterForm(UserCreationForm):
@@ -19,6 +20,14 @@ class UserRegisterForm(UserCreationForm):
         fields = ['username', 'email', 'phone_no', 'password1', 'password2']
 
 class SearchAuthorForm(ModelForm):
+    SORT_CHOICES = (
+        ('name', 'Name'),
+        ('books', 'Most books'),
+        ('rating', 'Best rated'),
+    )
+    sort = forms.ChoiceField(choices=SORT_CHOICES, required=False,
+                             widget=forms.Select(attrs={'class': 'form-control'}))
+
     class Meta:
         model = Author
         fields = ['name']
@@ -32,6 +41,8 @@ class SearchAuthorForm(ModelForm):
         self.fields['name'].required = False
 
 class SearchBookForm(ModelForm):
+    available = forms.BooleanField(required=False, label='Available only')
+
     class Meta:
         model = Book
         fields = ['title', 'author', 'genre', 'language']
@@ -101,6 +112,15 @@ class BorrowBookForm(forms.ModelForm):
             raise ValidationError(_('Invalid due date - due date cannot be earlier than start date'))
         return data
 
+    def clean(self):
+        cleaned_data = super().clean()
+        book_copy = cleaned_data.get('book_copy')
+        start_date = cleaned_data.get('start_date')
+        due_date = cleaned_data.get('due_date')
+        if book_copy and start_date and due_date and has_conflict(book_copy.id, start_date, due_date):
+            raise ValidationError(_('This book copy is already requested for these dates'))
+        return cleaned_data
+
 class DeclineBorrowingForm(forms.ModelForm):
     class Meta:
         model = Borrowing
@@ -123,3 +143,16 @@ class DeclineBorrowingForm(forms.ModelForm):
         self.fields['start_date'].disabled = True
         self.fields['due_date'].disabled = True
         self.fields['decline_reason'].required = True
+
+class AddBookCopiesForm(forms.Form):
+    STATUS_CHOICES = (
+        ('a', 'Available'),
+        ('m', 'Maintenance'),
+    )
+    count = forms.IntegerField(min_value=1, max_value=100, initial=1, label='Number of copies',
+                               widget=forms.NumberInput(attrs={'class': 'form-control'}))
+    publisher = forms.CharField(max_length=200, widget=forms.TextInput(attrs={'class': 'form-control'}))
+    published_date = forms.DateField(required=False,
+                                     widget=forms.widgets.DateInput(attrs={'type': 'date', 'class': 'form-control'}))
+    status = forms.ChoiceField(choices=STATUS_CHOICES, initial='a',
+                               widget=forms.Select(attrs={'class': 'form-select'}))
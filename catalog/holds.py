@@ -0,0 +1,100 @@
+import datetime
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+
+from . import bitmaps
+from . import changes
+from .borrowing import check_borrowing_limit, get_borrowing_stats
+from .models import BookCopy, Borrowing, Hold
+from .notifications import queue_notification
+from .reservations import has_conflict
+
+
+def join_queue(book, user):
+    """Put the user at the end of the hold queue of the book, returns (hold, created)."""
+    hold = Hold.objects.filter(book=book, user=user, status='w').first()
+    if hold is not None:
+        return hold, False
+    try:
+        with transaction.atomic():
+            return Hold.objects.create(book=book, user=user), True
+    except IntegrityError:
+        # concurrent join of the same user, the unique_waiting_hold constraint kept one
+        return Hold.objects.get(book=book, user=user, status='w'), False
+
+def leave_queue(book, user):
+    return Hold.objects.filter(book=book, user=user, status='w').update(status='c') > 0
+
+def queue_length(book_id):
+    return Hold.objects.filter(book_id=book_id, status='w').count()
+
+def queue_position(hold):
+    """1-based position of a waiting hold, counted on the (book, status, id) index."""
+    if hold.status != 'w':
+        return None
+    return Hold.objects.filter(book_id=hold.book_id, status='w', id__lte=hold.id).count()
+
+def get_user_hold(book_id, user):
+    if not user.is_authenticated:
+        return None
+    return Hold.objects.filter(book_id=book_id, user=user, status='w').first()
+
+def assign_returned_copy(book_copy):
+    """
+    Reserve a copy that just became available for the head of its book's hold queue.
+
+    The copy is claimed with a conditional update (status 'a' -> 'r') and the head hold
+    is locked with select_for_update(skip_locked), so concurrent returns never hand the
+    same copy or the same hold out twice. An approved borrowing is created for the
+    holder and an email is sent once the transaction commits. Holders over their loan
+    limits (catalog.borrowing) are passed over and keep their place for a later copy.
+    A copy already requested by other borrowings over the loan period is left to them,
+    not double-booked. Returns the fulfilled hold, or None when nobody (within their
+    limits) is waiting or the copy is booked.
+    """
+    with transaction.atomic():
+        waiting = (Hold.objects
+            .select_for_update(skip_locked=True)
+            .filter(book_id=book_copy.book_id, status='w')
+            .select_related('user', 'book')
+            .order_by('id'))
+        passed_over = []
+        while True:
+            hold = waiting.exclude(pk__in=passed_over).first()
+            if hold is None:
+                return None
+            if check_borrowing_limit(get_borrowing_stats(hold.user, lock=True), pending=False) is None:
+                break
+            passed_over.append(hold.pk)
+        if not BookCopy.objects.filter(pk=book_copy.pk, status='a').update(status='r'):
+            return None
+        # checked once the copy row is claimed (and locked), as the borrowing requests do
+        today = datetime.date.today()
+        due_date = today + datetime.timedelta(days=getattr(settings, 'CATALOG_HOLD_LOAN_DAYS', 14))
+        if has_conflict(book_copy.pk, today, due_date):
+            transaction.set_rollback(True)
+            return None
+        book_copy.status = 'r'
+        changes.record(BookCopy, [book_copy.pk])
+
+        hold.borrowing = Borrowing.objects.create(
+            borrower=hold.user,
+            book_copy=book_copy,
+            start_date=today,
+            due_date=due_date,
+            status='a', # approved
+        )
+        hold.status = 'f' # fulfilled
+        hold.save(update_fields=['status', 'borrowing'])
+        # the conditional update sends no BookCopy signal
+        transaction.on_commit(lambda: bitmaps.update_books([book_copy.book_id]))
+        send_hold_ready_email(hold)
+    return hold
+
+def send_hold_ready_email(hold):
+    """Queued when the transaction assigning the copy commits, sent once per hold."""
+    subject = 'Your book is ready!!!'
+    message = (f'A copy of {hold.book.title} has been reserved for you.\n\n'
+               f'Please collect it before {hold.borrowing.due_date}.')
+    queue_notification(subject, message, [hold.user.email], key=f'hold-{hold.pk}-ready')
@@ -0,0 +1,62 @@
+"""
+Import time of the project, measured with `python -X importtime` in a fresh
+interpreter (see the profile_imports management command).
+
+Every import of the child process is reported with its own time and its
+cumulative time (itself and the modules it imported first); the summary
+groups the own times by top-level package, to show which dependencies a
+process start pays for.
+"""
+import os
+import re
+import subprocess
+import sys
+from collections import defaultdict
+
+from django.conf import settings
+
+LINE = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+
+STARTUP = '''
+import django
+django.setup()
+{imports}
+'''
+
+
+def startup_code(modules=()):
+    """Code of a process starting Django and importing `modules` (the URLconf by default)."""
+    modules = list(modules) or [settings.ROOT_URLCONF]
+    return STARTUP.format(imports='\n'.join(f'import {module}' for module in modules))
+
+def run(code):
+    """(self us, cumulative us, depth, module) of every import done by `code` in a new interpreter."""
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'locallibrary.settings'))
+    completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=settings.BASE_DIR,
+                               env=env, capture_output=True, text=True)
+    if completed.returncode:
+        raise RuntimeError(completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else 'failed')
+    return parse(completed.stderr)
+
+def parse(output):
+    imports = []
+    for line in output.splitlines():
+        match = LINE.match(line)
+        if match is not None:
+            own, cumulative, indent, module = match.groups()
+            imports.append((int(own), int(cumulative), len(indent) // 2, module))
+    return imports
+
+def summarize(imports, top=15):
+    """Total import time, and the `top` slowest packages (own times) and modules (cumulative), in seconds."""
+    packages = defaultdict(int)
+    for own, _cumulative, _depth, module in imports:
+        packages[module.split('.')[0]] += own
+    slowest = sorted(imports, key=lambda entry: entry[1], reverse=True)[:top]
+    return {
+        'total': sum(own for own, *_rest in imports) / 1e6,
+        'modules': len(imports),
+        'packages': [(package, own / 1e6) for package, own in
+                     sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]],
+        'slowest': [(module, cumulative / 1e6) for _own, cumulative, _depth, module in slowest],
+    }
@@ -0,0 +1,72 @@
+"""
+ISBN validation and normalization.
+
+ISBN-10 and ISBN-13 numbers, with or without hyphens and spaces, are checked
+against their check digit and normalized to the 13 digit form, so
+"0-306-40615-2", "0306406152" and "978-0-306-40615-7" are the same key.
+Book.isbn_key stores that key in a unique index; lookup_books() resolves a
+batch of ISBNs with a single IN query on it.
+"""
+import re
+
+from django.core.exceptions import ValidationError
+
+SEPARATORS = re.compile(r'[\s-]+')
+
+
+def isbn10_check_digit(digits):
+    total = sum((10 - position) * int(digit) for position, digit in enumerate(digits[:9]))
+    check = (11 - total % 11) % 11
+    return 'X' if check == 10 else str(check)
+
+def isbn13_check_digit(digits):
+    total = sum(int(digit) * (3 if position % 2 else 1) for position, digit in enumerate(digits[:12]))
+    return str((10 - total % 10) % 10)
+
+def normalize_isbn(value):
+    """The 13 digit form of an ISBN-10 or ISBN-13, None when it is not a valid ISBN."""
+    value = SEPARATORS.sub('', value or '').upper()
+    if len(value) == 10 and value[:9].isdigit() and (value[9].isdigit() or value[9] == 'X'):
+        if isbn10_check_digit(value) != value[9]:
+            return None
+        value = '978' + value[:9]
+        return value + isbn13_check_digit(value)
+    if len(value) == 13 and value.isdigit() and value[:3] in ('978', '979'):
+        return value if isbn13_check_digit(value) == value[12] else None
+    return None
+
+def validate_isbn(value):
+    if normalize_isbn(value) is None:
+        raise ValidationError('%(value)s is not a valid ISBN-10 or ISBN-13', params={'value': value})
+
+def lookup_books(isbns, queryset=None):
+    """
+    Resolve a batch of ISBNs, returns (found, missing, invalid):
+    found maps each matched input to its book, missing and invalid list the other inputs.
+    The keys are looked up with one IN query (in_bulk() splits it on databases limiting query parameters).
+    """
+    from .models import Book
+    if queryset is None:
+        queryset = Book.objects.all()
+    keys, invalid = {}, []
+    for isbn in isbns:
+        key = normalize_isbn(isbn)
+        if key is None:
+            invalid.append(isbn)
+        else:
+            keys[isbn] = key
+
+    books = queryset.in_bulk(set(keys.values()), field_name='isbn_key')
+
+    found = {isbn: books[key] for isbn, key in keys.items() if key in books}
+    missing = [isbn for isbn, key in keys.items() if key not in books]
+    return found, missing, invalid
+
+def find_duplicates(isbns):
+    """Groups of inputs normalizing to the same ISBN, {isbn13: [inputs]}."""
+    groups = {}
+    for isbn in isbns:
+        key = normalize_isbn(isbn)
+        if key is not None:
+            groups.setdefault(key, []).append(isbn)
+    return {key: group for key, group in groups.items() if len(group) > 1}
@@ -0,0 +1,89 @@
+"""
+Built-in maintenance jobs of the scheduler (see catalog.scheduler).
+
+Status changes go through catalog.lifecycle in chunks, so the copies of the
+canceled reservations are put back on the shelf with one UPDATE per chunk and
+handed to the hold queues, and counters, change feed and events follow.
+"""
+import datetime
+
+from django.conf import settings
+from django.utils import timezone
+
+from . import lifecycle
+from .authentication import purge_expired_tokens
+from .models import Borrowing, Task, UserBorrowingStats
+from .notifications import queue_notification
+from .ranking import renormalize
+from .recommendations import update_recommendations
+from .rollups import update_rollups
+from .scheduler import job, pk_chunks
+
+
+def cancel_in_chunks(run, queryset):
+    for pks in pk_chunks(queryset, run.chunk_size):
+        # requests changed since the chunk was read are rejected and left alone
+        moved, _rejected = lifecycle.transition_many(pks, 'c')
+        run.chunk(len(moved))
+
+@job('expire_pending_borrowings', 'every 1h')
+def expire_pending_borrowings(run):
+    """Cancel the requests still pending CATALOG_PENDING_EXPIRY_DAYS after their start date."""
+    days = getattr(settings, 'CATALOG_PENDING_EXPIRY_DAYS', 0)
+    cutoff = datetime.date.today() - datetime.timedelta(days=days)
+    cancel_in_chunks(run, Borrowing.objects.filter(status='p', start_date__lt=cutoff))
+
+@job('cancel_uncollected_reservations', 'every 1h')
+def cancel_uncollected_reservations(run):
+    """Cancel the approved requests not collected CATALOG_RESERVATION_PICKUP_DAYS after their start date."""
+    days = getattr(settings, 'CATALOG_RESERVATION_PICKUP_DAYS', 3)
+    cutoff = datetime.date.today() - datetime.timedelta(days=days)
+    cancel_in_chunks(run, Borrowing.objects.filter(status='a', start_date__lt=cutoff))
+
+@job('send_overdue_reminders', '0 9 * * *')
+def send_overdue_reminders(run):
+    """Queue an email to the borrower of each loan past its due date, once a day per loan."""
+    today = datetime.date.today()
+    overdue = Borrowing.objects.filter(status='b', due_date__lt=today)
+    for pks in pk_chunks(overdue, run.chunk_size):
+        borrowings = Borrowing.objects.filter(pk__in=pks).select_related('borrower', 'book_copy__book')
+        for borrowing in borrowings:
+            queue_notification(
+                'Overdue borrowing book!!!',
+                f'You must return a book because of due date.\n\nBook name: {borrowing.book_copy.book.title}'
+                f'\n\nReturn Date: {borrowing.due_date}\n\nToday: {today}',
+                [borrowing.borrower.email],
+                key=f'overdue-{borrowing.pk}-{today}')
+        run.chunk(len(pks))
+
+@job('purge_expired_tokens', '30 3 * * *')
+def purge_tokens(run):
+    run.chunk(purge_expired_tokens())
+
+@job('reconcile_borrowing_stats', '0 4 * * *')
+def reconcile_borrowing_stats(run):
+    """Recount the borrowing counters of every user, in chunks of users."""
+    for user_ids in pk_chunks(UserBorrowingStats.objects.all(), run.chunk_size):
+        run.chunk(UserBorrowingStats.recount_many(user_ids))
+
+@job('update_rollups', 'every 15m')
+def rollups(run):
+    run.chunk(update_rollups(run.chunk_size))
+
+@job('renormalize_borrow_scores', '15 4 * * *')
+def renormalize_borrow_scores(run):
+    """Move the epoch of the book borrow scores to today, so the loan weights stay small."""
+    run.chunk(renormalize())
+
+@job('update_recommendations', 'every 1h')
+def recommendations(run):
+    run.chunk(update_recommendations())
+
+@job('purge_finished_tasks', '0 3 * * *')
+def purge_finished_tasks(run):
+    """Delete the background tasks done or failed more than CATALOG_TASK_RETENTION_DAYS ago."""
+    days = getattr(settings, 'CATALOG_TASK_RETENTION_DAYS', 7)
+    finished = Task.objects.filter(status__in=('d', 'f'), finished_at__lt=timezone.now() - datetime.timedelta(days=days))
+    for pks in pk_chunks(finished, run.chunk_size):
+        deleted, _rows = Task.objects.filter(pk__in=pks).delete()
+        run.chunk(deleted)
@@ -0,0 +1,42 @@
+"""
+NDJSON encoding, with orjson when it is installed.
+
+Kept apart from catalog.renderers so that the views streaming JSON lines
+(the event stream of catalog.async_views) do not import DRF.
+"""
+import datetime
+import decimal
+import json
+import uuid
+
+from django.utils.encoding import force_str
+
+try:
+    import orjson
+except ImportError: # pragma: no cover
+    orjson = None
+
+
+def encode_default(obj):
+    """Types left to the `default` hook of the encoders, converted as the DRF JSON encoder does."""
+    if isinstance(obj, (datetime.date, datetime.time)):
+        return obj.isoformat()
+    if isinstance(obj, decimal.Decimal):
+        return float(obj)
+    if isinstance(obj, uuid.UUID):
+        return str(obj)
+    if isinstance(obj, (set, frozenset, tuple)):
+        return list(obj)
+    if hasattr(obj, 'tolist'):
+        return obj.tolist()
+    if hasattr(obj, '__iter__') and not isinstance(obj, (str, bytes)):
+        return list(obj)
+    # lazy translations and other string-like objects
+    return force_str(obj)
+
+
+def json_line(obj):
+    """One NDJSON line."""
+    if orjson is not None:
+        return orjson.dumps(obj, default=encode_default, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_UTC_Z) + b'\n'
+    return json.dumps(obj, default=encode_default, separators=(',', ':')).encode() + b'\n'
@@ -0,0 +1,178 @@
+"""
+Borrowing state machine, shared by the HTML views, the API and the admin.
+
+    pending  -> canceled | approved | declined
+    approved -> canceled | borrowing
+    borrowing -> returned
+
+A transition may move the book copy too: approving reserves the available
+copy, starting the loan marks it borrowed, returning the book (or canceling
+an approved request) puts it back on the shelf, where it is handed to the
+hold queue.
+
+Transitions are checked against the borrowing rows (and their copies) read
+again with SELECT ... FOR UPDATE before anything is written, then applied with
+conditional UPDATEs (WHERE status is still the expected one), one per starting
+status for the borrowings and one for their copies. A concurrent change makes
+an UPDATE miss and the whole transition is rolled back. update() sends no model
+signals, so what the Borrowing and BookCopy signals do (borrowing counters,
+change feed, events, transition log) is done here; the cache invalidations and
+the hold queues run once the transaction commits (after_commit()).
+"""
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import bitmaps
+from . import changes
+from . import copies
+from . import events
+from . import ranking
+from . import transitions
+from .models import BookCopy, Borrowing, UserBorrowingStats
+from .reservations import invalidate_book_calendars
+
+# (from, to): (copy status required, copy status set), None when the copy is left alone
+TRANSITIONS = {
+    ('p', 'c'): None,
+    ('p', 'a'): ('a', 'r'),
+    ('p', 'd'): None,
+    ('a', 'c'): ('r', 'a'),
+    ('a', 'b'): ('r', 'b'),
+    ('b', 'r'): ('b', 'a'),
+}
+ACTIONS = {'c': 'cancel', 'a': 'approve', 'd': 'decline', 'b': 'start', 'r': 'return'}
+BORROWING_STATUSES = dict(Borrowing.BORROWING_STATUS)
+COPY_STATUSES = dict(BookCopy.STATUS)
+
+
+class TransitionError(ValueError):
+    """The borrowing cannot move to the requested status."""
+
+
+def next_statuses(status):
+    return [to_status for from_status, to_status in TRANSITIONS if from_status == status]
+
+def check(borrowing, to_status, claimed_copies=None):
+    """Raise TransitionError when the borrowing or its copy (book_copy is read) cannot move to `to_status`."""
+    if (borrowing.status, to_status) not in TRANSITIONS:
+        if to_status not in ACTIONS:
+            # no transition leads back to pending
+            raise TransitionError(f'Cannot move a {BORROWING_STATUSES[borrowing.status].lower()} '
+                                  f'borrowing request back to {BORROWING_STATUSES[to_status].lower()}!')
+        raise TransitionError(f'Cannot {ACTIONS[to_status]} a '
+                              f'{BORROWING_STATUSES[borrowing.status].lower()} borrowing request!')
+    rule = TRANSITIONS[(borrowing.status, to_status)]
+    if rule is None:
+        return
+    if borrowing.book_copy.status != rule[0] or (claimed_copies is not None and borrowing.book_copy_id in claimed_copies):
+        raise TransitionError(f'Cannot {ACTIONS[to_status]} this request because the book copy '
+                              f'is not {COPY_STATUSES[rule[0]].lower()}!')
+
+def transition(borrowing, to_status, **fields):
+    """
+    Move a borrowing (with its book_copy) to `to_status`, setting the other `fields`
+    (e.g. decline_reason) in the same UPDATE. The row is locked and read again to be
+    checked, the given instance is updated. Raises TransitionError.
+    """
+    with transaction.atomic():
+        current = (Borrowing.objects
+            .select_for_update()
+            .select_related('book_copy')
+            .filter(pk=borrowing.pk)
+            .first())
+        if current is None:
+            raise TransitionError('The borrowing request has been deleted meanwhile!')
+        check(current, to_status)
+        moved_copies = apply([current], to_status, fields)
+        transaction.on_commit(lambda: after_commit([current], moved_copies))
+    borrowing.status = current.status
+    borrowing.updated_at = current.updated_at
+    for name, value in fields.items():
+        setattr(borrowing, name, value)
+    if borrowing.book_copy_id == current.book_copy_id:
+        borrowing.book_copy.status = current.book_copy.status
+    return borrowing
+
+def transition_many(borrowing_ids, to_status):
+    """
+    Move the borrowings that can go to `to_status`, the rows are locked while checked.
+    Returns (moved ids, [(id, reason)] of the rejected ones), unknown ids are ignored.
+    """
+    moved, rejected = [], []
+    claimed_copies = set()
+    with transaction.atomic():
+        borrowings = (Borrowing.objects
+            .select_for_update()
+            .select_related('book_copy')
+            .filter(pk__in=borrowing_ids)
+            .order_by('pk'))
+        for borrowing in borrowings:
+            try:
+                check(borrowing, to_status, claimed_copies)
+            except TransitionError as error:
+                rejected.append((borrowing.pk, str(error)))
+                continue
+            moved.append(borrowing)
+            claimed_copies.add(borrowing.book_copy_id)
+        moved_copies = apply(moved, to_status)
+        transaction.on_commit(lambda: after_commit(moved, moved_copies))
+    return [borrowing.pk for borrowing in moved], rejected
+
+def apply(borrowings, to_status, fields=None):
+    """
+    Conditional UPDATEs of checked borrowings and of their copies, and the bookkeeping
+    the model signals would do. To be called in a transaction, returns the moved copies.
+    """
+    fields = fields or {}
+    now = timezone.now()
+    groups = defaultdict(list)
+    for borrowing in borrowings:
+        groups[borrowing.status].append(borrowing)
+
+    moved_copies = []
+    for from_status, group in groups.items():
+        updated = (Borrowing.objects
+            .filter(pk__in=[borrowing.pk for borrowing in group], status=from_status)
+            .update(status=to_status, updated_at=now, **fields))
+        if updated != len(group):
+            raise TransitionError('The borrowing request has been changed meanwhile, please try again!')
+        rule = TRANSITIONS[(from_status, to_status)]
+        if rule is not None:
+            updated = (BookCopy.objects
+                .filter(pk__in=[borrowing.book_copy_id for borrowing in group], status=rule[0])
+                .update(status=rule[1]))
+            if updated != len(group):
+                raise TransitionError('The book copy has been changed meanwhile, please try again!')
+
+        counts = Counter((borrowing.borrower_id, borrowing.due_date) for borrowing in group)
+        for (borrower_id, due_date), count in counts.items():
+            UserBorrowingStats.apply_change(borrower_id, (from_status, due_date), (to_status, due_date), count)
+        for borrowing in group:
+            borrowing.status = to_status
+            borrowing.updated_at = now
+            for name, value in fields.items():
+                setattr(borrowing, name, value)
+            if rule is not None:
+                borrowing.book_copy.status = rule[1]
+                moved_copies.append(borrowing.book_copy)
+            if to_status == 'b':
+                ranking.record_loan(borrowing.book_copy.book_id)
+            events.publish_borrowing('status_changed', borrowing, from_status)
+        transitions.record(group, from_status)
+
+    changes.record(Borrowing, [borrowing.pk for borrowing in borrowings])
+    changes.record(BookCopy, [copy.pk for copy in moved_copies])
+    return moved_copies
+
+def after_commit(borrowings, moved_copies):
+    """
+    Cache invalidations, and the copies back on the shelf handed to the hold queues
+    (in their own transactions). Registered with transaction.on_commit(), so other
+    requests cannot cache the state before the commit again.
+    """
+    invalidate_book_calendars({borrowing.book_copy.book_id for borrowing in borrowings})
+    if moved_copies:
+        bitmaps.update_books({copy.book_id for copy in moved_copies})
+        copies.serve_holds([copy for copy in moved_copies if copy.status == 'a'])
@@ -0,0 +1,15 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = 'Generate the OpenAPI schema of the REST API into CATALOG_API_SCHEMA_CACHE (e.g. at deployment)'
+
+    def handle(self, *args, **options):
+        path = getattr(settings, 'CATALOG_API_SCHEMA_CACHE', None)
+        if not path:
+            raise CommandError('CATALOG_API_SCHEMA_CACHE is not set')
+        # drf_yasg is only imported by the commands and views needing it
+        from catalog.api_schema import get_schema
+        schema = get_schema(refresh=True)
+        self.stdout.write(self.style.SUCCESS(f'Wrote the API schema ({len(schema)} bytes) to {path}'))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from catalog import importprofile
+
+
+class Command(BaseCommand):
+    help = 'Profile the imports of a process starting Django and loading the URLconf (python -X importtime)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('modules', nargs='*',
+                            help='Modules imported after django.setup() (default: the URLconf)')
+        parser.add_argument('--top', type=int, default=15, help='Number of packages and modules listed')
+
+    def handle(self, *args, **options):
+        try:
+            imports = importprofile.run(importprofile.startup_code(options['modules']))
+        except RuntimeError as error:
+            raise CommandError(f'The profiled process failed: {error}')
+        summary = importprofile.summarize(imports, options['top'])
+
+        self.stdout.write(f"{summary['modules']} modules imported in {summary['total'] * 1e3:.1f} ms")
+        self.stdout.write('\nPackages (own time):')
+        for package, seconds in summary['packages']:
+            self.stdout.write(f'  {seconds * 1e3:8.1f} ms  {package}')
+        self.stdout.write('\nModules (cumulative time):')
+        for module, seconds in summary['slowest']:
+            self.stdout.write(f'  {seconds * 1e3:8.1f} ms  {module}')
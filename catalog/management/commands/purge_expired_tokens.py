@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from catalog.authentication import purge_expired_tokens
+
+
+class Command(BaseCommand):
+    help = 'Delete expired knox authentication tokens'
+
+    def handle(self, *args, **options):
+        deleted = purge_expired_tokens()
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} expired token(s)'))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from catalog.ranking import rebuild_scores
+
+
+class Command(BaseCommand):
+    help = 'Recompute the rating and loan scores of every book from the reviews and borrowings'
+
+    def handle(self, *args, **options):
+        scored = rebuild_scores()
+        self.stdout.write(self.style.SUCCESS(f'Scored {scored} book(s)'))
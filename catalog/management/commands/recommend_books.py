@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from catalog.recommendations import rebuild_recommendations, update_recommendations
+
+
+class Command(BaseCommand):
+    help = 'Update the "readers also borrowed" recommendations from the loans changed since the last run'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true',
+                            help='Recompute the recommendations from the whole loan history')
+        parser.add_argument('-k', type=int, default=None,
+                            help='Recommendations kept per book (default: CATALOG_RECOMMENDATIONS_PER_BOOK)')
+
+    def handle(self, *args, **options):
+        if options['full']:
+            books = rebuild_recommendations(options['k'])
+        else:
+            books = update_recommendations(options['k'])
+        self.stdout.write(self.style.SUCCESS(f'Updated the recommendations of {books} book(s)'))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from catalog.rollups import backfill_rollups, update_rollups
+
+
+class Command(BaseCommand):
+    help = 'Update the circulation rollups from the borrowings changed since the last run'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--backfill', action='store_true',
+                            help='Rebuild the rollups from the whole borrowing history')
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Borrowings read per chunk')
+
+    def handle(self, *args, **options):
+        if options['backfill']:
+            changed = backfill_rollups(options['chunk_size'])
+        else:
+            changed = update_rollups(options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'Rolled up {changed} borrowing change(s)'))
@@ -0,0 +1,82 @@
+import signal
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from catalog import scheduler
+from catalog.models import ScheduledJob
+
+
+class Command(BaseCommand):
+    help = 'Run the periodic maintenance jobs as they come due (see catalog.scheduler)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Run the due jobs once and exit')
+        parser.add_argument('--job', action='append', default=[],
+                            help='Run this job now, due or not, and exit (repeatable)')
+        parser.add_argument('--list', action='store_true',
+                            help='List the jobs with their schedule and last run')
+        parser.add_argument('--worker', default=None,
+                            help='Worker name holding the job leases (default: host:pid)')
+        parser.add_argument('--max-sleep', type=float, default=30,
+                            help='Longest wait (seconds) between two looks at the job table')
+
+    def handle(self, *args, **options):
+        scheduler.sync_jobs()
+        if options['list']:
+            return self.list_jobs()
+        worker = options['worker'] or scheduler.default_worker()
+        if options['job']:
+            unknown = set(options['job']) - set(scheduler.get_jobs())
+            if unknown:
+                raise CommandError(f'Unknown job(s): {", ".join(sorted(unknown))}')
+            for name in options['job']:
+                self.report(name, scheduler.run_job(name, worker, force=True))
+            return
+        if options['once']:
+            self.run_due(worker)
+            return
+
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self.stop)
+        self.stdout.write(f'Scheduler {worker} started')
+        try:
+            while not self.stopping:
+                self.run_due(worker)
+                wait = scheduler.seconds_until_next_run()
+                wait = options['max_sleep'] if wait is None else min(wait, options['max_sleep'])
+                # sleep in short steps to stop quickly on SIGTERM
+                deadline = time.monotonic() + wait
+                while not self.stopping and time.monotonic() < deadline:
+                    time.sleep(min(1, deadline - time.monotonic()))
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(f'Scheduler {worker} stopped')
+
+    def stop(self, signum, frame):
+        # the running job finishes first
+        self.stopping = True
+
+    def run_due(self, worker):
+        for run in scheduler.run_due_jobs(worker):
+            self.report(run.name, run)
+
+    def report(self, name, run):
+        if run is None:
+            self.stdout.write(self.style.WARNING(f'{name}: held by another worker'))
+        elif run.status == 'ok':
+            self.stdout.write(self.style.SUCCESS(
+                f'{name}: {run.processed} row(s) in {run.chunks} chunk(s), {run.duration:.3f}s'))
+        else:
+            self.stdout.write(self.style.ERROR(f'{name}: {run.error}'))
+
+    def list_jobs(self):
+        for scheduled in ScheduledJob.objects.filter(name__in=scheduler.get_jobs()):
+            next_run = timezone.localtime(scheduled.next_run_at) if scheduled.next_run_at else '-'
+            state = '' if scheduled.enabled else ' (disabled)'
+            last = (f'last {scheduled.last_status} {scheduled.last_duration:.3f}s, '
+                    f'{scheduled.last_processed} row(s)' if scheduled.last_status else 'never run')
+            self.stdout.write(f'{scheduled.name} [{scheduled.schedule}]{state}: next {next_run}, {last}, '
+                              f'{scheduled.runs} run(s), {scheduled.failures} failure(s)')
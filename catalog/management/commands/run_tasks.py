@@ -0,0 +1,99 @@
+import logging
+import multiprocessing
+import signal
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from catalog import taskqueue
+from catalog.scheduler import default_worker
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Run the queued background tasks in a thread or process pool (see catalog.taskqueue)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pool', choices=('thread', 'process', 'sync'),
+                            default=getattr(settings, 'CATALOG_TASK_POOL', 'thread'),
+                            help='Run the tasks in a thread pool, a process pool or in this thread')
+        parser.add_argument('--concurrency', type=int, default=getattr(settings, 'CATALOG_TASK_CONCURRENCY', 4),
+                            help='Tasks run at the same time')
+        parser.add_argument('--burst', action='store_true',
+                            help='Exit once no task is due')
+        parser.add_argument('--worker', default=None,
+                            help='Worker name holding the claimed tasks (default: host:pid)')
+        parser.add_argument('--poll', type=float, default=1,
+                            help='Seconds between two looks at the queue when idle')
+
+    def handle(self, *args, **options):
+        worker = options['worker'] or default_worker()
+        concurrency = max(options['concurrency'], 1)
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self.stop)
+
+        if options['pool'] == 'thread':
+            executor = ThreadPoolExecutor(concurrency, thread_name_prefix='task')
+        elif options['pool'] == 'process':
+            # spawned processes set Django up from scratch and open their own database connections
+            connections.close_all()
+            executor = ProcessPoolExecutor(concurrency, mp_context=multiprocessing.get_context('spawn'),
+                                           initializer=django.setup)
+        else:
+            executor = None
+
+        running = {}
+        try:
+            while not self.stopping:
+                claimed = taskqueue.claim(worker, concurrency - len(running)) if len(running) < concurrency else []
+                for task_id in claimed:
+                    if executor is None:
+                        self.report(task_id, taskqueue.execute_task(task_id, worker))
+                    else:
+                        running[executor.submit(taskqueue.run_in_pool, task_id, worker)] = task_id
+                if running:
+                    done, _pending = wait(running, timeout=options['poll'], return_when=FIRST_COMPLETED)
+                    for future in done:
+                        self.collect(running.pop(future), future)
+                elif not claimed:
+                    if options['burst']:
+                        break
+                    time.sleep(options['poll'])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            # the running tasks finish first
+            if executor is not None:
+                for future in wait(running).done:
+                    self.collect(running.pop(future), future)
+                executor.shutdown()
+
+    def stop(self, signum, frame):
+        self.stopping = True
+
+    def collect(self, task_id, future):
+        try:
+            status = future.result()
+        except BrokenProcessPool:
+            raise
+        except Exception:
+            # left running, another worker takes it over once its lease expires
+            logger.exception('Task %s crashed its worker', task_id)
+            status = None
+        self.report(task_id, status)
+
+    def report(self, task_id, status):
+        if status == 'd':
+            self.stdout.write(self.style.SUCCESS(f'Task {task_id}: done'))
+        elif status == 'q':
+            self.stdout.write(self.style.WARNING(f'Task {task_id}: failed, retried later'))
+        elif status == 'f':
+            self.stdout.write(self.style.ERROR(f'Task {task_id}: failed'))
+        else:
+            self.stdout.write(self.style.WARNING(f'Task {task_id}: taken over by another worker'))
@@ -0,0 +1,162 @@
+"""
+Compression of API responses, batching of the borrowing transition log.
+
+Responses of the API content types (JSON, MessagePack, NDJSON) are
+compressed with brotli when installed and accepted by the client, gzip
+otherwise. Responses smaller than CATALOG_COMPRESSION_MIN_SIZE are sent as
+they are, the headers would cost more than the saving. HTML pages are left
+alone: they carry CSRF tokens, compressing them next to user input opens them
+to BREACH.
+
+TransitionLogMiddleware inserts the borrowing transitions committed during a
+request at its end, in one query (see catalog.transitions).
+"""
+import gzip
+import re
+import zlib
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+
+from . import transitions
+
+try:
+    import brotli
+except ImportError: # pragma: no cover
+    brotli = None
+
+COMPRESSIBLE_TYPES = ('application/json', 'application/msgpack', 'application/x-ndjson')
+BROTLI_QUALITY = 5
+GZIP_LEVEL = 6
+ACCEPT_ENCODING = re.compile(r'\s*([\w*-]+)\s*(?:;\s*q\s*=\s*(\d+(?:\.\d*)?))?\s*')
+
+
+def accepted_encodings(header):
+    """Encodings of an Accept-Encoding header with a non zero quality."""
+    encodings = set()
+    for item in header.split(','):
+        match = ACCEPT_ENCODING.fullmatch(item)
+        if match and (match.group(2) is None or float(match.group(2)) > 0):
+            encodings.add(match.group(1).lower())
+    return encodings
+
+def choose_encoding(header):
+    encodings = accepted_encodings(header)
+    if brotli is not None and 'br' in encodings:
+        return 'br'
+    if 'gzip' in encodings:
+        return 'gzip'
+    return None
+
+class StreamCompressor:
+    """Compresses a streamed body chunk by chunk, each chunk is flushed so it reaches the client (NDJSON, events)."""
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        if encoding == 'br':
+            self.compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            self.compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, chunk):
+        if self.encoding == 'br':
+            return self.compressor.process(chunk) + self.compressor.flush()
+        return self.compressor.compress(chunk) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        if self.encoding == 'br':
+            return self.compressor.finish()
+        return self.compressor.flush()
+
+def compress_stream(sequence, encoding):
+    compressor = StreamCompressor(encoding)
+    for chunk in sequence:
+        if chunk:
+            yield compressor.compress(chunk)
+    yield compressor.finish()
+
+async def compress_async_stream(sequence, encoding):
+    compressor = StreamCompressor(encoding)
+    async for chunk in sequence:
+        if chunk:
+            yield compressor.compress(chunk)
+    yield compressor.finish()
+
+
+class CompressionMiddleware:
+    # async under ASGI, so the async views are not moved to a thread
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        response = self.get_response(request)
+        return self.process_response(request, response)
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        # no database access, compressing in the event loop is cheaper than a thread hop
+        return self.process_response(request, response)
+
+    def process_response(self, request, response):
+        content_type = response.get('Content-Type', '').split(';')[0].strip()
+        if content_type not in COMPRESSIBLE_TYPES or response.has_header('Content-Encoding'):
+            return response
+        if not response.streaming and len(response.content) < getattr(settings, 'CATALOG_COMPRESSION_MIN_SIZE', 1024):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = choose_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoding is None:
+            return response
+
+        if response.streaming:
+            if response.is_async:
+                response.streaming_content = compress_async_stream(response.streaming_content, encoding)
+            else:
+                response.streaming_content = compress_stream(response.streaming_content, encoding)
+            response.headers.pop('Content-Length', None)
+        else:
+            if encoding == 'br':
+                content = brotli.compress(response.content, quality=BROTLI_QUALITY)
+            else:
+                content = gzip.compress(response.content, GZIP_LEVEL, mtime=0)
+            if len(content) >= len(response.content):
+                return response
+            response.content = content
+            response.headers['Content-Length'] = str(len(content))
+
+        # the compressed body is not byte for byte the one the strong ETag was computed for
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = encoding
+        return response
+
+
+class TransitionLogMiddleware:
+    # async under ASGI, an open event stream does not hold a thread
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with transitions.batch(request):
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        async with transitions.abatch(request):
+            return await self.get_response(request)
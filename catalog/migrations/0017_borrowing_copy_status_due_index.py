@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-19 17:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0016_alter_borrowing_options'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='borrowing',
+            index=models.Index(fields=['book_copy', 'status', 'due_date'], name='catalog_bor_book_co_93f701_idx'),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 4.2.30 on 2026-10-19 17:48
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0018_hold'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CirculationRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dimension', models.CharField(choices=[('book', 'Book'), ('genre', 'Genre'), ('language', 'Language')], max_length=10)),
+                ('key', models.BigIntegerField(help_text='Id of the book, genre or language')),
+                ('month', models.DateField(help_text='First day of the month the loans started')),
+                ('requests', models.IntegerField(default=0)),
+                ('declined', models.IntegerField(default=0)),
+                ('loans', models.IntegerField(default=0)),
+                ('returned', models.IntegerField(default=0)),
+                ('loan_days', models.IntegerField(default=0, help_text='Total days of the returned loans')),
+                ('overdue', models.IntegerField(default=0, help_text='Returned loans returned after their due date')),
+            ],
+            options={
+                'ordering': ['-month', '-loans'],
+            },
+        ),
+        migrations.CreateModel(
+            name='RolledUpBorrowing',
+            fields=[
+                ('borrowing', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='catalog.borrowing')),
+                ('status', models.CharField(max_length=1)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RollupWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('value', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='circulationrollup',
+            constraint=models.UniqueConstraint(fields=('dimension', 'month', 'key'), name='unique_circulation_rollup'),
+        ),
+    ]
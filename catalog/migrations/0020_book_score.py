@@ -0,0 +1,27 @@
+# Generated by Django 4.2.30 on 2026-10-19 17:50
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0019_circulation_rollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookScore',
+            fields=[
+                ('book', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='catalog.book')),
+                ('rating_count', models.IntegerField(default=0)),
+                ('rating_sum', models.IntegerField(default=0)),
+                ('rating_score', models.FloatField(default=0, help_text='Bayesian average rating')),
+                ('borrow_score', models.FloatField(default=0, help_text='Forward-decayed loan count')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['-rating_score'], name='catalog_boo_rating__b62750_idx'), models.Index(fields=['-borrow_score'], name='catalog_boo_borrow__55d42a_idx')],
+            },
+        ),
+    ]
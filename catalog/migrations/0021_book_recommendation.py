@@ -0,0 +1,48 @@
+# Generated by Django 4.2.30 on 2026-10-19 17:54
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('catalog', '0020_book_score'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookRecommendation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rank', models.PositiveSmallIntegerField()),
+                ('score', models.FloatField(help_text='Cosine similarity of the two books borrowers')),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recommendations', to='catalog.book')),
+                ('recommended', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='catalog.book')),
+            ],
+            options={
+                'ordering': ['book', 'rank'],
+            },
+        ),
+        migrations.CreateModel(
+            name='BorrowedBook',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='catalog.book')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['book', 'user'], name='catalog_bor_book_id_0f553f_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='borrowedbook',
+            constraint=models.UniqueConstraint(fields=('user', 'book'), name='unique_borrowed_book'),
+        ),
+        migrations.AddConstraint(
+            model_name='bookrecommendation',
+            constraint=models.UniqueConstraint(fields=('book', 'rank'), name='unique_recommendation_rank'),
+        ),
+    ]
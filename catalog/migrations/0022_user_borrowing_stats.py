@@ -0,0 +1,28 @@
+# Generated by Django 4.2.30 on 2026-10-19 17:57
+
+import datetime
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('catalog', '0021_book_recommendation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserBorrowingStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='borrowing_stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('pending', models.IntegerField(default=0)),
+                ('active', models.IntegerField(default=0, help_text='Approved and borrowed loans')),
+                ('overdue', models.IntegerField(default=0)),
+                ('lifetime', models.IntegerField(default=0, help_text='Loans ever borrowed')),
+                ('overdue_checked_on', models.DateField(default=datetime.date.today)),
+            ],
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.2.30 on 2026-10-19 18:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+from catalog.search import search_tokens
+
+
+def create_search_tokens(apps, schema_editor):
+    Author = apps.get_model('catalog', 'Author')
+    AuthorSearchToken = apps.get_model('catalog', 'AuthorSearchToken')
+    AuthorSearchToken.objects.bulk_create([
+        AuthorSearchToken(author_id=author_id, token=token)
+        for author_id, name in Author.objects.values_list('id', 'name')
+        for token in search_tokens(name)
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0022_user_borrowing_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuthorSearchToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(db_index=True, max_length=50)),
+                ('author', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='catalog.author')),
+            ],
+        ),
+        migrations.RunPython(create_search_tokens, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 4.2.30 on 2026-10-19 18:12
+
+import catalog.isbn
+from django.db import migrations, models
+
+from catalog.isbn import normalize_isbn
+
+
+def set_isbn_keys(apps, schema_editor):
+    # books whose ISBN duplicates an earlier one once normalized keep a NULL key
+    Book = apps.get_model('catalog', 'Book')
+    books, seen = [], set()
+    for book in Book.objects.order_by('id').only('id', 'isbn'):
+        key = normalize_isbn(book.isbn)
+        if key is not None and key not in seen:
+            seen.add(key)
+            book.isbn_key = key
+            books.append(book)
+    Book.objects.bulk_update(books, ['isbn_key'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0023_author_search_token'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='isbn_key',
+            field=models.CharField(editable=False, max_length=13, null=True, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='book',
+            name='isbn',
+            field=models.CharField(help_text='ISBN-10 or ISBN-13, hyphens allowed <a href="https://www.isbn-international.org/content/what-isbn">ISBN number</a>', max_length=17, unique=True, validators=[catalog.isbn.validate_isbn], verbose_name='ISBN'),
+        ),
+        migrations.RunPython(set_isbn_keys, migrations.RunPython.noop),
+    ]
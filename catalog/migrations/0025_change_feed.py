@@ -0,0 +1,38 @@
+# Generated by Django 4.2.30 on 2026-10-19 18:25
+
+from django.db import migrations, models
+
+
+def seed_change_feed(apps, schema_editor):
+    # one entry per existing object, a client syncing from 0 gets the whole catalogue
+    Change = apps.get_model('catalog', 'Change')
+    for name in ('author', 'book', 'bookcopy', 'review', 'borrowing'):
+        model = apps.get_model('catalog', name)
+        Change.objects.bulk_create([
+            Change(model=name, object_id=str(pk))
+            for pk in model.objects.order_by('pk').values_list('pk', flat=True).iterator()
+        ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0024_book_isbn_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Change',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('model', models.CharField(max_length=20)),
+                ('object_id', models.CharField(max_length=36)),
+                ('deleted', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['model', 'object_id'], name='catalog_cha_model_96e39e_idx')],
+            },
+        ),
+        migrations.RunPython(seed_change_feed, migrations.RunPython.noop),
+    ]
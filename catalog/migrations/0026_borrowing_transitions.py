@@ -0,0 +1,61 @@
+# Generated by Django 4.2.30 on 2026-10-19 18:35
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+# rows of the transition log are never updated, deletes are left to the ORM
+# guard so that test database flushes keep working
+TRIGGERS = {
+    'sqlite': (
+        """CREATE TRIGGER catalog_borrowingtransition_append_only
+           BEFORE UPDATE ON catalog_borrowingtransition
+           BEGIN SELECT RAISE(ABORT, 'borrowing transitions are append-only'); END""",
+        'DROP TRIGGER catalog_borrowingtransition_append_only',
+    ),
+    'postgresql': (
+        """CREATE FUNCTION catalog_borrowingtransition_append_only() RETURNS trigger AS $$
+           BEGIN RAISE EXCEPTION 'borrowing transitions are append-only'; END $$ LANGUAGE plpgsql;
+           CREATE TRIGGER catalog_borrowingtransition_append_only
+           BEFORE UPDATE ON catalog_borrowingtransition
+           FOR EACH ROW EXECUTE FUNCTION catalog_borrowingtransition_append_only()""",
+        """DROP TRIGGER catalog_borrowingtransition_append_only ON catalog_borrowingtransition;
+           DROP FUNCTION catalog_borrowingtransition_append_only()""",
+    ),
+}
+
+
+def create_trigger(apps, schema_editor):
+    if schema_editor.connection.vendor in TRIGGERS:
+        schema_editor.execute(TRIGGERS[schema_editor.connection.vendor][0])
+
+
+def drop_trigger(apps, schema_editor):
+    if schema_editor.connection.vendor in TRIGGERS:
+        schema_editor.execute(TRIGGERS[schema_editor.connection.vendor][1])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('catalog', '0025_change_feed'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BorrowingTransition',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('from_status', models.CharField(blank=True, choices=[('p', 'Pending'), ('c', 'Canceled'), ('a', 'Approved'), ('d', 'Declined'), ('b', 'Borrowing'), ('r', 'Returned')], max_length=1)),
+                ('to_status', models.CharField(choices=[('p', 'Pending'), ('c', 'Canceled'), ('a', 'Approved'), ('d', 'Declined'), ('b', 'Borrowing'), ('r', 'Returned')], max_length=1)),
+                ('created_at', models.DateTimeField()),
+                ('actor', models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('borrowing', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='transitions', to='catalog.borrowing')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['created_at'], name='catalog_bor_created_783ffd_idx'), models.Index(fields=['borrowing', 'created_at'], name='catalog_bor_borrowi_9b4f6e_idx')],
+            },
+        ),
+        migrations.RunPython(create_trigger, drop_trigger),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.30 on 2026-10-19 18:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0026_borrowing_transitions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScheduledJob',
+            fields=[
+                ('name', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('schedule', models.CharField(help_text="'every 15m' (s, m, h or d) or a cron expression such as '0 9 * * *'", max_length=100)),
+                ('enabled', models.BooleanField(default=True)),
+                ('next_run_at', models.DateTimeField(blank=True, db_index=True, null=True)),
+                ('locked_by', models.CharField(blank=True, max_length=100)),
+                ('locked_until', models.DateTimeField(blank=True, null=True)),
+                ('last_started_at', models.DateTimeField(blank=True, null=True)),
+                ('last_finished_at', models.DateTimeField(blank=True, null=True)),
+                ('last_status', models.CharField(blank=True, max_length=10)),
+                ('last_error', models.TextField(blank=True)),
+                ('last_duration', models.FloatField(blank=True, help_text='Seconds', null=True)),
+                ('last_processed', models.IntegerField(default=0, help_text='Rows processed by the last run')),
+                ('last_chunks', models.IntegerField(default=0)),
+                ('runs', models.IntegerField(default=0)),
+                ('failures', models.IntegerField(default=0)),
+                ('total_duration', models.FloatField(default=0, help_text='Seconds')),
+                ('total_processed', models.IntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['name'],
+            },
+        ),
+    ]
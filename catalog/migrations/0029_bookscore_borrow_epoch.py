@@ -0,0 +1,25 @@
+import datetime
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0028_task_queue'),
+    ]
+
+    operations = [
+        # the existing scores were computed against the fixed 2020-01-01 epoch
+        migrations.AddField(
+            model_name='bookscore',
+            name='borrow_epoch',
+            field=models.DateField(default=datetime.date(2020, 1, 1), help_text='Day the borrow score is relative to'),
+            preserve_default=False,
+        ),
+        migrations.AlterField(
+            model_name='bookscore',
+            name='borrow_epoch',
+            field=models.DateField(default=datetime.date.today, help_text='Day the borrow score is relative to'),
+        ),
+    ]
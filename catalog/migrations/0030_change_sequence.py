@@ -0,0 +1,35 @@
+# Generated by Django 4.2.30 on 2026-10-19 19:53
+
+from django.db import migrations, models
+from django.db.models import F, Max
+
+
+def number_existing_changes(apps, schema_editor):
+    # the cursors already handed out are ids, the existing entries keep them as seq
+    Change = apps.get_model('catalog', 'Change')
+    ChangeSequence = apps.get_model('catalog', 'ChangeSequence')
+    Change.objects.update(seq=F('id'))
+    ChangeSequence.objects.create(value=Change.objects.aggregate(value=Max('id'))['value'] or 0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0029_bookscore_borrow_epoch'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('value', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='change',
+            name='seq',
+            field=models.BigIntegerField(blank=True, null=True, unique=True),
+        ),
+        migrations.RunPython(number_existing_changes, migrations.RunPython.noop),
+    ]
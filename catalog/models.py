@@ -1,12 +1,16 @@
-from django.db import models
+from django.db import NotSupportedError, models, transaction
 from django.urls import reverse # Used to generate URLs by reversing the URL patterns
 import uuid # Required for unique book copies
 from django.contrib.auth.models import User
 from datetime import date
 
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
 from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db.models import Avg
 
+from .isbn import normalize_isbn, validate_isbn
+
 class Genre(models.Model):
     """Model representing a book genre."""
     name = models.CharField(max_length=200, help_text='Enter a book genre (e.g. Science Fiction)')
@@ -43,8 +47,10 @@ class Book(models.Model):
     title = models.CharField(max_length=200)
     author = models.ForeignKey('Author', on_delete=models.SET_NULL, null=True)
     summary = models.TextField(max_length=1000, help_text='Enter a brief description of the book')
-    isbn = models.CharField('ISBN', max_length=13, unique=True,
-                            help_text='13 Character <a href="https://www.isbn-international.org/content/what-isbn">ISBN number</a>')
+    isbn = models.CharField('ISBN', max_length=17, unique=True, validators=[validate_isbn],
+                            help_text='ISBN-10 or ISBN-13, hyphens allowed <a href="https://www.isbn-international.org/content/what-isbn">ISBN number</a>')
+    # 13 digit form of isbn (see catalog.isbn), NULL for the legacy rows without a valid ISBN
+    isbn_key = models.CharField(max_length=13, unique=True, null=True, editable=False)
     genre = models.ManyToManyField(Genre, help_text='Select a genre for this book')
     language = models.ForeignKey('Language', on_delete=models.SET_NULL, null=True)
 
@@ -52,6 +58,41 @@ class Book(models.Model):
         """String for representing the Model object."""
         return self.title
 
+    def isbn_unchanged(self):
+        """The stored row has this ISBN (an existing book saved again)."""
+        return not self._state.adding and Book.objects.filter(pk=self.pk, isbn=self.isbn).exists()
+
+    def clean_fields(self, exclude=None):
+        # an unchanged ISBN is not validated again: legacy rows saved before validate_isbn
+        # (left with a NULL isbn_key by migration 0024) stay editable as they are
+        if exclude is None or 'isbn' not in exclude:
+            if self.isbn_unchanged():
+                exclude = {*(exclude or ()), 'isbn'}
+        super().clean_fields(exclude)
+
+    def clean(self):
+        key = normalize_isbn(self.isbn)
+        if key is None or key == self.isbn_key:
+            return
+        if self.isbn_unchanged():
+            # legacy duplicate keeping its ISBN, see save()
+            return
+        if Book.objects.filter(isbn_key=key).exclude(pk=self.pk).exists():
+            raise ValidationError({'isbn': 'A book with this ISBN already exists.'})
+
+    def save(self, *args, **kwargs):
+        key = normalize_isbn(self.isbn)
+        if (key is not None and key != self.isbn_key and not self._state.adding
+                and Book.objects.filter(isbn_key=key).exclude(pk=self.pk).exists()):
+            # a legacy duplicate of another book's ISBN (left with a NULL key by migration 0024)
+            # stays editable, new books and ISBN changes are checked by clean()
+            key = None
+        self.isbn_key = key
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'isbn' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'isbn_key'}
+        super().save(*args, **kwargs)
+
     def get_absolute_url(self):
         """Returns the URL to access a detail record for this book."""
         return reverse('book-detail', args=[str(self.id)])
@@ -91,6 +132,24 @@ class Author(models.Model):
         """String for representing the Model object."""
         return f'{self.name}'
 
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if update_fields is None or 'name' in update_fields:
+                self.update_search_tokens()
+
+    def update_search_tokens(self):
+        from .search import search_tokens
+        self.authorsearchtoken_set.all().delete()
+        AuthorSearchToken.objects.bulk_create([AuthorSearchToken(author=self, token=token)
+                                               for token in search_tokens(self.name)])
+
+class AuthorSearchToken(models.Model):
+    """Normalized word of an author name, searched by prefix (see catalog.search)."""
+    author = models.ForeignKey(Author, on_delete=models.CASCADE)
+    token = models.CharField(max_length=50, db_index=True)
+
 class BookCopy(models.Model):
     """Model representing a specific copy of a book (i.e. that can be borrowed from the library)."""
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, help_text='Unique ID for this particular book across whole library')
@@ -147,6 +206,10 @@ class Borrowing(models.Model):
 
     class Meta:
         ordering = ['-updated_at']
+        indexes = [
+            # overlap lookups of active borrowings per copy (catalog.reservations)
+            models.Index(fields=['book_copy', 'status', 'due_date']),
+        ]
         permissions = (
             ("can_view_all_borrowing", "Can view all borrowing requests"),
             ("can_approve_borrowing", "Can set borrowing request as approved"),
@@ -161,4 +224,382 @@ class Borrowing(models.Model):
     @property
     def is_overdue(self):
         return bool(date.today() > self.due_date) and (self.status != 'r')
-        
\ No newline at end of file
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and not {'borrower', 'status', 'due_date'} & set(update_fields):
+            return super().save(*args, **kwargs)
+        with transaction.atomic():
+            old = None
+            if self.pk is not None:
+                old = Borrowing.objects.filter(pk=self.pk).values_list('borrower_id', 'status', 'due_date').first()
+            # read by the post_save signal publishing and logging the status changes
+            self._previous_status = old and old[1]
+            super().save(*args, **kwargs)
+            new = (self.borrower_id, self.status, self.due_date)
+            if old is None or old[0] == new[0]:
+                UserBorrowingStats.apply_change(self.borrower_id, old and old[1:], new[1:])
+            else:
+                UserBorrowingStats.apply_change(old[0], old[1:], None)
+                UserBorrowingStats.apply_change(new[0], None, new[1:])
+
+class UserBorrowingStats(models.Model):
+    """
+    Borrowing counters of a user, kept up to date by Borrowing.save() and deletes.
+
+    overdue counts the borrowed loans due before overdue_checked_on, it is recounted
+    on the first read of a day (see catalog.borrowing.get_borrowing_stats).
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='borrowing_stats')
+    pending = models.IntegerField(default=0)
+    active = models.IntegerField(default=0, help_text='Approved and borrowed loans')
+    overdue = models.IntegerField(default=0)
+    lifetime = models.IntegerField(default=0, help_text='Loans ever borrowed')
+    overdue_checked_on = models.DateField(default=date.today)
+
+    def __str__(self):
+        return f'{self.user}: {self.active} active, {self.pending} pending'
+
+    @classmethod
+    def recount(cls, user_id):
+        """Rebuild the counters of a user from the borrowing history."""
+        today = date.today()
+        counts = Borrowing.objects.filter(borrower_id=user_id).aggregate(
+            pending=models.Count('id', filter=models.Q(status='p')),
+            active=models.Count('id', filter=models.Q(status__in=('a', 'b'))),
+            overdue=models.Count('id', filter=models.Q(status='b', due_date__lt=today)),
+            lifetime=models.Count('id', filter=models.Q(status__in=('b', 'r'))),
+        )
+        stats, _created = cls.objects.update_or_create(user_id=user_id,
+                                                       defaults=dict(counts, overdue_checked_on=today))
+        return stats
+
+    @classmethod
+    def recount_many(cls, user_ids):
+        """
+        Rebuild the counters of existing stats rows with one aggregate query, the rows are
+        locked first so concurrent apply_change() calls wait and apply on top of the recount.
+        Returns the number of corrected rows.
+        """
+        today = date.today()
+        with transaction.atomic():
+            rows = list(cls.objects.select_for_update().filter(user_id__in=user_ids))
+            counts = {row['borrower_id']: row for row in Borrowing.objects
+                .filter(borrower_id__in=[stats.user_id for stats in rows])
+                .values('borrower_id')
+                .annotate(
+                    pending=models.Count('id', filter=models.Q(status='p')),
+                    active=models.Count('id', filter=models.Q(status__in=('a', 'b'))),
+                    overdue=models.Count('id', filter=models.Q(status='b', due_date__lt=today)),
+                    lifetime=models.Count('id', filter=models.Q(status__in=('b', 'r'))),
+                )}
+            fields = ('pending', 'active', 'overdue', 'lifetime')
+            corrected = []
+            for stats in rows:
+                user_counts = counts.get(stats.user_id, {})
+                values = [user_counts.get(name, 0) for name in fields]
+                if values != [getattr(stats, name) for name in fields] or stats.overdue_checked_on != today:
+                    for name, value in zip(fields, values):
+                        setattr(stats, name, value)
+                    stats.overdue_checked_on = today
+                    corrected.append(stats)
+            cls.objects.bulk_update(corrected, fields + ('overdue_checked_on',))
+        return len(corrected)
+
+    @classmethod
+    def apply_change(cls, user_id, old, new, count=1):
+        """Move `count` borrowings of a user from the old to the new (status, due_date), None when absent."""
+        if user_id is None or old == new:
+            return
+        changes = {}
+        for name, statuses in (('pending', ('p',)), ('active', ('a', 'b')), ('lifetime', ('b', 'r'))):
+            delta = count * ((new is not None and new[0] in statuses) - (old is not None and old[0] in statuses))
+            if delta:
+                changes[name] = models.F(name) + delta
+        overdue = [models.Case(models.When(overdue_checked_on__gt=state[1], then=models.Value(sign)),
+                               default=models.Value(0))
+                   for state, sign in ((old, -count), (new, count))
+                   if state is not None and state[0] == 'b']
+        if overdue:
+            changes['overdue'] = sum(overdue, models.F('overdue'))
+        if not changes:
+            return
+        if not cls.objects.filter(user_id=user_id).update(**changes):
+            cls.recount(user_id)
+
+class CirculationRollup(models.Model):
+    """Borrowing statistics of one book, genre or language for one month (see catalog.rollups)."""
+    DIMENSIONS = (
+        ('book', 'Book'),
+        ('genre', 'Genre'),
+        ('language', 'Language'),
+    )
+
+    dimension = models.CharField(max_length=10, choices=DIMENSIONS)
+    key = models.BigIntegerField(help_text='Id of the book, genre or language')
+    month = models.DateField(help_text='First day of the month the loans started')
+    requests = models.IntegerField(default=0)
+    declined = models.IntegerField(default=0)
+    loans = models.IntegerField(default=0)
+    returned = models.IntegerField(default=0)
+    loan_days = models.IntegerField(default=0, help_text='Total days of the returned loans')
+    overdue = models.IntegerField(default=0, help_text='Returned loans returned after their due date')
+
+    class Meta:
+        ordering = ['-month', '-loans']
+        constraints = [
+            models.UniqueConstraint(fields=['dimension', 'month', 'key'], name='unique_circulation_rollup'),
+        ]
+
+    @property
+    def average_loan_days(self):
+        return self.loan_days / self.returned if self.returned else None
+
+    @property
+    def overdue_rate(self):
+        return self.overdue / self.returned if self.returned else None
+
+    @property
+    def decline_rate(self):
+        return self.declined / self.requests if self.requests else None
+
+class RolledUpBorrowing(models.Model):
+    """Status of a borrowing last counted in CirculationRollup (kept apart so Borrowing.save() never resets it)."""
+    borrowing = models.OneToOneField(Borrowing, on_delete=models.CASCADE, primary_key=True)
+    status = models.CharField(max_length=1)
+
+class RollupWatermark(models.Model):
+    """Borrowing.updated_at up to which a batch job (rollups, recommendations) has been computed."""
+    name = models.CharField(max_length=50, unique=True)
+    value = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f'{self.name}: {self.value}'
+
+class BookScore(models.Model):
+    """Ranking scores of a book, kept up to date on review and loan changes (see catalog.ranking)."""
+    book = models.OneToOneField(Book, on_delete=models.CASCADE, primary_key=True)
+    rating_count = models.IntegerField(default=0)
+    rating_sum = models.IntegerField(default=0)
+    rating_score = models.FloatField(default=0, help_text='Bayesian average rating')
+    borrow_score = models.FloatField(default=0, help_text='Forward-decayed loan count')
+    borrow_epoch = models.DateField(default=date.today, help_text='Day the borrow score is relative to')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-rating_score']),
+            models.Index(fields=['-borrow_score']),
+        ]
+
+    def __str__(self):
+        return f'{self.book}: {self.rating_score:.2f}'
+
+    @property
+    def average_rating(self):
+        return self.rating_sum / self.rating_count if self.rating_count else None
+
+class BorrowedBook(models.Model):
+    """A book a user borrowed at least once, counted in the co-borrowing recommendations."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    book = models.ForeignKey(Book, on_delete=models.CASCADE)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['book', 'user']),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'book'], name='unique_borrowed_book'),
+        ]
+
+class BookRecommendation(models.Model):
+    """One of the top-K books borrowed by the readers of a book (see catalog.recommendations)."""
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='recommendations')
+    recommended = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='+')
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField(help_text='Cosine similarity of the two books borrowers')
+
+    class Meta:
+        ordering = ['book', 'rank']
+        constraints = [
+            models.UniqueConstraint(fields=['book', 'rank'], name='unique_recommendation_rank'),
+        ]
+
+    def __str__(self):
+        return f'{self.book} -> {self.recommended}'
+
+class Hold(models.Model):
+    """A user waiting for any copy of a book, served first come first served."""
+    book = models.ForeignKey(Book, on_delete=models.CASCADE)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    created_at = models.DateTimeField(auto_now_add=True)
+    borrowing = models.OneToOneField(Borrowing, on_delete=models.SET_NULL, null=True, blank=True)
+
+    HOLD_STATUS = (
+        ('w', 'Waiting'),
+        ('f', 'Fulfilled'), # a returned copy was reserved for the user
+        ('c', 'Canceled'),
+    )
+
+    status = models.CharField(
+        max_length=1,
+        choices=HOLD_STATUS,
+        default='w',
+        help_text='Hold status',
+    )
+
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            # queue head and positions are range scans on (book, status, id)
+            models.Index(fields=['book', 'status', 'id']),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['book', 'user'], condition=models.Q(status='w'),
+                                    name='unique_waiting_hold'),
+        ]
+
+    def __str__(self):
+        return f'{self.book} - held by {self.user}'
+
+class Change(models.Model):
+    """
+    Change feed entry of an object (see catalog.changes), only the last change of
+    each object is kept. seq is the change sequence number, given once committed.
+    """
+    id = models.BigAutoField(primary_key=True)
+    seq = models.BigIntegerField(null=True, blank=True, unique=True)
+    model = models.CharField(max_length=20)
+    object_id = models.CharField(max_length=36)
+    deleted = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['model', 'object_id']),
+        ]
+
+    def __str__(self):
+        return f'{self.seq}: {self.model} {self.object_id}{" (deleted)" if self.deleted else ""}'
+
+class ChangeSequence(models.Model):
+    """Last change sequence number given (see catalog.changes), a single row locked while numbering."""
+    value = models.BigIntegerField(default=0)
+
+
+class BorrowingTransitionQuerySet(models.QuerySet):
+    def update(self, **kwargs):
+        raise NotSupportedError('Borrowing transitions are append-only')
+
+    def delete(self):
+        raise NotSupportedError('Borrowing transitions are append-only')
+
+class BorrowingTransition(models.Model):
+    """
+    Append-only log of the borrowing status changes (see catalog.transitions),
+    from_status is empty for the creation of a borrowing. Rows outlive the
+    borrowings and users they refer to.
+    """
+    id = models.BigAutoField(primary_key=True)
+    borrowing = models.ForeignKey(Borrowing, on_delete=models.DO_NOTHING, db_constraint=False,
+                                  related_name='transitions')
+    from_status = models.CharField(max_length=1, choices=Borrowing.BORROWING_STATUS, blank=True)
+    to_status = models.CharField(max_length=1, choices=Borrowing.BORROWING_STATUS)
+    actor = models.ForeignKey(User, on_delete=models.DO_NOTHING, db_constraint=False, null=True,
+                              related_name='+')
+    # time of the change, the row may be inserted later with the other changes of the request
+    created_at = models.DateTimeField()
+
+    objects = BorrowingTransitionQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at']),
+            # timeline of a borrowing, next transition lookups (catalog.transitions)
+            models.Index(fields=['borrowing', 'created_at']),
+        ]
+
+    def __str__(self):
+        return f'{self.borrowing_id}: {self.from_status or "-"} -> {self.to_status} at {self.created_at}'
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise NotSupportedError('Borrowing transitions are append-only')
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        raise NotSupportedError('Borrowing transitions are append-only')
+
+class ScheduledJob(models.Model):
+    """
+    Schedule, lease and run metrics of a periodic maintenance job (see catalog.scheduler).
+    The worker running the job holds it until locked_until, so one worker runs it at a time.
+    """
+    name = models.CharField(max_length=100, primary_key=True)
+    schedule = models.CharField(max_length=100,
+                                help_text="'every 15m' (s, m, h or d) or a cron expression such as '0 9 * * *'")
+    enabled = models.BooleanField(default=True)
+    next_run_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    last_started_at = models.DateTimeField(null=True, blank=True)
+    last_finished_at = models.DateTimeField(null=True, blank=True)
+    last_status = models.CharField(max_length=10, blank=True)
+    last_error = models.TextField(blank=True)
+    last_duration = models.FloatField(null=True, blank=True, help_text='Seconds')
+    last_processed = models.IntegerField(default=0, help_text='Rows processed by the last run')
+    last_chunks = models.IntegerField(default=0)
+    runs = models.IntegerField(default=0)
+    failures = models.IntegerField(default=0)
+    total_duration = models.FloatField(default=0, help_text='Seconds')
+    total_processed = models.IntegerField(default=0)
+
+    class Meta:
+        ordering = ['name']
+
+    def __str__(self):
+        return f'{self.name} ({self.schedule})'
+
+    def clean(self):
+        from .scheduler import parse_schedule
+        try:
+            parse_schedule(self.schedule)
+        except ValueError as error:
+            raise ValidationError({'schedule': str(error)})
+
+class Task(models.Model):
+    """
+    Queued call of a background task (see catalog.taskqueue). A task with a key is
+    queued once, enqueuing the same key again returns the existing task.
+    """
+    STATUS = (
+        ('q', 'Queued'),
+        ('r', 'Running'),
+        ('d', 'Done'),
+        ('f', 'Failed'),
+    )
+
+    id = models.BigAutoField(primary_key=True)
+    name = models.CharField(max_length=100)
+    kwargs = models.JSONField(default=dict, encoder=DjangoJSONEncoder)
+    key = models.CharField(max_length=200, unique=True, null=True, blank=True, help_text='Idempotency key')
+    status = models.CharField(max_length=1, choices=STATUS, default='q')
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=5)
+    # not run before, pushed back after a failed attempt
+    run_at = models.DateTimeField()
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    result = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # claim of the due tasks
+            models.Index(fields=['status', 'run_at']),
+        ]
+
+    def __str__(self):
+        return f'{self.id}: {self.name} ({self.get_status_display()})'
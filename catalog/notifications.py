@@ -0,0 +1,6 @@
+from . import taskqueue
+
+
+def queue_notification(subject, message, recipients, key=None):
+    """Email users from the task workers once the current transaction commits, `key` sends it once."""
+    taskqueue.enqueue('send_email', {'subject': subject, 'message': message, 'recipients': list(recipients)}, key=key)
@@ -0,0 +1,181 @@
+"""
+Book rankings: top rated and most borrowed, overall or per genre / language.
+
+Ratings use a Bayesian average, (C * m + sum) / (C + n) with m the mean rating of the
+library and C = CATALOG_RATING_PRIOR_WEIGHT, so a single 5-star review does not beat
+a book rated by hundreds of readers.
+
+Loans use forward decay: a loan started on day t adds 2 ** ((t - epoch) / half_life)
+to borrow_score. Older loans weigh exponentially less relative to newer ones and the
+stored scores never need to be decayed, dividing by 2 ** ((today - epoch) / half_life)
+gives the decayed loan count of today. The epoch moves forward, so the weights stay
+far from the float range: renormalize() (daily job, and before a loan that would weigh
+more than 2 ** MAX_EXPONENT) rescales the scores to a new epoch with one UPDATE per old
+epoch, stored per score in borrow_epoch. The scores with loans share one epoch.
+
+CATALOG_BORROW_HALF_LIFE_DAYS is checked at startup (see catalog.checks). The stored
+scores are computed with it: after changing it, run `manage.py rank_books`.
+
+Scores live in BookScore (indexed on both scores) and are updated per book when a
+review changes or a loan starts, top lists are index range scans.
+rebuild_scores() recomputes everything, e.g. after the library mean drifted.
+"""
+import datetime
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F, Max, Sum
+
+from .models import BookScore, Borrowing, Review
+
+EPOCH_CACHE_KEY = 'ranking:epoch'
+# largest exponent of a loan weight before the scores are renormalized, far below the float limit (1023)
+MAX_EXPONENT = 64
+MEAN_RATING_CACHE_KEY = 'ranking:mean-rating'
+MEAN_RATING_CACHE_TIMEOUT = 60 * 10
+DEFAULT_MEAN_RATING = 3.0
+
+
+def get_prior_weight():
+    return getattr(settings, 'CATALOG_RATING_PRIOR_WEIGHT', 10)
+
+def get_half_life():
+    return getattr(settings, 'CATALOG_BORROW_HALF_LIFE_DAYS', 30)
+
+def bayesian_rating(rating_sum, rating_count, mean, weight):
+    return (weight * mean + rating_sum) / (weight + rating_count)
+
+def loan_weight(day, epoch):
+    return 2 ** ((day - epoch).days / get_half_life())
+
+def decayed(borrow_score, epoch, today=None):
+    """Decayed loan count of a borrow_score relative to `epoch`, as of today."""
+    return borrow_score / loan_weight(today or datetime.date.today(), epoch)
+
+def get_epoch():
+    """Epoch of the borrow scores, the latest one (the others only remain on scores without loans)."""
+    epoch = cache.get(EPOCH_CACHE_KEY)
+    if epoch is None:
+        epoch = (BookScore.objects.filter(borrow_score__gt=0).aggregate(epoch=Max('borrow_epoch'))['epoch']
+                 or datetime.date.today())
+        cache.set(EPOCH_CACHE_KEY, epoch, None)
+    return epoch
+
+def renormalize(epoch=None):
+    """Rescale the borrow scores to `epoch` (default today), returns the number of rescaled scores."""
+    epoch = epoch or datetime.date.today()
+    rescaled = 0
+    with transaction.atomic():
+        old_epochs = (BookScore.objects
+            .filter(borrow_epoch__lt=epoch)
+            .order_by()
+            .values_list('borrow_epoch', flat=True)
+            .distinct())
+        for old_epoch in list(old_epochs):
+            # below 1, very old scores go to 0 instead of overflowing
+            factor = loan_weight(old_epoch, epoch)
+            rescaled += (BookScore.objects
+                .filter(borrow_epoch=old_epoch)
+                .update(borrow_score=F('borrow_score') * factor, borrow_epoch=epoch))
+    # record_loan() corrects a cached epoch the scores do not have (rolled back)
+    cache.set(EPOCH_CACHE_KEY, max(epoch, get_epoch()), None)
+    return rescaled
+
+def get_mean_rating():
+    mean = cache.get(MEAN_RATING_CACHE_KEY)
+    if mean is None:
+        totals = BookScore.objects.aggregate(count=Sum('rating_count'), total=Sum('rating_sum'))
+        mean = totals['total'] / totals['count'] if totals['count'] else DEFAULT_MEAN_RATING
+        cache.set(MEAN_RATING_CACHE_KEY, mean, MEAN_RATING_CACHE_TIMEOUT)
+    return mean
+
+def update_book_rating(book_id):
+    """Recount the reviews of one book and update its rating score."""
+    totals = Review.objects.filter(book_id=book_id).aggregate(count=Count('id'), total=Sum('point'))
+    count, total = totals['count'], totals['total'] or 0
+    score = bayesian_rating(total, count, get_mean_rating(), get_prior_weight())
+    BookScore.objects.update_or_create(book_id=book_id, defaults={
+        'rating_count': count,
+        'rating_sum': total,
+        'rating_score': score,
+    })
+
+def record_loan(book_id, day=None):
+    """Add a loan started on `day` (default today) to the borrow score of a book."""
+    day = day or datetime.date.today()
+    epoch = get_epoch()
+    if (day - epoch).days / get_half_life() > MAX_EXPONENT:
+        renormalize(day)
+        epoch = day
+    weight = loan_weight(day, epoch)
+    scores = BookScore.objects.filter(book_id=book_id)
+    if scores.filter(borrow_epoch=epoch).update(borrow_score=F('borrow_score') + weight):
+        return
+    with transaction.atomic():
+        score, created = BookScore.objects.select_for_update().get_or_create(
+            book_id=book_id, defaults={'borrow_score': weight, 'borrow_epoch': epoch})
+        if created:
+            return
+        if not score.borrow_score:
+            # no loans yet, its epoch does not matter
+            scores.update(borrow_score=weight, borrow_epoch=epoch)
+        else:
+            # renormalized by another process since the epoch was cached: the score's epoch is the current one
+            scores.update(borrow_score=F('borrow_score') + loan_weight(day, score.borrow_epoch))
+            cache.delete(EPOCH_CACHE_KEY)
+
+def rebuild_scores():
+    """Recompute every score from the reviews and loans, returns the number of scored books."""
+    scores = {}
+    for row in Review.objects.values('book_id').annotate(count=Count('id'), total=Sum('point')):
+        scores[row['book_id']] = BookScore(book_id=row['book_id'], rating_count=row['count'], rating_sum=row['total'])
+    epoch = datetime.date.today()
+    loans = (Borrowing.objects
+        .filter(status__in=('b', 'r'))
+        .values_list('book_copy__book_id', 'start_date'))
+    for book_id, start_date in loans:
+        score = scores.setdefault(book_id, BookScore(book_id=book_id))
+        score.borrow_score += loan_weight(start_date, epoch)
+
+    count = sum(score.rating_count for score in scores.values())
+    total = sum(score.rating_sum for score in scores.values())
+    mean = total / count if count else DEFAULT_MEAN_RATING
+    for score in scores.values():
+        score.borrow_epoch = epoch
+        score.rating_score = bayesian_rating(score.rating_sum, score.rating_count, mean, get_prior_weight())
+
+    with transaction.atomic():
+        BookScore.objects.all().delete()
+        BookScore.objects.bulk_create(scores.values(), batch_size=500)
+    cache.set(MEAN_RATING_CACHE_KEY, mean, MEAN_RATING_CACHE_TIMEOUT)
+    cache.set(EPOCH_CACHE_KEY, epoch, None)
+    return len(scores)
+
+def ranked(order, genre=None, language=None):
+    queryset = BookScore.objects.select_related('book').order_by(order, 'book_id')
+    if genre is not None:
+        queryset = queryset.filter(book__genre=genre)
+    if language is not None:
+        queryset = queryset.filter(book__language=language)
+    return queryset
+
+def top_rated(limit=10, genre=None, language=None):
+    """Books with the best Bayesian rating, each with `avg_rating` and `rating_score` set."""
+    books = []
+    for score in ranked('-rating_score', genre, language).filter(rating_count__gt=0)[:limit]:
+        book = score.book
+        book.avg_rating = round(score.average_rating, 2)
+        book.rating_score = score.rating_score
+        books.append(book)
+    return books
+
+def most_borrowed(limit=10, genre=None, language=None):
+    """Books with the highest decayed loan count, each with `borrow_score` set."""
+    today = datetime.date.today()
+    books = []
+    for score in ranked('-borrow_score', genre, language).filter(borrow_score__gt=0)[:limit]:
+        book = score.book
+        book.borrow_score = decayed(score.borrow_score, score.borrow_epoch, today)
+        books.append(book)
+    return books
@@ -0,0 +1,200 @@
+"""
+"Readers also borrowed" recommendations from the co-borrowing matrix.
+
+X is the binary user x book matrix of loans (BorrowedBook), the co-borrowing counts
+are C = X.T @ X and two books are scored by cosine similarity,
+C[a, b] / sqrt(C[a, a] * C[b, b]). The top-K books of every book are stored in
+BookRecommendation, so serving them is a single lookup on (book, rank).
+
+rebuild_recommendations() computes the whole matrix, with NumPy/SciPy sparse products
+when they are installed and with plain Python otherwise. update_recommendations()
+reads the loans changed since the last run (Borrowing.updated_at watermark, read again
+from CATALOG_WATERMARK_LAG_SECONDS before it for the rows committed late, as in
+catalog.rollups), records the new (user, book) pairs and recomputes the neighbours of
+the books they touch with one grouped co-count query. Scores involving those books from the lists of
+other books are left as they are until the next full rebuild.
+"""
+import itertools
+import math
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max
+
+from .models import BookRecommendation, BorrowedBook, Borrowing, RollupWatermark
+from .rollups import rescan_from
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError: # pragma: no cover
+    np = sparse = None
+
+WATERMARK_NAME = 'recommendations'
+LOAN_STATUSES = ('b', 'r')
+
+
+def get_k():
+    return getattr(settings, 'CATALOG_RECOMMENDATIONS_PER_BOOK', 10)
+
+def loan_pairs(queryset=None):
+    """Distinct (user id, book id) pairs of the loans of a Borrowing queryset."""
+    if queryset is None:
+        queryset = Borrowing.objects.all()
+    return set(queryset
+        .filter(status__in=LOAN_STATUSES, borrower__isnull=False)
+        .values_list('borrower_id', 'book_copy__book_id')
+        .distinct())
+
+def top_neighbours(book_id, co_counts, readers, k):
+    """[(book id, score)] of the k books most similar to book_id, best first."""
+    scores = [(other, count / math.sqrt(readers[book_id] * readers[other]))
+              for other, count in co_counts.items() if other != book_id]
+    scores.sort(key=lambda item: (-item[1], item[0]))
+    return scores[:k]
+
+def compute_python(pairs, k):
+    books_by_user = defaultdict(list)
+    for user_id, book_id in pairs:
+        books_by_user[user_id].append(book_id)
+    readers = Counter(book_id for _user_id, book_id in pairs)
+
+    co_counts = defaultdict(Counter)
+    for books in books_by_user.values():
+        for a, b in itertools.combinations(books, 2):
+            co_counts[a][b] += 1
+            co_counts[b][a] += 1
+    return {book_id: top_neighbours(book_id, counts, readers, k) for book_id, counts in co_counts.items()}
+
+def compute_numpy(pairs, k):
+    users, books = np.array(list(pairs), dtype=np.int64).reshape(-1, 2).T
+    user_index = np.unique(users, return_inverse=True)[1]
+    book_ids, book_index = np.unique(books, return_inverse=True)
+    matrix = sparse.csr_matrix((np.ones(len(users)), (user_index, book_index)),
+                               shape=(user_index.max() + 1, len(book_ids)))
+
+    co = (matrix.T @ matrix).tocsr()
+    norms = np.sqrt(co.diagonal())
+    co.setdiag(0)
+    co.eliminate_zeros()
+    # cosine: scale rows and columns by 1 / sqrt(readers)
+    inverse = sparse.diags(1 / norms)
+    similarity = (inverse @ co @ inverse).tocsr()
+
+    result = {}
+    for row in range(similarity.shape[0]):
+        start, end = similarity.indptr[row], similarity.indptr[row + 1]
+        if start == end:
+            continue
+        columns, values = similarity.indices[start:end], similarity.data[start:end]
+        if len(values) > k:
+            # keep the ties of the k-th score, the book id order below breaks them
+            best = values >= np.partition(values, len(values) - k)[len(values) - k]
+            columns, values = columns[best], values[best]
+        order = np.lexsort((book_ids[columns], -values))[:k]
+        result[int(book_ids[row])] = [(int(book_ids[columns[i]]), float(values[i])) for i in order]
+    return result
+
+def compute_recommendations(pairs, k):
+    """{book id: [(book id, score)]} for a set of (user id, book id) pairs."""
+    if not pairs:
+        return {}
+    if np is not None:
+        return compute_numpy(pairs, k)
+    return compute_python(pairs, k)
+
+def store_recommendations(recommendations, book_ids):
+    """Replace the stored recommendations of book_ids."""
+    rows = [BookRecommendation(book_id=book_id, recommended_id=other, rank=rank, score=score)
+            for book_id in book_ids
+            for rank, (other, score) in enumerate(recommendations.get(book_id, ()), 1)]
+    with transaction.atomic():
+        BookRecommendation.objects.filter(book_id__in=book_ids).delete()
+        BookRecommendation.objects.bulk_create(rows, batch_size=1000)
+
+def recompute_books(book_ids, k):
+    """
+    Neighbours of some books from BorrowedBook: one grouped co-count query for all of
+    them (its diagonal is their reader counts) and one reader count query for the others.
+    """
+    co_counts = defaultdict(dict)
+    readers = {}
+    for book_id, other, count in (BorrowedBook.objects
+            .filter(user__borrowedbook__book_id__in=book_ids)
+            .values_list('user__borrowedbook__book_id', 'book_id')
+            .annotate(count=Count('id'))
+            .order_by()):
+        if other == book_id:
+            readers[book_id] = count
+        else:
+            co_counts[book_id][other] = count
+    others = {other for counts in co_counts.values() for other in counts} - set(readers)
+    readers.update(BorrowedBook.objects
+        .filter(book_id__in=others)
+        .values('book_id')
+        .annotate(count=Count('id'))
+        .values_list('book_id', 'count')
+        .order_by())
+    return {book_id: top_neighbours(book_id, co_counts[book_id], readers, k) for book_id in book_ids}
+
+def set_watermark(value):
+    RollupWatermark.objects.update_or_create(name=WATERMARK_NAME, defaults={'value': value})
+
+def rebuild_recommendations(k=None):
+    """Recompute every recommendation from the whole loan history, returns the number of books."""
+    k = k or get_k()
+    watermark = Borrowing.objects.aggregate(value=Max('updated_at'))['value']
+    pairs = loan_pairs()
+    recommendations = compute_recommendations(pairs, k)
+
+    with transaction.atomic():
+        BorrowedBook.objects.all().delete()
+        BorrowedBook.objects.bulk_create([BorrowedBook(user_id=user_id, book_id=book_id)
+                                          for user_id, book_id in pairs], batch_size=1000)
+        BookRecommendation.objects.all().delete()
+        store_recommendations(recommendations, list(recommendations))
+        set_watermark(watermark)
+    return len(recommendations)
+
+def update_recommendations(k=None):
+    """Add the loans changed since the last run, returns the number of recomputed books."""
+    k = k or get_k()
+    watermark = RollupWatermark.objects.filter(name=WATERMARK_NAME).first()
+    if watermark is None or watermark.value is None:
+        return rebuild_recommendations(k)
+
+    # the pairs read again are already known
+    changed = Borrowing.objects.filter(updated_at__gte=rescan_from(watermark.value))
+    new_watermark = max(changed.aggregate(value=Max('updated_at'))['value'] or watermark.value, watermark.value)
+    pairs = loan_pairs(changed)
+    if pairs:
+        known = set(BorrowedBook.objects
+            .filter(user__in={user_id for user_id, _book_id in pairs})
+            .values_list('user_id', 'book_id'))
+        pairs -= known
+    if not pairs:
+        set_watermark(new_watermark)
+        return 0
+
+    # a new pair changes the scores between its book and every other book of its user
+    BorrowedBook.objects.bulk_create([BorrowedBook(user_id=user_id, book_id=book_id)
+                                      for user_id, book_id in pairs], batch_size=1000)
+    affected = set(BorrowedBook.objects
+        .filter(user__in={user_id for user_id, _book_id in pairs})
+        .values_list('book_id', flat=True))
+    store_recommendations(recompute_books(affected, k), affected)
+    set_watermark(new_watermark)
+    return len(affected)
+
+def get_recommendations(book_id, limit=None):
+    """Recommended books of a book, best first, each with `score` set."""
+    books = []
+    for recommendation in (BookRecommendation.objects
+            .filter(book_id=book_id)
+            .select_related('recommended')
+            .order_by('rank')[:limit or get_k()]):
+        book = recommendation.recommended
+        book.score = recommendation.score
+        books.append(book)
+    return books
@@ -0,0 +1,62 @@
+"""
+Fast API renderers.
+
+ORJSONRenderer encodes JSON with orjson, falling back to the DRF encoder when
+orjson is not installed. MessagePackRenderer is offered to clients sending
+`Accept: application/msgpack` when msgpack is installed (see settings).
+NDJSONRenderer selects the streamed list mode of the list endpoints.
+"""
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+try:
+    import orjson
+except ImportError: # pragma: no cover
+    orjson = None
+
+try:
+    import msgpack
+except ImportError: # pragma: no cover
+    msgpack = None
+
+from .jsonlines import encode_default, json_line
+
+
+class ORJSONRenderer(JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None:
+            return super().render(data, accepted_media_type, renderer_context)
+        if data is None:
+            return b''
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_UTC_Z
+        if self.get_indent(accepted_media_type or '', renderer_context or {}):
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(data, default=encode_default, option=option)
+
+
+class MessagePackRenderer(BaseRenderer):
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=encode_default, use_bin_type=True)
+
+
+class NDJSONRenderer(BaseRenderer):
+    """
+    Newline delimited JSON. Lists are streamed by the views (see SparseFieldsAPIMixin),
+    what is left to render here (errors) is written one JSON value per line.
+    """
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if isinstance(data, list):
+            return b''.join(json_line(item) for item in data)
+        return json_line(data)
@@ -0,0 +1,170 @@
+import bisect
+import datetime
+import itertools
+
+from django.core.cache import cache
+from django.db.models import Q
+
+from .borrowing import ACTIVE_BORROWING_STATUSES
+from .models import BookCopy, Borrowing
+
+CALENDAR_CACHE_PREFIX = 'reservations:'
+CALENDAR_CACHE_TIMEOUT = 60 * 60
+
+ONE_DAY = datetime.timedelta(days=1)
+
+
+def merge_ranges(ranges):
+    """Merge overlapping or adjacent (start, end) date ranges."""
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + ONE_DAY:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+class IntervalIndex:
+    """
+    Static interval index over closed date ranges.
+
+    Intervals are sorted by start with a running maximum of their ends, so an overlap
+    query is a bisect on the starts followed by a backward scan that stops as soon as
+    the running maximum falls before the queried range: O(log n + k).
+    """
+
+    def __init__(self, intervals=()):
+        intervals = sorted(intervals)
+        self.starts = [start for start, end in intervals]
+        self.ends = [end for start, end in intervals]
+        self.max_ends = list(itertools.accumulate(self.ends, max))
+
+    def __len__(self):
+        return len(self.starts)
+
+    def overlapping(self, start, end):
+        """Intervals sharing at least one day with [start, end], ordered by start."""
+        found = []
+        i = bisect.bisect_right(self.starts, end) - 1
+        while i >= 0 and self.max_ends[i] >= start:
+            if self.ends[i] >= start:
+                found.append((self.starts[i], self.ends[i]))
+            i -= 1
+        found.reverse()
+        return found
+
+    def is_free(self, start, end):
+        i = bisect.bisect_right(self.starts, end) - 1
+        while i >= 0 and self.max_ends[i] >= start:
+            if self.ends[i] >= start:
+                return False
+            i -= 1
+        return True
+
+    def free_ranges(self, start, end):
+        """Sub-ranges of [start, end] not covered by any interval."""
+        free = []
+        cursor = start
+        for busy_start, busy_end in self.overlapping(start, end):
+            if busy_start > cursor:
+                free.append((cursor, busy_start - ONE_DAY))
+            cursor = max(cursor, busy_end + ONE_DAY)
+        if cursor <= end:
+            free.append((cursor, end))
+        return free
+
+
+class BookCalendar:
+    """Active borrowings of every copy of one book, one IntervalIndex per copy."""
+
+    def __init__(self, copies, unavailable=()):
+        self.copies = copies
+        self.unavailable = set(unavailable)
+
+    def booked(self, copy_id, start, end):
+        index = self.copies.get(copy_id)
+        return index.overlapping(start, end) if index is not None else []
+
+    def copy_free_ranges(self, copy_id, start, end):
+        if copy_id not in self.copies or copy_id in self.unavailable:
+            return []
+        return self.copies[copy_id].free_ranges(start, end)
+
+    def is_copy_free(self, copy_id, start, end):
+        if copy_id not in self.copies or copy_id in self.unavailable:
+            return False
+        return self.copies[copy_id].is_free(start, end)
+
+    def available_copies(self, start, end):
+        """Copies free for the whole [start, end] range."""
+        return [copy_id for copy_id in self.copies if self.is_copy_free(copy_id, start, end)]
+
+    def free_ranges(self, start, end):
+        """Days of [start, end] on which at least one copy is free."""
+        ranges = []
+        for copy_id in self.copies:
+            ranges.extend(self.copy_free_ranges(copy_id, start, end))
+        return merge_ranges(ranges)
+
+
+def calendar_cache_key(book_id):
+    return f'{CALENDAR_CACHE_PREFIX}{book_id}'
+
+def build_book_calendar(book_id):
+    """
+    Load the calendar of a book from the database.
+    Finished loans are skipped, a copy still out past its due date is booked until today.
+    """
+    today = datetime.date.today()
+    copies, unavailable = {}, []
+    for copy_id, status in BookCopy.objects.filter(book_id=book_id).values_list('id', 'status'):
+        copies[copy_id] = []
+        if status == 'm':
+            unavailable.append(copy_id)
+
+    rows = (Borrowing.objects
+        .filter(book_copy__book_id=book_id, status__in=ACTIVE_BORROWING_STATUSES)
+        .filter(Q(due_date__gte=today) | Q(status='b'))
+        .values_list('book_copy_id', 'start_date', 'due_date', 'status'))
+    for copy_id, start_date, due_date, status in rows:
+        if status == 'b' and due_date < today:
+            due_date = today
+        copies.setdefault(copy_id, []).append((start_date, due_date))
+
+    return BookCalendar({copy_id: IntervalIndex(intervals) for copy_id, intervals in copies.items()}, unavailable)
+
+def get_book_calendar(book_id):
+    key = calendar_cache_key(book_id)
+    calendar = cache.get(key)
+    if calendar is None:
+        calendar = build_book_calendar(book_id)
+        cache.set(key, calendar, CALENDAR_CACHE_TIMEOUT)
+    return calendar
+
+def invalidate_book_calendars(book_ids):
+    cache.delete_many([calendar_cache_key(book_id) for book_id in book_ids])
+
+def invalidate_copy_calendars(copy_ids):
+    book_ids = BookCopy.objects.filter(id__in=copy_ids).values_list('book_id', flat=True).distinct()
+    invalidate_book_calendars(book_ids)
+
+def has_conflict(book_copy_id, start_date, due_date, exclude=None, lock=False):
+    """
+    An active borrowing of the copy overlaps [start_date, due_date], checked on the database:
+    the cached calendars are for display only, they may be stale by up to CALENDAR_CACHE_TIMEOUT.
+    lock=True locks the copy until the end of the caller's transaction first: borrowings are
+    created or moved after such a check, so concurrent requests for a copy go one at a time.
+    """
+    if lock:
+        list(BookCopy.objects.select_for_update().filter(pk=book_copy_id).values_list('pk'))
+    conflicts = Borrowing.objects.filter(
+        book_copy_id=book_copy_id,
+        status__in=ACTIVE_BORROWING_STATUSES,
+        start_date__lte=due_date,
+        due_date__gte=start_date,
+    )
+    if exclude is not None:
+        conflicts = conflicts.exclude(pk=exclude)
+    return conflicts.exists()
@@ -0,0 +1,166 @@
+"""
+Circulation statistics kept as monthly rollups per book, genre and language.
+
+Every borrowing contributes to the rollups of the month its loan starts, according to
+its status: one request, one decline ('d'), one loan ('b' or 'r') and, once returned,
+its loan days and whether it came back after the due date. RolledUpBorrowing
+remembers which status was counted, so an update only applies the difference between
+the old and the new contribution and processing a borrowing twice is harmless.
+
+update_rollups() reads the borrowings changed since the last run (Borrowing.updated_at
+watermark) in keyset-paginated chunks, so the cost is proportional to the changes.
+updated_at is set before the saving transaction commits, so the rows saved up to
+CATALOG_WATERMARK_LAG_SECONDS before the watermark are read again. A deleted borrowing
+takes its contribution away as it is deleted (remove_borrowing(), from a pre_delete
+signal), its RolledUpBorrowing row goes with it. Reports read CirculationRollup only.
+"""
+import datetime
+from collections import defaultdict
+
+from django.conf import settings
+
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Book, Borrowing, CirculationRollup, Genre, Language, RolledUpBorrowing, RollupWatermark
+
+WATERMARK_NAME = 'circulation'
+DIMENSION_MODELS = {'book': Book, 'genre': Genre, 'language': Language}
+COUNTERS = ('requests', 'declined', 'loans', 'returned', 'loan_days', 'overdue')
+ROW_FIELDS = ('id', 'status', 'start_date', 'due_date', 'updated_at',
+              'book_copy__book_id', 'book_copy__book__language_id')
+
+
+def contribution(status, start_date, due_date, returned_on):
+    """Counters a borrowing in `status` adds to its month (returned_on: date of the last update)."""
+    counts = dict.fromkeys(COUNTERS, 0)
+    if status is None:
+        return counts
+    counts['requests'] = 1
+    counts['declined'] = int(status == 'd')
+    counts['loans'] = int(status in ('b', 'r'))
+    if status == 'r':
+        counts['returned'] = 1
+        counts['loan_days'] = max((returned_on - start_date).days, 0)
+        counts['overdue'] = int(returned_on > due_date)
+    return counts
+
+def rescan_from(watermark):
+    """updated_at from which a batch job reads again, None to read everything."""
+    if watermark is None:
+        return None
+    return watermark - datetime.timedelta(seconds=getattr(settings, 'CATALOG_WATERMARK_LAG_SECONDS', 300))
+
+def get_genres(book_ids):
+    genres = defaultdict(list)
+    for book_id, genre_id in (Book.genre.through.objects
+            .filter(book_id__in=book_ids)
+            .values_list('book_id', 'genre_id')):
+        genres[book_id].append(genre_id)
+    return genres
+
+def add_deltas(deltas, row, genres, old_status, new_status):
+    """Add the change of a borrowing row's contribution from old_status to new_status."""
+    returned_on = timezone.localdate(row['updated_at'])
+    new = contribution(new_status, row['start_date'], row['due_date'], returned_on)
+    old = contribution(old_status, row['start_date'], row['due_date'], returned_on)
+    month = row['start_date'].replace(day=1)
+    book_id = row['book_copy__book_id']
+
+    keys = [('book', book_id, month)]
+    if row['book_copy__book__language_id']:
+        keys.append(('language', row['book_copy__book__language_id'], month))
+    keys.extend(('genre', genre_id, month) for genre_id in genres[book_id])
+    for key in keys:
+        for name in COUNTERS:
+            deltas[key][name] += new[name] - old[name]
+
+def apply_deltas(deltas):
+    for (dimension, key, month), counts in deltas.items():
+        counts = {name: value for name, value in counts.items() if value}
+        if not counts:
+            continue
+        updated = (CirculationRollup.objects
+            .filter(dimension=dimension, key=key, month=month)
+            .update(**{name: F(name) + value for name, value in counts.items()}))
+        if not updated:
+            CirculationRollup.objects.create(dimension=dimension, key=key, month=month, **counts)
+
+def rollup_chunk(rows):
+    """Add the contribution changes of a chunk of borrowing rows, returns the number of changed rows."""
+    genres = get_genres({row['book_copy__book_id'] for row in rows})
+
+    rolled_up_status = dict(RolledUpBorrowing.objects
+        .filter(borrowing_id__in=[row['id'] for row in rows])
+        .values_list('borrowing_id', 'status'))
+
+    deltas = defaultdict(lambda: dict.fromkeys(COUNTERS, 0))
+    rolled_up = []
+    for row in rows:
+        old_status = rolled_up_status.get(row['id'])
+        if row['status'] == old_status:
+            continue
+        add_deltas(deltas, row, genres, old_status, row['status'])
+        rolled_up.append(RolledUpBorrowing(borrowing_id=row['id'], status=row['status']))
+
+    with transaction.atomic():
+        apply_deltas(deltas)
+        RolledUpBorrowing.objects.bulk_create(rolled_up, update_conflicts=True,
+                                              unique_fields=['borrowing'], update_fields=['status'])
+    return len(rolled_up)
+
+def update_rollups(chunk_size=1000):
+    """Roll up the borrowings changed since the last run, returns the number of changed borrowings."""
+    watermark, _created = RollupWatermark.objects.get_or_create(name=WATERMARK_NAME)
+    queryset = Borrowing.objects.order_by('updated_at', 'id').values(*ROW_FIELDS)
+    if watermark.value is not None:
+        # the rows read again have a zero delta, unless they committed after the last run
+        queryset = queryset.filter(updated_at__gte=rescan_from(watermark.value))
+
+    changed = 0
+    last = None
+    while True:
+        chunk = queryset
+        if last is not None:
+            chunk = chunk.filter(Q(updated_at__gt=last['updated_at']) | Q(updated_at=last['updated_at'], id__gt=last['id']))
+        rows = list(chunk[:chunk_size])
+        if not rows:
+            break
+        changed += rollup_chunk(rows)
+        last = rows[-1]
+        watermark.value = max(watermark.value or last['updated_at'], last['updated_at'])
+        watermark.save(update_fields=['value'])
+    return changed
+
+def remove_borrowing(borrowing):
+    """Take the counted contribution of a borrowing out of the rollups, before it is deleted."""
+    old_status = (RolledUpBorrowing.objects
+        .filter(borrowing_id=borrowing.pk)
+        .values_list('status', flat=True)
+        .first())
+    row = Borrowing.objects.filter(pk=borrowing.pk).values(*ROW_FIELDS).first()
+    if old_status is None or row is None:
+        return
+    deltas = defaultdict(lambda: dict.fromkeys(COUNTERS, 0))
+    add_deltas(deltas, row, get_genres([row['book_copy__book_id']]), old_status, None)
+    with transaction.atomic():
+        apply_deltas(deltas)
+        RolledUpBorrowing.objects.filter(borrowing_id=borrowing.pk).delete()
+
+def backfill_rollups(chunk_size=1000):
+    """Rebuild the rollups from the whole borrowing history."""
+    with transaction.atomic():
+        CirculationRollup.objects.all().delete()
+        RolledUpBorrowing.objects.all().delete()
+        RollupWatermark.objects.filter(name=WATERMARK_NAME).update(value=None)
+    return update_rollups(chunk_size)
+
+def get_report(dimension, month):
+    """Rollups of one dimension and month, most borrowed first."""
+    return CirculationRollup.objects.filter(dimension=dimension, month=month.replace(day=1)).order_by('-loans', 'key')
+
+def get_names(dimension, rollups):
+    """Display names of the books, genres or languages of some rollups."""
+    objects = DIMENSION_MODELS[dimension].objects.in_bulk([rollup.key for rollup in rollups])
+    return {key: str(obj) for key, obj in objects.items()}
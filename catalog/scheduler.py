@@ -0,0 +1,275 @@
+"""
+Periodic maintenance jobs, run by the `run_scheduler` management command.
+
+Jobs are functions registered with @job(name, schedule), catalog.jobs holds the
+built-in ones. Each job has a ScheduledJob row with its schedule (which the
+admin may change, or disable the job), the time of its next run, a lease and
+the metrics of its runs.
+
+A schedule is an interval counted from the start of the previous run,
+'every 30s', 'every 15m', 'every 6h' or 'every 1d', or a cron expression
+'minute hour day month weekday' in TIME_ZONE: numbers, *, lists, ranges and
+steps, weekday 0 or 7 for Sunday. As in cron, when both day and weekday are
+restricted a day matching either of them runs.
+
+Several workers may run the scheduler. A worker takes a due job with a
+conditional UPDATE (due, and not leased or its lease expired) making it the
+lease holder for CATALOG_SCHEDULER_LEASE_SECONDS, only one UPDATE can match.
+Jobs work in chunks of run.chunk_size rows and call run.chunk() after each
+one, which counts the processed rows and renews the lease. A worker that lost
+its lease (stopped for longer than the lease, another worker took over) stops
+at its next chunk.
+"""
+import datetime
+import logging
+import os
+import re
+import socket
+import time
+
+from django.conf import settings
+from django.db.models import F, Min, Q
+from django.utils import timezone
+
+from .models import ScheduledJob
+
+logger = logging.getLogger(__name__)
+
+# name: (function, default schedule)
+JOBS = {}
+
+INTERVAL_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+# name, lowest and highest value of the cron fields
+CRON_FIELDS = (('minute', 0, 59), ('hour', 0, 23), ('day', 1, 31), ('month', 1, 12), ('weekday', 0, 7))
+
+
+class LeaseLost(Exception):
+    """The lease of the worker expired and another worker took the job over."""
+
+
+class IntervalSchedule:
+    def __init__(self, seconds):
+        self.interval = datetime.timedelta(seconds=seconds)
+
+    def next_after(self, moment):
+        return moment + self.interval
+
+class CronSchedule:
+    def __init__(self, expression):
+        fields = expression.split()
+        if len(fields) != len(CRON_FIELDS):
+            raise ValueError(f'A cron expression has {len(CRON_FIELDS)} fields: minute hour day month weekday')
+        values = [sorted(parse_cron_field(text, low, high)) for text, (_name, low, high) in zip(fields, CRON_FIELDS)]
+        self.minutes, self.hours, self.days, self.months, weekdays = values
+        self.weekdays = {weekday % 7 for weekday in weekdays}
+        self.any_day = fields[2].startswith('*') or fields[4].startswith('*')
+
+    def day_matches(self, day):
+        if day.month not in self.months:
+            return False
+        in_days = day.day in self.days
+        # cron weekdays start on Sunday
+        in_weekdays = (day.weekday() + 1) % 7 in self.weekdays
+        return (in_days and in_weekdays) if self.any_day else (in_days or in_weekdays)
+
+    def next_after(self, moment):
+        """First matching minute after `moment`, in local time."""
+        start = (timezone.localtime(moment).replace(tzinfo=None, second=0, microsecond=0)
+                 + datetime.timedelta(minutes=1))
+        day = start.date()
+        # a February 29 schedule may wait 8 years across a century
+        for _ in range(366 * 8 + 1):
+            if self.day_matches(day):
+                for hour in self.hours:
+                    for minute in self.minutes:
+                        candidate = datetime.datetime.combine(day, datetime.time(hour, minute))
+                        if candidate >= start:
+                            return timezone.make_aware(candidate)
+            day += datetime.timedelta(days=1)
+        raise ValueError('The cron expression never matches a date')
+
+
+def parse_cron_field(text, low, high):
+    values = set()
+    for part in text.split(','):
+        match = re.fullmatch(r'(?:\*|(\d+)(?:-(\d+))?)(?:/(\d+))?', part)
+        if match is None:
+            raise ValueError(f'Invalid cron field {text!r}')
+        first, last, step = match.groups()
+        if first is None:
+            start, end = low, high
+        else:
+            start = int(first)
+            end = int(last) if last is not None else (high if step else start)
+        step = int(step) if step else 1
+        if not low <= start <= end <= high or step < 1:
+            raise ValueError(f'Cron field {text!r} is out of the {low}-{high} range')
+        values.update(range(start, end + 1, step))
+    return values
+
+def parse_schedule(text):
+    """IntervalSchedule or CronSchedule of a schedule spec, raises ValueError."""
+    match = re.fullmatch(r'every\s+(\d+)\s*([smhd])', text.strip())
+    if match is not None:
+        seconds = int(match.group(1)) * INTERVAL_UNITS[match.group(2)]
+        if not seconds:
+            raise ValueError('The interval must be longer than 0')
+        return IntervalSchedule(seconds)
+    schedule = CronSchedule(text)
+    schedule.next_after(timezone.now())
+    return schedule
+
+def next_run(schedule, started_at, finished_at):
+    """Next run after a run, a run longer than the interval is not followed by catch-up runs."""
+    next_at = schedule.next_after(started_at)
+    return next_at if next_at > finished_at else schedule.next_after(finished_at)
+
+
+def job(name, schedule):
+    """Register the decorated function(run) as the periodic job `name`, with its default schedule."""
+    parse_schedule(schedule)
+
+    def decorator(function):
+        JOBS[name] = (function, schedule)
+        return function
+    return decorator
+
+def get_jobs():
+    # registers the built-in jobs
+    from . import jobs  # noqa: F401
+    return JOBS
+
+def default_worker():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+def lease_duration():
+    return datetime.timedelta(seconds=getattr(settings, 'CATALOG_SCHEDULER_LEASE_SECONDS', 300))
+
+def sync_jobs(now=None):
+    """Create the rows of the registered jobs, and schedule the jobs without a next run."""
+    now = now or timezone.now()
+    registered = get_jobs()
+    ScheduledJob.objects.bulk_create([ScheduledJob(name=name, schedule=schedule)
+                                      for name, (_function, schedule) in registered.items()],
+                                     ignore_conflicts=True)
+    unscheduled = ScheduledJob.objects.filter(name__in=registered, next_run_at__isnull=True)
+    for name, schedule in unscheduled.values_list('name', 'schedule'):
+        (ScheduledJob.objects
+            .filter(name=name, next_run_at__isnull=True)
+            .update(next_run_at=parse_schedule(schedule).next_after(now)))
+
+def pk_chunks(queryset, chunk_size):
+    """
+    Primary keys of the queryset by chunks, keyset-paginated so rows leaving the
+    queryset while the chunks are processed (e.g. status changed) are not skipped.
+    """
+    last = None
+    while True:
+        page = queryset if last is None else queryset.filter(pk__gt=last)
+        pks = list(page.order_by('pk').values_list('pk', flat=True)[:chunk_size])
+        if not pks:
+            return
+        yield pks
+        last = pks[-1]
+
+
+class JobRun:
+    """One run of a job, passed to the job function."""
+
+    def __init__(self, name, worker, started_at):
+        self.name = name
+        self.worker = worker
+        self.started_at = started_at
+        self.chunk_size = getattr(settings, 'CATALOG_SCHEDULER_CHUNK_SIZE', 500)
+        self.processed = 0
+        self.chunks = 0
+        self.status = ''
+        self.error = ''
+        self.duration = None
+
+    def chunk(self, processed):
+        """Count a processed chunk and renew the lease, raises LeaseLost when another worker took the job."""
+        self.processed += processed
+        self.chunks += 1
+        renewed = (ScheduledJob.objects
+            .filter(name=self.name, locked_by=self.worker)
+            .update(locked_until=timezone.now() + lease_duration()))
+        if not renewed:
+            raise LeaseLost(f'{self.worker} lost the lease of {self.name}')
+
+
+def free_or_expired(now):
+    return Q(locked_until__isnull=True) | Q(locked_until__lte=now)
+
+def claim(name, worker, now, force=False):
+    """Take the lease of a due (any with force=True) job, False when it is not due or another worker holds it."""
+    jobs = ScheduledJob.objects.filter(free_or_expired(now), name=name)
+    if not force:
+        jobs = jobs.filter(enabled=True, next_run_at__lte=now)
+    return jobs.update(locked_by=worker, locked_until=now + lease_duration(), last_started_at=now) == 1
+
+def run_job(name, worker=None, force=False):
+    """Run a job if this worker gets its lease, returns its JobRun, None when not run."""
+    worker = worker or default_worker()
+    function, _schedule = get_jobs()[name]
+    started_at = timezone.now()
+    if not claim(name, worker, started_at, force):
+        return None
+
+    run = JobRun(name, worker, started_at)
+    timer = time.perf_counter()
+    try:
+        function(run)
+        run.status = 'ok'
+    except LeaseLost:
+        # the new lease holder runs the job and records its metrics
+        logger.warning('Scheduled job %s: lease lost by %s', name, worker)
+        return None
+    except Exception as error:
+        logger.exception('Scheduled job %s failed', name)
+        run.status, run.error = 'failed', f'{type(error).__name__}: {error}'
+    run.duration = time.perf_counter() - timer
+    finished_at = timezone.now()
+
+    schedule = ScheduledJob.objects.values_list('schedule', flat=True).get(name=name)
+    ScheduledJob.objects.filter(name=name, locked_by=worker).update(
+        next_run_at=next_run(parse_schedule(schedule), started_at, finished_at),
+        locked_by='',
+        locked_until=None,
+        last_finished_at=finished_at,
+        last_status=run.status,
+        last_error=run.error,
+        last_duration=run.duration,
+        last_processed=run.processed,
+        last_chunks=run.chunks,
+        runs=F('runs') + 1,
+        failures=F('failures') + int(run.status == 'failed'),
+        total_duration=F('total_duration') + run.duration,
+        total_processed=F('total_processed') + run.processed,
+    )
+    logger.info('Scheduled job %s: %s, %d row(s) in %d chunk(s), %.3fs',
+                name, run.status, run.processed, run.chunks, run.duration)
+    return run
+
+def run_due_jobs(worker=None):
+    """Run the due jobs this worker gets the lease of, one after the other, returns their JobRuns."""
+    worker = worker or default_worker()
+    now = timezone.now()
+    due = (ScheduledJob.objects
+        .filter(free_or_expired(now), enabled=True, next_run_at__lte=now, name__in=get_jobs())
+        .order_by('next_run_at')
+        .values_list('name', flat=True))
+    runs = []
+    for name in due:
+        run = run_job(name, worker)
+        if run is not None:
+            runs.append(run)
+    return runs
+
+def seconds_until_next_run(now=None):
+    """Seconds until the next enabled job is due (0 if one is due), None without enabled jobs."""
+    now = now or timezone.now()
+    next_at = ScheduledJob.objects.filter(enabled=True, name__in=get_jobs()).aggregate(next_at=Min('next_run_at'))['next_at']
+    if next_at is None:
+        return None
+    return max((next_at - now).total_seconds(), 0)
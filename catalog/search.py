@@ -0,0 +1,38 @@
+"""
+Normalized search keys.
+
+Names are case folded, stripped of accents and split on anything that is not a
+letter or a digit, so "Gabriel García Márquez" is found by "garcia" or "gab marq".
+Each token is stored in an indexed column and looked up by prefix.
+"""
+import re
+import unicodedata
+
+TOKEN_SEPARATOR = re.compile(r'[\W_]+')
+MAX_TOKEN_LENGTH = 50
+
+
+def normalize(value):
+    value = unicodedata.normalize('NFKD', value or '')
+    value = ''.join(char for char in value if not unicodedata.combining(char))
+    return value.casefold()
+
+def search_tokens(value):
+    """Distinct normalized tokens of a name, in order."""
+    tokens = []
+    for token in TOKEN_SEPARATOR.split(normalize(value)):
+        token = token[:MAX_TOKEN_LENGTH]
+        if token and token not in tokens:
+            tokens.append(token)
+    return tokens
+
+def prefix_range(term):
+    """Lookups matching the tokens starting with term as an index range (LIKE is case-insensitive on SQLite)."""
+    return {'token__gte': term, 'token__lt': term + '\U0010ffff'}
+
+def filter_authors(queryset, name):
+    """Authors having, for every token of `name`, a name token starting with it."""
+    from .models import AuthorSearchToken
+    for term in search_tokens(name):
+        queryset = queryset.filter(id__in=AuthorSearchToken.objects.filter(**prefix_range(term)).values('author'))
+    return queryset
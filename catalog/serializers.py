@@ -1,7 +1,108 @@
+import datetime
+
 from rest_framework import serializers
 from django.contrib.auth.models import User
+from django.db import models
+
+from .models import Author, Book, BookCopy, Borrowing, CirculationRollup, Review, Task, UserBorrowingStats
+from .borrowing import ACTIVE_BORROWING_STATUSES
+from .reservations import has_conflict
+
+def parse_fields(value, allowed):
+    """Field names of a ?fields=a,b sparse fieldset, None (all fields) when it is empty."""
+    if not value:
+        return None
+    fields = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = [name for name in fields if name not in allowed]
+    if unknown:
+        raise serializers.ValidationError({'fields': f'Unknown field(s): {", ".join(unknown)}'})
+    return [name for name in allowed if name in fields]
+
+def model_columns(model, fields):
+    """Columns to load with only() for the given serializer fields (many-to-many fields have none)."""
+    return ['pk'] + [name for name in fields if not model._meta.get_field(name).many_to_many]
+
+class SparseFieldsMixin:
+    """Serializes only the fields listed in context['fields'] (a ?fields= sparse fieldset) when set."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        fields = self.context.get('fields')
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+class ValuesSerializer:
+    """
+    Read-only list serializer working on .values() rows.
+
+    The output is the one of a ModelSerializer with the same fields (foreign keys
+    as primary keys, many-to-many fields as lists of primary keys, dates in ISO
+    format) but no model instance is created and no serializer field runs per
+    value. Many-to-many fields are read with one query on their through table,
+    per chunk with iter_chunks().
+    """
+    model = None
+    fields = ()
 
-from .models import Book, Borrowing
+    def __init__(self, queryset, fields=None):
+        self.queryset = queryset
+        self.field_names = [name for name in self.fields if fields is None or name in fields]
+        model_fields = [self.model._meta.get_field(name) for name in self.field_names]
+        self.columns = [field for field in model_fields if not field.many_to_many]
+        self.many_to_many = [field for field in model_fields if field.many_to_many]
+
+    def values(self, queryset):
+        return queryset.values('pk', *(field.attname for field in self.columns))
+
+    @property
+    def data(self):
+        return self.serialize(list(self.values(self.queryset)), self.queryset.order_by().values('pk'))
+
+    def iter_chunks(self, chunk_size):
+        """
+        The serialized rows, chunk_size at a time in primary key order. Each chunk
+        is a keyset query (pk > last pk), so memory does not grow with the result.
+        """
+        queryset = self.queryset.order_by('pk')
+        last_pk = None
+        while True:
+            chunk = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+            rows = list(self.values(chunk)[:chunk_size])
+            if not rows:
+                return
+            last_pk = rows[-1]['pk']
+            yield self.serialize(rows, [row['pk'] for row in rows])
+            if len(rows) < chunk_size:
+                return
+
+    def serialize(self, rows, pks):
+        renames = [(field.attname, field.name) for field in self.columns if field.attname != field.name]
+        dates = [field.name for field in self.columns if isinstance(field, (models.DateField, models.TimeField))]
+        for row in rows:
+            for attname, name in renames:
+                row[name] = row.pop(attname)
+            for name in dates:
+                if row[name] is not None:
+                    row[name] = row[name].isoformat()
+
+        for field in self.many_to_many:
+            self.add_many_to_many(rows, field, pks)
+        return [{name: row[name] for name in self.field_names} for row in rows]
+
+    def add_many_to_many(self, rows, field, pks):
+        related = {row['pk']: [] for row in rows}
+        if related:
+            source, target = field.m2m_field_name(), field.m2m_reverse_field_name()
+            links = (field.remote_field.through.objects
+                .filter(**{f'{source}__in': pks})
+                .order_by('pk')
+                .values_list(f'{source}_id', f'{target}_id'))
+            for pk, related_pk in links:
+                if pk in related:
+                    related[pk].append(related_pk)
+        for row in rows:
+            row[field.name] = related[row['pk']]
 
 # User Serializer
 class UserSerializer(serializers.ModelSerializer):
@@ -21,17 +122,220 @@ class RegisterSerializer(serializers.ModelSerializer):
 
         return user
 
-class BookSerializer(serializers.ModelSerializer):
+class BookSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Book
         fields = ('title', 'summary', 'author', 'genre', 'language')
 
-class ProcessBorrowBookSerializer(serializers.ModelSerializer):
+class BookValuesSerializer(ValuesSerializer):
+    model = Book
+    fields = BookSerializer.Meta.fields
+
+class ProcessBorrowBookSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Borrowing
         fields = ('borrower', 'book_copy', 'start_date', 'due_date')
 
-class BorrowBookSerializer(serializers.ModelSerializer):
+    def validate(self, data):
+        if data['due_date'] < data['start_date']:
+            raise serializers.ValidationError(
+                {'due_date': 'Invalid due date - due date cannot be earlier than start date'})
+        if has_conflict(data['book_copy'].id, data['start_date'], data['due_date']):
+            raise serializers.ValidationError('This book copy is already requested for these dates')
+        return data
+
+class BorrowBookSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Borrowing
         fields = ('borrower', 'book_copy', 'start_date', 'due_date', 'decline_reason', 'status')
+
+    def validate_status(self, value):
+        # status changes of existing borrowings follow the state machine, checked before any write
+        if self.instance is not None and value != self.instance.status:
+            from .lifecycle import TransitionError, check
+            try:
+                check(self.instance, value)
+            except TransitionError as error:
+                raise serializers.ValidationError(str(error))
+        return value
+
+    def validate(self, data):
+        # a changed copy or period must not overlap another active borrowing of the copy
+        instance = self.instance
+        if instance is None or not {'book_copy', 'start_date', 'due_date'} & set(data):
+            return data
+        book_copy = data.get('book_copy', instance.book_copy)
+        start_date = data.get('start_date', instance.start_date)
+        due_date = data.get('due_date', instance.due_date)
+        if due_date < start_date:
+            raise serializers.ValidationError(
+                {'due_date': 'Invalid due date - due date cannot be earlier than start date'})
+        if (data.get('status', instance.status) in ACTIVE_BORROWING_STATUSES
+                and has_conflict(book_copy.id, start_date, due_date, exclude=instance.pk)):
+            raise serializers.ValidationError('This book copy is already requested for these dates')
+        return data
+
+class BorrowingValuesSerializer(ValuesSerializer):
+    model = Borrowing
+    fields = BorrowBookSerializer.Meta.fields
+
+class BatchBorrowItemSerializer(serializers.Serializer):
+    book_copy = serializers.UUIDField()
+    start_date = serializers.DateField()
+    due_date = serializers.DateField()
+
+    # same rules as BorrowBookForm.clean_start_date / clean_due_date
+    def validate_start_date(self, value):
+        if value < datetime.date.today():
+            raise serializers.ValidationError('Invalid start date - start date cannot be in the past')
+        return value
+
+    def validate_due_date(self, value):
+        if value < datetime.date.today():
+            raise serializers.ValidationError('Invalid due date - due date cannot be in the past')
+        return value
+
+    def validate(self, data):
+        if data['due_date'] < data['start_date']:
+            raise serializers.ValidationError(
+                {'due_date': 'Invalid due date - due date cannot be earlier than start date'})
+        return data
+
+class BatchBorrowBookSerializer(serializers.Serializer):
+    borrower = serializers.PrimaryKeyRelatedField(queryset=User.objects.all())
+    borrowings = BatchBorrowItemSerializer(many=True, allow_empty=False, max_length=50)
+
+class AvailabilityQuerySerializer(serializers.Serializer):
+    start = serializers.DateField(required=False)
+    end = serializers.DateField(required=False)
+
+    def validate(self, data):
+        start = data.get('start') or datetime.date.today()
+        end = data.get('end') or start + datetime.timedelta(days=30)
+        if end < start:
+            raise serializers.ValidationError({'end': 'End date cannot be earlier than start date'})
+        if (end - start).days > 366:
+            raise serializers.ValidationError({'end': 'Date range cannot be longer than a year'})
+        return {'start': start, 'end': end}
+
+class CirculationRollupSerializer(serializers.ModelSerializer):
+    name = serializers.SerializerMethodField()
+    average_loan_days = serializers.FloatField(read_only=True)
+    overdue_rate = serializers.FloatField(read_only=True)
+    decline_rate = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = CirculationRollup
+        fields = ('dimension', 'key', 'name', 'month', 'requests', 'declined', 'loans', 'returned',
+                  'average_loan_days', 'overdue_rate', 'decline_rate')
+
+    def get_name(self, obj):
+        return self.context.get('names', {}).get(obj.key)
+
+class CirculationReportQuerySerializer(serializers.Serializer):
+    dimension = serializers.ChoiceField(choices=CirculationRollup.DIMENSIONS, default='book')
+    month = serializers.DateField(input_formats=['%Y-%m'], required=False)
+
+    def validate(self, data):
+        data['month'] = (data.get('month') or datetime.date.today()).replace(day=1)
+        return data
+
+class BorrowingLatencyQuerySerializer(serializers.Serializer):
+    status = serializers.ChoiceField(choices=Borrowing.BORROWING_STATUS, default='p')
+    to_status = serializers.ChoiceField(choices=Borrowing.BORROWING_STATUS, required=False)
+    since = serializers.DateTimeField(required=False)
+    until = serializers.DateTimeField(required=False)
+
+class RankingQuerySerializer(serializers.Serializer):
+    kind = serializers.ChoiceField(choices=(('rated', 'Top rated'), ('borrowed', 'Most borrowed')), default='rated')
+    genre = serializers.IntegerField(required=False)
+    language = serializers.IntegerField(required=False)
+    limit = serializers.IntegerField(min_value=1, max_value=100, default=10)
+
+class RankedBookSerializer(serializers.ModelSerializer):
+    avg_rating = serializers.FloatField(read_only=True, default=None)
+    rating_score = serializers.FloatField(read_only=True, default=None)
+    borrow_score = serializers.FloatField(read_only=True, default=None)
+
+    class Meta:
+        model = Book
+        fields = ('id', 'title', 'author', 'language', 'avg_rating', 'rating_score', 'borrow_score')
+
+class RecommendedBookSerializer(serializers.ModelSerializer):
+    score = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = Book
+        fields = ('id', 'title', 'author', 'score')
+
+class BorrowingStatsSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = UserBorrowingStats
+        fields = ('pending', 'active', 'overdue', 'lifetime')
+
+class BookCopySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = BookCopy
+        fields = ('id', 'book', 'publisher', 'published_date', 'status')
+
+class AddBookCopiesSerializer(serializers.Serializer):
+    count = serializers.IntegerField(min_value=1, max_value=100)
+    publisher = serializers.CharField(max_length=200)
+    published_date = serializers.DateField(required=False, allow_null=True)
+    status = serializers.ChoiceField(choices=(('a', 'Available'), ('m', 'Maintenance')), default='a')
+
+class BookCopyStatusSerializer(serializers.Serializer):
+    copies = serializers.ListField(child=serializers.UUIDField(), allow_empty=False, max_length=500)
+    status = serializers.ChoiceField(choices=(('a', 'Available'), ('m', 'Maintenance')))
+
+class BorrowingStatusSerializer(serializers.Serializer):
+    borrowings = serializers.ListField(child=serializers.IntegerField(), allow_empty=False, max_length=500)
+    status = serializers.ChoiceField(choices=Borrowing.BORROWING_STATUS)
+
+class TaskSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Task
+        fields = ('id', 'name', 'key', 'status', 'attempts', 'max_attempts', 'run_at', 'created_at',
+                  'started_at', 'finished_at', 'result', 'last_error')
+
+class IsbnLookupSerializer(serializers.Serializer):
+    isbns = serializers.ListField(child=serializers.CharField(max_length=20), allow_empty=False, max_length=5000)
+
+class IsbnBookSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Book
+        fields = ('id', 'title', 'author', 'isbn', 'isbn_key')
+
+class AuthorValuesSerializer(ValuesSerializer):
+    model = Author
+    fields = ('name', 'date_of_birth', 'date_of_death')
+
+class BookCopyValuesSerializer(ValuesSerializer):
+    model = BookCopy
+    fields = ('book', 'publisher', 'published_date', 'status')
+
+class ReviewValuesSerializer(ValuesSerializer):
+    model = Review
+    fields = ('user', 'book', 'point', 'comment')
+
+# object data of the change feed (see catalog.changes)
+CHANGE_FEED_SERIALIZERS = {
+    'author': AuthorValuesSerializer,
+    'book': BookValuesSerializer,
+    'bookcopy': BookCopyValuesSerializer,
+    'review': ReviewValuesSerializer,
+    'borrowing': BorrowingValuesSerializer,
+}
+
+class ChangeFeedQuerySerializer(serializers.Serializer):
+    since = serializers.IntegerField(min_value=0, default=0)
+    limit = serializers.IntegerField(min_value=1, max_value=1000, default=500)
+    models = serializers.CharField(required=False)
+
+    def validate_models(self, value):
+        from .changes import FEED_MODELS
+        models = [name.strip() for name in value.split(',') if name.strip()]
+        unknown = [name for name in models if name not in FEED_MODELS]
+        if unknown:
+            raise serializers.ValidationError(f'Unknown model(s): {", ".join(unknown)}')
+        return models
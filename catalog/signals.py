@@ -0,0 +1,126 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from knox.models import AuthToken
+
+from .authentication import invalidate_token, invalidate_user_tokens
+from . import bitmaps
+from . import changes
+from . import events
+from . import transitions
+from .models import Author, Book, BookCopy, Borrowing, Genre, Language, Review, UserBorrowingStats
+from .ranking import update_book_rating
+from .reservations import invalidate_book_calendars, invalidate_copy_calendars
+from .rollups import remove_borrowing
+
+
+@receiver(post_delete, sender=AuthToken)
+def auth_token_deleted(sender, instance, **kwargs):
+    invalidate_token(instance.digest)
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, **kwargs):
+    # cached tokens hold a copy of the user (is_active, permissions...)
+    if not created:
+        invalidate_user_tokens(instance)
+
+@receiver(post_save, sender=Borrowing)
+@receiver(post_delete, sender=Borrowing)
+def borrowing_changed(sender, instance, **kwargs):
+    invalidate_copy_calendars([instance.book_copy_id])
+
+@receiver(post_delete, sender=Borrowing)
+def borrowing_deleted(sender, instance, **kwargs):
+    # Borrowing.save() keeps the counters up to date, deletes are handled here
+    UserBorrowingStats.apply_change(instance.borrower_id, (instance.status, instance.due_date), None)
+
+@receiver(pre_delete, sender=Borrowing)
+def borrowing_deleted_rollups(sender, instance, **kwargs):
+    # its RolledUpBorrowing row is deleted with it (CASCADE)
+    remove_borrowing(instance)
+
+@receiver(post_save, sender=Borrowing)
+def borrowing_status_changed(sender, instance, created, **kwargs):
+    previous_status = instance.__dict__.pop('_previous_status', None)
+    if created:
+        events.publish_borrowing('created', instance)
+        transitions.record([instance])
+    elif previous_status is not None and previous_status != instance.status:
+        events.publish_borrowing('status_changed', instance, previous_status)
+        transitions.record([instance], previous_status)
+
+@receiver(post_delete, sender=Borrowing)
+def borrowing_deleted_event(sender, instance, **kwargs):
+    events.publish_borrowing('deleted', instance)
+
+@receiver(post_save, sender=BookCopy)
+@receiver(post_delete, sender=BookCopy)
+def book_copy_changed(sender, instance, **kwargs):
+    invalidate_book_calendars([instance.book_id])
+    bitmaps.update_books([instance.book_id])
+
+@receiver(post_save, sender=Book)
+def book_saved(sender, instance, **kwargs):
+    bitmaps.update_books([instance.pk])
+
+@receiver(post_delete, sender=Book)
+def book_deleted(sender, instance, **kwargs):
+    bitmaps.remove_book(instance.pk)
+
+@receiver(m2m_changed, sender=Book.genre.through)
+def book_genres_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        bitmaps.update_books([instance.pk])
+    elif pk_set:
+        bitmaps.update_books(pk_set)
+    else:
+        bitmaps.invalidate_index()
+
+@receiver(post_delete, sender=Author)
+@receiver(post_delete, sender=Genre)
+@receiver(post_delete, sender=Language)
+def facet_deleted(sender, instance, **kwargs):
+    # the books are updated with QuerySet.update() (SET_NULL), no Book signal
+    bitmaps.invalidate_index()
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def review_changed(sender, instance, **kwargs):
+    update_book_rating(instance.book_id)
+
+@receiver(post_save, sender=Author)
+@receiver(post_save, sender=Book)
+@receiver(post_save, sender=BookCopy)
+@receiver(post_save, sender=Review)
+@receiver(post_save, sender=Borrowing)
+def feed_object_saved(sender, instance, **kwargs):
+    changes.record(sender, [instance.pk])
+
+@receiver(post_delete, sender=Author)
+@receiver(post_delete, sender=Book)
+@receiver(post_delete, sender=BookCopy)
+@receiver(post_delete, sender=Review)
+@receiver(post_delete, sender=Borrowing)
+def feed_object_deleted(sender, instance, **kwargs):
+    changes.record(sender, [instance.pk], deleted=True)
+
+@receiver(m2m_changed, sender=Book.genre.through)
+def feed_book_genres_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action.startswith('post_'):
+            changes.record(Book, [instance.pk])
+    elif action == 'pre_clear':
+        # genre.book_set.clear(), the books are not known afterwards
+        changes.record(Book, instance.book_set.values_list('id', flat=True))
+    elif action.startswith('post_') and pk_set:
+        changes.record(Book, pk_set)
+
+@receiver(pre_delete, sender=Author)
+@receiver(pre_delete, sender=Genre)
+@receiver(pre_delete, sender=Language)
+def feed_book_facet_deleted(sender, instance, **kwargs):
+    # the books lose their author/language (SET_NULL) or genre with no Book signal
+    changes.record(Book, instance.book_set.values_list('id', flat=True))
@@ -0,0 +1,149 @@
+"""
+Background tasks, run by the `run_tasks` management command.
+
+Slow side effects of the requests (mail, later reports and imports) are queued
+as Task rows and run by workers, the request only pays for an INSERT. Tasks are
+functions registered with @task(name), catalog.tasks holds the built-in ones.
+Their keyword arguments are stored as JSON, dates and decimals as strings.
+
+enqueue() queues a task when the current transaction commits, so no task runs
+for changes rolled back, nor before the worker can read them. A task may have
+an idempotency key: queuing the same key again returns the task already
+queued instead of adding one.
+
+A worker claims due tasks with a conditional UPDATE (queued and due, or
+running with an expired lease) and runs them in a thread or process pool. A
+failed attempt is retried after CATALOG_TASK_RETRY_DELAY seconds, doubled on
+every attempt up to CATALOG_TASK_MAX_RETRY_DELAY, and the task is marked
+failed after its max_attempts. A task still running after CATALOG_TASK_TIMEOUT
+seconds (its worker was stopped) is taken over by another worker and counted
+as an attempt, so tasks should be safe to run twice.
+"""
+import datetime
+import json
+import logging
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import Count, F, Min, Q
+from django.utils import timezone
+
+from .models import Task
+
+logger = logging.getLogger(__name__)
+
+# name: (function, max attempts)
+TASKS = {}
+
+
+def task(name, max_attempts=5):
+    """Register the decorated function(**kwargs) as the background task `name`."""
+    def decorator(function):
+        TASKS[name] = (function, max_attempts)
+        return function
+    return decorator
+
+def get_tasks():
+    # registers the built-in tasks
+    from . import tasks  # noqa: F401
+    return TASKS
+
+def timeout():
+    return datetime.timedelta(seconds=getattr(settings, 'CATALOG_TASK_TIMEOUT', 300))
+
+def retry_delay(attempts):
+    """Backoff after the `attempts`-th failed attempt."""
+    delay = getattr(settings, 'CATALOG_TASK_RETRY_DELAY', 10) * 2 ** (attempts - 1)
+    return datetime.timedelta(seconds=min(delay, getattr(settings, 'CATALOG_TASK_MAX_RETRY_DELAY', 3600)))
+
+
+def create_task(name, kwargs=None, key=None, delay=0):
+    """Queue a task in the current transaction, returns it (the task already queued with `key` if any)."""
+    if name not in get_tasks():
+        raise ValueError(f'Unknown task {name!r}')
+    if key is not None:
+        existing = Task.objects.filter(key=key).first()
+        if existing is not None:
+            return existing
+    try:
+        with transaction.atomic():
+            return Task.objects.create(name=name, kwargs=kwargs or {}, key=key, max_attempts=get_tasks()[name][1],
+                                       run_at=timezone.now() + datetime.timedelta(seconds=delay))
+    except IntegrityError:
+        # queued meanwhile with the same key
+        if key is None:
+            raise
+        return Task.objects.get(key=key)
+
+def enqueue(name, kwargs=None, key=None, delay=0):
+    """create_task() when the current transaction commits (at once outside transactions)."""
+    if name not in get_tasks():
+        raise ValueError(f'Unknown task {name!r}')
+    # fail in the caller rather than after the commit
+    json.dumps(kwargs, cls=DjangoJSONEncoder)
+    transaction.on_commit(lambda: create_task(name, kwargs, key, delay))
+
+
+def claim(worker, limit):
+    """Take up to `limit` due tasks for this worker, returns their ids."""
+    now = timezone.now()
+    claimable = Q(status='q', run_at__lte=now) | Q(status='r', locked_until__lte=now)
+    ids = list(Task.objects.filter(claimable).order_by('run_at', 'id').values_list('id', flat=True)[:limit])
+    if not ids:
+        return []
+    # another worker may have taken some of them since they were read
+    (Task.objects
+        .filter(claimable, id__in=ids)
+        .update(status='r', locked_by=worker, locked_until=now + timeout(), started_at=now,
+                attempts=F('attempts') + 1))
+    return list(Task.objects
+        .filter(id__in=ids, status='r', locked_by=worker, started_at=now)
+        .order_by('run_at', 'id')
+        .values_list('id', flat=True))
+
+def finish(task_id, worker, **fields):
+    """Release a task run by this worker, returns its new status, None when its lease was lost."""
+    updated = (Task.objects
+        .filter(id=task_id, status='r', locked_by=worker)
+        .update(locked_by='', locked_until=None, finished_at=timezone.now(), **fields))
+    return fields['status'] if updated else None
+
+def execute_task(task_id, worker):
+    """Run a task claimed by this worker and record the outcome, returns its new status."""
+    task = Task.objects.filter(id=task_id, status='r', locked_by=worker).first()
+    if task is None:
+        return None
+    if task.attempts > task.max_attempts:
+        # the last attempt did not finish within the timeout
+        return finish(task.id, worker, status='f', last_error=task.last_error or 'Timed out')
+    if task.name not in get_tasks():
+        return finish(task.id, worker, status='f', last_error=f'Unknown task {task.name!r}')
+
+    function, _max_attempts = get_tasks()[task.name]
+    try:
+        result = function(**task.kwargs)
+    except Exception as error:
+        logger.exception('Task %s (%s) failed, attempt %d of %d', task.id, task.name, task.attempts, task.max_attempts)
+        last_error = f'{type(error).__name__}: {error}'
+        if task.attempts < task.max_attempts:
+            return finish(task.id, worker, status='q', last_error=last_error,
+                          run_at=timezone.now() + retry_delay(task.attempts))
+        return finish(task.id, worker, status='f', last_error=last_error)
+    return finish(task.id, worker, status='d', result=result, last_error='')
+
+def run_in_pool(task_id, worker):
+    """execute_task() in a pool thread or process, which does not keep its database connection."""
+    try:
+        return execute_task(task_id, worker)
+    finally:
+        close_old_connections()
+
+def queue_stats():
+    """Number of tasks per status, and the seconds the oldest due task has been waiting."""
+    now = timezone.now()
+    counts = dict(Task.objects.order_by().values_list('status').annotate(count=Count('id')))
+    stats = {label.lower(): counts.get(status, 0) for status, label in Task.STATUS}
+    oldest = Task.objects.filter(status='q', run_at__lte=now).aggregate(oldest=Min('run_at'))['oldest']
+    stats['lag'] = (now - oldest).total_seconds() if oldest is not None else 0
+    return stats
@@ -0,0 +1,16 @@
+"""
+Built-in background tasks (see catalog.taskqueue).
+"""
+from django.conf import settings
+from django.core.mail import send_mail
+
+from .taskqueue import task
+
+
+@task('send_email')
+def send_email(subject, message, recipients):
+    """Email through the configured EMAIL_BACKEND, a failure is raised so the attempt is retried."""
+    recipients = [recipient for recipient in recipients if recipient]
+    if not recipients:
+        return 0
+    return send_mail(subject, message, settings.EMAIL_HOST_USER, recipients)
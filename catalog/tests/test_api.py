@@ -1,10 +1,25 @@
+import json
 from django.contrib.auth.models import User
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from rest_framework import status
-from rest_framework.test import APIClient
+from rest_framework import permissions
+from rest_framework.response import Response
+from rest_framework.test import APIClient, APIRequestFactory, force_authenticate
+from rest_framework.views import APIView
 from ..models import Book, Author, Language, Genre, Borrowing, BookCopy
-from datetime import date
+from datetime import date, timedelta
+from io import StringIO
+from unittest import mock
+from django.core.cache import cache
+from django.core.management import call_command
 from django.urls import reverse
+from django.utils import timezone
+from knox.models import AuthToken
+from ..authentication import token_cache_key
+from ..checks import check_token_cache
+from ..throttling import bucket_throttles, get_rejection_metrics
+from ..borrowing import get_borrowing_stats
+from ..serializers import BookSerializer, BorrowBookSerializer
 
 class RegisterAPITestCase(TestCase):
     def setUp(self):
@@ -155,6 +170,15 @@ class SearchBookAPITestCase(TestCase):
             self.assertEqual(book['language'], 1)
             self.assertIn(1, book['genre'])
 
+    def test_search_with_facets(self):
+        response = self.client.get(self.url, {'language': self.language1.id, 'facets': '1'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 2)
+        facets = response.data['facets']
+        self.assertEqual([(value['name'], value['count']) for value in facets['genre']], [('Fiction', 2)])
+        self.assertEqual([(value['name'], value['count']) for value in facets['language']], [('English', 2)])
+        self.assertEqual([(value['key'], value['count']) for value in facets['author']], [(self.author1.id, 2)])
+
 
 
 class BorrowBookAPITestCase(TestCase):
@@ -164,6 +188,7 @@ class BorrowBookAPITestCase(TestCase):
 
         author = Author.objects.create(name='Author 1')
         self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.client.force_authenticate(self.user)
         self.book = Book.objects.create(
             title='Test Book',
             author=author,
@@ -189,6 +214,29 @@ class BorrowBookAPITestCase(TestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertIn('borrow', response.data)
 
+    def test_requires_authentication(self):
+        data = {'borrower': self.user.id, 'book_copy': self.book_copy.id,
+                'start_date': date.today(), 'due_date': date.today()}
+        response = APIClient().post(self.url, data)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertFalse(Borrowing.objects.exists())
+        # signed in without a knox token, there is no token to send back
+        response = self.client.post(self.url, data)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIsNone(response.data['token'])
+
+    def test_overlapping_request_saved_meanwhile_is_rejected(self):
+        other = User.objects.create_user(username='otheruser', password='testpassword')
+        data = {'borrower': self.user.id, 'book_copy': self.book_copy.id,
+                'start_date': date.today(), 'due_date': date.today() + timedelta(days=3)}
+        self.assertEqual(self.client.post(self.url, data).status_code, status.HTTP_200_OK)
+        # the second request passes validate() before the first one is saved
+        with mock.patch('catalog.serializers.has_conflict', return_value=False):
+            response = self.client.post(self.url, {**data, 'borrower': other.id})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['non_field_errors'], ['This book copy is already requested for these dates'])
+        self.assertEqual(Borrowing.objects.filter(book_copy=self.book_copy).count(), 1)
+
     def test_borrow_book_invalid_data(self):
         data = {
             'book_id': 999, 
@@ -279,6 +327,8 @@ class ProcessBorrowBookAPITestCase(TestCase):
     def setUp(self):
         self.client = APIClient()
         self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.staff = User.objects.create_user(username='librarian', password='testpassword', is_staff=True)
+        self.client.force_authenticate(self.staff)
         self.book = Book.objects.create(
             title='Test Book',
             summary='Test Summary',
@@ -308,6 +358,50 @@ class ProcessBorrowBookAPITestCase(TestCase):
         updated_borrowing = Borrowing.objects.get(id=self.borrowing.id)
         self.assertEqual(updated_borrowing.status, 'a')
 
+    def test_update_requires_staff(self):
+        url = reverse('update-status', kwargs={'id': self.borrowing.id})
+        anonymous = APIClient()
+        self.assertEqual(anonymous.patch(url, {'status': 'a'}).status_code, status.HTTP_401_UNAUTHORIZED)
+        borrower = APIClient()
+        borrower.force_authenticate(self.user)
+        self.assertEqual(borrower.patch(url, {'status': 'a'}).status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(Borrowing.objects.get(id=self.borrowing.id).status, 'p')
+        self.assertEqual(anonymous.get(url).status_code, status.HTTP_200_OK)
+
+    def test_update_rejects_overlapping_dates(self):
+        other = Borrowing.objects.create(borrower=self.user, book_copy=self.book_copy,
+                                         start_date='2023-06-01', due_date='2023-06-30', status='a')
+        url = reverse('update-status', kwargs={'id': self.borrowing.id})
+        response = self.client.patch(url, {'due_date': '2023-06-10'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Borrowing.objects.get(id=self.borrowing.id).due_date.isoformat(), '2023-05-01')
+        # its own period does not conflict with itself
+        response = self.client.patch(url, {'due_date': '2023-05-20'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        other_copy = BookCopy.objects.create(book=self.book, status='a', publisher='Test Publisher')
+        response = self.client.patch(reverse('update-status', kwargs={'id': other.id}),
+                                     {'book_copy': str(other_copy.id), 'start_date': '2023-05-01'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_update_overlap_saved_meanwhile_is_rejected(self):
+        Borrowing.objects.create(borrower=self.user, book_copy=self.book_copy,
+                                 start_date='2023-06-01', due_date='2023-06-30', status='p')
+        url = reverse('update-status', kwargs={'id': self.borrowing.id})
+        # the other request is saved after validate()
+        with mock.patch('catalog.serializers.has_conflict', return_value=False):
+            response = self.client.patch(url, {'due_date': '2023-06-10'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['non_field_errors'], ['This book copy is already requested for these dates'])
+        self.assertEqual(Borrowing.objects.get(id=self.borrowing.id).due_date.isoformat(), '2023-05-01')
+
+    def test_update_borrowing_status_back_to_pending(self):
+        Borrowing.objects.filter(id=self.borrowing.id).update(status='d')
+        url = reverse('update-status', kwargs={'id': self.borrowing.id})
+        response = self.client.patch(url, {'status': 'p'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['status'], ['Cannot move a declined borrowing request back to pending!'])
+
     def test_update_borrowing_status_invalid_id(self):
         url = reverse('update-status', kwargs={'id': 999})  # Provide a non-existing borrowing ID
         data = {'status': 'a'}
@@ -327,3 +421,280 @@ class ProcessBorrowBookAPITestCase(TestCase):
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data['status'], self.borrowing.status)
+
+
+class CachedTokenAuthenticationTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.token = AuthToken.objects.create(self.user)[1]
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token)
+        self.url = reverse('search-book')
+
+    def test_token_lookup_is_cached(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # only the book query is left once the token is cached
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_logout_invalidates_cached_token(self):
+        self.client.get(self.url)
+        response = self.client.post(reverse('api-logout'))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_expired_token_is_rejected(self):
+        self.client.get(self.url)
+        AuthToken.objects.filter(user=self.user).update(expiry=timezone.now() - timedelta(seconds=1))
+        cache.clear()
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_borrow_book_reuses_caller_token(self):
+        book = Book.objects.create(title='Test Book', summary='Test Summary', isbn='1234567890123')
+        book_copy = BookCopy.objects.create(book=book, status='a', publisher='Test Publisher')
+        data = {
+            'borrower': self.user.id,
+            'book_copy': book_copy.id,
+            'start_date': date.today(),
+            'due_date': date.today()
+        }
+        response = self.client.post(reverse('borrow-book'), data)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['token'], self.token)
+        self.assertEqual(AuthToken.objects.filter(user=self.user).count(), 1)
+
+    def test_cache_hit_renews_token_with_auto_refresh(self):
+        with override_settings(REST_KNOX={'AUTO_REFRESH': True}):
+            self.client.get(self.url)
+            soon = timezone.now() + timedelta(minutes=5)
+            AuthToken.objects.filter(user=self.user).update(expiry=soon)
+            cached = cache.get(token_cache_key(AuthToken.objects.get(user=self.user).digest))
+            cached[1].expiry = soon
+            cache.set(token_cache_key(cached[1].digest), cached)
+
+            response = self.client.get(self.url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            expiry = AuthToken.objects.get(user=self.user).expiry
+            self.assertGreater(expiry, soon + timedelta(hours=9))
+            # renewed once per MIN_REFRESH_INTERVAL, the cache holds the new expiry
+            with self.assertNumQueries(1):
+                self.client.get(self.url)
+            self.assertEqual(cache.get(token_cache_key(cached[1].digest))[1].expiry, expiry)
+
+    def test_local_memory_cache_deploy_warning(self):
+        self.assertEqual([warning.id for warning in check_token_cache(None)], ['catalog.W001'])
+        with override_settings(CATALOG_TOKEN_CACHE_TTL=0):
+            self.assertEqual(check_token_cache(None), [])
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache'}}):
+            self.assertEqual(check_token_cache(None), [])
+
+    def test_purge_expired_tokens(self):
+        AuthToken.objects.create(self.user, expiry=timedelta(seconds=-1))
+        call_command('purge_expired_tokens', stdout=StringIO())
+        self.assertEqual(AuthToken.objects.filter(user=self.user).count(), 1)
+
+
+class SlidingWindowThrottleTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.factory = APIRequestFactory()
+        self.now = 1000.0
+        throttle_classes = bucket_throttles('test-throttle', user='3/min', ip='2/min')
+        for throttle_class in throttle_classes:
+            throttle_class.timer = lambda _self: self.now
+
+        class ThrottledView(APIView):
+            permission_classes = [permissions.AllowAny]
+
+            def get(self, request):
+                return Response('ok')
+
+        self.view = ThrottledView.as_view(throttle_classes=throttle_classes)
+
+    def test_requests_over_the_rate_are_rejected(self):
+        self.assertEqual(self.view(self.factory.get('/')).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.view(self.factory.get('/')).status_code, status.HTTP_200_OK)
+        response = self.view(self.factory.get('/'))
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertIn('Retry-After', response)
+        self.assertEqual(get_rejection_metrics()['test-throttle'], {'user': 0, 'ip': 1})
+
+    def test_window_slides_over_time(self):
+        self.view(self.factory.get('/'))
+        self.view(self.factory.get('/'))
+        self.assertEqual(self.view(self.factory.get('/')).status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.now += 90
+        self.assertEqual(self.view(self.factory.get('/')).status_code, status.HTTP_200_OK)
+
+    def test_ip_rate_only_applies_to_anonymous_calls(self):
+        user = User.objects.create_user(username='testuser', password='testpassword')
+        statuses = []
+        for _ in range(4):
+            request = self.factory.get('/')
+            force_authenticate(request, user)
+            statuses.append(self.view(request).status_code)
+        self.assertEqual(statuses, [status.HTTP_200_OK] * 3 + [status.HTTP_429_TOO_MANY_REQUESTS])
+        self.assertEqual(get_rejection_metrics()['test-throttle'], {'user': 1, 'ip': 0})
+        # the anonymous callers behind the same address still have their own budget
+        self.assertEqual(self.view(self.factory.get('/')).status_code, status.HTTP_200_OK)
+
+    def test_rejected_call_is_not_counted_by_the_other_buckets(self):
+        throttle_classes = bucket_throttles('test-token-throttle', user='3/min', token='1/min')
+        throttle_classes[0].timer = lambda _self: self.now
+        view = self.view.view_class.as_view(throttle_classes=throttle_classes)
+        user = User.objects.create_user(username='testuser', password='testpassword')
+        statuses = []
+        for token_key in ('first', 'first', 'second', 'third'):
+            request = self.factory.get('/')
+            force_authenticate(request, user, token=mock.Mock(token_key=token_key))
+            statuses.append(view(request).status_code)
+        # the call rejected by the token rate is not counted by the user rate
+        self.assertEqual(statuses, [status.HTTP_200_OK, status.HTTP_429_TOO_MANY_REQUESTS,
+                                    status.HTTP_200_OK, status.HTTP_200_OK])
+        self.assertEqual(get_rejection_metrics()['test-token-throttle'], {'user': 0, 'token': 1})
+
+    @override_settings(CATALOG_THROTTLE_RATES={'test-throttle': {'ip': '5/min'}})
+    def test_rates_from_settings(self):
+        throttle_class, = bucket_throttles('test-throttle', user='3/min', ip='2/min')
+        self.assertEqual(throttle_class.rates, {'ip': '5/min'})
+
+    def test_throttle_metrics_requires_staff(self):
+        response = self.client.get(reverse('throttle-metrics'))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class BatchBorrowBookAPITestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.url = reverse('batch-borrow-book')
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.book = Book.objects.create(title='Test Book', summary='Test Summary', isbn='1234567890123')
+        self.copy1 = BookCopy.objects.create(book=self.book, status='a', publisher='Test Publisher')
+        self.copy2 = BookCopy.objects.create(book=self.book, status='a', publisher='Test Publisher')
+        self.copy3 = BookCopy.objects.create(book=self.book, status='m', publisher='Test Publisher')
+
+    def item(self, book_copy, start, end):
+        today = date.today()
+        return {
+            'book_copy': str(book_copy.id),
+            'start_date': today + timedelta(days=start),
+            'due_date': today + timedelta(days=end),
+        }
+
+    def test_batch_borrow(self):
+        data = {
+            'borrower': self.user.id,
+            'borrowings': [self.item(self.copy1, 0, 5), self.item(self.copy2, 1, 3)],
+        }
+        response = self.client.post(self.url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['accepted']), 2)
+        self.assertEqual(response.data['rejected'], [])
+        self.assertEqual(Borrowing.objects.filter(borrower=self.user, status='p').count(), 2)
+
+    def test_batch_borrow_rejects_unavailable_and_overlapping(self):
+        Borrowing.objects.create(borrower=self.user, book_copy=self.copy2,
+                                 start_date=date.today(), due_date=date.today() + timedelta(days=2))
+        data = {
+            'borrower': self.user.id,
+            'borrowings': [
+                self.item(self.copy1, 0, 5),
+                self.item(self.copy1, 3, 7),  # overlaps the previous item
+                self.item(self.copy1, 6, 7),
+                self.item(self.copy2, 1, 3),  # overlaps the existing pending request
+                self.item(self.copy3, 0, 1),  # maintenance
+            ],
+        }
+        response = self.client.post(self.url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['accepted']), 2)
+        self.assertEqual([rejected['index'] for rejected in response.data['rejected']], [1, 3, 4])
+        self.assertEqual(Borrowing.objects.filter(book_copy=self.copy1).count(), 2)
+
+    def test_batch_borrow_invalid_dates(self):
+        data = {
+            'borrower': self.user.id,
+            'borrowings': [self.item(self.copy1, -2, 1), self.item(self.copy2, 3, 1)],
+        }
+        response = self.client.post(self.url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('start_date', response.data['borrowings'][0])
+        self.assertIn('due_date', response.data['borrowings'][1])
+        self.assertFalse(Borrowing.objects.exists())
+
+    def test_batch_borrow_query_count(self):
+        data = {
+            'borrower': self.user.id,
+            'borrowings': [self.item(self.copy1, 0, 1), self.item(self.copy2, 0, 1), self.item(self.copy3, 0, 1)],
+        }
+        get_borrowing_stats(self.user)
+        # borrower, copies, active borrowings, savepoint, locked counters, bulk insert,
+        # counters update, change feed delete + insert, release, calendar invalidation
+        with self.assertNumQueries(11):
+            self.client.post(self.url, data, format='json')
+
+
+class SparseFieldsetAPITestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        author = Author.objects.create(name='Test Author')
+        language = Language.objects.create(name='English')
+        genres = [Genre.objects.create(name='Fiction'), Genre.objects.create(name='Drama')]
+        for index in range(3):
+            book = Book.objects.create(title=f'Book{index}', summary='Summary', author=author, language=language,
+                                       isbn=f'123456789012{index}')
+            book.genre.set(genres[:index])
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.book_copy = BookCopy.objects.create(book=book, status='a', publisher='Test Publisher')
+        self.borrowing = Borrowing.objects.create(borrower=self.user, book_copy=self.book_copy,
+                                                  start_date='2023-01-01', due_date='2023-05-01', status='p')
+
+    def test_values_output_matches_model_serializer(self):
+        with self.assertNumQueries(2):  # books, genres
+            response = self.client.get(reverse('search-book'))
+        self.assertEqual(response.data, BookSerializer(Book.objects.all(), many=True).data)
+
+        response = self.client.get(reverse('pending-borrowing'))
+        self.assertEqual(response.data, BorrowBookSerializer(Borrowing.objects.filter(status='p'), many=True).data)
+
+    def test_fields_selection(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('search-book'), {'fields': 'title,author'})
+        self.assertEqual(response.data[0], {'title': 'Book0', 'author': 1})
+
+        response = self.client.get(reverse('search-book'), {'fields': 'genre', 'facets': '1'})
+        self.assertEqual([book['genre'] for book in response.data['results']], [[], [1], [1, 2]])
+
+        response = self.client.get(reverse('pending-borrowing'), {'fields': 'status,due_date'})
+        self.assertEqual(response.data, [{'due_date': '2023-05-01', 'status': 'p'}])
+
+        response = self.client.get(reverse('update-status', args=[self.borrowing.id]), {'fields': 'status'})
+        self.assertEqual(response.data, {'status': 'p'})
+
+    def test_unknown_field(self):
+        response = self.client.get(reverse('search-book'), {'fields': 'title,isbn'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('isbn', str(response.data['fields']))
+
+    @override_settings(CATALOG_STREAM_CHUNK_SIZE=2)
+    def test_ndjson_stream(self):
+        response = self.client.get(reverse('search-book'), {'stream': '1'})
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        with self.assertNumQueries(4):  # 2 chunks: books, genres
+            lines = b''.join(response.streaming_content).splitlines()
+        self.assertEqual([json.loads(line) for line in lines],
+                         json.loads(self.client.get(reverse('search-book')).content))
+
+        response = self.client.get(reverse('pending-borrowing'), {'fields': 'book_copy,status'},
+                                   HTTP_ACCEPT='application/x-ndjson')
+        self.assertEqual([json.loads(line) for line in b''.join(response.streaming_content).splitlines()],
+                         [{'book_copy': str(self.book_copy.id), 'status': 'p'}])
+
+        response = self.client.get(reverse('search-book'), {'stream': '1', 'fields': 'isbn'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
@@ -0,0 +1,104 @@
+import json
+import os
+import tempfile
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import resolve, reverse
+
+from unittest.mock import patch
+from catalog import api_schema, importprofile
+from catalog.api_urls import LazyAPIView
+
+
+class LazyLoadingTest(TestCase):
+    def test_urlconf_does_not_import_the_api(self):
+        modules = {module for *_times, module in importprofile.run(importprofile.startup_code())}
+        self.assertIn('catalog.views', modules)
+        for module in ('catalog.api_views', 'catalog.serializers', 'catalog.api_schema', 'catalog.renderers',
+                       'drf_yasg.views', 'rest_framework.serializers', 'rest_framework.renderers'):
+            self.assertNotIn(module, modules)
+
+    def test_lazy_view(self):
+        view = resolve(reverse('rankings-api')).func
+        self.assertIsInstance(view, LazyAPIView)
+        self.assertEqual(view.__name__, 'RankingAPI')
+        self.assertEqual(view.cls.__name__, 'RankingAPI')
+        self.assertEqual(self.client.get(reverse('rankings-api')).status_code, 200)
+
+
+class SchemaCacheTest(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'cache', 'openapi.json')
+        settings = override_settings(CATALOG_API_SCHEMA_CACHE=self.path)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        api_schema._schemas.clear()
+        self.addCleanup(api_schema._schemas.clear)
+        self.url = reverse('schema-swagger-ui') + '?format=openapi'
+
+    def get_schema(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content)
+
+    def test_generated_once(self):
+        # drf_yasg warns about the views it cannot introspect
+        with self.assertLogs('drf_yasg', 'WARNING'):
+            schema = self.get_schema()
+        self.assertEqual(schema['info']['title'], 'Simple API')
+        self.assertEqual(schema['host'], 'testserver')
+        self.assertIn('/rankings/', schema['paths'])
+        with open(self.path) as file:
+            self.assertEqual(json.load(file)['fingerprint'], api_schema.fingerprint())
+
+        # another process reads the file
+        api_schema._schemas.clear()
+        with patch('catalog.api_schema.generate', side_effect=AssertionError):
+            self.assertEqual(self.get_schema(), schema)
+            self.assertEqual(self.client.get(reverse('schema-redoc')).status_code, 200)
+
+    def test_regenerated_when_the_code_changes(self):
+        with patch('catalog.api_schema.generate', return_value='{"info": {"title": "Old"}}'):
+            api_schema.get_schema()
+        api_schema._schemas.clear()
+        with patch('catalog.api_schema.fingerprint', return_value='changed'), \
+                patch('catalog.api_schema.generate', return_value='{"info": {"title": "New"}}') as generate:
+            self.assertEqual(json.loads(api_schema.get_schema())['info']['title'], 'New')
+        generate.assert_called_once()
+
+    def test_command(self):
+        out = StringIO()
+        with patch('catalog.api_schema.generate', return_value='{"info": {}}'):
+            call_command('generate_api_schema', stdout=out)
+        self.assertIn(self.path, out.getvalue())
+        self.assertTrue(os.path.exists(self.path))
+
+        with override_settings(CATALOG_API_SCHEMA_CACHE=None), self.assertRaisesMessage(Exception, 'is not set'):
+            call_command('generate_api_schema')
+
+
+class ImportProfileTest(TestCase):
+    def test_parse_and_summarize(self):
+        output = '\n'.join([
+            'import time: self [us] | cumulative | imported package',
+            'import time:       100 |        100 |     rest_framework.settings',
+            'import time:       200 |        300 |   rest_framework',
+            'import time:      1000 |       1000 | catalog.api_views',
+        ])
+        imports = importprofile.parse(output)
+        self.assertEqual(imports[0], (100, 100, 2, 'rest_framework.settings'))
+        summary = importprofile.summarize(imports, top=1)
+        self.assertEqual(summary['modules'], 3)
+        self.assertAlmostEqual(summary['total'], 0.0013)
+        self.assertEqual(summary['packages'], [('catalog', 0.001)])
+        self.assertEqual(summary['slowest'], [('catalog.api_views', 0.001)])
+
+    def test_command(self):
+        out = StringIO()
+        call_command('profile_imports', '--top', '3', stdout=out)
+        self.assertIn('modules imported in', out.getvalue())
+        self.assertIn('django', out.getvalue())
@@ -0,0 +1,51 @@
+from django.contrib.auth.models import User, Permission
+from django.test import TestCase
+from django.urls import reverse
+
+from datetime import date
+from catalog.models import Author, Book, BookCopy, Borrowing, Genre, Review
+
+
+class AsyncViewsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = Author.objects.create(name='Author 1')
+        cls.genre = Genre.objects.create(name='Genre 1')
+        cls.user = User.objects.create_user(username='testuser', password='testpassword')
+        for i in range(12):
+            book = Book.objects.create(title=f'Book {i}', author=cls.author, isbn=f'12345678901{i:02}')
+            book.genre.add(cls.genre)
+        cls.book = Book.objects.get(title='Book 0')
+        cls.book_copy = BookCopy.objects.create(book=cls.book, status='a', publisher='Test Publisher')
+        Review.objects.create(user=cls.user, book=cls.book, point=4)
+        Borrowing.objects.create(borrower=cls.user, book_copy=cls.book_copy,
+                                 start_date=date.today(), due_date=date.today(), status='p')
+
+    def test_index(self):
+        response = self.client.get(reverse('async-index'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['num_books'], 12)
+        self.assertEqual(response.context['num_copies_available'], 1)
+
+    def test_book_list_pagination(self):
+        response = self.client.get(reverse('async-books'), {'page': 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['is_paginated'])
+        self.assertEqual(len(response.context['book_list']), 2)
+
+    def test_book_detail(self):
+        response = self.client.get(reverse('async-book-detail', args=(self.book.id,)))
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'catalog/book_detail.html')
+        self.assertEqual(self.client.get(reverse('async-book-detail', args=(9999,))).status_code, 404)
+
+    def test_borrowing_lists(self):
+        response = self.client.get(reverse('async-borrowing-list'))
+        self.assertEqual(response.status_code, 302)
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('async-borrowing-list'))
+        self.assertEqual(len(response.context['borrowing_list']), 1)
+        self.assertEqual(self.client.get(reverse('async-all-borrowing')).status_code, 403)
+        self.user.user_permissions.add(Permission.objects.get(codename='can_view_all_borrowing'))
+        response = self.client.get(reverse('async-all-borrowing'))
+        self.assertEqual(response.status_code, 200)
@@ -0,0 +1,128 @@
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from catalog import bitmaps
+from catalog.bitmaps import IntBitmap
+from catalog.models import Author, Book, BookCopy, Genre, Language
+
+
+class IntBitmapTest(TestCase):
+    def test_set_operations(self):
+        a, b = IntBitmap([1, 5, 64, 1000]), IntBitmap([5, 1000, 7])
+        self.assertEqual(list(a & b), [5, 1000])
+        self.assertEqual(list(a | b), [1, 5, 7, 64, 1000])
+        self.assertEqual(list(a - b), [1, 64])
+        self.assertEqual(len(a), 4)
+        self.assertEqual(a.intersection_cardinality(b), 2)
+        self.assertIn(64, a)
+        a.discard(64)
+        self.assertNotIn(64, a)
+
+    def test_slices(self):
+        bitmap = IntBitmap(range(0, 100, 3))
+        self.assertEqual(list(bitmap[2:5]), [6, 9, 12])
+        self.assertEqual(list(bitmap[32:40]), [96, 99])
+        self.assertEqual(list(bitmap[50:60]), [])
+
+
+@override_settings(CATALOG_BITMAP_INDEX=True)
+class BookBitmapIndexTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        bitmaps.reset_index()
+        self.author1 = Author.objects.create(name='Author 1')
+        self.author2 = Author.objects.create(name='Author 2')
+        self.fiction = Genre.objects.create(name='Fiction')
+        self.drama = Genre.objects.create(name='Drama')
+        self.english = Language.objects.create(name='English')
+        self.books = []
+        for index, (author, language, genres) in enumerate((
+                (self.author1, self.english, [self.fiction]),
+                (self.author2, None, [self.drama]),
+                (self.author1, self.english, [self.fiction, self.drama]),
+                (self.author2, self.english, []))):
+            book = Book.objects.create(title=f'Book {index}', author=author, language=language,
+                                       isbn=f'100000000000{index}')
+            book.genre.set(genres)
+            self.books.append(book)
+        BookCopy.objects.create(book=self.books[0], status='a', publisher='Publisher')
+        BookCopy.objects.create(book=self.books[2], status='b', publisher='Publisher')
+
+    def tearDown(self):
+        bitmaps.reset_index()
+
+    def titles(self, expression):
+        return [book.title for book in bitmaps.search(expression)]
+
+    def test_and_or_not_expressions(self):
+        self.assertEqual(self.titles(('and', [('genre', self.fiction.id), ('genre', self.drama.id)])), ['Book 2'])
+        self.assertEqual(self.titles(('or', [('genre', self.drama.id), ('language', self.english.id)])),
+                         ['Book 0', 'Book 1', 'Book 2', 'Book 3'])
+        self.assertEqual(self.titles(('and', [('author', self.author1.id), ('not', ('genre', self.drama.id))])),
+                         ['Book 0'])
+        self.assertEqual(self.titles(('available', True)), ['Book 0'])
+        self.assertEqual(self.titles(None), ['Book 0', 'Book 1', 'Book 2', 'Book 3'])
+
+    def test_signals_keep_index_up_to_date(self):
+        bitmaps.get_index()
+        self.books[1].genre.add(self.fiction)
+        self.books[3].author = self.author1
+        self.books[3].save()
+        BookCopy.objects.filter(book=self.books[2]).get().delete()
+        BookCopy.objects.create(book=self.books[2], status='a', publisher='Publisher')
+        self.books[0].bookcopy_set.all().delete()
+        self.books[0].delete()
+
+        self.assertEqual(self.titles(('genre', self.fiction.id)), ['Book 1', 'Book 2'])
+        self.assertEqual(self.titles(('author', self.author1.id)), ['Book 2', 'Book 3'])
+        self.assertEqual(self.titles(('available', True)), ['Book 2'])
+        # the same process kept its index, no reload
+        self.assertEqual(bitmaps.get_index().version, cache.get(bitmaps.VERSION_CACHE_KEY))
+
+    def test_deleted_author_reloads_index(self):
+        bitmaps.get_index()
+        self.author2.delete()
+        self.assertEqual(self.titles(('author', self.author2.id)), [])
+        self.assertEqual(len(self.titles(None)), 4)
+
+    def test_other_process_change_reloads_index(self):
+        index = bitmaps.get_index()
+        cache.set(bitmaps.VERSION_CACHE_KEY, cache.get(bitmaps.VERSION_CACHE_KEY, 0) + 1)
+        self.assertIsNot(bitmaps.get_index(), index)
+
+    def test_book_list_uses_bitmaps(self):
+        response = self.client.get(reverse('books'), {'genre': [self.fiction.id, self.drama.id],
+                                                      'language': self.english.id})
+        self.assertIsInstance(response.context['book_list'], list)
+        self.assertIsInstance(response.context['paginator'].object_list, bitmaps.BitmapResult)
+        self.assertEqual([book.title for book in response.context['book_list']], ['Book 0', 'Book 2'])
+        facets = response.context['facets']
+        self.assertEqual([(value['name'], value['count']) for value in facets['genre']],
+                         [('Fiction', 2), ('Drama', 1)])
+        self.assertEqual([(value['name'], value['count']) for value in facets['author']], [('Author 1', 2)])
+
+    def test_bitmap_and_sql_paths_agree(self):
+        params = [
+            {},
+            {'genre': [self.drama.id]},
+            {'author': self.author2.id},
+            {'available': 'on'},
+            {'genre': [self.fiction.id], 'author': self.author1.id, 'language': self.english.id},
+        ]
+        for query in params:
+            with self.subTest(query=query):
+                bitmap_response = self.client.get(reverse('books'), query)
+                with self.settings(CATALOG_BITMAP_INDEX=False):
+                    sql_response = self.client.get(reverse('books'), query)
+                self.assertEqual(list(bitmap_response.context['book_list']), list(sql_response.context['book_list']))
+                self.assertEqual(
+                    {facet: [(v['key'], v['count']) for v in values]
+                     for facet, values in bitmap_response.context['facets'].items()},
+                    {facet: [(v['key'], v['count']) for v in values]
+                     for facet, values in sql_response.context['facets'].items()})
+
+    def test_title_search_uses_sql(self):
+        response = self.client.get(reverse('books'), {'title': 'Book 1'})
+        self.assertNotIsInstance(response.context['paginator'].object_list, bitmaps.BitmapResult)
+        self.assertEqual([book.title for book in response.context['book_list']], ['Book 1'])
@@ -0,0 +1,134 @@
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from datetime import date, timedelta
+from catalog.borrowing import get_borrowing_stats
+from catalog.models import Author, Book, BookCopy, Borrowing, UserBorrowingStats
+
+
+def counters(stats):
+    return (stats.pending, stats.active, stats.overdue, stats.lifetime)
+
+
+class UserBorrowingStatsTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.other = User.objects.create_user(username='otheruser', password='testpassword')
+        self.book = Book.objects.create(title='Test Book', summary='Test Summary', isbn='1234567890123',
+                                        author=Author.objects.create(name='Test Author'))
+        self.copies = [BookCopy.objects.create(book=self.book, status='a', publisher='Test Publisher')
+                       for _ in range(6)]
+        get_borrowing_stats(self.user)
+
+    def borrow(self, copy=0, status='p', due_in=7, user=None):
+        return Borrowing.objects.create(borrower=user or self.user, book_copy=self.copies[copy], status=status,
+                                        start_date=date.today(), due_date=date.today() + timedelta(days=due_in))
+
+    def stats(self, user=None):
+        return get_borrowing_stats(user or self.user)
+
+    def assertMatchesRecount(self, user=None):
+        stats = counters(self.stats(user))
+        self.assertEqual(stats, counters(UserBorrowingStats.recount((user or self.user).pk)))
+        return stats
+
+    def test_counters_follow_status_changes(self):
+        borrowing = self.borrow()
+        self.assertEqual(self.assertMatchesRecount(), (1, 0, 0, 0))
+        for status_, expected in (('a', (0, 1, 0, 0)), ('b', (0, 1, 0, 1)), ('r', (0, 0, 0, 1))):
+            borrowing.status = status_
+            borrowing.save()
+            self.assertEqual(self.assertMatchesRecount(), expected)
+
+        self.borrow(1, status='d')
+        self.assertEqual(self.assertMatchesRecount(), (0, 0, 0, 1))
+
+    def test_overdue_loans(self):
+        borrowing = self.borrow(status='b', due_in=-1)
+        self.assertEqual(self.assertMatchesRecount(), (0, 1, 1, 1))
+        borrowing.status = 'r'
+        borrowing.save()
+        self.assertEqual(self.assertMatchesRecount(), (0, 0, 0, 1))
+
+    def test_overdue_counter_is_recounted_once_a_day(self):
+        borrowing = self.borrow(status='b', due_in=-1)
+        UserBorrowingStats.objects.filter(user=self.user).update(overdue=0,
+                                                                 overdue_checked_on=date.today() - timedelta(days=2))
+        self.assertEqual(self.stats().overdue, 1)
+        borrowing.delete()
+        self.assertEqual(self.assertMatchesRecount(), (0, 0, 0, 0))
+
+    def test_delete_and_borrower_change(self):
+        borrowing = self.borrow(status='a')
+        self.borrow(1).delete()
+        self.assertEqual(self.assertMatchesRecount(), (0, 1, 0, 0))
+        borrowing.borrower = self.other
+        borrowing.save()
+        self.assertEqual(self.assertMatchesRecount(), (0, 0, 0, 0))
+        self.assertEqual(self.assertMatchesRecount(self.other), (0, 1, 0, 0))
+
+    def test_stats_read_does_not_scan_history(self):
+        self.borrow()
+        with self.assertNumQueries(1):
+            self.stats()
+
+    @override_settings(CATALOG_MAX_PENDING_REQUESTS=2)
+    def test_borrow_view_enforces_pending_limit(self):
+        self.client.force_login(self.user)
+        for copy in self.copies[:3]:
+            response = self.client.post(reverse('borrowing-create', args=(self.book.id, copy.id)), data={
+                'bookcopy_id': copy.id,
+                'start_date': date.today(),
+                'due_date': date.today(),
+            })
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'You cannot have more than 2 pending borrowing requests')
+        self.assertEqual(Borrowing.objects.filter(borrower=self.user).count(), 2)
+
+    @override_settings(CATALOG_MAX_ACTIVE_LOANS=2)
+    def test_api_enforces_active_limit(self):
+        self.borrow(0, status='b')
+        self.borrow(1, status='a')
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.post(reverse('borrow-book'), {
+            'borrower': self.user.id,
+            'book_copy': self.copies[2].id,
+            'start_date': date.today(),
+            'due_date': date.today(),
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('2 active loans', response.data['non_field_errors'][0])
+
+    @override_settings(CATALOG_MAX_PENDING_REQUESTS=3)
+    def test_batch_borrow_rejects_requests_over_the_limit(self):
+        self.borrow(0)
+        day = date.today().isoformat()
+        response = APIClient().post(reverse('batch-borrow-book'), {
+            'borrower': self.user.id,
+            'borrowings': [{'book_copy': str(copy.id), 'start_date': day, 'due_date': day}
+                           for copy in self.copies[1:5]],
+        }, format='json')
+        self.assertEqual(len(response.data['accepted']), 2)
+        self.assertEqual(response.data['rejected'], [
+            {'index': 2, 'book_copy': self.copies[3].id, 'reason': 'Borrowing limit reached'},
+            {'index': 3, 'book_copy': self.copies[4].id, 'reason': 'Borrowing limit reached'},
+        ])
+        self.assertEqual(self.assertMatchesRecount(), (3, 0, 0, 0))
+
+    def test_dashboard_and_api(self):
+        self.borrow(0, status='b', due_in=-3)
+        self.borrow(1)
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('borrowing-list'))
+        self.assertEqual(counters(response.context['stats']), (1, 1, 1, 1))
+        self.assertContains(response, 'Active loans:</strong> 1/5')
+
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.get(reverse('borrowing-stats'))
+        self.assertEqual(response.data, {'pending': 1, 'active': 1, 'overdue': 1, 'lifetime': 1,
+                                         'max_active_loans': 5, 'max_pending_requests': 3, 'remaining': 2})
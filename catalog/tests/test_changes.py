@@ -0,0 +1,107 @@
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from datetime import date
+from catalog import changes, copies
+from catalog.models import Author, Book, BookCopy, Borrowing, Change, Genre, Review
+
+
+def summary(entries):
+    return [(entry['model'], entry['id'], entry['deleted']) for entry in entries]
+
+
+class ChangeFeedTest(TestCase):
+    def setUp(self):
+        self.author = Author.objects.create(name='Test Author')
+        self.genre = Genre.objects.create(name='Fiction')
+        self.book = Book.objects.create(title='Test Book', summary='Summary', isbn='1234567890123', author=self.author)
+        self.user = User.objects.create_user(username='reader', password='testpassword')
+        self.cursor = changes.get_changes(0, 1000)[1]
+
+    def sync(self, **kwargs):
+        entries, self.cursor, _has_more = changes.get_changes(self.cursor, **kwargs)
+        return entries
+
+    def test_writes_and_deletes_since_cursor(self):
+        self.assertEqual(self.sync(), [])
+        self.book.title = 'New Title'
+        self.book.save()
+        self.book.genre.add(self.genre)
+        copy = BookCopy.objects.create(book=self.book, status='a', publisher='Publisher')
+        review_id = Review.objects.create(user=self.user, book=self.book, point=4).id
+        Review.objects.filter(id=review_id).delete()
+
+        entries = self.sync()
+        # the book was written three times, it is sent once with its last state
+        self.assertEqual(summary(entries), [('book', self.book.id, False), ('bookcopy', copy.id, False),
+                                            ('review', review_id, True)])
+        self.assertEqual(entries[0]['data'], {'title': 'New Title', 'summary': 'Summary', 'author': self.author.id,
+                                              'genre': [self.genre.id], 'language': None})
+        self.assertEqual(entries[1]['data']['status'], 'a')
+        self.assertIsNone(entries[2]['data'])
+        self.assertEqual(self.sync(), [])
+
+    def test_bulk_writes_and_cascades_are_recorded(self):
+        new_copies = copies.add_copies(self.book, 2, 'Publisher', status='m')
+        copies.set_copies_status([new_copies[0].id], 'a')
+        self.assertEqual(summary(self.sync()), [('bookcopy', new_copies[1].id, False),
+                                                ('bookcopy', new_copies[0].id, False)])
+
+        self.book.genre.add(self.genre)
+        self.sync()
+        author_id = self.author.id
+        self.genre.delete()
+        self.author.delete()
+        entries = self.sync()
+        self.assertEqual(summary(entries), [('book', self.book.id, False), ('author', author_id, True)])
+        self.assertEqual(entries[0]['data']['author'], None)
+        self.assertEqual(entries[0]['data']['genre'], [])
+
+    def test_pages(self):
+        for index in range(5):
+            Author.objects.create(name=f'Author {index}')
+        pages = []
+        while True:
+            entries, self.cursor, has_more = changes.get_changes(self.cursor, limit=2)
+            pages.append(len(entries))
+            if not has_more:
+                break
+        self.assertEqual(pages, [2, 2, 1])
+
+    def test_late_commit_is_not_skipped(self):
+        late_author = Author.objects.create(name='Late Author')
+        # written first, committed after the next entry has been served
+        late = Change.objects.get(model='author', object_id=str(late_author.id))
+        late.delete()
+        author = Author.objects.create(name='Author')
+        self.assertEqual(summary(self.sync()), [('author', author.id, False)])
+
+        Change.objects.bulk_create([Change(id=late.id, model=late.model, object_id=late.object_id)])
+        entries = self.sync()
+        self.assertEqual(summary(entries), [('author', late_author.id, False)])
+        self.assertGreater(entries[0]['seq'], Change.objects.get(model='author', object_id=str(author.id)).seq)
+        self.assertEqual(self.sync(), [])
+
+    def test_api(self):
+        copy = BookCopy.objects.create(book=self.book, status='a', publisher='Publisher')
+        Borrowing.objects.create(borrower=self.user, book_copy=copy, start_date=date.today(), due_date=date.today())
+        client = APIClient()
+        url = reverse('change-feed')
+        self.assertEqual(client.get(url).status_code, status.HTTP_401_UNAUTHORIZED)
+
+        client.force_authenticate(self.user)
+        response = client.get(url, {'since': self.cursor})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # borrowings are for staff only
+        self.assertEqual([entry['model'] for entry in response.data['changes']], ['bookcopy'])
+        self.assertEqual(response.data['cursor'], Change.objects.get(model='bookcopy').seq)
+        self.assertFalse(response.data['has_more'])
+
+        self.user.is_staff = True
+        self.user.save()
+        response = client.get(url, {'since': self.cursor, 'models': 'borrowing'})
+        self.assertEqual([entry['model'] for entry in response.data['changes']], ['borrowing'])
+        self.assertEqual(client.get(url, {'models': 'hold'}).status_code, status.HTTP_400_BAD_REQUEST)
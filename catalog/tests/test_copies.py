@@ -0,0 +1,90 @@
+from django.contrib.auth.models import Permission, User
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from datetime import date
+from catalog import bitmaps, copies
+from catalog.models import Author, Book, BookCopy, Hold
+from catalog.reservations import get_book_calendar
+
+
+class BookCopyBulkTest(TestCase):
+    def setUp(self):
+        self.book = Book.objects.create(title='Test Book', summary='Test Summary', isbn='1234567890123',
+                                        author=Author.objects.create(name='Test Author'))
+        self.staff = User.objects.create_user(username='staff', password='testpassword', is_staff=True)
+        self.staff.user_permissions.add(Permission.objects.get(codename='can_mark_returned'))
+        self.reader = User.objects.create_user(username='reader', password='testpassword')
+
+    def test_add_copies_in_one_insert(self):
+        get_book_calendar(self.book.id)
+        with self.assertNumQueries(5):  # savepoint, INSERT, change feed delete + insert, release
+            new_copies = copies.add_copies(self.book, 5, 'Publisher', date(2020, 1, 1), status='m')
+        self.assertEqual(len(new_copies), 5)
+        self.assertEqual(BookCopy.objects.filter(book=self.book, status='m', publisher='Publisher').count(), 5)
+        # the cached calendar of the book was dropped
+        self.assertEqual(len(get_book_calendar(self.book.id).copies), 5)
+
+    def test_new_available_copies_serve_hold_queue(self):
+        Hold.objects.create(book=self.book, user=self.reader)
+        copies.add_copies(self.book, 3, 'Publisher')
+        self.assertEqual(Hold.objects.get().status, 'f')
+        self.assertEqual(sorted(BookCopy.objects.values_list('status', flat=True)), ['a', 'a', 'r'])
+
+    def test_status_change_skips_borrowed_and_reserved_copies(self):
+        shelf = copies.add_copies(self.book, 2, 'Publisher', status='m')
+        borrowed = BookCopy.objects.create(book=self.book, status='b', publisher='Publisher')
+        reserved = BookCopy.objects.create(book=self.book, status='r', publisher='Publisher')
+        copy_ids = [copy.id for copy in shelf] + [borrowed.id, reserved.id]
+
+        self.assertEqual(sorted(copies.set_copies_status(copy_ids, 'a')), sorted(copy.id for copy in shelf))
+        self.assertEqual(copies.set_copies_status(copy_ids, 'a'), [])
+        self.assertEqual(dict(BookCopy.objects.values_list('id', 'status')),
+                         {shelf[0].id: 'a', shelf[1].id: 'a', borrowed.id: 'b', reserved.id: 'r'})
+        with self.assertRaises(ValueError):
+            copies.set_copies_status(copy_ids, 'b')
+
+    @override_settings(CATALOG_BITMAP_INDEX=True)
+    def test_bitmap_index_follows_bulk_changes(self):
+        cache.clear()
+        bitmaps.reset_index()
+        self.addCleanup(bitmaps.reset_index)
+        available = lambda: [book.id for book in bitmaps.search(('available', True))]
+        self.assertEqual(available(), [])
+        shelf = copies.add_copies(self.book, 2, 'Publisher')
+        self.assertEqual(available(), [self.book.id])
+        copies.set_copies_status([copy.id for copy in shelf], 'm')
+        self.assertEqual(available(), [])
+
+    def test_api(self):
+        client = APIClient()
+        url = reverse('book-copies-api', args=[self.book.id])
+        self.assertEqual(client.post(url, {'count': 2, 'publisher': 'Publisher'}).status_code,
+                         status.HTTP_401_UNAUTHORIZED)
+
+        client.force_authenticate(self.staff)
+        response = client.post(url, {'count': 2, 'publisher': 'Publisher', 'status': 'm'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([copy['status'] for copy in response.data], ['m', 'm'])
+        borrowed = BookCopy.objects.create(book=self.book, status='b', publisher='Publisher')
+
+        copy_ids = [copy['id'] for copy in response.data] + [str(borrowed.id)]
+        response = client.post(reverse('book-copy-status-api'), {'copies': copy_ids, 'status': 'a'}, format='json')
+        self.assertEqual(len(response.data['updated']), 2)
+        self.assertEqual(response.data['skipped'], [borrowed.id])
+
+        response = client.post(url, {'count': 0, 'publisher': 'Publisher'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_staff_view(self):
+        url = reverse('book-copies-add', args=[self.book.id])
+        self.client.force_login(self.reader)
+        self.assertEqual(self.client.get(url).status_code, 302)
+
+        self.client.force_login(self.staff)
+        response = self.client.post(url, {'count': 4, 'publisher': 'Publisher', 'status': 'a'})
+        self.assertRedirects(response, reverse('book-detail', args=[self.book.id]))
+        self.assertEqual(BookCopy.objects.filter(book=self.book, status='a').count(), 4)
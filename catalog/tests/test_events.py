@@ -0,0 +1,156 @@
+import asyncio
+import json
+import threading
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.contrib.auth.models import Permission, User
+from django.core.cache import cache
+from django.db import transaction
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from datetime import date
+from catalog import events
+from catalog.events import CacheBroker, LocalBroker
+from catalog.models import Author, Book, BookCopy, Borrowing
+
+
+class LocalBrokerTest(TestCase):
+    broker_class = LocalBroker
+
+    def setUp(self):
+        cache.clear()
+        self.broker = self.broker_class(history=3)
+
+    def test_events_since(self):
+        self.assertEqual(self.broker.events_since(0), [])
+        for index in range(4):
+            self.broker.publish('borrowing.created', {'index': index})
+        self.assertEqual(self.broker.head(), 4)
+        self.assertEqual([event['index'] for event in self.broker.events_since(2)], [2, 3])
+        self.assertEqual(self.broker.events_since(4), [])
+        # event 1 is no longer kept
+        self.assertIsNone(self.broker.events_since(0))
+        # cursor of another broker
+        self.assertIsNone(self.broker.events_since(10))
+
+    def test_wait(self):
+        wait = async_to_sync(self.broker.wait)
+        self.assertEqual(wait(0, 0.01), [])
+        self.broker.publish('borrowing.created', {})
+        self.assertEqual([event['id'] for event in wait(0, 1)], [1])
+
+    def test_wait_wakes_up_on_publish(self):
+        async def wait():
+            publisher = threading.Timer(0.05, self.broker.publish, ('borrowing.created', {}))
+            publisher.start()
+            try:
+                return await self.broker.wait(0, 5)
+            finally:
+                publisher.join()
+        self.assertEqual([event['id'] for event in asyncio.run(wait())], [1])
+
+
+class CacheBrokerTest(LocalBrokerTest):
+    broker_class = CacheBroker
+
+    def test_expired_events(self):
+        for _ in range(3):
+            self.broker.publish('borrowing.created', {})
+        cache.delete(self.broker.event_key(2))
+        self.assertIsNone(self.broker.events_since(0))
+        # the last event is numbered but not stored yet
+        cache.delete(self.broker.event_key(3))
+        self.assertEqual([event['id'] for event in self.broker.events_since(2)], [])
+
+
+@override_settings(CATALOG_EVENT_BROKER='local')
+class BorrowingEventsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = Author.objects.create(name='Author')
+        book = Book.objects.create(title='Book', author=author, isbn='1234567890123')
+        cls.copy = BookCopy.objects.create(book=book, status='a', publisher='Publisher')
+        cls.user = User.objects.create_user(username='reader', password='testpassword')
+        cls.staff = User.objects.create_user(username='librarian', password='testpassword')
+        cls.staff.user_permissions.add(Permission.objects.get(codename='can_view_all_borrowing'))
+
+    def setUp(self):
+        events._brokers.clear()
+        self.broker = events.get_broker()
+
+    def create_borrowing(self):
+        return Borrowing.objects.create(borrower=self.user, book_copy=self.copy,
+                                        start_date=date.today(), due_date=date.today())
+
+    def test_published_on_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            borrowing = self.create_borrowing()
+        with self.captureOnCommitCallbacks(execute=True):
+            borrowing.decline_reason = 'No reason'
+            borrowing.save()
+            borrowing.status = 'a'
+            borrowing.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            Borrowing.objects.get(pk=borrowing.pk).delete()
+
+        published = self.broker.events_since(0)
+        self.assertEqual([event['type'] for event in published],
+                         ['borrowing.created', 'borrowing.status_changed', 'borrowing.deleted'])
+        self.assertEqual(published[1]['borrowing']['status'], 'a')
+        self.assertEqual(published[1]['borrowing']['status_display'], 'Approved')
+        self.assertEqual(published[1]['previous_status'], 'p')
+
+    def test_rolled_back(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                self.create_borrowing()
+                transaction.set_rollback(True)
+        self.assertEqual(self.broker.events_since(0), [])
+
+    def test_batch_borrow(self):
+        self.client.force_login(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('batch-borrow-book'), {'borrower': self.user.id, 'borrowings': [
+                {'book_copy': str(self.copy.id), 'start_date': date.today(), 'due_date': date.today()},
+            ]}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([event['type'] for event in self.broker.events_since(0)], ['borrowing.created'])
+
+    def test_long_poll(self):
+        url = reverse('borrowing-events-poll')
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+        self.client.force_login(self.staff)
+        self.assertEqual(self.client.get(url).json(), {'events': [], 'cursor': 0, 'reset': False})
+        self.assertEqual(self.client.get(url, {'since': 0, 'timeout': 0}).json()['events'], [])
+        self.assertEqual(self.client.get(url, {'since': 'x'}).status_code, 400)
+        with self.captureOnCommitCallbacks(execute=True):
+            borrowing = self.create_borrowing()
+        data = self.client.get(url, {'since': 0}).json()
+        self.assertEqual(data['cursor'], 1)
+        self.assertEqual(data['events'][0]['borrowing']['id'], borrowing.id)
+        self.assertEqual(data['events'][0]['borrowing']['book_copy'], str(self.copy.id))
+        self.assertTrue(self.client.get(url, {'since': 5, 'timeout': 0}).json()['reset'])
+
+    async def test_event_stream(self):
+        await sync_to_async(self.async_client.force_login)(self.staff)
+        await sync_to_async(self.broker.publish)('borrowing.created', {'borrowing': {'id': 1}})
+        response = await self.async_client.get(reverse('borrowing-events'), headers={'Last-Event-ID': '0'})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = response.streaming_content
+        try:
+            self.assertEqual(await anext(stream), b'retry: 3000\n\n')
+            message = await anext(stream)
+        finally:
+            await stream.aclose()
+        header, data = message.decode().rsplit('data: ', 1)
+        self.assertEqual(header, 'id: 1\nevent: borrowing.created\n')
+        self.assertEqual(json.loads(data), {'id': 1, 'type': 'borrowing.created', 'borrowing': {'id': 1}})
+        self.assertTrue(data.endswith('\n\n'))
+
+    def test_staff_page(self):
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('async-all-borrowing'))
+        self.assertContains(response, reverse('borrowing-events'))
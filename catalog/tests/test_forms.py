@@ -2,6 +2,8 @@ from django.test import TestCase
 from django.core.exceptions import ValidationError
 
 import datetime
+from django.contrib.auth.models import User
+from catalog.models import Book, BookCopy, Borrowing
 from catalog.forms import UserRegisterForm, SearchAuthorForm, \
                         SearchBookForm, ReviewBookForm, BorrowBookForm, \
                         DeclineBorrowingForm
@@ -207,6 +209,23 @@ class BorrowBookFormTest(TestCase):
         self.assertIn('due_date', form.errors)
         self.assertEqual(form.errors['due_date'][0], 'Invalid due date - due date cannot be in the past')
 
+    def test_borrow_book_form_overlapping_borrowing(self):
+        book = Book.objects.create(title='Test Book', summary='Test Summary', isbn='1234567890123')
+        book_copy = BookCopy.objects.create(book=book, status='a', publisher='Test Publisher')
+        user = User.objects.create_user(username='testuser', password='testpassword')
+        start_date = datetime.date.today()
+        Borrowing.objects.create(borrower=user, book_copy=book_copy, status='a',
+                                 start_date=start_date, due_date=start_date + datetime.timedelta(days=3))
+
+        form_data = {
+            'start_date': start_date + datetime.timedelta(days=2),
+            'due_date': start_date + datetime.timedelta(days=5)
+        }
+        form = BorrowBookForm(data=form_data, initial={'bookcopy_id': book_copy.id})
+
+        self.assertFalse(form.is_valid())
+        self.assertEqual(form.non_field_errors()[0], 'This book copy is already requested for these dates')
+
   
 #####################################################################
 class DeclineBorrowingFormTest(TestCase):
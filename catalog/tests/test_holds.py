@@ -0,0 +1,116 @@
+from django.contrib.auth.models import User
+from django.core import mail
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from datetime import date
+from catalog.models import Author, Book, BookCopy, Borrowing, Hold
+from catalog import holds
+from catalog.tests.test_views import run_queued_tasks
+
+
+class HoldQueueTest(TestCase):
+    def setUp(self):
+        author = Author.objects.create(name='Author 1')
+        self.book = Book.objects.create(title='Test Book', author=author, summary='Test Summary', isbn='1234567890123')
+        self.book_copy = BookCopy.objects.create(book=self.book, status='b', publisher='Test Publisher')
+        self.users = [User.objects.create_user(username=f'user{i}', password='testpassword',
+                                               email=f'user{i}@example.com') for i in range(3)]
+
+    def test_queue_is_fifo(self):
+        hold_list = [holds.join_queue(self.book, user)[0] for user in self.users]
+        self.assertEqual([holds.queue_position(hold) for hold in hold_list], [1, 2, 3])
+        holds.leave_queue(self.book, self.users[0])
+        hold_list[1].refresh_from_db()
+        self.assertEqual(holds.queue_position(hold_list[1]), 1)
+        self.assertEqual(holds.queue_length(self.book.id), 2)
+
+    def test_join_twice_keeps_one_hold(self):
+        holds.join_queue(self.book, self.users[0])
+        hold, created = holds.join_queue(self.book, self.users[0])
+        self.assertFalse(created)
+        self.assertEqual(Hold.objects.filter(book=self.book).count(), 1)
+
+    def test_returned_copy_is_assigned_to_queue_head(self):
+        for user in self.users[:2]:
+            holds.join_queue(self.book, user)
+        self.book_copy.status = 'a'
+        self.book_copy.save()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            hold = holds.assign_returned_copy(self.book_copy)
+
+        self.assertEqual(hold.user, self.users[0])
+        self.assertEqual(hold.status, 'f')
+        self.book_copy.refresh_from_db()
+        self.assertEqual(self.book_copy.status, 'r')
+        self.assertEqual(hold.borrowing.status, 'a')
+        self.assertEqual(hold.borrowing.borrower, self.users[0])
+        # queued, sent by the task workers
+        self.assertEqual(len(mail.outbox), 0)
+        run_queued_tasks()
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['user0@example.com'])
+        # the copy is taken, nothing left to hand out
+        self.assertIsNone(holds.assign_returned_copy(self.book_copy))
+        self.assertEqual(holds.queue_length(self.book.id), 1)
+
+    def test_booked_copy_is_not_assigned(self):
+        holds.join_queue(self.book, self.users[1])
+        self.book_copy.status = 'a'
+        self.book_copy.save()
+        Borrowing.objects.create(borrower=self.users[2], book_copy=self.book_copy, start_date=date.today(),
+                                 due_date=date.today(), status='p')
+
+        self.assertIsNone(holds.assign_returned_copy(self.book_copy))
+        self.book_copy.refresh_from_db()
+        self.assertEqual(self.book_copy.status, 'a')
+        self.assertEqual(holds.queue_length(self.book.id), 1)
+        self.assertFalse(Borrowing.objects.filter(borrower=self.users[1]).exists())
+
+    @override_settings(CATALOG_MAX_ACTIVE_LOANS=1)
+    def test_holder_over_the_loan_limit_is_passed_over(self):
+        for user in self.users[:2]:
+            holds.join_queue(self.book, user)
+        other_copy = BookCopy.objects.create(book=self.book, status='b', publisher='Test Publisher')
+        Borrowing.objects.create(borrower=self.users[0], book_copy=other_copy, start_date=date.today(),
+                                 due_date=date.today(), status='b')
+        self.book_copy.status = 'a'
+        self.book_copy.save()
+
+        hold = holds.assign_returned_copy(self.book_copy)
+        self.assertEqual(hold.user, self.users[1])
+        # still first in the queue for the next copy
+        first = holds.get_user_hold(self.book.id, self.users[0])
+        self.assertEqual(holds.queue_position(first), 1)
+
+    def test_end_borrowing_assigns_copy(self):
+        holds.join_queue(self.book, self.users[1])
+        borrowing = Borrowing.objects.create(borrower=self.users[0], book_copy=self.book_copy,
+                                             start_date=date.today(), due_date=date.today(), status='b')
+        self.client.force_login(self.users[0])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('borrowing-end', args=(borrowing.id,)))
+        self.book_copy.refresh_from_db()
+        self.assertEqual(self.book_copy.status, 'r')
+        self.assertTrue(Borrowing.objects.filter(borrower=self.users[1], status='a').exists())
+
+    def test_hold_api(self):
+        client = APIClient()
+        client.force_authenticate(self.users[0])
+        url = reverse('book-hold', args=(self.book.id,))
+        response = client.post(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['position'], 1)
+        response = client.delete(url)
+        self.assertEqual(response.data['queue_length'], 0)
+        self.assertIsNone(response.data['position'])
+
+    def test_hold_views(self):
+        self.client.force_login(self.users[0])
+        response = self.client.post(reverse('hold-join', args=(self.book.id,)))
+        self.assertRedirects(response, reverse('book-detail', args=(self.book.id,)))
+        response = self.client.get(reverse('book-detail', args=(self.book.id,)))
+        self.assertEqual(response.context['hold_position'], 1)
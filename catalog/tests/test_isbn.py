@@ -0,0 +1,103 @@
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from catalog.isbn import find_duplicates, lookup_books, normalize_isbn
+from catalog.models import Author, Book, Genre, Language
+
+
+class IsbnTest(TestCase):
+    def setUp(self):
+        author = Author.objects.create(name='Test Author')
+        self.book = Book.objects.create(title='Signal Processing', author=author, isbn='0-306-40615-2')
+        self.other = Book.objects.create(title='Other Book', author=author, isbn='9791032300824')
+        self.legacy = Book.objects.create(title='Legacy Book', author=author, isbn='1234567890123')
+
+    def test_normalize(self):
+        for value in ('0306406152', '0-306-40615-2', '978-0-306-40615-7', ' 978 0306406157 '):
+            self.assertEqual(normalize_isbn(value), '9780306406157')
+        self.assertEqual(normalize_isbn('080442957x'), '9780804429573')
+        for value in ('0306406153', '9780306406158', '1234567890123', '97803064061', 'abc', '', None):
+            self.assertIsNone(normalize_isbn(value))
+
+    def test_key_is_stored_and_unique(self):
+        self.assertEqual(self.book.isbn_key, '9780306406157')
+        self.assertIsNone(self.legacy.isbn_key)
+
+        duplicate = Book(title='Same Book', isbn='978-0-306-40615-7')
+        with self.assertRaises(ValidationError) as context:
+            duplicate.full_clean()
+        self.assertIn('isbn', context.exception.message_dict)
+        with self.assertRaises(IntegrityError):
+            duplicate.save()
+
+        with self.assertRaises(ValidationError):
+            Book(title='Bad ISBN', summary='Summary', isbn='0306406153').full_clean(exclude=['author', 'language', 'genre'])
+
+    def test_legacy_duplicate_stays_editable(self):
+        # as migration 0024 leaves a later book with the same ISBN once normalized
+        duplicate, = Book.objects.bulk_create([Book(title='Same Book', isbn='978-0-306-40615-7')])
+        duplicate = Book.objects.get(pk=duplicate.pk)
+        self.assertIsNone(duplicate.isbn_key)
+        duplicate.title = 'Same Book, 2nd edition'
+        duplicate.clean()
+        duplicate.save()
+        duplicate.refresh_from_db()
+        self.assertEqual(duplicate.title, 'Same Book, 2nd edition')
+        self.assertIsNone(duplicate.isbn_key)
+        # but cannot take another book's ISBN
+        duplicate.isbn = '9791032300824'
+        with self.assertRaises(ValidationError):
+            duplicate.clean()
+        duplicate.isbn = '978-0-306-40615-7'
+
+        # once the other book changes its ISBN the key is free again
+        self.book.isbn = '9780804429573'
+        self.book.save()
+        duplicate.save()
+        self.assertEqual(duplicate.isbn_key, '9780306406157')
+
+    def test_legacy_invalid_isbn_stays_editable(self):
+        # saved before validate_isbn, migration 0024 leaves it with a NULL key
+        self.assertIsNone(normalize_isbn(self.legacy.isbn))
+        self.legacy.title = 'Legacy Book, revised'
+        self.legacy.clean_fields(exclude=['summary', 'language'])
+        self.legacy.save()
+        # a new ISBN has to be valid
+        self.legacy.isbn = '123-4567890123'
+        with self.assertRaisesMessage(ValidationError, 'not a valid ISBN'):
+            self.legacy.clean_fields(exclude=['summary', 'language'])
+
+        staff = User.objects.create_user(username='staff', password='testpassword', is_staff=True)
+        self.client.force_login(staff)
+        data = {'title': 'Legacy Book', 'summary': 'Summary', 'isbn': '1234567890123',
+                'author': self.legacy.author_id, 'language': Language.objects.create(name='English').id,
+                'genre': [Genre.objects.create(name='Fiction').id]}
+        response = self.client.post(reverse('book-update', args=(self.legacy.pk,)), data)
+        self.assertRedirects(response, self.legacy.get_absolute_url())
+        self.assertEqual(Book.objects.get(pk=self.legacy.pk).title, 'Legacy Book')
+
+    def test_bulk_lookup_in_one_query(self):
+        isbns = ['0306406152', '979-10-323-0082-4', '9780804429573', '1234567890123', '978-0-306-40615-7']
+        with self.assertNumQueries(1):
+            found, missing, invalid = lookup_books(isbns)
+        self.assertEqual(found, {'0306406152': self.book, '979-10-323-0082-4': self.other,
+                                 '978-0-306-40615-7': self.book})
+        self.assertEqual(missing, ['9780804429573'])
+        self.assertEqual(invalid, ['1234567890123'])
+        self.assertEqual(find_duplicates(isbns), {'9780306406157': ['0306406152', '978-0-306-40615-7']})
+
+    def test_lookup_api(self):
+        response = APIClient().post(reverse('isbn-lookup'), {'isbns': ['0-306-40615-2', '9780804429573', 'x']},
+                                    format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['found']['0-306-40615-2']['id'], self.book.id)
+        self.assertEqual(response.data['missing'], ['9780804429573'])
+        self.assertEqual(response.data['invalid'], ['x'])
+
+        response = APIClient().post(reverse('isbn-lookup'), {'isbns': []}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
@@ -0,0 +1,155 @@
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from datetime import date, timedelta
+from catalog import holds, lifecycle
+from catalog.lifecycle import TransitionError
+from catalog.models import Author, Book, BookCopy, Borrowing, Change, UserBorrowingStats
+
+
+class LifecycleTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = Author.objects.create(name='Author')
+        cls.book = Book.objects.create(title='Book', author=author, isbn='1234567890123')
+        cls.user = User.objects.create_user(username='reader', password='testpassword')
+
+    def setUp(self):
+        self.copy = BookCopy.objects.create(book=self.book, status='a', publisher='Publisher')
+
+    def create_borrowing(self, status='p', copy=None):
+        return Borrowing.objects.create(borrower=self.user, book_copy=copy or self.copy, status=status,
+                                        start_date=date.today(), due_date=date.today() + timedelta(days=7))
+
+    def load(self, borrowing):
+        return Borrowing.objects.select_related('book_copy__book').get(pk=borrowing.pk)
+
+    def assert_statuses(self, borrowing, borrowing_status, copy_status):
+        borrowing.refresh_from_db()
+        self.copy.refresh_from_db()
+        self.assertEqual((borrowing.status, self.copy.status), (borrowing_status, copy_status))
+
+    def test_loan(self):
+        borrowing = self.create_borrowing()
+        for to_status, copy_status in (('a', 'r'), ('b', 'b'), ('r', 'a')):
+            lifecycle.transition(self.load(borrowing), to_status)
+            self.assert_statuses(borrowing, to_status, copy_status)
+
+        stats = UserBorrowingStats.objects.get(user=self.user)
+        recounted = UserBorrowingStats.recount(self.user.id)
+        self.assertEqual((stats.pending, stats.active, stats.lifetime),
+                         (recounted.pending, recounted.active, recounted.lifetime))
+        self.assertTrue(Change.objects.filter(model='borrowing', object_id=str(borrowing.pk)).exists())
+        self.assertTrue(Change.objects.filter(model='bookcopy', object_id=str(self.copy.pk)).exists())
+
+    def test_rejected_before_any_write(self):
+        borrowing = self.load(self.create_borrowing())
+        BookCopy.objects.filter(pk=self.copy.pk).update(status='m')
+        for to_status, message in (('r', 'Cannot return a pending'), ('a', 'the book copy is not available')):
+            with CaptureQueriesContext(connection) as queries, self.assertRaisesMessage(TransitionError, message):
+                lifecycle.transition(borrowing, to_status)
+            self.assertFalse([query for query in queries if query['sql'].startswith(('UPDATE', 'INSERT'))])
+        self.assert_statuses(borrowing, 'p', 'm')
+
+    def test_stale_instance_is_checked_on_the_current_row(self):
+        borrowing = self.load(self.create_borrowing())
+        Borrowing.objects.filter(pk=borrowing.pk).update(status='c')
+        with self.assertRaisesMessage(TransitionError, 'Cannot approve a canceled borrowing request!'):
+            lifecycle.transition(borrowing, 'a')
+        self.assert_statuses(borrowing, 'c', 'a')
+
+        # the copy was taken by another request since the borrowing was loaded
+        borrowing = self.load(self.create_borrowing())
+        BookCopy.objects.filter(pk=self.copy.pk).update(status='r')
+        with self.assertRaisesMessage(TransitionError, 'the book copy is not available'):
+            lifecycle.transition(borrowing, 'a')
+        self.assert_statuses(borrowing, 'p', 'r')
+
+    def test_cancel_approved_serves_holds(self):
+        borrowing = self.create_borrowing()
+        lifecycle.transition(self.load(borrowing), 'a')
+        waiting = User.objects.create_user(username='waiting', password='testpassword')
+        holds.join_queue(self.book, waiting)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            lifecycle.transition(self.load(borrowing), 'c')
+        self.assert_statuses(borrowing, 'c', 'r')
+        self.assertEqual(Borrowing.objects.get(borrower=waiting).status, 'a')
+
+    def test_transition_many(self):
+        other_copy = BookCopy.objects.create(book=self.book, status='a', publisher='Publisher')
+        first = self.create_borrowing()
+        # same copy as the first one, it cannot be reserved twice
+        second = self.create_borrowing()
+        third = self.create_borrowing(copy=other_copy)
+        declined = self.create_borrowing(status='d')
+
+        moved, rejected = lifecycle.transition_many([first.pk, second.pk, third.pk, declined.pk, 9999], 'a')
+        self.assertEqual(moved, [first.pk, third.pk])
+        self.assertEqual([pk for pk, reason in rejected], [second.pk, declined.pk])
+        self.assertEqual(BookCopy.objects.filter(status='r').count(), 2)
+        self.assertEqual(Borrowing.objects.get(pk=second.pk).status, 'p')
+
+
+class LifecycleAPITest(TestCase):
+    def setUp(self):
+        author = Author.objects.create(name='Author')
+        book = Book.objects.create(title='Book', author=author, isbn='1234567890123')
+        self.copy = BookCopy.objects.create(book=book, status='a', publisher='Publisher')
+        self.user = User.objects.create_user(username='reader', password='testpassword', is_staff=True)
+        self.borrowing = Borrowing.objects.create(borrower=self.user, book_copy=self.copy,
+                                                  start_date=date.today(), due_date=date.today())
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_update_status(self):
+        url = reverse('update-status', kwargs={'id': self.borrowing.id})
+        response = self.client.patch(url, {'status': 'r'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['status'], ['Cannot return a pending borrowing request!'])
+
+        response = self.client.patch(url, {'status': 'a', 'decline_reason': ''})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['status'], 'a')
+        self.copy.refresh_from_db()
+        self.assertEqual(self.copy.status, 'r')
+
+    def test_update_side_effects_run_after_commit(self):
+        Borrowing.objects.filter(pk=self.borrowing.pk).update(status='b')
+        BookCopy.objects.filter(pk=self.copy.pk).update(status='b')
+        waiting = User.objects.create_user(username='waiting', password='testpassword')
+        holds.join_queue(self.copy.book, waiting)
+
+        url = reverse('update-status', kwargs={'id': self.borrowing.id})
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.patch(url, {'status': 'r'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # the copy is handed to the hold queue once the transition is committed
+        self.assertFalse(Borrowing.objects.filter(borrower=waiting).exists())
+        with self.captureOnCommitCallbacks(execute=True):
+            for callback in callbacks:
+                callback()
+        self.assertEqual(Borrowing.objects.get(borrower=waiting).status, 'a')
+        self.copy.refresh_from_db()
+        self.assertEqual(self.copy.status, 'r')
+
+    def test_bulk_status(self):
+        url = reverse('borrowing-status-api')
+        response = self.client.post(url, {'borrowings': [self.borrowing.id], 'status': 'b'}, format='json')
+        self.assertEqual(response.data['updated'], [])
+        self.assertEqual(response.data['rejected'][0]['id'], self.borrowing.id)
+
+        response = self.client.post(url, {'borrowings': [self.borrowing.id], 'status': 'a'}, format='json')
+        self.assertEqual(response.data, {'updated': [self.borrowing.id], 'rejected': []})
+
+    def test_decline_view_updates_the_request(self):
+        self.client.force_login(self.user)
+        self.client.post(reverse('borrowing-decline', args=(self.borrowing.id,)), {'decline_reason': 'Lost'})
+        self.assertEqual(Borrowing.objects.count(), 1)
+        self.borrowing.refresh_from_db()
+        self.assertEqual((self.borrowing.status, self.borrowing.decline_reason), ('d', 'Lost'))
@@ -195,7 +195,7 @@ class BookModelTest(TestCase):
     def test_book_isbn_max_length(self):
         book = Book.objects.get(id=1)
         max_length = book._meta.get_field('isbn').max_length
-        self.assertEqual(max_length, 13)
+        self.assertEqual(max_length, 17)
     
     def test_book_display_genre(self):
         book = Book.objects.get(id=1)
@@ -0,0 +1,140 @@
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db.models import F
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from datetime import date, timedelta
+from catalog.models import Book, BookCopy, BookScore, Borrowing, Genre, Language, Review
+from catalog import ranking
+from catalog.checks import check_ranking_settings
+
+
+class RankingTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.users = [User.objects.create_user(username=f'user{i}', password='testpassword') for i in range(20)]
+        self.english = Language.objects.create(name='English')
+        self.fiction = Genre.objects.create(name='Fiction')
+        self.classic = Book.objects.create(title='Classic', summary='Summary', isbn='1000000000001',
+                                           language=self.english)
+        self.classic.genre.add(self.fiction)
+        self.newcomer = Book.objects.create(title='Newcomer', summary='Summary', isbn='1000000000002')
+
+    def review(self, book, user, point):
+        return Review.objects.create(book=book, user=user, point=point)
+
+    def test_single_review_does_not_beat_many_ratings(self):
+        for user in self.users:
+            self.review(self.classic, user, 4)
+        self.review(self.newcomer, self.users[0], 5)
+
+        books = ranking.top_rated(10)
+        self.assertEqual([book.title for book in books], ['Classic', 'Newcomer'])
+        self.assertEqual(books[0].avg_rating, 4)
+        self.assertEqual(books[1].avg_rating, 5)
+
+    def test_review_changes_update_score(self):
+        review = self.review(self.newcomer, self.users[0], 1)
+        self.assertEqual(BookScore.objects.get(book=self.newcomer).rating_sum, 1)
+        review.point = 5
+        review.save()
+        self.assertEqual(BookScore.objects.get(book=self.newcomer).rating_sum, 5)
+        review.delete()
+        self.assertEqual(BookScore.objects.get(book=self.newcomer).rating_count, 0)
+        self.assertEqual(ranking.top_rated(10), [])
+
+    def test_recent_loans_outweigh_old_ones(self):
+        today = date.today()
+        half_life = ranking.get_half_life()
+        for _ in range(3):
+            ranking.record_loan(self.classic.id, today - timedelta(days=half_life * 2))
+        for _ in range(2):
+            ranking.record_loan(self.newcomer.id, today)
+
+        books = ranking.most_borrowed(10)
+        self.assertEqual([book.title for book in books], ['Newcomer', 'Classic'])
+        self.assertAlmostEqual(books[0].borrow_score, 2)
+        self.assertAlmostEqual(books[1].borrow_score, 0.75)
+
+    @override_settings(CATALOG_BORROW_HALF_LIFE_DAYS=1)
+    def test_short_half_life_does_not_overflow(self):
+        today = date.today()
+        # scores left relative to the former fixed epoch
+        BookScore.objects.create(book=self.classic, borrow_score=2.0 ** 100, borrow_epoch=today - timedelta(days=100))
+        cache.clear()
+        ranking.record_loan(self.newcomer.id)
+        self.assertEqual(ranking.get_epoch(), today)
+        self.assertEqual(BookScore.objects.get(book=self.classic).borrow_epoch, today)
+        self.assertAlmostEqual(ranking.most_borrowed(10)[0].borrow_score, 1)
+        self.assertAlmostEqual(ranking.most_borrowed(10)[1].borrow_score, 1)
+
+        # years without renormalization
+        later = today + timedelta(days=5000)
+        ranking.record_loan(self.newcomer.id, later)
+        self.assertEqual(BookScore.objects.get(book=self.newcomer).borrow_epoch, later)
+        self.assertAlmostEqual(ranking.decayed(BookScore.objects.get(book=self.newcomer).borrow_score, later, later), 1)
+
+    def test_renormalize_keeps_decayed_scores(self):
+        long_ago = date.today() - timedelta(days=400)
+        for _ in range(3):
+            ranking.record_loan(self.classic.id, date.today() - timedelta(days=30))
+        before = ranking.most_borrowed(10)[0].borrow_score
+        BookScore.objects.update(borrow_score=F('borrow_score') * ranking.loan_weight(date.today(), long_ago),
+                                 borrow_epoch=long_ago)
+        self.assertAlmostEqual(ranking.most_borrowed(10)[0].borrow_score, before)
+        self.assertEqual(ranking.renormalize(), 1)
+        self.assertEqual(BookScore.objects.get().borrow_epoch, date.today())
+        self.assertAlmostEqual(ranking.most_borrowed(10)[0].borrow_score, before)
+
+    def test_half_life_setting_is_checked(self):
+        self.assertEqual(check_ranking_settings(None), [])
+        for value in (0, 0.5, -3, '30', None):
+            with self.subTest(value=value), override_settings(CATALOG_BORROW_HALF_LIFE_DAYS=value):
+                self.assertEqual([error.id for error in check_ranking_settings(None)], ['catalog.E001'])
+
+    def test_top_lists_per_genre_and_language(self):
+        self.review(self.classic, self.users[0], 3)
+        self.review(self.newcomer, self.users[0], 5)
+        self.assertEqual([book.title for book in ranking.top_rated(10, genre=self.fiction.id)], ['Classic'])
+        self.assertEqual([book.title for book in ranking.top_rated(10, language=self.english.id)], ['Classic'])
+
+    def test_rebuild_scores_matches_incremental_updates(self):
+        self.review(self.classic, self.users[0], 4)
+        self.review(self.newcomer, self.users[1], 2)
+        copy = BookCopy.objects.create(book=self.classic, status='a', publisher='Publisher')
+        Borrowing.objects.create(borrower=self.users[0], book_copy=copy, status='r',
+                                 start_date=date.today(), due_date=date.today())
+        Borrowing.objects.create(borrower=self.users[0], book_copy=copy, status='d',
+                                 start_date=date.today(), due_date=date.today())
+
+        self.assertEqual(ranking.rebuild_scores(), 2)
+        self.assertEqual([book.title for book in ranking.most_borrowed(10)], ['Classic'])
+        self.assertAlmostEqual(ranking.most_borrowed(10)[0].borrow_score, 1)
+        self.assertEqual([book.title for book in ranking.top_rated(10)], ['Classic', 'Newcomer'])
+
+    def test_start_borrowing_records_loan(self):
+        staff = User.objects.create_user(username='staff', password='testpassword', is_staff=True)
+        copy = BookCopy.objects.create(book=self.classic, status='r', publisher='Publisher')
+        borrowing = Borrowing.objects.create(borrower=self.users[0], book_copy=copy, status='a',
+                                             start_date=date.today(), due_date=date.today() + timedelta(days=7))
+        self.client.force_login(staff)
+        self.client.post(reverse('borrowing-start', args=[borrowing.id]))
+        self.assertAlmostEqual(ranking.most_borrowed(10)[0].borrow_score, 1)
+
+    def test_ranking_api(self):
+        self.review(self.classic, self.users[0], 4)
+        ranking.record_loan(self.newcomer.id)
+        client = APIClient()
+
+        response = client.get(reverse('rankings-api'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([book['title'] for book in response.data], ['Classic'])
+
+        response = client.get(reverse('rankings-api'), {'kind': 'borrowed'})
+        self.assertEqual([book['title'] for book in response.data], ['Newcomer'])
+
+        response = client.get(reverse('rankings-api'), {'limit': 0})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
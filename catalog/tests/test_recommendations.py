@@ -0,0 +1,119 @@
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from datetime import date, timedelta
+from io import StringIO
+from unittest import skipIf
+from catalog.models import Author, Book, BookCopy, BookRecommendation, BorrowedBook, Borrowing
+from catalog import recommendations
+
+
+class RecommendationTest(TestCase):
+    def setUp(self):
+        author = Author.objects.create(name='Test Author')
+        self.users = [User.objects.create_user(username=f'user{i}', password='testpassword') for i in range(4)]
+        self.books = [Book.objects.create(title=f'Book {i}', summary='Summary', isbn=f'100000000000{i}', author=author)
+                      for i in range(4)]
+        self.copies = [BookCopy.objects.create(book=book, status='a', publisher='Publisher') for book in self.books]
+
+    def lend(self, user, book, status='r'):
+        return Borrowing.objects.create(borrower=self.users[user], book_copy=self.copies[book], status=status,
+                                        start_date=date.today(), due_date=date.today() + timedelta(days=7))
+
+    def stored(self):
+        return {book.id: [(rec.recommended_id, round(rec.score, 6))
+                          for rec in BookRecommendation.objects.filter(book=book).order_by('rank')]
+                for book in self.books}
+
+    def test_cosine_similarity_ranking(self):
+        self.lend(0, 0); self.lend(0, 1)
+        self.lend(1, 0); self.lend(1, 1); self.lend(1, 2)
+        self.lend(2, 0); self.lend(2, 3)
+        self.lend(3, 2, status='p')  # not a loan
+        self.assertEqual(recommendations.rebuild_recommendations(), 4)
+
+        books = recommendations.get_recommendations(self.books[0].id)
+        self.assertEqual([book.title for book in books], ['Book 1', 'Book 2', 'Book 3'])
+        self.assertAlmostEqual(books[0].score, 2 / (3 * 2) ** 0.5)
+        self.assertEqual([book.title for book in recommendations.get_recommendations(self.books[3].id)], ['Book 0'])
+
+    def test_python_computation_keeps_top_k(self):
+        pairs = {(user, book) for user in range(30) for book in range(12) if (user * 7 + book * 3) % 5 < 2}
+        result = recommendations.compute_python(pairs, 3)
+        self.assertEqual(set(result), set(range(12)))
+        self.assertTrue(all(len(neighbours) == 3 for neighbours in result.values()))
+
+    @skipIf(recommendations.np is None, 'numpy/scipy not installed')
+    def test_python_and_numpy_computations_agree(self):
+        # many tied scores, the book id order has to break them the same way
+        pairs = {(user, book) for user in range(30) for book in range(12) if (user * 7 + book * 3) % 5 < 2}
+        pairs |= {(100 + user, book) for user in range(5) for book in range(user, user + 4)}
+        for k in (1, 3, 20):
+            expected = recommendations.compute_python(pairs, k)
+            result = recommendations.compute_numpy(pairs, k)
+            self.assertEqual(set(result), set(expected))
+            for book, neighbours in expected.items():
+                self.assertEqual([other for other, _ in result[book]], [other for other, _ in neighbours])
+                for (_, score), (_, expected_score) in zip(result[book], neighbours):
+                    self.assertAlmostEqual(score, expected_score)
+
+    def test_incremental_update_matches_rebuild(self):
+        self.lend(0, 0); self.lend(0, 1)
+        self.lend(1, 1)
+        recommendations.rebuild_recommendations()
+
+        self.lend(1, 2)
+        self.lend(2, 0); self.lend(2, 2); self.lend(2, 3)
+        self.lend(0, 1)  # borrowed again, already counted
+        self.assertGreater(recommendations.update_recommendations(), 0)
+        incremental = self.stored()
+        self.assertEqual(recommendations.update_recommendations(), 0)
+
+        recommendations.rebuild_recommendations()
+        self.assertEqual(incremental, self.stored())
+
+    def test_recompute_books_batches_the_queries(self):
+        self.lend(0, 0); self.lend(0, 1)
+        self.lend(1, 0); self.lend(1, 1); self.lend(1, 2)
+        self.lend(2, 0); self.lend(2, 3)
+        recommendations.rebuild_recommendations()
+        expected = recommendations.compute_python(recommendations.loan_pairs(), 10)
+        # the readers of books 2 and 3 come from the second query
+        book_ids = [self.books[0].id, self.books[1].id]
+        with self.assertNumQueries(2):
+            result = recommendations.recompute_books(book_ids, 10)
+        self.assertEqual(result, {book_id: expected.get(book_id, []) for book_id in book_ids})
+
+    def test_late_commit_is_read_again(self):
+        self.lend(0, 0); self.lend(0, 1)
+        recommendations.rebuild_recommendations()
+        # saved before the watermark, committed after the last run
+        late = self.lend(1, 1)
+        self.lend(1, 2)
+        late.updated_at -= timedelta(seconds=10)
+        Borrowing.objects.filter(pk=late.pk).update(updated_at=late.updated_at)
+        recommendations.update_recommendations()
+        self.assertTrue(BorrowedBook.objects.filter(user=self.users[1], book=self.books[1]).exists())
+        self.assertIn(self.books[2].id, [other for other, _ in self.stored()[self.books[1].id]])
+
+    def test_detail_page_and_api(self):
+        self.lend(0, 0); self.lend(0, 1)
+        out = StringIO()
+        call_command('recommend_books', stdout=out)
+        self.assertIn('2 book(s)', out.getvalue())
+
+        response = self.client.get(reverse('book-detail', args=[self.books[0].id]))
+        self.assertContains(response, 'Readers also borrowed')
+        self.assertEqual(response.context['recommended_books'], [self.books[1]])
+
+        response = APIClient().get(reverse('book-recommendations', args=[self.books[1].id]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([book['title'] for book in response.data], ['Book 0'])
+        self.assertAlmostEqual(response.data[0]['score'], 1)
+
+        response = APIClient().get(reverse('book-recommendations', args=[999]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
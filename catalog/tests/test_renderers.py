@@ -0,0 +1,112 @@
+import datetime
+import gzip
+import json
+import logging
+import uuid
+import zlib
+from decimal import Decimal
+
+from asgiref.sync import iscoroutinefunction
+from django.core.handlers.base import BaseHandler
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from catalog import middleware, renderers
+from catalog.middleware import CompressionMiddleware, accepted_encodings
+from catalog.models import Author, Book
+from catalog.renderers import MessagePackRenderer, ORJSONRenderer
+
+
+class RendererTest(TestCase):
+    data = {
+        'title': 'Book', 'count': 3, 'score': Decimal('4.5'), 'id': uuid.UUID(int=1),
+        'day': datetime.date(2024, 1, 2), 'genres': [1, 2], 'facets': {1: 'Fiction'}, 'empty': None,
+    }
+
+    def test_orjson_matches_json_renderer(self):
+        self.assertEqual(json.loads(ORJSONRenderer().render(self.data)), json.loads(JSONRenderer().render(self.data)))
+        self.assertEqual(ORJSONRenderer().render(None), b'')
+
+    def test_msgpack(self):
+        if renderers.msgpack is None:
+            self.skipTest('msgpack not installed')
+        unpacked = renderers.msgpack.unpackb(MessagePackRenderer().render(self.data), strict_map_key=False)
+        self.assertEqual(unpacked['id'], str(uuid.UUID(int=1)))
+        self.assertEqual(unpacked['day'], '2024-01-02')
+
+    def test_api_content_negotiation(self):
+        response = APIClient().get(reverse('search-book'), HTTP_ACCEPT='application/msgpack')
+        if renderers.msgpack is None:
+            self.assertEqual(response.status_code, 406)
+        else:
+            self.assertEqual(response['Content-Type'], 'application/msgpack')
+        response = APIClient().get(reverse('search-book'))
+        self.assertEqual(response['Content-Type'], 'application/json')
+
+
+@override_settings(CATALOG_COMPRESSION_MIN_SIZE=1024)
+class CompressionMiddlewareTest(TestCase):
+    def compress(self, response, accept_encoding='gzip, deflate'):
+        request = RequestFactory().get('/', HTTP_ACCEPT_ENCODING=accept_encoding)
+        return CompressionMiddleware(lambda request: response)(request)
+
+    def test_accepted_encodings(self):
+        self.assertEqual(accepted_encodings('gzip;q=1.0, br;q=0, identity'), {'gzip', 'identity'})
+        self.assertEqual(accepted_encodings(''), set())
+
+    def test_large_json_is_compressed(self):
+        body = json.dumps([{'title': f'Book {i}'} for i in range(200)]).encode()
+        response = self.compress(HttpResponse(body, content_type='application/json'))
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertEqual(gzip.decompress(response.content), body)
+        self.assertEqual(int(response['Content-Length']), len(response.content))
+
+    def test_small_html_and_unaccepted_responses_are_left_alone(self):
+        small = self.compress(HttpResponse(b'{}', content_type='application/json'))
+        html = self.compress(HttpResponse(b'<p>x</p>' * 500, content_type='text/html'))
+        identity = self.compress(HttpResponse(b'[1]' * 500, content_type='application/json'), 'identity')
+        for response in (small, html, identity):
+            self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_brotli_preferred_when_installed(self):
+        response = self.compress(HttpResponse(b'[1]' * 500, content_type='application/json'), 'gzip, br')
+        self.assertEqual(response['Content-Encoding'], 'br' if middleware.brotli else 'gzip')
+
+    def test_streaming_chunks_are_flushed(self):
+        lines = [json.dumps({'id': i}).encode() + b'\n' for i in range(3)]
+        response = self.compress(StreamingHttpResponse(iter(lines), content_type='application/x-ndjson'))
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        chunks = list(response.streaming_content)
+        # each line can be decoded as soon as its chunk arrives
+        self.assertEqual([decompressor.decompress(chunk) for chunk in chunks[:3]], lines)
+
+    async def test_async(self):
+        body = json.dumps([{'title': f'Book {i}'} for i in range(200)]).encode()
+
+        async def get_response(request):
+            return HttpResponse(body, content_type='application/json')
+        compression = CompressionMiddleware(get_response)
+        self.assertTrue(iscoroutinefunction(compression))
+        response = await compression(RequestFactory().get('/', HTTP_ACCEPT_ENCODING='gzip'))
+        self.assertEqual(gzip.decompress(response.content), body)
+
+    def test_not_adapted_under_asgi(self):
+        with self.assertLogs('django.request', 'DEBUG') as logs:
+            BaseHandler().load_middleware(is_async=True)
+            # at least one line for assertLogs
+            logging.getLogger('django.request').debug('Middleware loaded')
+        self.assertFalse([line for line in logs.output if 'CompressionMiddleware' in line])
+
+    def test_api_response(self):
+        author = Author.objects.create(name='Test Author')
+        for index in range(40):
+            Book.objects.create(title=f'Book {index}', summary='Summary ' * 10, author=author,
+                                isbn=f'10000000000{index:02}')
+        response = APIClient().get(reverse('search-book'), HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(len(json.loads(gzip.decompress(response.content))), 40)
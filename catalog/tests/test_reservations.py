@@ -0,0 +1,88 @@
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from datetime import date, timedelta
+from catalog.models import Book, BookCopy, Borrowing
+from catalog.reservations import IntervalIndex, get_book_calendar
+
+def day(n):
+    return date(2030, 1, 1) + timedelta(days=n)
+
+
+class IntervalIndexTest(TestCase):
+    def setUp(self):
+        self.index = IntervalIndex([(day(10), day(12)), (day(0), day(30)), (day(40), day(45)), (day(20), day(22))])
+
+    def test_overlapping(self):
+        self.assertEqual(self.index.overlapping(day(11), day(21)),
+                         [(day(0), day(30)), (day(10), day(12)), (day(20), day(22))])
+        self.assertEqual(self.index.overlapping(day(31), day(39)), [])
+        self.assertEqual(self.index.overlapping(day(45), day(50)), [(day(40), day(45))])
+
+    def test_is_free(self):
+        self.assertTrue(self.index.is_free(day(31), day(39)))
+        self.assertFalse(self.index.is_free(day(30), day(31)))
+
+    def test_free_ranges(self):
+        self.assertEqual(self.index.free_ranges(day(25), day(50)),
+                         [(day(31), day(39)), (day(46), day(50))])
+        self.assertEqual(IntervalIndex().free_ranges(day(0), day(5)), [(day(0), day(5))])
+
+
+class BookCalendarTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.book = Book.objects.create(title='Test Book', summary='Test Summary', isbn='1234567890123')
+        self.copy1 = BookCopy.objects.create(book=self.book, status='a', publisher='Test Publisher')
+        self.copy2 = BookCopy.objects.create(book=self.book, status='a', publisher='Test Publisher')
+        self.today = date.today()
+        Borrowing.objects.create(borrower=self.user, book_copy=self.copy1, status='a',
+                                 start_date=self.today, due_date=self.today + timedelta(days=5))
+        # finished loans are not part of the calendar
+        Borrowing.objects.create(borrower=self.user, book_copy=self.copy2, status='r',
+                                 start_date=self.today, due_date=self.today + timedelta(days=5))
+
+    def test_available_copies(self):
+        calendar = get_book_calendar(self.book.id)
+        self.assertEqual(calendar.available_copies(self.today, self.today + timedelta(days=2)), [self.copy2.id])
+        self.assertEqual(len(calendar.available_copies(self.today + timedelta(days=6), self.today + timedelta(days=7))), 2)
+
+    def test_calendar_is_invalidated_on_change(self):
+        get_book_calendar(self.book.id)
+        self.copy2.status = 'm'
+        self.copy2.save()
+        calendar = get_book_calendar(self.book.id)
+        self.assertEqual(calendar.available_copies(self.today, self.today + timedelta(days=2)), [])
+        self.assertEqual(calendar.free_ranges(self.today, self.today + timedelta(days=10)),
+                         [(self.today + timedelta(days=6), self.today + timedelta(days=10))])
+
+    def test_availability_api(self):
+        url = reverse('book-availability', args=(self.book.id,))
+        response = APIClient().get(url, {'start': self.today, 'end': self.today + timedelta(days=9)})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['free'], [{'start': self.today, 'end': self.today + timedelta(days=9)}])
+        booked = {copy['book_copy']: copy['booked'] for copy in response.data['copies']}
+        self.assertEqual(booked[self.copy1.id], [{'start': self.today, 'end': self.today + timedelta(days=5)}])
+        self.assertEqual(booked[self.copy2.id], [])
+
+    def test_availability_api_invalid_range(self):
+        url = reverse('book-availability', args=(self.book.id,))
+        response = APIClient().get(url, {'start': self.today, 'end': self.today - timedelta(days=1)})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_borrow_book_api_rejects_overlap(self):
+        data = {
+            'borrower': self.user.id,
+            'book_copy': self.copy1.id,
+            'start_date': self.today + timedelta(days=3),
+            'due_date': self.today + timedelta(days=8),
+        }
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.post(reverse('borrow-book'), data)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
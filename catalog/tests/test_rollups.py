@@ -0,0 +1,110 @@
+from django.contrib.auth.models import User, Permission
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from datetime import date, timedelta
+from io import StringIO
+from catalog.models import Book, BookCopy, Borrowing, CirculationRollup, Genre, Language
+from catalog.rollups import update_rollups
+
+
+class CirculationRollupTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.language = Language.objects.create(name='English')
+        self.genre1 = Genre.objects.create(name='Fiction')
+        self.genre2 = Genre.objects.create(name='Drama')
+        self.book = Book.objects.create(title='Test Book', summary='Test Summary', isbn='1234567890123',
+                                        language=self.language)
+        self.book.genre.add(self.genre1, self.genre2)
+        self.book_copy = BookCopy.objects.create(book=self.book, status='a', publisher='Test Publisher')
+        self.start = date.today() - timedelta(days=10)
+        self.month = self.start.replace(day=1)
+
+    def borrow(self, status, due_in=5):
+        return Borrowing.objects.create(borrower=self.user, book_copy=self.book_copy, status=status,
+                                        start_date=self.start, due_date=self.start + timedelta(days=due_in))
+
+    def rollup(self, dimension, key):
+        return CirculationRollup.objects.get(dimension=dimension, key=key, month=self.month)
+
+    def test_rollups_by_dimension(self):
+        self.borrow('r')  # returned 10 days after start, 5 days late
+        self.borrow('d')
+        self.borrow('b')
+        self.assertEqual(update_rollups(), 3)
+
+        for dimension, key in (('book', self.book.id), ('language', self.language.id),
+                               ('genre', self.genre1.id), ('genre', self.genre2.id)):
+            rollup = self.rollup(dimension, key)
+            self.assertEqual((rollup.requests, rollup.declined, rollup.loans, rollup.returned), (3, 1, 2, 1))
+            self.assertEqual(rollup.average_loan_days, 10)
+            self.assertEqual(rollup.overdue_rate, 1)
+            self.assertAlmostEqual(rollup.decline_rate, 1 / 3)
+
+    def test_incremental_update_applies_status_changes_once(self):
+        borrowing = self.borrow('p', due_in=20)
+        update_rollups()
+        self.assertEqual(update_rollups(), 0)
+        borrowing.status = 'b'
+        borrowing.save()
+        borrowing.status = 'r'
+        borrowing.save()
+        self.assertEqual(update_rollups(), 1)
+
+        rollup = self.rollup('book', self.book.id)
+        self.assertEqual((rollup.requests, rollup.loans, rollup.returned, rollup.overdue), (1, 1, 1, 0))
+
+    def test_late_commit_is_rolled_up(self):
+        update_rollups()
+        self.borrow('b')
+        update_rollups()
+        # saved before the watermark, committed after the last run
+        late = self.borrow('p')
+        watermark = Borrowing.objects.exclude(pk=late.pk).get().updated_at
+        Borrowing.objects.filter(pk=late.pk).update(updated_at=watermark - timedelta(seconds=10))
+        self.assertEqual(update_rollups(), 1)
+        self.assertEqual(self.rollup('book', self.book.id).requests, 2)
+
+    def test_deleted_borrowing_is_subtracted(self):
+        self.borrow('r')
+        self.borrow('b').delete()  # never rolled up
+        deleted = [self.borrow('r'), self.borrow('d')]
+        update_rollups()
+        deleted[0].delete()
+        Borrowing.objects.filter(pk=deleted[1].pk).delete()
+
+        for dimension, key in (('book', self.book.id), ('language', self.language.id), ('genre', self.genre1.id)):
+            rollup = self.rollup(dimension, key)
+            self.assertEqual((rollup.requests, rollup.loans, rollup.returned, rollup.loan_days), (1, 1, 1, 10))
+        self.assertEqual(update_rollups(), 0)
+
+    def test_backfill_command_matches_incremental(self):
+        for borrowing_status in ('r', 'd', 'b', 'p', 'r'):
+            self.borrow(borrowing_status)
+        update_rollups()
+        expected = list(CirculationRollup.objects.order_by('dimension', 'key').values())
+        call_command('rollup_circulation', '--backfill', '--chunk-size', '2', stdout=StringIO())
+        self.assertEqual([{**row, 'id': None} for row in CirculationRollup.objects.order_by('dimension', 'key').values()],
+                         [{**row, 'id': None} for row in expected])
+
+    def test_report_api_and_view(self):
+        self.borrow('r')
+        update_rollups()
+        staff = User.objects.create_user(username='staff', password='testpassword', is_staff=True)
+        staff.user_permissions.add(Permission.objects.get(codename='can_view_all_borrowing'))
+
+        client = APIClient()
+        client.force_authenticate(staff)
+        response = client.get(reverse('circulation-report-api'),
+                              {'dimension': 'genre', 'month': self.month.strftime('%Y-%m')})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual({row['name'] for row in response.data}, {'Fiction', 'Drama'})
+
+        self.client.force_login(staff)
+        response = self.client.get(reverse('circulation-report'), {'month': self.month.strftime('%Y-%m')})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['rollup_list'][0].name, 'Test Book')
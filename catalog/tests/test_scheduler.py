@@ -0,0 +1,216 @@
+import datetime
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from datetime import date, timedelta
+from unittest.mock import patch
+from catalog import scheduler
+from catalog.models import Author, Book, BookCopy, Borrowing, ScheduledJob, Task, UserBorrowingStats
+from catalog.tests.test_views import run_queued_tasks
+
+
+def local(*args):
+    return timezone.make_aware(datetime.datetime(*args))
+
+
+class ScheduleTest(TestCase):
+    def test_interval(self):
+        schedule = scheduler.parse_schedule('every 15m')
+        self.assertEqual(schedule.next_after(local(2026, 1, 1, 10, 0)), local(2026, 1, 1, 10, 15))
+        self.assertEqual(scheduler.parse_schedule('every 2d').interval, timedelta(days=2))
+
+    def test_cron(self):
+        daily = scheduler.parse_schedule('0 9 * * *')
+        self.assertEqual(daily.next_after(local(2026, 1, 1, 8, 59, 30)), local(2026, 1, 1, 9, 0))
+        self.assertEqual(daily.next_after(local(2026, 1, 1, 9, 0)), local(2026, 1, 2, 9, 0))
+
+        # 2026-01-01 is a Thursday, Sunday is 0 or 7
+        weekly = scheduler.parse_schedule('*/30 8-9 * * 7')
+        self.assertEqual(weekly.next_after(local(2026, 1, 1, 12, 0)), local(2026, 1, 4, 8, 0))
+        self.assertEqual(weekly.next_after(local(2026, 1, 4, 9, 10)), local(2026, 1, 4, 9, 30))
+        # day and weekday restricted: either matches
+        either = scheduler.parse_schedule('0 0 15 * 1')
+        self.assertEqual(either.next_after(local(2026, 1, 1, 12, 0)), local(2026, 1, 5, 0, 0))
+        self.assertEqual(scheduler.parse_schedule('0 0 29 2 *').next_after(local(2026, 1, 1)),
+                         local(2028, 2, 29))
+
+    def test_invalid(self):
+        for text in ('every 0m', 'every 5w', '0 9 * *', '60 * * * *', '0 9 31 2 *', '5-1 * * * *', 'x * * * *'):
+            with self.subTest(text=text), self.assertRaises(ValueError):
+                scheduler.parse_schedule(text)
+
+    def test_next_run_skips_missed_runs(self):
+        schedule = scheduler.parse_schedule('every 1m')
+        started = local(2026, 1, 1, 10, 0)
+        self.assertEqual(scheduler.next_run(schedule, started, started + timedelta(seconds=5)),
+                         local(2026, 1, 1, 10, 1))
+        self.assertEqual(scheduler.next_run(schedule, started, started + timedelta(minutes=3)),
+                         local(2026, 1, 1, 10, 4))
+
+
+class SchedulerTest(TestCase):
+    def setUp(self):
+        self.calls = []
+        patcher = patch.dict(scheduler.JOBS, {'test_job': (self.calls.append, 'every 1h')}, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # keep catalog.jobs from registering the built-in jobs into the patched registry
+        patcher = patch('catalog.scheduler.get_jobs', lambda: scheduler.JOBS)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        scheduler.sync_jobs()
+
+    def make_due(self):
+        ScheduledJob.objects.update(next_run_at=timezone.now() - timedelta(seconds=1))
+
+    def test_sync_schedules_new_jobs(self):
+        scheduled = ScheduledJob.objects.get()
+        self.assertEqual((scheduled.name, scheduled.schedule), ('test_job', 'every 1h'))
+        self.assertGreater(scheduled.next_run_at, timezone.now() + timedelta(minutes=59))
+        # a schedule changed in the admin is kept
+        ScheduledJob.objects.update(schedule='every 5m')
+        scheduler.sync_jobs()
+        self.assertEqual(ScheduledJob.objects.get().schedule, 'every 5m')
+        self.assertEqual(scheduler.run_due_jobs('worker'), [])
+
+    def test_run_due_job(self):
+        self.make_due()
+        runs = scheduler.run_due_jobs('worker')
+        self.assertEqual([run.name for run in runs], ['test_job'])
+        self.assertEqual(len(self.calls), 1)
+
+        scheduled = ScheduledJob.objects.get()
+        self.assertEqual((scheduled.last_status, scheduled.runs, scheduled.locked_by), ('ok', 1, ''))
+        self.assertIsNone(scheduled.locked_until)
+        self.assertGreater(scheduled.next_run_at, timezone.now() + timedelta(minutes=59))
+        self.assertEqual(scheduler.run_due_jobs('worker'), [])
+
+    def test_one_worker_per_job(self):
+        self.make_due()
+        ScheduledJob.objects.update(locked_by='other', locked_until=timezone.now() + timedelta(minutes=1))
+        self.assertEqual(scheduler.run_due_jobs('worker'), [])
+        self.assertIsNone(scheduler.run_job('test_job', 'worker', force=True))
+
+        # the lease of a stopped worker expires
+        ScheduledJob.objects.update(locked_until=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(len(scheduler.run_due_jobs('worker')), 1)
+
+    def test_chunks_and_lost_lease(self):
+        def chunked(run):
+            run.chunk(3)
+            run.chunk(2)
+            ScheduledJob.objects.update(locked_by='other')
+            run.chunk(1)
+        scheduler.JOBS['test_job'] = (chunked, 'every 1h')
+        with self.assertLogs('catalog.scheduler', 'WARNING'):
+            self.assertIsNone(scheduler.run_job('test_job', 'worker', force=True))
+        # the metrics are left to the worker holding the lease
+        self.assertEqual(ScheduledJob.objects.get().runs, 0)
+
+        scheduler.JOBS['test_job'] = (lambda run: (run.chunk(3), run.chunk(2)), 'every 1h')
+        ScheduledJob.objects.update(locked_by='', locked_until=None)
+        run = scheduler.run_job('test_job', 'worker', force=True)
+        scheduled = ScheduledJob.objects.get()
+        self.assertEqual((run.processed, run.chunks), (5, 2))
+        self.assertEqual((scheduled.last_processed, scheduled.last_chunks, scheduled.total_processed), (5, 2, 5))
+
+    def test_failure_is_recorded(self):
+        def failing(run):
+            raise RuntimeError('Broken')
+        scheduler.JOBS['test_job'] = (failing, 'every 1h')
+        self.make_due()
+        with self.assertLogs('catalog.scheduler', 'ERROR'):
+            run, = scheduler.run_due_jobs('worker')
+        scheduled = ScheduledJob.objects.get()
+        self.assertEqual((scheduled.last_status, scheduled.last_error), ('failed', 'RuntimeError: Broken'))
+        self.assertEqual((scheduled.runs, scheduled.failures, scheduled.locked_by), (1, 1, ''))
+
+    def test_disabled(self):
+        self.make_due()
+        ScheduledJob.objects.update(enabled=False)
+        self.assertEqual(scheduler.run_due_jobs('worker'), [])
+        self.assertIsNone(scheduler.seconds_until_next_run())
+
+
+@override_settings(CATALOG_PENDING_EXPIRY_DAYS=0, CATALOG_RESERVATION_PICKUP_DAYS=3)
+class MaintenanceJobsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = Author.objects.create(name='Author')
+        cls.book = Book.objects.create(title='Book', author=author, isbn='1234567890123')
+        cls.user = User.objects.create_user(username='reader', password='testpassword', email='reader@example.com')
+
+    def create_borrowing(self, status, copy_status, days_ago):
+        copy = BookCopy.objects.create(book=self.book, status=copy_status, publisher='Publisher')
+        start_date = date.today() - timedelta(days=days_ago)
+        return Borrowing.objects.create(borrower=self.user, book_copy=copy, status=status,
+                                        start_date=start_date, due_date=start_date + timedelta(days=7))
+
+    def run_job(self, name):
+        scheduler.sync_jobs()
+        return scheduler.run_job(name, 'worker', force=True)
+
+    @override_settings(CATALOG_SCHEDULER_CHUNK_SIZE=2)
+    def test_expire_and_cancel(self):
+        stale = [self.create_borrowing('p', 'a', 1) for _ in range(3)]
+        fresh = self.create_borrowing('p', 'a', 0)
+        uncollected = [self.create_borrowing('a', 'r', 4) for _ in range(3)]
+        collectable = self.create_borrowing('a', 'r', 2)
+
+        run = self.run_job('expire_pending_borrowings')
+        self.assertEqual((run.processed, run.chunks), (3, 2))
+        run = self.run_job('cancel_uncollected_reservations')
+        self.assertEqual(run.processed, 3)
+
+        statuses = dict(Borrowing.objects.values_list('id', 'status'))
+        self.assertEqual({statuses[borrowing.id] for borrowing in stale + uncollected}, {'c'})
+        self.assertEqual((statuses[fresh.id], statuses[collectable.id]), ('p', 'a'))
+        copy_statuses = dict(BookCopy.objects.values_list('id', 'status'))
+        self.assertEqual({copy_statuses[borrowing.book_copy_id] for borrowing in uncollected}, {'a'})
+        self.assertEqual(copy_statuses[collectable.book_copy_id], 'r')
+        stats = UserBorrowingStats.objects.get(user=self.user)
+        self.assertEqual((stats.pending, stats.active), (1, 1))
+
+    def test_overdue_reminders(self):
+        self.create_borrowing('b', 'b', 10)
+        self.create_borrowing('b', 'b', 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            run = self.run_job('send_overdue_reminders')
+            # run again the same day, the reminder is queued once
+            self.run_job('send_overdue_reminders')
+        self.assertEqual(run.processed, 1)
+        self.assertEqual(Task.objects.filter(name='send_email').count(), 1)
+        run_queued_tasks()
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['reader@example.com'])
+
+    def test_reconcile_borrowing_stats(self):
+        self.create_borrowing('b', 'b', 10)
+        self.create_borrowing('p', 'a', 0)
+        UserBorrowingStats.objects.filter(user=self.user).update(pending=5, active=0)
+        run = self.run_job('reconcile_borrowing_stats')
+        self.assertEqual(run.processed, 1)
+        stats = UserBorrowingStats.objects.get(user=self.user)
+        self.assertEqual((stats.pending, stats.active, stats.overdue, stats.lifetime), (1, 1, 1, 1))
+        self.assertEqual(self.run_job('reconcile_borrowing_stats').processed, 0)
+
+    def test_command(self):
+        self.create_borrowing('p', 'a', 1)
+        out = StringIO()
+        call_command('run_scheduler', '--job', 'expire_pending_borrowings', stdout=out)
+        self.assertIn('expire_pending_borrowings: 1 row(s)', out.getvalue())
+
+        out = StringIO()
+        call_command('run_scheduler', '--list', stdout=out)
+        self.assertIn('expire_pending_borrowings [every 1h]: next', out.getvalue())
+        self.assertIn('send_overdue_reminders [0 9 * * *]', out.getvalue())
+
+        ScheduledJob.objects.update(next_run_at=timezone.now() - timedelta(seconds=1))
+        out = StringIO()
+        call_command('run_scheduler', '--once', stdout=out)
+        self.assertEqual(ScheduledJob.objects.filter(runs__gt=0).count(), ScheduledJob.objects.count())
@@ -0,0 +1,108 @@
+import datetime
+from io import StringIO
+
+from django.core import mail
+from django.core.management import call_command
+from django.contrib.auth.models import User
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from unittest.mock import patch
+from catalog import taskqueue
+from catalog.models import Task
+
+
+def email(subject='Subject'):
+    return {'subject': subject, 'message': 'Message', 'recipients': ['reader@example.com']}
+
+
+@override_settings(CATALOG_TASK_RETRY_DELAY=10, CATALOG_TASK_MAX_RETRY_DELAY=30)
+class TaskQueueTest(TestCase):
+    def test_enqueued_on_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            taskqueue.enqueue('send_email', email())
+            self.assertFalse(Task.objects.exists())
+        callbacks[0]()
+        task = Task.objects.get()
+        self.assertEqual((task.name, task.status, task.kwargs), ('send_email', 'q', email()))
+
+        with self.assertRaises(ValueError):
+            taskqueue.enqueue('unknown', {})
+        with self.assertRaises(TypeError):
+            taskqueue.enqueue('send_email', {'recipients': object()})
+
+    def test_idempotency_key(self):
+        first = taskqueue.create_task('send_email', email(), key='welcome-1')
+        second = taskqueue.create_task('send_email', email('Other'), key='welcome-1')
+        self.assertEqual(first.pk, second.pk)
+        taskqueue.create_task('send_email', email())
+        taskqueue.create_task('send_email', email())
+        self.assertEqual(Task.objects.count(), 3)
+
+    def test_run(self):
+        task = taskqueue.create_task('send_email', email())
+        taskqueue.create_task('send_email', email(), delay=60)
+        self.assertEqual(taskqueue.claim('worker', 10), [task.pk])
+        # claimed, not claimable by another worker
+        self.assertEqual(taskqueue.claim('other', 10), [])
+        self.assertEqual(taskqueue.execute_task(task.pk, 'other'), None)
+
+        self.assertEqual(taskqueue.execute_task(task.pk, 'worker'), 'd')
+        task.refresh_from_db()
+        self.assertEqual((task.status, task.attempts, task.result, task.locked_by), ('d', 1, 1, ''))
+        self.assertEqual(mail.outbox[0].subject, 'Subject')
+
+    def test_retry_with_backoff(self):
+        task = taskqueue.create_task('send_email', email())
+        Task.objects.filter(pk=task.pk).update(max_attempts=3)
+        delays = []
+        with patch('catalog.tasks.send_mail', side_effect=ConnectionRefusedError('SMTP down')), \
+                self.assertLogs('catalog.taskqueue', 'ERROR'):
+            for expected in ('q', 'q', 'f'):
+                Task.objects.filter(pk=task.pk).update(run_at=timezone.now())
+                self.assertEqual(taskqueue.claim('worker', 1), [task.pk])
+                before = timezone.now()
+                self.assertEqual(taskqueue.execute_task(task.pk, 'worker'), expected)
+                task.refresh_from_db()
+                delays.append(round((task.run_at - before).total_seconds()))
+        self.assertEqual(delays[:2], [10, 20])
+        self.assertEqual((task.attempts, task.last_error), (3, 'ConnectionRefusedError: SMTP down'))
+        self.assertEqual(taskqueue.retry_delay(5), datetime.timedelta(seconds=30))
+
+    def test_expired_lease_is_taken_over(self):
+        task = taskqueue.create_task('send_email', email())
+        taskqueue.claim('stopped', 1)
+        self.assertEqual(taskqueue.claim('worker', 1), [])
+        Task.objects.filter(pk=task.pk).update(locked_until=timezone.now() - datetime.timedelta(seconds=1))
+        self.assertEqual(taskqueue.claim('worker', 1), [task.pk])
+        self.assertEqual(taskqueue.execute_task(task.pk, 'worker'), 'd')
+        # the stopped worker lost the task
+        self.assertIsNone(taskqueue.finish(task.pk, 'stopped', status='d'))
+
+    def test_status_api(self):
+        task = taskqueue.create_task('send_email', email())
+        client = APIClient()
+        user = User.objects.create_user(username='librarian', password='testpassword')
+        client.force_authenticate(user)
+        self.assertEqual(client.get(reverse('task-status', args=(task.pk,))).status_code,
+                         status.HTTP_403_FORBIDDEN)
+
+        user.is_staff = True
+        response = client.get(reverse('task-status', args=(task.pk,)))
+        self.assertEqual((response.data['name'], response.data['status']), ('send_email', 'q'))
+        response = client.get(reverse('task-queue'))
+        self.assertEqual((response.data['queued'], response.data['done']), (1, 0))
+
+
+class TaskWorkerTest(TransactionTestCase):
+    def test_thread_pool(self):
+        tasks = [taskqueue.create_task('send_email', email(f'Subject {index}')) for index in range(5)]
+        out = StringIO()
+        call_command('run_tasks', '--pool', 'thread', '--concurrency', '2', '--burst', stdout=out)
+        self.assertEqual(Task.objects.filter(status='d').count(), len(tasks))
+        self.assertEqual(sorted(message.subject for message in mail.outbox),
+                         [f'Subject {index}' for index in range(5)])
+        self.assertEqual(out.getvalue().count(': done'), len(tasks))
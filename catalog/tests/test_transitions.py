@@ -0,0 +1,167 @@
+import datetime
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.contrib.auth.models import User
+from django.core.handlers.base import BaseHandler
+from django.db import DatabaseError, NotSupportedError, connection, transaction
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from datetime import date
+from catalog import transitions
+from catalog.middleware import TransitionLogMiddleware
+from catalog.models import Author, Book, BookCopy, Borrowing, BorrowingTransition, Hold
+
+
+def log_of(borrowing):
+    return [(item.from_status, item.to_status) for item in transitions.timeline(borrowing.pk)]
+
+
+class TransitionLogTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = Author.objects.create(name='Author')
+        cls.book = Book.objects.create(title='Book', author=author, isbn='1234567890123')
+        cls.copy = BookCopy.objects.create(book=cls.book, status='a', publisher='Publisher')
+        cls.user = User.objects.create_user(username='reader', password='testpassword')
+
+    def create_borrowing(self, **kwargs):
+        return Borrowing.objects.create(borrower=self.user, book_copy=self.copy,
+                                        start_date=date.today(), due_date=date.today(), **kwargs)
+
+    def test_status_changes_are_logged_on_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            borrowing = self.create_borrowing()
+            borrowing.decline_reason = 'Reason'
+            borrowing.save()
+            borrowing.status = 'a'
+            borrowing.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                borrowing.status = 'b'
+                borrowing.save()
+                transaction.set_rollback(True)
+        self.assertEqual(log_of(borrowing), [('', 'p'), ('p', 'a')])
+
+    def test_append_only(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            borrowing = self.create_borrowing()
+        entry = BorrowingTransition.objects.get(borrowing=borrowing)
+        with self.assertRaises(NotSupportedError):
+            entry.save()
+        with self.assertRaises(NotSupportedError):
+            entry.delete()
+        with self.assertRaises(NotSupportedError):
+            BorrowingTransition.objects.filter(pk=entry.pk).update(to_status='a')
+        with self.assertRaises(NotSupportedError):
+            BorrowingTransition.objects.all().delete()
+        with self.assertRaises(DatabaseError), transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute("UPDATE catalog_borrowingtransition SET to_status = 'a'")
+        # the log outlives the borrowing
+        borrowing.delete()
+        self.assertEqual(BorrowingTransition.objects.filter(borrowing_id=entry.borrowing_id).count(), 1)
+
+    def test_time_in_state(self):
+        start = timezone.now() - datetime.timedelta(days=10)
+        borrowings = [self.create_borrowing() for _ in range(5)]
+        rows = []
+        # pending for 1, 2, 3 and 4 hours then approved, the last one declined after 10 hours
+        for hours, borrowing in enumerate(borrowings, start=1):
+            entered = start + datetime.timedelta(days=hours)
+            to_status, stay = ('a', hours) if hours < 5 else ('d', 10)
+            rows += [
+                BorrowingTransition(borrowing=borrowing, to_status='p', created_at=entered),
+                BorrowingTransition(borrowing=borrowing, from_status='p', to_status=to_status,
+                                    created_at=entered + datetime.timedelta(hours=stay)),
+            ]
+        BorrowingTransition.objects.bulk_create(rows)
+
+        self.assertEqual(sorted(transitions.time_in_state('p', 'a')), [3600, 7200, 10800, 14400])
+        self.assertEqual(len(transitions.time_in_state('p')), 5)
+        # approvals, still waiting for the next transition
+        self.assertEqual(transitions.time_in_state('a'), [])
+        self.assertEqual(len(transitions.time_in_state('p', since=start + datetime.timedelta(days=3))), 3)
+
+        report = transitions.latency_report('p', 'a')
+        self.assertEqual(report['count'], 4)
+        self.assertEqual(report['mean'], 9000)
+        self.assertEqual(report['p50'], 9000)
+        self.assertEqual(report['p90'], 13320)
+        self.assertIsNone(transitions.latency_report('r')['p50'])
+
+    def test_report_api(self):
+        client = APIClient()
+        url = reverse('borrowing-latency-report')
+        client.force_authenticate(self.user)
+        self.assertEqual(client.get(url).status_code, status.HTTP_403_FORBIDDEN)
+
+        self.user.is_staff = True
+        response = client.get(url, {'status': 'p', 'to_status': 'a'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 0)
+        self.assertEqual(client.get(url, {'status': 'x'}).status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class TransitionLogRequestTest(TransactionTestCase):
+    def setUp(self):
+        author = Author.objects.create(name='Author')
+        self.book = Book.objects.create(title='Book', author=author, isbn='1234567890123')
+        self.copy = BookCopy.objects.create(book=self.book, status='b', publisher='Publisher')
+        self.user = User.objects.create_user(username='reader', password='testpassword')
+        self.staff = User.objects.create_user(username='librarian', password='testpassword', is_staff=True)
+        self.borrowing = Borrowing.objects.create(borrower=self.user, book_copy=self.copy, status='b',
+                                                  start_date=date.today(), due_date=date.today())
+
+    def test_one_insert_per_request(self):
+        waiting = User.objects.create_user(username='waiting', password='testpassword')
+        Hold.objects.create(book=self.book, user=waiting)
+        self.client.force_login(self.staff)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(reverse('borrowing-end', args=(self.borrowing.id,)))
+        inserts = [query for query in queries if query['sql'].startswith('INSERT INTO "catalog_borrowingtransition"')]
+        self.assertEqual(len(inserts), 1)
+
+        # the returned copy went to the hold
+        hold_borrowing = Borrowing.objects.get(borrower=waiting)
+        self.assertEqual(log_of(self.borrowing)[-1], ('b', 'r'))
+        self.assertEqual(log_of(hold_borrowing), [('', 'a')])
+        # both transitions of the request are done by the librarian
+        self.assertEqual(BorrowingTransition.objects.filter(actor=self.staff).count(), 2)
+
+    def test_api_update(self):
+        client = APIClient()
+        client.force_authenticate(self.staff)
+        response = client.patch(reverse('update-status', kwargs={'id': self.borrowing.id}), {'status': 'r'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        entry = transitions.timeline(self.borrowing.id)[-1]
+        self.assertEqual((entry.from_status, entry.to_status, entry.actor_id), ('b', 'r', self.staff.id))
+
+    async def test_async_request(self):
+        def end_borrowing():
+            borrowing = Borrowing.objects.get(pk=self.borrowing.pk)
+            borrowing.status = 'r'
+            borrowing.save()
+
+        async def get_response(request):
+            await sync_to_async(end_borrowing)()
+            # kept until the end of the request
+            self.assertFalse(await BorrowingTransition.objects.filter(to_status='r').aexists())
+            return HttpResponse()
+
+        request = RequestFactory().post('/')
+        request.user = self.staff
+        log_middleware = TransitionLogMiddleware(get_response)
+        self.assertTrue(iscoroutinefunction(log_middleware))
+        await log_middleware(request)
+        entry = await BorrowingTransition.objects.aget(to_status='r')
+        self.assertEqual((entry.from_status, entry.actor_id), ('b', self.staff.id))
+
+    def test_no_middleware_adapted_under_asgi(self):
+        # Django logs the sync-only middleware it runs in a thread for async requests
+        with self.assertNoLogs('django.request', 'DEBUG'):
+            BaseHandler().load_middleware(is_async=True)
@@ -3,12 +3,19 @@ from django.contrib.auth.models import User, Permission
 from django.urls import reverse
 from django.core.paginator import Page
 
-from catalog.models import Book, Author, Genre, Review, Borrowing, BookCopy
+from django.core import mail
+
+from catalog import taskqueue
+from catalog.models import Book, Author, Genre, Language, Review, Borrowing, BookCopy, Task
 from catalog.forms import ReviewBookForm
 from datetime import date
-from unittest.mock import patch
+from unittest import mock
+
 
-from django.conf import settings
+def run_queued_tasks():
+    """Run the due tasks in this thread, as `manage.py run_tasks --pool sync --burst` does."""
+    for task_id in taskqueue.claim('test', 100):
+        taskqueue.execute_task(task_id, 'test')
 
 class IndexViewTest(TestCase):
     def test_index_view(self):
@@ -118,6 +125,53 @@ class BookListViewTest(TestCase):
         self.assertEqual(len(response.context['page_obj']), 3)
 
 
+class BookListFacetTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author1 = Author.objects.create(name='Author 1')
+        cls.author2 = Author.objects.create(name='Author 2')
+        cls.genre1 = Genre.objects.create(name='Genre 1')
+        cls.genre2 = Genre.objects.create(name='Genre 2')
+        cls.english = Language.objects.create(name='English')
+        book1 = Book.objects.create(title='Book 1', author=cls.author1, isbn='1234567890123', language=cls.english)
+        book1.genre.add(cls.genre1)
+        book2 = Book.objects.create(title='Book 2', author=cls.author2, isbn='1234567890124')
+        book2.genre.add(cls.genre2)
+        book3 = Book.objects.create(title='Book 3', author=cls.author1, isbn='1234567890125', language=cls.english)
+        book3.genre.add(cls.genre1, cls.genre2)
+
+    def facet(self, response, facet):
+        return [(value['name'], value['count']) for value in response.context['facets'][facet]]
+
+    def test_facet_counts_of_all_books(self):
+        response = self.client.get(reverse('books'))
+        self.assertEqual(self.facet(response, 'genre'), [('Genre 1', 2), ('Genre 2', 2)])
+        self.assertEqual(self.facet(response, 'language'), [('English', 2)])
+        self.assertEqual(self.facet(response, 'author'), [('Author 1', 2), ('Author 2', 1)])
+
+    def test_facet_counts_follow_filters(self):
+        response = self.client.get(reverse('books'), {'genre': [self.genre2.id], 'author': self.author1.id})
+        self.assertEqual([book.title for book in response.context['book_list']], ['Book 3'])
+        self.assertEqual(self.facet(response, 'genre'), [('Genre 1', 1), ('Genre 2', 1)])
+        self.assertEqual(self.facet(response, 'author'), [('Author 1', 1)])
+        genre2 = response.context['facets']['genre'][1]
+        self.assertTrue(genre2['selected'])
+
+    def test_genre_filter_has_no_duplicates(self):
+        response = self.client.get(reverse('books'), {'genre': [self.genre1.id, self.genre2.id]})
+        self.assertEqual([book.title for book in response.context['book_list']], ['Book 1', 'Book 2', 'Book 3'])
+
+    def test_facet_links_add_genres(self):
+        response = self.client.get(reverse('books'), {'genre': [self.genre1.id], 'page': 1})
+        genre2 = response.context['facets']['genre'][1]
+        self.assertEqual(genre2['query'], f'genre={self.genre1.id}&genre={self.genre2.id}')
+
+    def test_facets_are_one_query(self):
+        # count, facets, author/genre/language choices of the form, page
+        with self.assertNumQueries(6):
+            response = self.client.get(reverse('books'), {'title': 'Book'})
+            response.context['facets']
+
 class BookDetailViewTest(TestCase):
     @classmethod
     def setUpTestData(cls):
@@ -202,6 +256,52 @@ class AuthorListViewTest(TestCase):
         self.assertTrue(response.context['is_paginated'] == True)
         self.assertEqual(len(response.context['author_list']), 3)
         
+class AuthorListSearchSortTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user(username='reader', password='testpassword')
+        cls.marquez = Author.objects.create(name='Gabriel García Márquez')
+        cls.tolkien = Author.objects.create(name='J.R.R. Tolkien')
+        cls.rowling = Author.objects.create(name='J.K. Rowling')
+        for index, (author, point) in enumerate(((cls.marquez, 5), (cls.tolkien, 3), (cls.tolkien, 4))):
+            book = Book.objects.create(title=f'Book {index}', author=author, isbn=f'100000000000{index}')
+            Review.objects.create(book=book, user=user, point=point)
+
+    def names(self, **params):
+        response = self.client.get(reverse('authors'), params)
+        return [author.name for author in response.context['author_list']]
+
+    def test_search_by_normalized_token_prefix(self):
+        self.assertEqual(self.names(name='garcia'), ['Gabriel García Márquez'])
+        self.assertEqual(self.names(name='GAB marq'), ['Gabriel García Márquez'])
+        self.assertEqual(self.names(name='j.'), ['J.K. Rowling', 'J.R.R. Tolkien'])
+        self.assertEqual(self.names(name='tolkien rowling'), [])
+
+    def test_renamed_author_is_found_by_new_name(self):
+        self.rowling.name = 'Robert Galbraith'
+        self.rowling.save()
+        self.assertEqual(self.names(name='rowling'), [])
+        self.assertEqual(self.names(name='galb'), ['Robert Galbraith'])
+
+    def test_sort_by_book_count_and_rating(self):
+        self.assertEqual(self.names(sort='books'), ['J.R.R. Tolkien', 'Gabriel García Márquez', 'J.K. Rowling'])
+        self.assertEqual(self.names(sort='rating'), ['Gabriel García Márquez', 'J.R.R. Tolkien', 'J.K. Rowling'])
+        response = self.client.get(reverse('authors'), {'sort': 'rating'})
+        self.assertEqual(response.context['author_list'][1].num_books, 2)
+        self.assertEqual(response.context['author_list'][1].avg_rating, 3.5)
+        self.assertIsNone(response.context['author_list'][2].avg_rating)
+
+    def test_author_list_query_count(self):
+        # count query and one annotated page query
+        with self.assertNumQueries(2):
+            self.client.get(reverse('authors'), {'sort': 'books'})
+
+    def test_author_detail_prefetches_books(self):
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('author-detail', kwargs={'pk': self.tolkien.pk}))
+        self.assertContains(response, 'Books (2)')
+        self.assertContains(response, 'rating: 4.00 (1)')
+
 class AuthorDetailViewTest(TestCase):
     def test_author_detail_view(self):
         author = Author.objects.create(
@@ -475,6 +575,19 @@ class BorrowBookViewTest(TestCase):
         borrowing = Borrowing.objects.first()
         self.assertEqual(borrowing.book_copy, self.book_copy)
 
+    def test_overlapping_request_saved_meanwhile_is_rejected(self):
+        other = User.objects.create_user(username='otheruser', password='testpassword')
+        Borrowing.objects.create(borrower=other, book_copy=self.book_copy, status='p',
+                                 start_date=date.today(), due_date=date.today())
+        self.client.force_login(self.user)
+        form_data = {'start_date': date.today(), 'due_date': date.today()}
+        # the request passes clean() before the other one is saved
+        with mock.patch('catalog.forms.has_conflict', return_value=False):
+            response = self.client.post(self.url, data=form_data)
+        self.assertEqual(response.status_code, 200)
+        self.assertFormError(response.context['form'], None, 'This book copy is already requested for these dates')
+        self.assertEqual(Borrowing.objects.filter(book_copy=self.book_copy).count(), 1)
+
 class CancelBorrowingViewTest(TestCase):
     @classmethod
     def setUp(self):
@@ -547,26 +660,24 @@ class ApproveBorrowingViewTest(TestCase):
         response = self.client.get(self.url)
         self.assertEqual(response.status_code, 302)
 
-    @patch('catalog.views.smtplib.SMTP')
-    def test_approve_borrowing_view_post_request_with_available_book_copy(self, mock_smtp):
+    def test_approve_borrowing_view_post_request_with_available_book_copy(self):
         self.client.force_login(self.user)
-        response = self.client.post(self.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(self.url)
         self.assertEqual(response.status_code, 302)
         self.borrowing.refresh_from_db()
         self.book_copy.refresh_from_db()
         self.assertEqual(self.borrowing.status, 'a')
         self.assertEqual(self.book_copy.status, 'r')
 
-        mock_email_server = mock_smtp.return_value
-        mock_email_server.starttls.assert_called_once()
-        mock_email_server.login.assert_called_once_with(settings.EMAIL_HOST_USER, settings.EMAIL_HOST_PASSWORD)
-        mock_email_server.sendmail.assert_called_once()
-        # Assert email content
-        sent_email_content = mock_email_server.sendmail.call_args[0][2]
-        self.assertIn('Borrowed success!!!', sent_email_content)
-        self.assertIn('You have borrowed a book successfully', sent_email_content)
-        self.assertIn(f'Book name: {self.book_copy.book.title}', sent_email_content)
-        mock_email_server.quit.assert_called_once()
+        # the email is queued, sent by the task workers
+        self.assertEqual(len(mail.outbox), 0)
+        run_queued_tasks()
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].subject, 'Borrowed success!!!')
+        self.assertEqual(mail.outbox[0].to, ['test@gmail.com'])
+        self.assertIn('You have borrowed a book successfully', mail.outbox[0].body)
+        self.assertIn(f'Book name: {self.book_copy.book.title}', mail.outbox[0].body)
 
     def test_approve_borrowing_view_post_request_with_unavailable_book_copy(self):
         self.client.force_login(self.user)
@@ -612,25 +723,20 @@ class DeclineBorrowingViewTest(TestCase):
         response = self.client.get(self.url)
         self.assertEqual(response.status_code, 200)
 
-    @patch('catalog.views.smtplib.SMTP')
-    def test_decline_borrowing_view_post_request(self, mock_smtp):
+    def test_decline_borrowing_view_post_request(self):
         self.client.force_login(self.user)
-        response = self.client.post(self.url, {'decline_reason': 'Book not available'})
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(self.url, {'decline_reason': 'Book not available'})
         self.assertEqual(response.status_code, 302)
         self.borrowing.refresh_from_db()
         self.borrowing.status = 'd'
         self.assertEqual(self.borrowing.status, 'd')
 
-        mock_email_server = mock_smtp.return_value
-        mock_email_server.starttls.assert_called_once()
-        mock_email_server.login.assert_called_once_with(settings.EMAIL_HOST_USER, settings.EMAIL_HOST_PASSWORD)
-        mock_email_server.sendmail.assert_called_once()
-        # Assert email content
-        sent_email_content = mock_email_server.sendmail.call_args[0][2]
-        self.assertIn('Borrowed failed!!!', sent_email_content)
-        self.assertIn('You cant borrowed a book', sent_email_content)
-        self.assertIn('Reason: Book not available', sent_email_content)
-        mock_email_server.quit.assert_called_once()
+        run_queued_tasks()
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].subject, 'Borrowed failed!!!')
+        self.assertIn('You cant borrowed a book', mail.outbox[0].body)
+        self.assertIn('Reason: Book not available', mail.outbox[0].body)
 
 class StartBorrowingViewTest(TestCase):
     @classmethod
@@ -647,7 +753,7 @@ class StartBorrowingViewTest(TestCase):
         self.book.save()
         self.book_copy = BookCopy.objects.create(
             book=self.book,
-            status='a',
+            status='r', # reserved for the approved borrowing
             publisher='Test Publisher'
         )
         self.borrowing = Borrowing.objects.create(
@@ -689,7 +795,7 @@ class EndBorrowingViewTest(TestCase):
         self.book.save()
         self.book_copy = BookCopy.objects.create(
             book=self.book,
-            status='a',
+            status='b', # borrowed
             publisher='Test Publisher'
         )
         self.borrowing = Borrowing.objects.create(
@@ -749,20 +855,17 @@ class RequestReturnBookViewTest(TestCase):
         response = self.client.get(self.url)
         self.assertEqual(response.status_code, 302)
 
-    @patch('catalog.views.smtplib.SMTP')
-    def test_request_return_book_view_post_request(self, mock_smtp):
-        mock_email_server = mock_smtp.return_value
+    def test_request_return_book_view_post_request(self):
         self.client.force_login(self.user)
-        response = self.client.post(self.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(self.url)
+            # asked twice the same day, mailed once
+            self.client.post(self.url)
         self.assertEqual(response.status_code, 302)
+        self.assertEqual(Task.objects.count(), 1)
 
-        # Assert email server is called with the expected arguments
-        mock_email_server.starttls.assert_called_once()
-        mock_email_server.login.assert_called_once_with(settings.EMAIL_HOST_USER, settings.EMAIL_HOST_PASSWORD)
-        mock_email_server.sendmail.assert_called_once()
-        # Assert email content
-        sent_email_content = mock_email_server.sendmail.call_args[0][2]
-        self.assertIn('Overdue borrowing book!!!', sent_email_content)
-        self.assertIn(str(self.borrowing.due_date), sent_email_content)
-        self.assertIn(str(date.today()), sent_email_content)
-        mock_email_server.quit.assert_called_once()
+        run_queued_tasks()
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].subject, 'Overdue borrowing book!!!')
+        self.assertIn(str(self.borrowing.due_date), mail.outbox[0].body)
+        self.assertIn(str(date.today()), mail.outbox[0].body)
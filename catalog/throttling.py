@@ -0,0 +1,169 @@
+import logging
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.throttling import BaseThrottle
+
+logger = logging.getLogger(__name__)
+
+THROTTLE_CACHE_PREFIX = 'throttle:'
+REJECTED_CACHE_PREFIX = 'throttle-rejected:'
+
+DURATIONS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+KINDS = ('user', 'token', 'ip')
+
+# scope -> {kind: rate} of the API endpoints, CATALOG_THROTTLE_RATES overrides a scope
+DEFAULT_THROTTLE_RATES = {
+    'search-book': {'user': '120/min', 'token': '120/min', 'ip': '60/min'},
+    'borrow-book': {'user': '20/min', 'token': '20/min', 'ip': '20/min'},
+    'batch-borrow-book': {'user': '10/min', 'token': '10/min', 'ip': '10/min'},
+    'isbn-lookup': {'user': '30/min', 'token': '30/min', 'ip': '10/min'},
+    'pending-borrowing': {'user': '60/min', 'token': '60/min', 'ip': '30/min'},
+}
+
+# scope -> kinds, filled by bucket_throttles() so metrics know what to report
+registered_scopes = {}
+
+
+def parse_rate(rate):
+    """'60/min' -> (60, 60)"""
+    num, period = rate.split('/')
+    return int(num), DURATIONS[period[0]]
+
+def record_rejection(scope, kind):
+    key = f'{REJECTED_CACHE_PREFIX}{scope}:{kind}'
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, None)
+
+def get_rejection_metrics():
+    """Number of rejected calls per scope and identity kind since the cache was last cleared."""
+    keys = [f'{REJECTED_CACHE_PREFIX}{scope}:{kind}'
+            for scope, kinds in registered_scopes.items() for kind in kinds]
+    counts = cache.get_many(keys)
+    metrics = {}
+    for scope, kinds in registered_scopes.items():
+        metrics[scope] = {kind: counts.get(f'{REJECTED_CACHE_PREFIX}{scope}:{kind}', 0) for kind in kinds}
+    return metrics
+
+
+class SlidingWindowThrottle(BaseThrottle):
+    """
+    Sliding window counters: at most `rate` calls over the last rate period, per bucket.
+
+    The calls of a window are estimated from two atomic cache counters (current and
+    previous fixed period): used = previous * (1 - elapsed / period) + current, so the
+    limit moves smoothly instead of resetting at period boundaries.
+    `rates` maps the identity kinds the counters are kept for ('user', 'token', 'ip')
+    to their rate. A call is counted in every bucket that applies to it, and when any
+    of them is over its rate the call is rejected and taken out of all of them again:
+    a rejected call does not count, so a client is blocked only until older calls
+    leave the window. The ip counters only apply to anonymous calls, as DRF's
+    AnonRateThrottle: callers signed in are limited by their user and token rates,
+    not by the address they share (e.g. behind a NAT) with others.
+    """
+    scope = None
+    rates = {}
+    timer = time.time
+
+    def __init__(self):
+        self.limits = {kind: parse_rate(rate) for kind, rate in self.rates.items()}
+        self.wait_seconds = None
+
+    def get_bucket_ident(self, request, kind):
+        if kind == 'user':
+            user = getattr(request, 'user', None)
+            return f'user:{user.pk}' if user is not None and user.is_authenticated else None
+        if kind == 'token':
+            token_key = getattr(request.auth, 'token_key', None)
+            return f'token:{token_key}' if token_key else None
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            return None
+        return f'ip:{self.get_ident(request)}'
+
+    def allow_request(self, request, view):
+        now = self.timer()
+        counted, rejected = [], []
+        for kind, (num_requests, duration) in self.limits.items():
+            ident = self.get_bucket_ident(request, kind)
+            if ident is None:
+                continue
+            window = int(now // duration)
+            elapsed = now - window * duration
+            prefix = f'{THROTTLE_CACHE_PREFIX}{self.scope}:{ident}:'
+            current_key = prefix + str(window)
+
+            previous = cache.get(prefix + str(window - 1), 0)
+            cache.add(current_key, 0, duration * 2)
+            try:
+                current = cache.incr(current_key)
+            except ValueError:
+                # expired between add() and incr()
+                cache.set(current_key, 1, duration * 2)
+                current = 1
+            counted.append(current_key)
+
+            if previous * (1 - elapsed / duration) + current > num_requests:
+                wait = self.get_wait(num_requests, duration, previous, current - 1, elapsed)
+                rejected.append((kind, ident, wait))
+        if not rejected:
+            return True
+
+        for key in counted:
+            try:
+                cache.decr(key)
+            except ValueError:
+                pass
+        self.wait_seconds = max(wait for _kind, _ident, wait in rejected)
+        for kind, ident, wait in rejected:
+            record_rejection(self.scope, kind)
+            logger.info('Throttled %s call from %s (retry in %ss)', self.scope, ident, wait)
+        return False
+
+    def get_wait(self, num_requests, duration, previous, current, elapsed):
+        """Seconds until the window has room for one more call."""
+        free = num_requests - 1
+        if current <= free and previous > 0:
+            # room made by the previous period leaving the window
+            drained_at = duration * (1 - (free - current) / previous)
+            return max(1, math.ceil(drained_at - elapsed))
+        # wait for the next period, then for the current count to drain
+        wait = duration - elapsed
+        if current > free and current > 0:
+            wait += duration * (1 - free / current)
+        return max(1, math.ceil(wait))
+
+    def wait(self):
+        return self.wait_seconds
+
+
+def get_rates(scope, defaults=None):
+    """Rates of an endpoint: CATALOG_THROTTLE_RATES[scope], else `defaults`, else DEFAULT_THROTTLE_RATES[scope]."""
+    rates = getattr(settings, 'CATALOG_THROTTLE_RATES', {}).get(scope)
+    if rates is None:
+        rates = defaults or DEFAULT_THROTTLE_RATES.get(scope, {})
+    return {kind: rate for kind, rate in rates.items() if rate}
+
+def bucket_throttles(scope, **defaults):
+    """
+    Build the throttle classes of one endpoint, e.g.
+    throttle_classes = bucket_throttles('search-book'), with its user, token and ip
+    rates from CATALOG_THROTTLE_RATES; the ip rate applies to anonymous calls only
+    """
+    rates = get_rates(scope, defaults)
+    for kind, rate in rates.items():
+        if kind not in KINDS:
+            raise ValueError(f'Unknown throttle identity {kind!r} for {scope!r}')
+        parse_rate(rate) # fail at import time on a bad rate
+    registered_scopes[scope] = [kind for kind in KINDS if kind in rates]
+    if not rates:
+        return []
+    return [type('SlidingWindowThrottle', (SlidingWindowThrottle,), {
+        'scope': scope,
+        'rates': {kind: rates[kind] for kind in KINDS if kind in rates},
+    })]
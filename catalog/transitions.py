@@ -0,0 +1,144 @@
+"""
+Log of the borrowing status changes, and time-in-state statistics.
+
+Every status change of a borrowing (Borrowing.save() through the post_save
+signal, plus the code creating borrowings with bulk_create()) appends a
+BorrowingTransition once its transaction commits. During a request the
+transitions are kept by TransitionLogMiddleware and inserted together at the
+end of the request, one INSERT whatever the number of changes, with the
+signed in user as actor. Outside a request (management commands, shell) they
+are inserted at commit.
+
+The log is append-only: the model and its queryset refuse updates and
+deletes, and a database trigger refuses updates. It is indexed by time and by
+(borrowing, time), which serves both the time range scans of the reports and
+the "next transition of the same borrowing" lookups of time_in_state().
+"""
+import contextlib
+import math
+from contextvars import ContextVar
+
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.db.models import OuterRef, Q, Subquery
+from django.utils import timezone
+
+from .models import BorrowingTransition
+
+PERCENTILES = (50, 90, 95, 99)
+
+# TransitionBatch of the current request
+_batch = ContextVar('borrowing_transitions', default=None)
+
+
+class TransitionBatch:
+    def __init__(self, request=None):
+        self.request = request
+        self.transitions = []
+
+    def actor_id(self):
+        # read at the end of the request, API authentication sets the user in the view
+        user = getattr(self.request, 'user', None)
+        return user.pk if user is not None and user.is_authenticated else None
+
+    def flush(self):
+        if not self.transitions:
+            return
+        actor_id = self.actor_id()
+        for item in self.transitions:
+            item.actor_id = actor_id
+        BorrowingTransition.objects.bulk_create(self.transitions)
+        self.transitions = []
+
+
+@contextlib.contextmanager
+def batch(request=None):
+    """Keep the transitions committed inside the block, insert them when it exits."""
+    current = TransitionBatch(request)
+    token = _batch.set(current)
+    try:
+        yield current
+    finally:
+        _batch.reset(token)
+        current.flush()
+
+@contextlib.asynccontextmanager
+async def abatch(request=None):
+    """batch() for async code, the transitions are inserted in a thread when there are any."""
+    current = TransitionBatch(request)
+    token = _batch.set(current)
+    try:
+        yield current
+    finally:
+        _batch.reset(token)
+        if current.transitions:
+            await sync_to_async(current.flush)()
+
+def record(borrowings, from_status=None):
+    """
+    Log the move of borrowings from `from_status` (None for new borrowings) to
+    their current status, when the current transaction commits.
+    """
+    now = timezone.now()
+    transitions = [BorrowingTransition(borrowing_id=borrowing.pk, from_status=from_status or '',
+                                       to_status=borrowing.status, created_at=now)
+                   for borrowing in borrowings]
+    if transitions:
+        transaction.on_commit(lambda: append(transitions))
+
+def append(transitions):
+    current = _batch.get()
+    if current is None:
+        BorrowingTransition.objects.bulk_create(transitions)
+    else:
+        current.transitions.extend(transitions)
+
+
+def timeline(borrowing_id):
+    """Transitions of a borrowing, oldest first."""
+    return list(BorrowingTransition.objects.filter(borrowing_id=borrowing_id).order_by('created_at', 'id'))
+
+def time_in_state(status, to_status=None, since=None, until=None):
+    """
+    Seconds borrowings stayed in `status` before leaving it (for `to_status` only
+    when given), for the stays starting between `since` and `until`.
+    Stays not over yet are not counted.
+    """
+    next_transitions = (BorrowingTransition.objects
+        .filter(borrowing_id=OuterRef('borrowing_id'))
+        .filter(Q(created_at__gt=OuterRef('created_at')) | Q(created_at=OuterRef('created_at'), id__gt=OuterRef('id')))
+        .order_by('created_at', 'id'))
+    stays = (BorrowingTransition.objects
+        .filter(to_status=status)
+        .annotate(left_at=Subquery(next_transitions.values('created_at')[:1]),
+                  next_status=Subquery(next_transitions.values('to_status')[:1]))
+        .filter(left_at__isnull=False))
+    if since is not None:
+        stays = stays.filter(created_at__gte=since)
+    if until is not None:
+        stays = stays.filter(created_at__lt=until)
+    if to_status is not None:
+        stays = stays.filter(next_status=to_status)
+    return [(left_at - entered_at).total_seconds()
+            for entered_at, left_at in stays.values_list('created_at', 'left_at').iterator()]
+
+def percentile(values, p):
+    """p-th percentile of sorted values, interpolated between the closest ranks."""
+    if not values:
+        return None
+    rank = (len(values) - 1) * p / 100
+    low, high = math.floor(rank), math.ceil(rank)
+    return values[low] + (values[high] - values[low]) * (rank - low)
+
+def latency_report(status, to_status=None, since=None, until=None, percentiles=PERCENTILES):
+    """Count, mean and percentiles (seconds) of time_in_state(), e.g. ('p', 'a'): pending to approved."""
+    durations = sorted(time_in_state(status, to_status, since, until))
+    report = {
+        'status': status,
+        'to_status': to_status,
+        'count': len(durations),
+        'mean': sum(durations) / len(durations) if durations else None,
+    }
+    for p in percentiles:
+        report[f'p{p}'] = percentile(durations, p)
+    return report
@@ -1,20 +1,6 @@
-from django.urls import path
+from django.urls import include, path
 from . import views
-from rest_framework import permissions
-from drf_yasg.views import get_schema_view
-from drf_yasg import openapi
-
-schema_view = get_schema_view(
-openapi.Info(
-        title="Simple API",
-        default_version='v1',
-        description="An simple API for CRUD with Article",
-        contact=openapi.Contact(email="contact@education.sun.local"),
-        license=openapi.License(name="Sun Education License"),
-        ),
-        public=True,
-        permission_classes=(permissions.AllowAny,),
-    )
+from . import async_views
 
 # guest
 urlpatterns = [
@@ -23,18 +9,20 @@ urlpatterns = [
     path('book/<int:pk>', views.BookDetailView.as_view(), name='book-detail'),
 ]
 
+# REST API and its documentation, loaded with their first request
 urlpatterns += [
-    path('api/v1/register/', views.RegisterAPI.as_view(), name='api-register'),
-    path('api/v1/login/', views.LoginAPI.as_view(), name='api-login'),
-    path('api/v1/search-book/', views.SearchBookAPI.as_view(), name='search-book'),
-    path('api/v1/create-borrow-book/', views.BorrowBookAPI.as_view(), name='borrow-book'),
-    path('api/v1/pending-borrowing/', views.PendingBorrowingAPI.as_view(), name='pending-borrowing'),
-    path('api/v1/pending-borrowing/update-status/<int:id>', views.ProcessBorrowBookAPI.as_view(), name='update-status'),
+    path('', include('catalog.api_urls')),
 ]
 
+# async (ASGI) variants of the read views
 urlpatterns += [
-    path('swagger', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
-    path('redoc', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
+    path('async/', async_views.index, name='async-index'),
+    path('async/books/', async_views.book_list, name='async-books'),
+    path('async/book/<int:pk>', async_views.BookDetailView.as_view(), name='async-book-detail'),
+    path('async/borrowing/', async_views.borrowing_list_user, name='async-borrowing-list'),
+    path('async/allborrowing/', async_views.borrowing_list_staff, name='async-all-borrowing'),
+    path('async/api/v1/borrowing-events/', async_views.borrowing_events, name='borrowing-events'),
+    path('async/api/v1/borrowing-events/poll/', async_views.borrowing_events_poll, name='borrowing-events-poll'),
 ]
 
 urlpatterns += [
@@ -50,6 +38,8 @@ urlpatterns += [
 urlpatterns += [
     path('book/<int:book_id>/review/create/', views.review_book, name='review-create'),
     path('book/<int:book_id>/borrowing/create/<uuid:bookcopy_id>', views.borrow_book, name='borrowing-create'),
+    path('book/<int:book_id>/hold/join/', views.join_hold, name='hold-join'),
+    path('book/<int:book_id>/hold/leave/', views.leave_hold, name='hold-leave'),
 ]
 
 urlpatterns += [
@@ -60,6 +50,7 @@ urlpatterns += [
 # librarian
 urlpatterns += [
     path('allborrowing/', views.BorrowingByStaffListView.as_view(), name='all-borrowing'),
+    path('reports/circulation/', views.CirculationReportView.as_view(), name='circulation-report'),
 ]
 
 urlpatterns += [
@@ -80,4 +71,5 @@ urlpatterns += [
     path('book/create/', views.BookCreate.as_view(), name='book-create'),
     path('book/<int:pk>/update/', views.BookUpdate.as_view(), name='book-update'),
     path('book/<int:pk>/delete/', views.BookDelete.as_view(), name='book-delete'),
+    path('book/<int:book_id>/copies/add/', views.add_book_copies, name='book-copies-add'),
 ]
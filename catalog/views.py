@@ -1,7 +1,8 @@
 from django.shortcuts import render
 from django.views import generic
 from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMixin
-from .models import Book, Author, Genre, Borrowing, BookCopy
+from django.contrib.auth.decorators import login_required, permission_required
+from .models import Book, Author, Genre, Borrowing, BookCopy, CirculationRollup
 import datetime
 
 from django.shortcuts import render, get_object_or_404, redirect
@@ -11,9 +12,11 @@ from django.urls import reverse
 from django.views.generic.edit import CreateView, UpdateView, DeleteView
 from django.urls import reverse_lazy
 
-from catalog.forms import SearchAuthorForm, SearchBookForm, ReviewBookForm, BorrowBookForm, DeclineBorrowingForm
+from catalog.forms import (AddBookCopiesForm, SearchAuthorForm, SearchBookForm, ReviewBookForm, BorrowBookForm,
+                           DeclineBorrowingForm)
 
-from django.db.models import Avg
+from django.db.models import Count, F, FloatField, Prefetch, Sum
+from django.db.models.functions import Cast, NullIf
 from django.views.generic.edit import FormMixin
 from django.contrib import messages
 
@@ -21,88 +24,22 @@ from django.contrib.auth import authenticate, login
 from django.contrib.auth.forms import AuthenticationForm
 
 from .forms import UserRegisterForm
-from django.conf import settings
-import smtplib
-
-################## API #####################
-from rest_framework import generics, permissions
-from rest_framework.response import Response
-from knox.models import AuthToken
-from .models import Book
-from .serializers import *
-from django.contrib.auth import login
-from rest_framework.authtoken.serializers import AuthTokenSerializer
-from knox.views import LoginView as KnoxLoginView
-from django_filters.rest_framework import DjangoFilterBackend
-
-# Register API
-class RegisterAPI(generics.GenericAPIView):
-    serializer_class = RegisterSerializer
-
-    def post(self, request, *args, **kwargs):
-        serializer = self.get_serializer(data=request.data)
-        serializer.is_valid(raise_exception=True)
-        user = serializer.save()
-        return Response({
-            "user": UserSerializer(user, context=self.get_serializer_context()).data,
-            "token": AuthToken.objects.create(user)[1]
-            })
-
-class LoginAPI(KnoxLoginView):
-    permission_classes = (permissions.AllowAny,)
-
-    def post(self, request, format=None):
-        serializer = AuthTokenSerializer(data=request.data)
-        serializer.is_valid(raise_exception=True)
-        user = serializer.validated_data['user']
-        login(request, user)
-        return super(LoginAPI, self).post(request, format=None)
-
-class SearchBookAPI(generics.ListAPIView):
-    """
-    GET
-    """
-    queryset = Book.objects.all()
-    serializer_class = BookSerializer
-    filter_backends = [DjangoFilterBackend, ]
-    filterset_fields  = ('title', 'author', 'language', 'genre')
-
-class BorrowBookAPI(generics.CreateAPIView):
-    """
-    POST
-    """
-    serializer_class = ProcessBorrowBookSerializer
-    permission_classes = [permissions.AllowAny, ]
-
-    def post(self, request, *args, **kwargs):
-        serializer = self.get_serializer(data=request.data)
-        serializer.is_valid(raise_exception=True)
-        borrow = serializer.save()
-        user = borrow.borrower
-        token = AuthToken.objects.create(user)[1]
-        return Response({
-            "borrow": ProcessBorrowBookSerializer(borrow, context=self.get_serializer_context()).data,
-            "token": token
-            })
-
-class PendingBorrowingAPI(generics.ListAPIView):
-    """
-    GET
-    """
-    queryset = Borrowing.objects.filter(status='p')
-    serializer_class = BorrowBookSerializer
-    permission_classes = [permissions.AllowAny, ]
-
-class ProcessBorrowBookAPI(generics.RetrieveUpdateAPIView):
-    """
-    PUT
-    PATCH
-    """
-    queryset = Borrowing.objects.all()
-    serializer_class = BorrowBookSerializer
-    permission_classes = [permissions.AllowAny]
-    lookup_url_kwarg = 'id'
-
+from .notifications import queue_notification
+
+from django.db import transaction
+from .borrowing import check_borrowing_limit, get_borrowing_limits, get_borrowing_stats
+from .reservations import get_book_calendar, has_conflict
+from .search import filter_authors
+from .facets import add_facet_links, get_facets
+from . import bitmaps
+from . import copies
+from . import holds
+from . import lifecycle
+from . import ranking
+from . import recommendations
+from . import rollups
+
+# the REST API views are in catalog.api_views
 
 #######################################
 
@@ -123,7 +60,8 @@ def index(request):
     num_genres = Genre.objects.all().count()
     num_copies_available = BookCopy.objects.filter(status__exact='a').count()
     num_authors = Author.objects.count()
-    top_rated_books = Book.objects.annotate(avg_rating=Avg('review__point')).order_by('-avg_rating')[:10]
+    top_rated_books = ranking.top_rated(10)
+    most_borrowed_books = ranking.most_borrowed(10)
 
     context = {
         'num_books': num_books,
@@ -132,6 +70,7 @@ def index(request):
         'num_authors': num_authors,
         'num_genres': num_genres,
         'top_rated_books': top_rated_books,
+        'most_borrowed_books': most_borrowed_books,
     }
     return render(request, 'index.html', context=context)
 
@@ -142,17 +81,11 @@ def Register(request):
             form.save()
             username = form.cleaned_data.get('username')
             email = form.cleaned_data.get('email')
-            ######################### mail system ####################################
-            email_server = smtplib.SMTP(settings.EMAIL_HOST, settings.EMAIL_PORT)
-            email_server.starttls()
-            email_server.login(settings.EMAIL_HOST_USER, settings.EMAIL_HOST_PASSWORD)
+            # mailed by the task workers
             subject = 'Account created successfully!!!'
             message = 'Welcome\n\nYour account has been created ! You are now able to log in'
-            content = f'Subject: {subject}\n\n{message}.\n\nLogin here: http://127.0.0.1:8000/login/'
-            to = [email]
-            email_server.sendmail(settings.EMAIL_HOST_USER, to, content)
-            email_server.quit()
-            ##################################################################
+            content = f'{message}.\n\nLogin here: {request.build_absolute_uri(reverse("login"))}'
+            queue_notification(subject, content, [email])
             return redirect('login')
     else:
         form = UserRegisterForm()
@@ -175,6 +108,37 @@ def Login(request):
 
 ############  2. BOOK  ############
 
+def search_books(cleaned_data):
+    """Books matching the cleaned data of a SearchBookForm."""
+    title = cleaned_data['title']
+    author = cleaned_data['author']
+    genre = cleaned_data['genre']
+    language = cleaned_data['language']
+    book_list = Book.objects.filter(title__icontains=title)
+    if author:
+        book_list = book_list.filter(author=author)
+    if genre:
+        # a subquery instead of a join, no duplicate rows to remove with distinct()
+        book_list = book_list.filter(id__in=Book.genre.through.objects.filter(genre__in=genre).values('book_id'))
+    if language:
+        book_list = book_list.filter(language=language)
+    if cleaned_data.get('available'):
+        book_list = book_list.filter(id__in=BookCopy.objects.filter(status='a').values('book_id'))
+
+    return book_list
+
+def search_books_bitmaps(cleaned_data):
+    """search_books() on the bitmap index, None when the search needs SQL (title text)."""
+    if not bitmaps.is_enabled() or cleaned_data['title']:
+        return None
+    author, language = cleaned_data['author'], cleaned_data['language']
+    return bitmaps.search(bitmaps.search_expression(
+        genre_ids=[genre.pk for genre in cleaned_data['genre'] or ()],
+        language_id=language.pk if language else None,
+        author_id=author.pk if author else None,
+        available=cleaned_data.get('available'),
+    ))
+
 class BookListView(generic.ListView, FormMixin):
     """Generic class-based view for a list of books."""
     model = Book
@@ -184,26 +148,63 @@ class BookListView(generic.ListView, FormMixin):
     def get_queryset(self):
         form = SearchBookForm(self.request.GET)
         if form.is_valid():
-            title = form.cleaned_data['title']
-            author = form.cleaned_data['author']
-            genre = form.cleaned_data['genre']
-            language = form.cleaned_data['language']
-            book_list = self.model.objects.filter(title__icontains=title)
-            if author:
-                book_list = book_list.filter(author__name__icontains=author)
-            if genre:
-                book_list = book_list.filter(genre__in=genre)
-            if language:
-                book_list = book_list.filter(language__name__iexact=language)
-
-            return book_list.distinct()
-
-        return self.model.objects.all()
+            result = search_books_bitmaps(form.cleaned_data)
+            if result is not None:
+                return result
+            return search_books(form.cleaned_data).select_related('author').order_by('pk')
+
+        return self.model.objects.select_related('author').order_by('pk')
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        if isinstance(self.object_list, bitmaps.BitmapResult):
+            facets = bitmaps.get_facets(self.object_list)
+        else:
+            facets = get_facets(self.object_list)
+        context['facets'] = add_facet_links(facets, self.request.GET)
+        return context
 
 class BookDetailView(generic.DetailView):
     """Generic class-based detail view for a book."""
     model = Book
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # availability widget: next 30 days
+        start = datetime.date.today()
+        end = start + datetime.timedelta(days=30)
+        calendar = get_book_calendar(self.object.pk)
+        context['availability_end'] = end
+        context['free_ranges'] = calendar.free_ranges(start, end)
+        context['copy_bookings'] = [
+            (copy, calendar.booked(copy.id, start, end))
+            for copy in self.object.bookcopy_set.all()
+        ]
+        hold = holds.get_user_hold(self.object.pk, self.request.user)
+        context['hold_queue_length'] = holds.queue_length(self.object.pk)
+        context['hold_position'] = holds.queue_position(hold) if hold else None
+        context['recommended_books'] = recommendations.get_recommendations(self.object.pk)
+        return context
+
+@permission_required('catalog.can_mark_returned')
+def add_book_copies(request, book_id):
+    book = get_object_or_404(Book, pk=book_id)
+
+    if request.method == 'POST':
+        form = AddBookCopiesForm(request.POST)
+        if form.is_valid():
+            new_copies = copies.add_copies(book, **form.cleaned_data)
+            messages.info(request, f'{len(new_copies)} copies of {book.title} added.')
+            return HttpResponseRedirect(reverse('book-detail', args=(book.id,)))
+    else:
+        form = AddBookCopiesForm()
+
+    context = {
+        'form': form,
+        'form_title': f'Add copies of {book.title}',
+    }
+    return render(request, 'form_generic.html', context)
+
 class BookCreate(CreateView):
     model = Book
     fields = ['title', 'author', 'summary', 'isbn', 'genre', 'language']
@@ -228,19 +229,37 @@ class AuthorListView(generic.ListView, FormMixin):
     paginate_by = 10
     form_class = SearchAuthorForm
 
+    ORDERINGS = {
+        'name': ['name', 'id'],
+        'books': [F('num_books').desc(), 'name', 'id'],
+        'rating': [F('avg_rating').desc(nulls_last=True), 'name', 'id'],
+    }
+
     def get_queryset(self):
         form = SearchAuthorForm(self.request.GET)
-
+        # book counts and ratings in the same query, ratings from the BookScore counters
+        queryset = self.model.objects.annotate(
+            num_books=Count('book'),
+            avg_rating=Cast(Sum('book__bookscore__rating_sum'), FloatField())
+                / NullIf(Sum('book__bookscore__rating_count'), 0),
+        )
+        sort = 'name'
         if form.is_valid():
-            name = form.cleaned_data['name']
-            return self.model.objects.filter(name__icontains=name)
+            queryset = filter_authors(queryset, form.cleaned_data['name'])
+            sort = form.cleaned_data['sort'] or sort
 
-        return self.model.objects.all()
+        return queryset.order_by(*self.ORDERINGS[sort])
 
 class AuthorDetailView(generic.DetailView):
     """Generic class-based detail view for an author."""
     model = Author
 
+    def get_queryset(self):
+        return Author.objects.prefetch_related(Prefetch(
+            'book_set',
+            queryset=Book.objects.select_related('bookscore').prefetch_related('genre').order_by('title'),
+        ))
+
 class AuthorCreate(CreateView):
     model = Author
     fields = ['name', 'date_of_birth', 'date_of_death']
@@ -288,12 +307,7 @@ def review_book(request, book_id):
 
 
 ############  5. BORROW BOOK  ############
-# borrowing status change:
-#     pending -> canceled -> approvde/declined -> borrowing -> returned
-#     (user)     (user)      (staff)              (staff)      (staff)
-
-# book copy status change
-#     available -> reserved -> borrowed -> available
+# borrowing and book copy status changes: see catalog.lifecycle
 
 class BorrowingByUserListView(LoginRequiredMixin, generic.ListView):
     model = Borrowing
@@ -303,6 +317,12 @@ class BorrowingByUserListView(LoginRequiredMixin, generic.ListView):
     def get_queryset(self):
         return Borrowing.objects.filter(borrower=self.request.user).order_by('-updated_at')
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['stats'] = get_borrowing_stats(self.request.user)
+        context.update(get_borrowing_limits())
+        return context
+
 class BorrowingByStaffListView(LoginRequiredMixin, PermissionRequiredMixin, generic.ListView):
     model = Borrowing
     template_name = 'catalog/borrowing_list_staff.html'
@@ -312,6 +332,33 @@ class BorrowingByStaffListView(LoginRequiredMixin, PermissionRequiredMixin, gene
     def get_queryset(self):
         return Borrowing.objects.all()
 
+class CirculationReportView(LoginRequiredMixin, PermissionRequiredMixin, generic.ListView):
+    """Monthly circulation statistics, served from the rollups (see catalog.rollups)."""
+    template_name = 'catalog/circulation_report.html'
+    context_object_name = 'rollup_list'
+    permission_required = 'catalog.can_view_all_borrowing'
+    paginate_by = 10
+
+    def get_queryset(self):
+        # the serializers import DRF, only loaded with the report
+        from .serializers import CirculationReportQuerySerializer
+        self.query = CirculationReportQuerySerializer(data=self.request.GET)
+        if not self.query.is_valid():
+            self.query = CirculationReportQuerySerializer(data={})
+            self.query.is_valid()
+        return rollups.get_report(self.query.validated_data['dimension'], self.query.validated_data['month'])
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        dimension = self.query.validated_data['dimension']
+        names = rollups.get_names(dimension, context['rollup_list'])
+        for rollup in context['rollup_list']:
+            rollup.name = names.get(rollup.key)
+        context['dimension'] = dimension
+        context['dimensions'] = CirculationRollup.DIMENSIONS
+        context['month'] = self.query.validated_data['month']
+        return context
+
 def borrow_book(request, book_id, bookcopy_id):
     book = get_object_or_404(Book, pk=book_id)
     bookcopy = get_object_or_404(BookCopy, pk=bookcopy_id)
@@ -326,11 +373,23 @@ def borrow_book(request, book_id, bookcopy_id):
         form = BorrowBookForm(request.POST, initial = initial_dict)
 
         if form.is_valid():
-            borrowing = form.save(commit=False)
-            borrowing.borrower = request.user
-            borrowing.bookcopy = bookcopy
-            borrowing.save()
-            return HttpResponseRedirect(reverse('book-detail', args=(book.id,)))
+            with transaction.atomic():
+                error = None
+                if request.user.is_authenticated:
+                    error = check_borrowing_limit(get_borrowing_stats(request.user, lock=True))
+                # checked again under the copy lock, another request may have been saved since clean()
+                data = form.cleaned_data
+                if not error and has_conflict(data['book_copy'].id, data['start_date'], data['due_date'], lock=True):
+                    error = 'This book copy is already requested for these dates'
+                if error:
+                    form.add_error(None, error)
+                else:
+                    borrowing = form.save(commit=False)
+                    borrowing.borrower = request.user
+                    borrowing.bookcopy = bookcopy
+                    borrowing.save()
+            if not error:
+                return HttpResponseRedirect(reverse('book-detail', args=(book.id,)))
 
     else:
         form = BorrowBookForm(initial = initial_dict)
@@ -341,45 +400,59 @@ def borrow_book(request, book_id, bookcopy_id):
     }
     return render(request, 'form_generic.html', context)
 
+@login_required
+def join_hold(request, book_id):
+    book = get_object_or_404(Book, pk=book_id)
+
+    if request.method == 'POST':
+        holds.join_queue(book, request.user)
+
+    return HttpResponseRedirect(reverse('book-detail', args=(book.id,)))
+
+@login_required
+def leave_hold(request, book_id):
+    book = get_object_or_404(Book, pk=book_id)
+
+    if request.method == 'POST':
+        holds.leave_queue(book, request.user)
+
+    return HttpResponseRedirect(reverse('book-detail', args=(book.id,)))
+
+def get_borrowing(pk):
+    return get_object_or_404(Borrowing.objects.select_related('book_copy__book', 'borrower'), pk=pk)
+
 def cancel_borrowing(request, pk):
-    borrowing = get_object_or_404(Borrowing, pk=pk)
+    borrowing = get_borrowing(pk)
 
     if request.method == 'POST':
-        borrowing.status = 'c' # canceled
-        borrowing.save()
+        try:
+            lifecycle.transition(borrowing, 'c') # canceled
+        except lifecycle.TransitionError as error:
+            messages.info(request, str(error))
 
     return HttpResponseRedirect(reverse('borrowing-list'))
 
 def approve_borrowing(request, pk):
-    borrowing = get_object_or_404(Borrowing, pk=pk)
-    book_copy = get_object_or_404(BookCopy, pk=borrowing.book_copy.id)
+    borrowing = get_borrowing(pk)
+    book_copy = borrowing.book_copy
 
     if request.method == 'POST':
-        if book_copy.status == 'a': # available
-            borrowing.status = 'a' # approved
-            borrowing.save()
-
-            book_copy.status = 'r' # reserved
-            book_copy.save()
-            # send email to user
-            ######################### mail system ####################################
-            email_server = smtplib.SMTP(settings.EMAIL_HOST, settings.EMAIL_PORT)
-            email_server.starttls()
-            email_server.login(settings.EMAIL_HOST_USER, settings.EMAIL_HOST_PASSWORD)
+        try:
+            # approved, the copy is reserved
+            lifecycle.transition(borrowing, 'a')
+        except lifecycle.TransitionError as error:
+            messages.info(request, str(error))
+        else:
+            # send email to user, from the task workers
             subject = 'Borrowed success!!!'
             message = 'You have borrowed a book successfully'
-            content = f'Subject: {subject}\n\n{message}. Book name: {book_copy.book.title}'
-            to = [borrowing.borrower.email]
-            email_server.sendmail(settings.EMAIL_HOST_USER, to, content)
-            email_server.quit()
-            ##################################################################
-        else:
-            messages.info(request, 'Cannot approve this request because the book copy is not available!')
+            content = f'{message}. Book name: {book_copy.book.title}'
+            queue_notification(subject, content, [borrowing.borrower.email], key=f'borrowing-{borrowing.pk}-approved')
 
     return HttpResponseRedirect(reverse('all-borrowing'))
 
 def decline_borrowing(request, pk):
-    borrowing = get_object_or_404(Borrowing, pk=pk)
+    borrowing = get_borrowing(pk)
 
     initial_dict = {
         'bookcopy_id' : borrowing.book_copy.id,
@@ -391,22 +464,18 @@ def decline_borrowing(request, pk):
     if request.method == 'POST':
         form = DeclineBorrowingForm(request.POST, initial = initial_dict)
         if form.is_valid():
-            borrowing = form.save(commit=False)
-            borrowing.status = 'd' # declined
-            borrowing.save()
-            ######################### mail system ####################################
-            email_server = smtplib.SMTP(settings.EMAIL_HOST, settings.EMAIL_PORT)
-            email_server.starttls()
-            email_server.login(settings.EMAIL_HOST_USER, settings.EMAIL_HOST_PASSWORD)
-            subject = 'Borrowed failed!!!'
-            message = 'You cant borrowed a book'
             # get declined reason
             declined_reason = form.cleaned_data['decline_reason']
-            content = f'Subject: {subject}\n\n{message}.\n\nReason: {declined_reason}'
-            to = [borrowing.borrower.email]
-            email_server.sendmail(settings.EMAIL_HOST_USER, to, content)
-            email_server.quit()
-            ##################################################################
+            try:
+                lifecycle.transition(borrowing, 'd', decline_reason=declined_reason) # declined
+            except lifecycle.TransitionError as error:
+                messages.info(request, str(error))
+                return HttpResponseRedirect(reverse('all-borrowing'))
+            # mailed by the task workers
+            subject = 'Borrowed failed!!!'
+            message = 'You cant borrowed a book'
+            content = f'{message}.\n\nReason: {declined_reason}'
+            queue_notification(subject, content, [borrowing.borrower.email], key=f'borrowing-{borrowing.pk}-declined')
             return HttpResponseRedirect(reverse('all-borrowing'))
 
     else:
@@ -419,45 +488,38 @@ def decline_borrowing(request, pk):
     return render(request, 'form_generic.html', context)
 
 def start_borrowing(request, pk):
-    borrowing = get_object_or_404(Borrowing, pk=pk)
-    book_copy = get_object_or_404(BookCopy, pk=borrowing.book_copy.id)
+    borrowing = get_borrowing(pk)
 
     if request.method == 'POST':
-        borrowing.status = 'b' # borrowing
-        borrowing.save()
-
-        book_copy.status = 'b' # borrowed
-        book_copy.save()
+        try:
+            # borrowing, the copy is borrowed and the loan counted in the book ranking
+            lifecycle.transition(borrowing, 'b')
+        except lifecycle.TransitionError as error:
+            messages.info(request, str(error))
 
     return HttpResponseRedirect(reverse('all-borrowing'))
 
 def end_borrowing(request, pk):
-    borrowing = get_object_or_404(Borrowing, pk=pk)
-    book_copy = get_object_or_404(BookCopy, pk=borrowing.book_copy.id)
+    borrowing = get_borrowing(pk)
 
     if request.method == 'POST':
-        borrowing.status = 'r' # returned
-        borrowing.save()
-        
-        book_copy.status = 'a' # availabel
-        book_copy.save()
+        try:
+            # returned, the copy is available again or handed to the first user waiting for this book
+            lifecycle.transition(borrowing, 'r')
+        except lifecycle.TransitionError as error:
+            messages.info(request, str(error))
 
     return HttpResponseRedirect(reverse('all-borrowing'))
 
 def request_return_book(request, pk):
     borrowing = get_object_or_404(Borrowing, pk=pk)
     if request.method == 'POST':
-        ######################### mail system ####################################
-        email_server = smtplib.SMTP(settings.EMAIL_HOST, settings.EMAIL_PORT)
-        email_server.starttls()
-        email_server.login(settings.EMAIL_HOST_USER, settings.EMAIL_HOST_PASSWORD)
+        # mailed by the task workers, once a day
+        today = datetime.date.today()
         subject = 'Overdue borrowing book!!!'
         message = 'You must return a book because of due date'
-        content = f'Subject: {subject}\n\n{message}.\n\nReturn Date: {borrowing.due_date}\n\nToday: {datetime.date.today()}'
-        to = [borrowing.borrower.email]
-        email_server.sendmail(settings.EMAIL_HOST_USER, to, content)
-        email_server.quit()
-        ##################################################################
+        content = f'{message}.\n\nReturn Date: {borrowing.due_date}\n\nToday: {today}'
+        queue_notification(subject, content, [borrowing.borrower.email], key=f'borrowing-{borrowing.pk}-return-{today}')
 
     return HttpResponseRedirect(reverse('all-borrowing'))
     
\ No newline at end of file
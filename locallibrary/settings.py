@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+from importlib.util import find_spec
 from pathlib import Path
 import os
 from dotenv import load_dotenv
@@ -53,10 +54,12 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'catalog.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'catalog.middleware.TransitionLogMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -65,11 +68,94 @@ ROOT_URLCONF = 'locallibrary.urls'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'knox.auth.TokenAuthentication',
+        'catalog.authentication.CachedTokenAuthentication',
     ],
-    'DEFAULT_FILTER_BACKENDS': ['django_filters.rest_framework.DjangoFilterBackend']
+    'DEFAULT_FILTER_BACKENDS': ['django_filters.rest_framework.DjangoFilterBackend'],
+    # orjson when installed, the stdlib json encoder otherwise (see catalog.renderers)
+    'DEFAULT_RENDERER_CLASSES': [
+        'catalog.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+}
+# Accept: application/msgpack, offered when msgpack is installed
+if find_spec('msgpack') is not None:
+    REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES'].append('catalog.renderers.MessagePackRenderer')
+
+# API responses smaller than this (bytes) are not compressed (see catalog.middleware)
+CATALOG_COMPRESSION_MIN_SIZE = 1024
+
+# Rows read per query by the NDJSON streamed lists (?stream=1)
+CATALOG_STREAM_CHUNK_SIZE = 500
+
+# API rates per endpoint and caller identity (see catalog.throttling), a scope listed
+# here replaces its defaults; the ip rate applies to anonymous calls only
+CATALOG_THROTTLE_RATES = {
+    'search-book': {'user': '120/min', 'token': '120/min', 'ip': '60/min'},
+    'borrow-book': {'user': '20/min', 'token': '20/min', 'ip': '20/min'},
+    'batch-borrow-book': {'user': '10/min', 'token': '10/min', 'ip': '10/min'},
+    'isbn-lookup': {'user': '30/min', 'token': '30/min', 'ip': '10/min'},
+    'pending-borrowing': {'user': '60/min', 'token': '60/min', 'ip': '30/min'},
 }
 
+# Seconds a validated knox token is kept in the cache (see catalog.authentication).
+# With the per-process LocMemCache, a logout or revocation reaches the other worker
+# processes only when their entry expires: use a shared cache in production (0 disables it)
+CATALOG_TOKEN_CACHE_TTL = 60
+
+# Loan length (days) of the borrowing created when a returned copy is assigned to a hold
+CATALOG_HOLD_LOAN_DAYS = 14
+
+# Per-user limits checked when a borrowing request is made (see catalog.borrowing)
+CATALOG_MAX_ACTIVE_LOANS = 5
+CATALOG_MAX_PENDING_REQUESTS = 3
+
+# Book ranking (see catalog.ranking): weight of the library-wide mean rating in the
+# Bayesian average, and half-life (days, at least 1) of a loan in the "most borrowed"
+# score. The stored scores depend on the half-life: run `manage.py rank_books` after changing it
+CATALOG_RATING_PRIOR_WEIGHT = 10
+CATALOG_BORROW_HALF_LIFE_DAYS = 30
+
+# Seconds before their watermark the rollup and recommendation jobs read the borrowings
+# again, for the rows saved by transactions that committed after the previous run
+# (see catalog.rollups)
+CATALOG_WATERMARK_LAG_SECONDS = 300
+
+# "Readers also borrowed" books kept per book (see catalog.recommendations). The full
+# rebuild uses NumPy/SciPy sparse products when they are installed (optional,
+# `pip install numpy scipy`), plain Python otherwise
+CATALOG_RECOMMENDATIONS_PER_BOOK = 10
+
+# Serve facet-only book searches from the in-process bitmap index (see catalog.bitmaps).
+# Processes notice each other's changes through a version number in the cache,
+# so a shared cache backend is needed with several worker processes.
+CATALOG_BITMAP_INDEX = False
+
+# Broker of the borrowing events pushed to the staff (see catalog.events): 'local' keeps
+# them in process, 'cache' shares them between worker processes through the cache
+CATALOG_EVENT_BROKER = 'local'
+
+# Periodic maintenance jobs (see catalog.scheduler and catalog.jobs): seconds a worker
+# holds a job between two chunks, rows per chunk, days after their start date before
+# pending requests expire and approved requests not collected are canceled
+CATALOG_SCHEDULER_LEASE_SECONDS = 300
+CATALOG_SCHEDULER_CHUNK_SIZE = 500
+CATALOG_PENDING_EXPIRY_DAYS = 0
+CATALOG_RESERVATION_PICKUP_DAYS = 3
+
+# Background tasks (see catalog.taskqueue): pool of the run_tasks workers ('thread' or
+# 'process') and its size, seconds before a running task is taken over by another worker,
+# retry backoff (seconds, doubled on every attempt) and days finished tasks are kept
+CATALOG_TASK_POOL = 'thread'
+CATALOG_TASK_CONCURRENCY = 4
+CATALOG_TASK_TIMEOUT = 300
+CATALOG_TASK_RETRY_DELAY = 10
+CATALOG_TASK_MAX_RETRY_DELAY = 3600
+CATALOG_TASK_RETENTION_DAYS = 7
+
+# OpenAPI schema of the REST API (see catalog.api_schema), generated with the first request
+# to /swagger or /redoc, or by the generate_api_schema command, and kept until the code changes
+CATALOG_API_SCHEMA_CACHE = os.path.join(BASE_DIR, '.cache', 'openapi.json')
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -100,6 +186,17 @@ DATABASES = {
 }
 
 
+# Cache
+# API throttling (catalog.throttling) and token caching keep their state here;
+# use a shared backend (memcached/redis) when running several workers.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -126,6 +223,7 @@ EMAIL_HOST = env('EMAIL_HOST')
 EMAIL_PORT = env('EMAIL_PORT')
 EMAIL_HOST_USER = env('EMAIL_HOST_USER')
 EMAIL_HOST_PASSWORD = env('EMAIL_HOST_PASSWORD')
+EMAIL_USE_TLS = True
 
 # Internationalization
 # https://docs.djangoproject.com/en/4.2/topics/i18n/